@@ -2,6 +2,9 @@
 #define XtalDAQ_OnlineCBCAnalyser_interface_CBCChannelUnpacker_h
 
 #include <vector>
+#include <array>
+#include <cstddef>
+#include <stdint.h>
 
 //
 // Forward declarations
@@ -14,7 +17,11 @@ namespace sistrip
 
 namespace cbcanalyser
 {
-	/** @brief Simple utility class to unpack the bits from the CBC1 and present the result as a 128 bool vector.
+	/** @brief Simple utility class to unpack the bits from the CBC1 and present the result as a 128 bit mask.
+	 *
+	 * The hits are stored in two 64 bit words rather than a std::vector<bool>, so that nothing is
+	 * allocated on the heap and consumers can work on a word at a time (e.g.
+	 * FedChannelSCurves::addEvent). Strip n is bit n%64 of word n/64.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 28/May/2013
@@ -22,12 +29,22 @@ namespace cbcanalyser
 	class CBCChannelUnpacker
 	{
 	public:
+		static const size_t numberOfStrips=128;
+		static const size_t numberOfWords=2;
+		typedef std::array<uint64_t,numberOfWords> HitMask;
+
 		CBCChannelUnpacker( const sistrip::FEDChannel& fedChannel );
-		const std::vector<bool>& hits() const;
+		/** @brief The hits as a bit mask, strip n is bit n%64 of word n/64. */
+		const HitMask& hitMask() const;
+		/** @brief Whether the given strip was hit. Doesn't check the strip number is less than numberOfStrips. */
+		bool hit( size_t stripNumber ) const;
+		/** @brief The hits as a vector of numberOfStrips bools. This allocates a new vector every time,
+		 * so use hitMask() where speed matters. */
+		std::vector<bool> hits() const;
 		bool hasData() const;
 	private:
 		bool hasData_;
-		std::vector<bool> hits_;
+		HitMask hitMask_;
 	};
 }
 
@@ -0,0 +1,62 @@
+#ifndef XtalDAQ_OnlineCBCAnalyser_interface_CBCHitCollection_h
+#define XtalDAQ_OnlineCBCAnalyser_interface_CBCHitCollection_h
+
+#include <vector>
+#include <cstddef>
+#include <stdint.h>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
+
+namespace cbcanalyser
+{
+	/** @brief The hits on one FED channel for one event, as a bit mask in the same format as CBCChannelUnpacker::hitMask().
+	 *
+	 * A plain array rather than the HitMask std::array so that a dictionary can be generated for it.
+	 */
+	struct CBCChannelHits
+	{
+		CBCChannelHits();
+		CBCChannelHits( uint16_t newFedNumber, uint16_t newFedChannel, const cbcanalyser::CBCChannelUnpacker::HitMask& hitMask );
+		/** @brief Whether the given strip was hit. Doesn't check the strip number is less than CBCChannelUnpacker::numberOfStrips. */
+		bool hit( size_t stripNumber ) const;
+
+		uint16_t fedNumber;
+		uint16_t fedChannel;
+		uint64_t hitWords[cbcanalyser::CBCChannelUnpacker::numberOfWords];
+	};
+
+	/** @brief All of the CBC hits in an event, so the raw data only has to be unpacked once.
+	 *
+	 * Made by the CBCHitProducer module and used by AnalyseCBCOutput and OccupancyDQM. Only channels
+	 * that had data are included, sorted by FED number then FED channel. Also records how many FED
+	 * buffers couldn't be unpacked; any channels unpacked before the problem are still included.
+	 */
+	class CBCHitCollection
+	{
+	public:
+		typedef std::vector<cbcanalyser::CBCChannelHits>::const_iterator const_iterator;
+
+		CBCHitCollection();
+
+		/** @brief Adds the hits for a channel. Cheapest if channels are added in order, which is how the FED
+		 * buffers are unpacked. Throws a std::runtime_error if the channel is already in the collection. */
+		void add( const cbcanalyser::CBCChannelHits& channelHits );
+		/** @brief Returns the hits for the channel, or nullptr if the channel had no data. */
+		const cbcanalyser::CBCChannelHits* find( uint16_t fedNumber, uint16_t fedChannel ) const;
+
+		const_iterator begin() const;
+		const_iterator end() const;
+		size_t size() const;
+		bool empty() const;
+
+		/** @brief Records that one of the FED buffers couldn't be unpacked. */
+		void addMalformedBuffer();
+		/** @brief The number of FED buffers in the event that couldn't be unpacked. */
+		size_t malformedBuffers() const;
+	private:
+		std::vector<cbcanalyser::CBCChannelHits> channels_;
+		uint32_t malformedBuffers_;
+	};
+
+} // end of namespace cbcanalyser
+
+#endif
@@ -0,0 +1,79 @@
+#ifndef XtalDAQ_OnlineCBCAnalyser_interface_HttpRouteTable_h
+#define XtalDAQ_OnlineCBCAnalyser_interface_HttpRouteTable_h
+
+#include <string>
+#include <vector>
+#include <functional>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/HttpServer.h"
+
+namespace httpserver
+{
+	/** @brief A request URI split into the path components and the "name=value" parameters after the "?".
+	 *
+	 * Percent encoding and "+" for spaces are undone in both. E.g. "/scurves/50/3?format=binary" has
+	 * the path components "scurves", "50" and "3", and the single parameter "format" set to "binary".
+	 * Parameters without an "=" are given an empty value.
+	 */
+	class DecodedUri
+	{
+	public:
+		DecodedUri( const std::string& uri );
+
+		/** @brief Returns true if the parameter was given at all, with or without a value. */
+		bool hasParameter( const std::string& name ) const;
+		/** @brief Returns the value of the first parameter called "name", or "defaultValue" if there isn't one. */
+		std::string parameter( const std::string& name, const std::string& defaultValue="" ) const;
+		/** @brief Converts the parameter to an unsigned integer, throwing a std::runtime_error if it isn't one. */
+		size_t unsignedParameter( const std::string& name, size_t defaultValue ) const;
+
+		std::string path; ///< Everything before the "?", still percent encoded
+		std::vector<std::string> pathComponents;
+		std::vector< std::pair<std::string,std::string> > parameters; ///< In the order they were given
+	};
+
+	/** @brief Converts a string from a URI to an unsigned integer, throwing a std::runtime_error if it isn't one.
+	 *
+	 * Values too large for an unsigned int are an error too, rather than wrapping. The description
+	 * is only used in the exception message.
+	 */
+	size_t convertToUnsigned( const std::string& value, const std::string& description );
+
+	/** @brief Dispatches HTTP requests to a different handler depending on the path of the URI.
+	 *
+	 * Each route is added with a pattern of path components, where a component in angle brackets
+	 * matches anything and the matched components are passed to the handler. For example the pattern
+	 * "/scurves/<fed>/<channel>" calls the handler for "/scurves/50/3" with the arguments "50" and "3".
+	 * Routes are tried in the order they were added. If a handler throws a std::exception the reply
+	 * is a "400 bad request" with the message, and if no route matches the reply is a "404 not found"
+	 * listing the routes that are available.
+	 *
+	 * Since it implements HttpServer::IRequestHandler it can be given straight to an HttpServer, or a
+	 * class that is already the handler can forward requests to it.
+	 */
+	class RouteTable : public httpserver::HttpServer::IRequestHandler
+	{
+	public:
+		typedef std::function<void( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )> Handler;
+
+		/** @brief Adds a handler for URIs whose path matches "pattern". The description is used in the list of routes. */
+		void addRoute( const std::string& pattern, Handler handler, const std::string& description="" );
+
+		virtual void handleRequest( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply );
+
+		/** @brief Sets the status, content, and the Content-Length and Content-Type headers of the reply. */
+		static void setReply( httpserver::HttpServer::Reply& reply, httpserver::HttpServer::Reply::StatusType status,
+				const std::string& content, const std::string& contentType="text/plain" );
+	protected:
+		struct Route
+		{
+			std::string pattern;
+			std::vector<std::string> patternComponents;
+			Handler handler;
+			std::string description;
+		};
+		std::vector<Route> routes_;
+	};
+
+} // end of namespace httpserver
+
+#endif
@@ -14,6 +14,8 @@
 #include <string>
 #include <vector>
 #include <memory>
+#include <functional>
+#include <chrono>
 
 namespace httpserver
 {
@@ -69,6 +71,16 @@ namespace httpserver
 			std::vector<Header> headers;
 			std::string content;
 
+			/** @brief Optional, for long polling. If this is set when the handler returns the reply isn't sent
+			 * straight away. Instead poll is called every pollInterval until it returns true, and then the
+			 * reply is sent. It should fill the reply before returning true.
+			 *
+			 * It's called in the server thread, so it mustn't block because no other requests are served
+			 * while it runs. If it throws a std::exception a "500 internal server error" is sent instead.
+			 */
+			std::function<bool( Reply& reply )> poll;
+			std::chrono::milliseconds pollInterval;
+
 			/// Get a stock reply.
 			static Reply stockReply( StatusType status );
 		};
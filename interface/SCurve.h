@@ -2,10 +2,11 @@
 #define XtalDAQ_OnlineCBCAnalyser_interface_SCurve_h
 
 #include <vector>
-#include <map>
 #include <cstddef>
 #include <iosfwd>
 #include <memory>
+#include <stdint.h>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
 
 //
 // Forward declarations
@@ -18,6 +19,9 @@ namespace cbcanalyser
 {
 
 	/** @brief Class to record data for a single bin in an s-curve.
+	 *
+	 * The counters are 32 bit, since there are a lot of these (one per bin per strip) and
+	 * they're stored in contiguous blocks by FedChannelSCurves.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 04/Sep/2013
@@ -29,10 +33,10 @@ namespace cbcanalyser
 		bool operator==( const SCurveEntry& otherSCurveEntry ) const;
 		bool operator!=( const SCurveEntry& otherSCurveEntry ) const;
 
-		size_t& eventsOn();
-		const size_t& eventsOn() const;
-		size_t& eventsOff();
-		const size_t& eventsOff() const;
+		uint32_t& eventsOn();
+		const uint32_t& eventsOn() const;
+		uint32_t& eventsOff();
+		const uint32_t& eventsOff() const;
 		/** @brief Returns the fraction of events where the channel was on. */
 		float fraction() const;
 		/** @brief Returns simple error assuming poisson error on the number of events on, and no error on the total. */
@@ -41,11 +45,16 @@ namespace cbcanalyser
 		void dumpToStream( std::ostream& outputStream ) const;
 		void restoreFromStream( std::istream& inputStream );
 	protected:
-		size_t eventsOn_;
-		size_t eventsOff_;
+		uint32_t eventsOn_;
+		uint32_t eventsOff_;
 	};
 
 	/** @brief Class to record data to calculate an s-curve.
+	 *
+	 * An SCurve either owns its bins, or is a view of one strip's bins in the block that a
+	 * FedChannelSCurves holds for all of its strips. Copying always gives an SCurve that owns
+	 * its bins; assigning to a view copies the contents into the view, which must then be the
+	 * same size.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 04/Sep/2013
@@ -55,6 +64,13 @@ namespace cbcanalyser
 	public:
 		/** @brief Constructor that specifies how many bins the SCurve will have. */
 		SCurve( size_t numberOfEntries=256 );
+		/** @brief Constructor for a view of "numberOfEntries" bins owned by something else. */
+		SCurve( cbcanalyser::SCurveEntry* pEntries, size_t numberOfEntries );
+		SCurve( const cbcanalyser::SCurve& otherSCurve );
+		SCurve( cbcanalyser::SCurve&& otherSCurve ) noexcept;
+		/** @brief Copies the contents. Throws a std::runtime_error if this is a view and the sizes are different. */
+		SCurve& operator=( const cbcanalyser::SCurve& otherSCurve );
+		SCurve& operator=( cbcanalyser::SCurve&& otherSCurve );
 		bool operator==( const SCurve& otherSCurve ) const;
 		bool operator!=( const SCurve& otherSCurve ) const;
 
@@ -70,7 +86,48 @@ namespace cbcanalyser
 		 */
 		std::unique_ptr<TEfficiency> createHistogram( const std::string& name ) const;
 
+		/** @brief Quick estimate of the fit parameters, worked out in one pass over the bins without fitting. */
+		struct Estimate
+		{
+			bool isValid; ///< @brief False if fewer than two bins have events, or the fraction doesn't change
+			int direction; ///< @brief +1 if the fraction rises with the bin index, -1 if it falls
+			float plateau; ///< @brief The total change in the fraction across the s-curve
+			float mean; ///< @brief The 50% point, in bins
+			float width; ///< @brief The sigma of the turn on, in bins
+		};
+		/** @brief Estimates the 50% point, width and plateau from the differences between the fractions of neighbouring bins.
+		 *
+		 * For an error function s-curve those differences are a Gaussian, so the plateau is its sum,
+		 * the 50% point its mean and the width comes from its mean absolute deviation. Bins without
+		 * any events are skipped, so this can be used on a scan that is still in progress. It's good
+		 * enough to start a fit from or for a quick look, but it isn't a fit.
+		 */
+		Estimate estimateParameters() const;
+
+		/** @brief The result of SCurve::fit. The parameters are the same as the function in FitSCurve. */
+		struct FitResult
+		{
+			bool converged; ///< @brief False if there were too few bins with events or the iteration limit was hit
+			float plateau; ///< @brief Parameter [0]
+			float slope; ///< @brief Parameter [1], negative for a falling curve
+			float mean; ///< @brief Parameter [2]
+			float chi2;
+			size_t ndf;
+		};
+		/** @brief Fits the same function as FitSCurve, on the x axis of createHistogram, without using ROOT.
+		 *
+		 * It's a Levenberg-Marquardt least squares fit with binomial weights, started from
+		 * estimateParameters. Since nothing global is touched it can be called from several threads at
+		 * once, which Minuit can't.
+		 */
+		FitResult fit() const;
 
+		/** @brief Adds the events on and off in every bin of "otherSCurve" to this one.
+		 *
+		 * Throws a std::runtime_error, without changing anything, if the number of bins is different or a
+		 * count would be too large for a uint32_t.
+		 */
+		void merge( const SCurve& otherSCurve );
 
 		void dumpToStream( std::ostream& outputStream ) const;
 		void restoreFromStream( std::istream& inputStream );
@@ -80,7 +137,9 @@ namespace cbcanalyser
 
 
 	protected:
-		std::vector<SCurveEntry> entries_;
+		std::vector<SCurveEntry> ownedEntries_; ///< @brief Empty if this is a view
+		SCurveEntry* pEntries_; ///< @brief Either ownedEntries_.data() or the bins being viewed
+		size_t numberOfEntries_;
 
 		/** @brief Stores parameters of function passed to it
 		 *
@@ -106,6 +165,13 @@ namespace cbcanalyser
 	public:
 	    FitSCurve( TEfficiency & sCurve, const std::string& name );
 
+            /** @brief Starts the fit from an SCurve::Estimate instead of the default parameters
+             *
+             * The estimate is in bins, so the number of bins is needed to convert it to the x axis
+             * of the histogram from SCurve::createHistogram. Invalid estimates are ignored.
+             */
+            void setInitialParameters( const SCurve::Estimate& estimate, size_t numberOfBins );
+
             /** @brief Performs a fit of the fitFunction_ to sCurveToFit_
              *
              */
@@ -116,12 +182,17 @@ namespace cbcanalyser
             TEfficiency & sCurveToFit_;
             // The function to fit
             TF1 *fitFunction_;
+            // The parameters the fit starts from
+            double initialParameters_[3];
 	};
 
 	/** @brief Convenience class to store all the s-curves for a FED channel.
 	 *
-	 * Could have just used a raw std::map but this way makes the intention in the code a bit
-	 * clearer.
+	 * The bins for every strip are kept in one contiguous block, indexed [strip][bin], which is
+	 * allocated for defaultNumberOfStrips strips when the channel is first used. The SCurves
+	 * returned by getStripSCurve are views into that block. If a strip beyond the block is asked
+	 * for the block is reallocated, which invalidates any references to SCurves or SCurveEntries
+	 * previously taken from this channel.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 04/Sep/2013
@@ -129,23 +200,65 @@ namespace cbcanalyser
 	class FedChannelSCurves
 	{
 	public:
+		/** @brief The number of strips on a CBC, so the block never has to grow in normal running. */
+		static const size_t defaultNumberOfStrips=cbcanalyser::CBCChannelUnpacker::numberOfStrips;
+
+		/** @brief Constructor that specifies how many bins every strip's SCurve will have. */
+		FedChannelSCurves( size_t numberOfBins=256 );
+		FedChannelSCurves( const cbcanalyser::FedChannelSCurves& otherFedChannelSCurves );
+		FedChannelSCurves( cbcanalyser::FedChannelSCurves&& otherFedChannelSCurves ) noexcept;
+		FedChannelSCurves& operator=( const cbcanalyser::FedChannelSCurves& otherFedChannelSCurves );
+		FedChannelSCurves& operator=( cbcanalyser::FedChannelSCurves&& otherFedChannelSCurves ) noexcept;
+
 		SCurve& getStripSCurve( size_t stripNumber );
+		/** @brief Const version that throws a std::out_of_range if there's no s-curve for the strip. */
+		const SCurve& getStripSCurve( size_t stripNumber ) const;
+		/** @brief Shortcut for getStripSCurve(stripNumber).getEntry(bin), without creating the SCurve view.
+		 *
+		 * Throws a std::out_of_range if "bin" is not less than numberOfBins().
+		 */
+		SCurveEntry& getEntry( size_t stripNumber, size_t bin );
+		/** @brief Adds one event to "bin" of strips 0 to numberOfStrips-1, where the hits are a bit mask.
+		 *
+		 * The mask is in the format of CBCChannelUnpacker::hitMask(), i.e. strip n is bit n%64 of
+		 * pHitWords[n/64]. Every strip gets either eventsOn or eventsOff incremented, working through
+		 * the mask a word at a time. Throws a std::out_of_range if "bin" is not less than numberOfBins().
+		 */
+		void addEvent( size_t bin, const uint64_t* pHitWords, size_t numberOfStrips );
+		/** @brief Returns the number of bins in the SCurve of every strip. */
+		size_t numberOfBins() const;
 		/** @brief Returns a vector of the strip indices that have data recorded for them. */
 		std::vector<size_t> getValidStripIndices() const;
 
 		/** @brief Creates a series of sub-directories for histograms for all of the s-curves. */
 		void createHistograms( TDirectory* pParentDirectory ) const;
+		/** @brief Calls SCurve::fit for every strip, in the order of getValidStripIndices(). Nothing is shared, so
+		 * different channels can be fitted in different threads. */
+		std::vector<SCurve::FitResult> fitStrips() const;
+		/** @brief Creates the histograms, but writes functions with the parameters, chi2 and NDF in "fitResults" (from
+		 * fitStrips) instead of fitting them with ROOT. */
+		void createHistograms( TDirectory* pParentDirectory, const std::vector<SCurve::FitResult>& fitResults ) const;
+		/** @brief Adds the counts of every strip in "otherFedChannelSCurves" to this channel, see DetectorSCurves::merge. */
+		void merge( const FedChannelSCurves& otherFedChannelSCurves );
 
 		void dumpToStream( std::ostream& outputStream ) const;
 		void restoreFromStream( std::istream& inputStream );
 	protected:
-		std::map<size_t,SCurve> stripSCurves_;
+		/** @brief Makes sure there is space in entries_ for "stripNumber", and marks it as valid. */
+		void useStrip( size_t stripNumber );
+		/** @brief Points the SCurves in stripSCurves_ at the current entries_ block. */
+		void createViews();
+
+		size_t numberOfBins_;
+		std::vector<SCurveEntry> entries_; ///< @brief The bins for all strips, indexed [strip][bin]
+		std::vector<SCurve> stripSCurves_; ///< @brief Views of entries_, one per strip
+		std::vector<char> validStrips_; ///< @brief Whether each strip has been used. char rather than bool for speed.
 	};
 
 	/** @brief Convenience class to store all the s-curves for a single FED.
 	 *
-	 * Could have just used a series of raw std::map but this way makes the intention in the
-	 * code a bit clearer.
+	 * Channels are indexed directly by FED channel number, rather than looked up in a map. Each
+	 * channel is allocated separately so references to them stay valid as more are added.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 04/Sep/2013
@@ -153,24 +266,33 @@ namespace cbcanalyser
 	class FedSCurves
 	{
 	public:
+		FedSCurves();
+		FedSCurves( const cbcanalyser::FedSCurves& otherFedSCurves );
+		FedSCurves( cbcanalyser::FedSCurves&& otherFedSCurves ) noexcept;
+		FedSCurves& operator=( cbcanalyser::FedSCurves otherFedSCurves );
+
+		/** @brief Creates the channel if it doesn't exist. Throws a std::out_of_range if the channel number is 96 or more. */
 		FedChannelSCurves& getFedChannelSCurves( size_t fedChannelNumber );
+		/** @brief Const version that throws a std::out_of_range if there's no data for the channel. */
+		const FedChannelSCurves& getFedChannelSCurves( size_t fedChannelNumber ) const;
 		SCurve& getStripSCurve( size_t fedChannelNumber, size_t stripNumber );
 		/** @brief Returns a vector of the channel indices that have data recorded for them. */
 		std::vector<size_t> getValidChannelIndices() const;
 
 		/** @brief Creates a series of sub-directories for histograms for all of the s-curves. */
 		void createHistograms( TDirectory* pParentDirectory ) const;
+		/** @brief Adds the counts of every channel in "otherFedSCurves" to this FED, see DetectorSCurves::merge. */
+		void merge( const FedSCurves& otherFedSCurves );
 
 		void dumpToStream( std::ostream& outputStream ) const;
 		void restoreFromStream( std::istream& inputStream );
 	protected:
-		std::map<size_t,FedChannelSCurves> fedChannelSCurves_;
+		std::vector< std::unique_ptr<FedChannelSCurves> > fedChannelSCurves_; ///< @brief Null for channels that haven't been used
 	};
 
 	/** @brief Convenience class to store all the s-curves for all of the FEDs.
 	 *
-	 * Could have just used a series of raw std::map but this way makes the intention in the
-	 * code a bit clearer.
+	 * FEDs are indexed directly by FED number, in the same way as FedSCurves indexes channels.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 04/Sep/2013
@@ -178,7 +300,15 @@ namespace cbcanalyser
 	class DetectorSCurves
 	{
 	public:
+		DetectorSCurves();
+		DetectorSCurves( const cbcanalyser::DetectorSCurves& otherDetectorSCurves );
+		DetectorSCurves( cbcanalyser::DetectorSCurves&& otherDetectorSCurves ) noexcept;
+		DetectorSCurves& operator=( cbcanalyser::DetectorSCurves otherDetectorSCurves );
+
+		/** @brief Creates the FED if it doesn't exist. Throws a std::out_of_range if the FED number is above sistrip::FED_ID_MAX. */
 		FedSCurves& getFedSCurves( size_t fedNumber );
+		/** @brief Const version that throws a std::out_of_range if there's no data for the FED. */
+		const FedSCurves& getFedSCurves( size_t fedNumber ) const;
 		FedChannelSCurves& getFedChannelSCurves( size_t fedNumber, size_t fedChannelNumber );
 		SCurve& getStripSCurve( size_t fedNumber, size_t fedChannelNumber, size_t stripNumber );
 		/** @brief Returns a vector of the FED indices that have data recorded for them. */
@@ -187,10 +317,36 @@ namespace cbcanalyser
 		/** @brief Creates a series of sub-directories for histograms for all of the s-curves. */
 		void createHistograms( TDirectory* pParentDirectory ) const;
 
+		/** @brief How long the parts of the multi-threaded createHistograms took. */
+		struct HistogramTiming
+		{
+			size_t numberOfChannels;
+			size_t numberOfThreads;
+			double fittingSeconds; ///< @brief Wall clock time until every channel had been fitted
+			double summedFittingSeconds; ///< @brief The time each channel's fit took, summed over all channels
+			double writingSeconds; ///< @brief Time creating the histograms and functions after the fits
+		};
+		/** @brief Same as createHistograms, but with the fits spread over "numberOfThreads" threads.
+		 *
+		 * Each FED channel is a separate task, fitted with FedChannelSCurves::fitStrips. The ROOT
+		 * objects are then all created in this thread, in the same order as the single threaded
+		 * version, since ROOT isn't thread safe. The calling thread counts as one of the threads, so
+		 * 0 or 1 does everything in this thread. The first exception from a task is rethrown here.
+		 */
+		HistogramTiming createHistograms( TDirectory* pParentDirectory, size_t numberOfThreads ) const;
+
+		/** @brief Adds the counts in "otherDetectorSCurves" to these, e.g. to combine states saved by several processes.
+		 *
+		 * Strips, channels and FEDs that only "otherDetectorSCurves" has are copied in. Where both have the
+		 * same channel it must have the same number of bins. If anything doesn't match, or a count would be
+		 * too large for a uint32_t, a std::runtime_error is thrown and this instance is left unchanged.
+		 */
+		void merge( const DetectorSCurves& otherDetectorSCurves );
+
 		void dumpToStream( std::ostream& outputStream ) const;
 		void restoreFromStream( std::istream& inputStream );
 	protected:
-		std::map<size_t,FedSCurves> fedSCurves_;
+		std::vector< std::unique_ptr<FedSCurves> > fedSCurves_; ///< @brief Null for FEDs that haven't been used
 	};
 
 } // end of namespace cbcanalyser
@@ -0,0 +1,74 @@
+#ifndef XtalDAQ_OnlineCBCAnalyser_interface_SCurveSnapshot_h
+#define XtalDAQ_OnlineCBCAnalyser_interface_SCurveSnapshot_h
+
+#include <string>
+#include <vector>
+#include <cstddef>
+#include <stdint.h>
+
+//
+// Forward declarations
+//
+namespace cbcanalyser
+{
+	class DetectorSCurves;
+}
+
+namespace cbcanalyser
+{
+	/** @brief Everything AnalyseCBCOutput needs to carry over between jobs, in a binary file that can be mapped into memory.
+	 *
+	 * The text format from DetectorSCurves::dumpToStream has to be parsed token by token, which is
+	 * slow and large when there are a lot of FEDs. This is a fixed layout instead, with the
+	 * on/off counts for every strip of a FED channel in one contiguous block of uint32_t, so it
+	 * can be read with mmap and no parsing. runcontrol/pythonlib/SavedState.py has a reader.
+	 *
+	 * Everything is little endian (i.e. native on the machines this runs on) and every block starts
+	 * on an 8 byte boundary:
+	 *
+	 *   header        char magic[8]="CBCSNAP\0", uint32_t version, uint32_t byteOrderMark=0x01020304,
+	 *                 uint32_t headerSize, uint32_t numberOfChannels, uint32_t numberOfStripThresholdOffsets,
+	 *                 uint32_t reserved, uint64_t eventsProcessed, uint64_t runsProcessed
+	 *   offsets       uint32_t stripThresholdOffsets[numberOfStripThresholdOffsets]
+	 *   channel table numberOfChannels times: uint32_t fedNumber, uint32_t fedChannel, uint32_t numberOfStrips,
+	 *                 uint32_t numberOfBins, uint64_t dataOffset (bytes from the start of the file)
+	 *   channel data  at dataOffset for each channel: uint32_t stripNumbers[numberOfStrips], then
+	 *                 uint32_t counts[numberOfStrips][numberOfBins][2] with eventsOn then eventsOff
+	 *
+	 * Files are written to a temporary file which is renamed over the target, so a reader never
+	 * sees a half written snapshot.
+	 */
+	class SCurveSnapshot
+	{
+	public:
+		static const uint32_t version=1;
+
+		SCurveSnapshot();
+
+		/** @brief Returns true if the file exists and starts with the snapshot magic number.
+		 *
+		 * Used to tell snapshots apart from files saved in the old text format.
+		 */
+		static bool isSnapshotFile( const std::string& filename );
+
+		/** @brief Writes the s-curves and the other members to a temporary file and renames it to "filename".
+		 *
+		 * Throws a std::runtime_error if anything goes wrong, including any count being too large for
+		 * a uint32_t. All the strips in a FED channel must have s-curves with the same number of bins.
+		 */
+		void write( const std::string& filename, const cbcanalyser::DetectorSCurves& detectorSCurves ) const;
+
+		/** @brief Maps the file into memory and overwrites "detectorSCurves" and the other members with what's in it.
+		 *
+		 * Throws a std::runtime_error if the file isn't a valid snapshot, in which case nothing is modified.
+		 */
+		void read( const std::string& filename, cbcanalyser::DetectorSCurves& detectorSCurves );
+
+		std::vector<unsigned int> stripThresholdOffsets;
+		size_t eventsProcessed;
+		size_t runsProcessed;
+	};
+
+} // end of namespace cbcanalyser
+
+#endif
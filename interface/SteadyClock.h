@@ -0,0 +1,22 @@
+#ifndef XtalDAQ_OnlineCBCAnalyser_interface_SteadyClock_h
+#define XtalDAQ_OnlineCBCAnalyser_interface_SteadyClock_h
+
+#include <chrono>
+
+namespace cbcanalyser
+{
+	/** @brief The monotonic clock from std::chrono, for measuring intervals.
+	 *
+	 * GCC 4.6 (used for CMSSW_5_3_4) calls it std::chrono::monotonic_clock, later versions follow
+	 * the standard and call it std::chrono::steady_clock. Use this typedef instead of either so that
+	 * the code builds on both.
+	 */
+#if defined(__GNUC__) && !defined(__clang__) && __GNUC__==4 && __GNUC_MINOR__<7
+	typedef std::chrono::monotonic_clock SteadyClock;
+#else
+	typedef std::chrono::steady_clock SteadyClock;
+#endif
+
+} // end of namespace cbcanalyser
+
+#endif
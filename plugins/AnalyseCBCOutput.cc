@@ -2,16 +2,18 @@
 
 #include <iostream>
 #include <stdexcept>
+#include <sstream>
+#include <iomanip>
 #include <FWCore/Framework/interface/MakerMacros.h>
 #include <FWCore/Framework/interface/Event.h>
 #include <DataFormats/Common/interface/TriggerResults.h>
-#include <DataFormats/FEDRawData/interface/FEDRawDataCollection.h>
-#include <EventFilter/SiStripRawToDigi/interface/SiStripFEDBuffer.h>
 #include <FWCore/ServiceRegistry/interface/Service.h>
 #include <CommonTools/UtilAlgos/interface/TFileService.h>
 #include <FWCore/MessageService/interface/MessageLogger.h>
 #include "XtalDAQ/OnlineCBCAnalyser/interface/stringManipulationTools.h"
 #include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCHitCollection.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SCurveSnapshot.h"
 
 
 namespace cbcanalyser
@@ -40,14 +42,27 @@ namespace // Use the unnamed namespace for tools only used in this file
 }
 
 cbcanalyser::AnalyseCBCOutput::AnalyseCBCOutput( const edm::ParameterSet& config )
-	: stripThresholdOffsets_(128), pSCurveEntryToMonitorForDQM_(nullptr), server_(*this)
+	: stripThresholdOffsets_(128), server_(*this)
 {
 	debug_=config.getUntrackedParameter<bool>("debug",false);
 
 	if( debug_ ) std::cout << "cbcanalyser::AnalyseCBCOutput::AnalyseCBCOutput()" << std::endl;
 
 	I2CValuesFilename_=config.getParameter<std::string>("trimFilename");
+	hitCollectionLabel_=config.getUntrackedParameter<edm::InputTag>("hitCollectionLabel",edm::InputTag("cbcHits"));
 	savedStateFilename_=config.getUntrackedParameter<std::string>("savedStateFilename","");
+	// Zero fits with ROOT in a single thread, the way it was always done. Multithreaded fitting has to be asked for.
+	numberOfFitThreads_=config.getUntrackedParameter<unsigned int>("numberOfFitThreads",0);
+
+	eventsProcessed_=0;
+	runsProcessed_=0;
+	runStartTime_=cbcanalyser::SteadyClock::now().time_since_epoch().count();
+
+	using namespace std::placeholders; // For _1, _2 and _3 in the std::binds below
+	routeTable_.addRoute( "/changeVar", std::bind( &AnalyseCBCOutput::handleChangeVar, this, _1, _2, _3 ), "Set variables, e.g. /changeVar?globalComparatorThreshold_=0.5" );
+	routeTable_.addRoute( "/status", std::bind( &AnalyseCBCOutput::handleStatus, this, _1, _2, _3 ), "Event counts and rates as JSON" );
+	routeTable_.addRoute( "/scurves/<fed>/<channel>", std::bind( &AnalyseCBCOutput::handleSCurves, this, _1, _2, _3 ), "Raw s-curve counts as JSON, or add ?format=binary" );
+	routeTable_.addRoute( "/estimates/<fed>/<channel>", std::bind( &AnalyseCBCOutput::handleEstimates, this, _1, _2, _3 ), "Quick estimate of each strip's s-curve parameters (in bins) as JSON" );
 
 	std::string hostname=config.getUntrackedParameter<std::string>("commsServerHostname");
 	std::string port=config.getUntrackedParameter<std::string>("commsServerPort");
@@ -55,8 +70,6 @@ cbcanalyser::AnalyseCBCOutput::AnalyseCBCOutput( const edm::ParameterSet& config
 	if( debug_ ) std::cout << "cbcanalyser::AnalyseCBCOutput - Starting server on host " << hostname << " and port " << port << std::endl;
 	server_.start( hostname, port );
 
-	runsProcessed_=0;
-
 	if( !savedStateFilename_.empty() )
 	{
 		try{ restoreState( savedStateFilename_ ); }
@@ -83,8 +96,19 @@ cbcanalyser::AnalyseCBCOutput::~AnalyseCBCOutput()
 	// data that has been collected.
 	//
 	edm::Service<TFileService> pFileService;
-	detectorSCurves_.createHistograms( &pFileService->file() );
+	cbcanalyser::SteadyClock::time_point startTime=cbcanalyser::SteadyClock::now();
+	if( numberOfFitThreads_==0 ) detectorSCurves_.createHistograms( &pFileService->file() );
+	else
+	{
+		cbcanalyser::DetectorSCurves::HistogramTiming timing=detectorSCurves_.createHistograms( &pFileService->file(), numberOfFitThreads_ );
+		std::cout << "cbcanalyser::AnalyseCBCOutput - fitted " << timing.numberOfChannels << " FED channels with " << timing.numberOfThreads << " threads in "
+				<< timing.fittingSeconds << "s (" << timing.summedFittingSeconds << "s summed over the channels, a speed up of "
+				<< ( timing.fittingSeconds>0 ? timing.summedFittingSeconds/timing.fittingSeconds : 1 ) << "). Creating the histograms took "
+				<< timing.writingSeconds << "s." << std::endl;
+	}
 	pFileService->file().Write();
+	std::cout << "cbcanalyser::AnalyseCBCOutput - histogramming, fitting and writing took "
+			<< std::chrono::duration_cast< std::chrono::duration<double> >( cbcanalyser::SteadyClock::now()-startTime ).count() << "s in total." << std::endl;
 
 	//
 	// If the constructor is called then job has reached it's natural conclusion.
@@ -149,11 +173,10 @@ void cbcanalyser::AnalyseCBCOutput::analyze( const edm::Event& event, const edm:
 {
 	++eventsProcessed_;
 	if( debug_ ) std::cout << "cbcanalyser::AnalyseCBCOutput::analyze() event " << eventsProcessed_ << std::endl;
-	//if( pSCurveEntryToMonitorForDQM_==nullptr ) std::cout << std::endl;
-	//else std::cout << " Strip ratio=" << pSCurveEntryToMonitorForDQM_->fraction() << "(" << pSCurveEntryToMonitorForDQM_->eventsOn() << ":" << pSCurveEntryToMonitorForDQM_->eventsOff() << ")" << std::endl;
 
-	edm::Handle<FEDRawDataCollection> hRawData;
-	event.getByLabel( "rawDataCollector", hRawData );
+	// The hits are unpacked once per event by CBCHitProducer
+	edm::Handle<cbcanalyser::CBCHitCollection> hHits;
+	event.getByLabel( hitCollectionLabel_, hHits );
 
 	// Since this could change if someone makes a http request, copy it into another
 	// variable so that all data has the same value for this event.
@@ -164,67 +187,21 @@ void cbcanalyser::AnalyseCBCOutput::analyze( const edm::Event& event, const edm:
 	if( globalThreshold<0 ) globalThreshold=0;
 	else if( globalThreshold>1 ) globalThreshold=1;
 
-	size_t fedIndex;
-	for( fedIndex=0; fedIndex<sistrip::CMS_FED_ID_MAX; ++fedIndex )
-	{
-		const FEDRawData& fedData=hRawData->FEDData(fedIndex);
-
-		if( fedData.size()!=0 )
-		{
-			// Check to see if this FED is one of the ones allocated to the strip tracker
-			if( fedIndex < sistrip::FED_ID_MIN || fedIndex > sistrip::FED_ID_MAX )
-			{
-				//std::cout << "Skipping FEDRawData at fedIndex " << std::dec << fedIndex << " has size " << fedData.size() << std::endl;
-				continue;
-			}
-
-			//std::cout << "FEDRawData at fedIndex " << std::dec << fedIndex << " has size " << fedData.size() << std::endl;
-			try
-			{
-				sistrip::FEDBuffer myBuffer(fedData.data(),fedData.size());
-				//myBuffer.print( std::cout );
-
-				for ( uint16_t feIndex = 0; feIndex<sistrip::FEUNITS_PER_FED; ++feIndex )
-				{
-					if( !myBuffer.fePresent(feIndex) ) continue;
-
-					for ( uint16_t channelInFe = 0; channelInFe < sistrip::FEDCH_PER_FEUNIT; ++channelInFe )
-					{
-						const uint16_t channelIndex=feIndex*sistrip::FEDCH_PER_FEUNIT+channelInFe;
-						const sistrip::FEDChannel& channel=myBuffer.channel(channelIndex);
-
-						cbcanalyser::CBCChannelUnpacker unpacker(channel);
-						if( !unpacker.hasData() ) continue;
-
-						cbcanalyser::FedChannelSCurves& fedChannelSCurves=detectorSCurves_.getFedChannelSCurves( fedIndex, channelIndex );
-
-						const std::vector<bool>& hits=unpacker.hits();
+	// Stop the server reading the s-curves while they're modified
+	std::lock_guard<std::mutex> sCurveLock( sCurveMutex_ );
 
-						for( size_t stripNumber=0; stripNumber<hits.size(); ++stripNumber )
-						{
-							cbcanalyser::SCurve& sCurve=fedChannelSCurves.getStripSCurve(stripNumber);
-							// Convert the [0,1] of the global threshold to the bin number in the s-curve.
-							// Add the 0.5 so that round happens properly, although I also need to take 1
-							// off because bin numbers start from 0.
-							size_t thresholdBin=static_cast<size_t>( globalThreshold*sCurve.maxiumumEntries()-0.5 );
-							cbcanalyser::SCurveEntry& sCurveEntry=sCurve.getEntry( thresholdBin );
-
-							if( hits[stripNumber]==true ) ++sCurveEntry.eventsOn();
-							else ++sCurveEntry.eventsOff();
-
-							if( pSCurveEntryToMonitorForDQM_==nullptr ) pSCurveEntryToMonitorForDQM_=&sCurveEntry;
-						}
-
-					} // end of loop over FED channels
-				}
-			}
-			catch( std::exception& error )
-			{
-				std::cout << "Exception: "<< error.what() << std::endl;
-			}
-
-		} // end of "if FED has data"
-	} // end of loop over FEDs
+	for( const auto& channelHits : *hHits )
+	{
+		cbcanalyser::FedChannelSCurves& fedChannelSCurves=detectorSCurves_.getFedChannelSCurves( channelHits.fedNumber, channelHits.fedChannel );
+		// Convert the [0,1] of the global threshold to the bin number in the s-curve.
+		// Add the 0.5 so that round happens properly, although I also need to take 1
+		// off because bin numbers start from 0. All strips in the channel have the
+		// same number of bins so this only needs doing once.
+		size_t thresholdBin=static_cast<size_t>( globalThreshold*fedChannelSCurves.numberOfBins()-0.5 );
+
+		// Add the whole hit mask in one go
+		fedChannelSCurves.addEvent( thresholdBin, channelHits.hitWords, cbcanalyser::CBCChannelUnpacker::numberOfStrips );
+	}
 
 	if( debug_ ) dumpSCurveToStream( std::cout );
 }
@@ -244,6 +221,7 @@ void cbcanalyser::AnalyseCBCOutput::beginRun( const edm::Run& run, const edm::Ev
 	}
 	eventsProcessed_=0;
 	++runsProcessed_;
+	runStartTime_=cbcanalyser::SteadyClock::now().time_since_epoch().count();
 }
 
 void cbcanalyser::AnalyseCBCOutput::endRun( const edm::Run& run, const edm::EventSetup& setup )
@@ -265,79 +243,197 @@ void cbcanalyser::AnalyseCBCOutput::endLuminosityBlock( const edm::LuminosityBlo
 
 void cbcanalyser::AnalyseCBCOutput::handleRequest( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply )
 {
-	//
-	// Currently just returns the details of the request for debugging. Also able to set members with
-	// a request to the location "/changeVar" with the member name and new value as parameters. Only
-	// member currently is "globalComparatorThreshold_" which must be set between 0 and 1.
-	//
+	// The echo needs the whole request rather than just the decoded URI, so it's the only
+	// resource not in the route table.
+	std::string path=request.uri.substr( 0, request.uri.find_first_of("?") );
+	if( path.empty() || path=="/" ) handleDebugEcho( request, reply );
+	else routeTable_.handleRequest( request, reply );
+}
+
+void cbcanalyser::AnalyseCBCOutput::handleChangeVar( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	// Check and convert everything before setting anything, so that a mistake in one of the
+	// parameters doesn't leave the variables half changed.
+	float newGlobalComparatorThreshold=globalComparatorThreshold_;
+	bool newDebug=debug_;
+	for( const auto& parameter : uri.parameters )
+	{
+		std::stringstream stringConverter( parameter.second );
+		if( parameter.first=="globalComparatorThreshold_" )
+		{
+			stringConverter >> newGlobalComparatorThreshold;
+			if( stringConverter.fail() || !stringConverter.eof() ) throw std::runtime_error( "Couldn't convert \""+parameter.second+"\" to a number for "+parameter.first );
+			if( newGlobalComparatorThreshold<0 || newGlobalComparatorThreshold>1 ) throw std::runtime_error( "globalComparatorThreshold_ must be set between 0 and 1 inclusive" );
+		}
+		else if( parameter.first=="debug_" )
+		{
+			if( parameter.second=="1" || parameter.second=="true" ) newDebug=true;
+			else if( parameter.second=="0" || parameter.second=="false" ) newDebug=false;
+			else throw std::runtime_error( "debug_ must be set to 0 or 1, not \""+parameter.second+"\"" );
+		}
+		else throw std::runtime_error( "Unknown variable \""+parameter.first+"\"" );
+	}
+
+	globalComparatorThreshold_=newGlobalComparatorThreshold;
+	debug_=newDebug;
 
 	std::stringstream outputStream;
+	for( const auto& parameter : uri.parameters ) outputStream << "Setting " << parameter.first << " to " << parameter.second << "\n";
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str() );
+}
 
-	outputStream << "Request was:" << "\n"
-			<< 	"method=" << request.method << "\n"
-			<< 	"uri=" << request.uri << "\n"
-			<< 	"http_version_major=" << request.http_version_major << "\n"
-			<< 	"http_version_minor=" << request.http_version_minor << "\n"
-			<< 	"headers.size()=" << request.headers.size() << "\n";
-	for( const auto& header : request.headers ) outputStream << "\t" << header.name << "=" << header.value << "\n";
+void cbcanalyser::AnalyseCBCOutput::handleStatus( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	// Copy the atomics so that the numbers are consistent with each other
+	size_t eventsProcessed=eventsProcessed_;
+	cbcanalyser::SteadyClock::duration runDuration=cbcanalyser::SteadyClock::now().time_since_epoch()-cbcanalyser::SteadyClock::duration( runStartTime_.load() );
+	double secondsInRun=std::chrono::duration_cast< std::chrono::duration<double> >( runDuration ).count();
 
-	outputStream << "\n" << "globalComparatorThreshold_=" << globalComparatorThreshold_ << "\n";
+	std::stringstream outputStream;
+	outputStream << "{\"eventsProcessed\":" << eventsProcessed
+			<< ",\"runsProcessed\":" << runsProcessed_
+			<< ",\"secondsInRun\":" << secondsInRun
+			<< ",\"eventRate\":" << ( secondsInRun>0 ? eventsProcessed/secondsInRun : 0 )
+			<< ",\"globalComparatorThreshold\":" << globalComparatorThreshold_
+			<< "}";
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str(), "application/json" );
+}
 
-	// Split off any parameters in the uri
-	std::string resource;
-	std::vector< std::pair<std::string,std::string> > parameters;
-	size_t characterPosition=request.uri.find_first_of("?");
-	resource=request.uri.substr(0,characterPosition);
-	if( characterPosition!=std::string::npos )
+void cbcanalyser::AnalyseCBCOutput::handleSCurves( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	size_t fedNumber=httpserver::convertToUnsigned( arguments[0], "The FED number" );
+	size_t fedChannel=httpserver::convertToUnsigned( arguments[1], "The FED channel" );
+	std::string format=uri.parameter( "format", "json" );
+	if( format!="json" && format!="binary" ) throw std::runtime_error( "The format must be \"json\" or \"binary\", not \""+format+"\"" );
+
+	// Copy the counts out while holding the lock, and do the formatting afterwards. All the strips
+	// in a channel have the same number of bins.
+	std::vector<uint32_t> stripNumbers;
+	std::vector<uint32_t> counts; // [strip][bin][on/off]
+	size_t numberOfBins;
 	{
-		std::string parameterString=request.uri.substr(characterPosition+1);
-		// For now I'll just decode as one parameter, and work out logic for others later
-		parameters.resize(1);
-		characterPosition=parameterString.find_first_of("=");
-		parameters[0].first=parameterString.substr(0,characterPosition);
-		parameters[0].second=parameterString.substr(characterPosition+1);
+		std::lock_guard<std::mutex> sCurveLock( sCurveMutex_ );
+		const cbcanalyser::DetectorSCurves& constDetectorSCurves=detectorSCurves_; // Use the const getters which don't create anything
+		const cbcanalyser::FedChannelSCurves* pChannelSCurves;
+		try{ pChannelSCurves=&constDetectorSCurves.getFedSCurves(fedNumber).getFedChannelSCurves(fedChannel); }
+		catch( std::out_of_range& error )
+		{
+			std::stringstream outputStream;
+			outputStream << "There are no s-curves for FED " << fedNumber << " channel " << fedChannel;
+			httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::not_found, outputStream.str() );
+			return;
+		}
+
+		numberOfBins=pChannelSCurves->numberOfBins();
+		for( const auto stripNumber : pChannelSCurves->getValidStripIndices() )
+		{
+			stripNumbers.push_back( stripNumber );
+			const cbcanalyser::SCurve& sCurve=pChannelSCurves->getStripSCurve(stripNumber);
+			for( size_t bin=0; bin<numberOfBins; ++bin )
+			{
+				counts.push_back( sCurve.getEntry(bin).eventsOn() );
+				counts.push_back( sCurve.getEntry(bin).eventsOff() );
+			}
+		}
 	}
 
-	outputStream << "Decoded uri as:" << "\n"
-			<< "resource=" << resource << "\n";
-	for( const auto& parameter : parameters ) outputStream << parameter.first << "=" << parameter.second << "\n";
+	if( format=="binary" )
+	{
+		std::vector<uint32_t> packed;
+		packed.reserve( 2+stripNumbers.size()+counts.size() );
+		packed.push_back( stripNumbers.size() );
+		packed.push_back( numberOfBins );
+		packed.insert( packed.end(), stripNumbers.begin(), stripNumbers.end() );
+		packed.insert( packed.end(), counts.begin(), counts.end() );
+		const char* pBytes=reinterpret_cast<const char*>( packed.data() );
+		httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, std::string( pBytes, pBytes+sizeof(uint32_t)*packed.size() ), "application/octet-stream" );
+		return;
+	}
 
-	try
+	std::stringstream outputStream;
+	outputStream << "{\"fed\":" << fedNumber << ",\"channel\":" << fedChannel << ",\"numberOfBins\":" << numberOfBins << ",\"strips\":[";
+	for( size_t stripIndex=0; stripIndex<stripNumbers.size(); ++stripIndex )
 	{
-		if( resource=="/changeVar" )
+		if( stripIndex!=0 ) outputStream << ",";
+		outputStream << "{\"strip\":" << stripNumbers[stripIndex];
+		// Events on are the even entries in counts, and events off the odd ones
+		for( size_t offset=0; offset<2; ++offset )
 		{
-			for( const auto& parameter : parameters )
+			outputStream << ( offset==0 ? ",\"eventsOn\":[" : "],\"eventsOff\":[" );
+			for( size_t bin=0; bin<numberOfBins; ++bin )
 			{
-				if( parameter.first=="globalComparatorThreshold_" )
-				{
-					std::stringstream stringConverter;
-					stringConverter.str(parameter.second);
-					float variable;
-					stringConverter >> variable;
-					if( variable<0 || variable>1 ) throw std::runtime_error( "globalComparatorThreshold_ must be set between 0 and 1 inclusive" );
-					outputStream << "Setting " << parameter.first << " to " << variable << "\n";
-					globalComparatorThreshold_=variable;
-				}
+				if( bin!=0 ) outputStream << ",";
+				outputStream << counts[2*(stripIndex*numberOfBins+bin)+offset];
 			}
 		}
-		reply.status=httpserver::HttpServer::Reply::StatusType::ok;
-		reply.content=outputStream.str();
-		reply.headers.resize( 2 );
-		reply.headers[0].name="Content-Length";
-		reply.headers[0].value=std::to_string( reply.content.size() );
-		reply.headers[1].name="Content-Type";
-		reply.headers[1].value="text/plain";
-	} // end of try block
-	catch( std::exception& error )
+		outputStream << "]}";
+	}
+	outputStream << "]}";
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str(), "application/json" );
+}
+
+void cbcanalyser::AnalyseCBCOutput::handleEstimates( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	size_t fedNumber=httpserver::convertToUnsigned( arguments[0], "The FED number" );
+	size_t fedChannel=httpserver::convertToUnsigned( arguments[1], "The FED channel" );
+
+	// The estimates are a single pass over the bins, so they're cheap enough to work out while holding the lock
+	std::vector< std::pair<size_t,cbcanalyser::SCurve::Estimate> > estimates;
+	size_t numberOfBins;
+	{
+		std::lock_guard<std::mutex> sCurveLock( sCurveMutex_ );
+		const cbcanalyser::DetectorSCurves& constDetectorSCurves=detectorSCurves_; // Use the const getters which don't create anything
+		const cbcanalyser::FedChannelSCurves* pChannelSCurves;
+		try{ pChannelSCurves=&constDetectorSCurves.getFedSCurves(fedNumber).getFedChannelSCurves(fedChannel); }
+		catch( std::out_of_range& error )
+		{
+			std::stringstream outputStream;
+			outputStream << "There are no s-curves for FED " << fedNumber << " channel " << fedChannel;
+			httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::not_found, outputStream.str() );
+			return;
+		}
+
+		numberOfBins=pChannelSCurves->numberOfBins();
+		for( const auto stripNumber : pChannelSCurves->getValidStripIndices() )
+		{
+			estimates.push_back( std::make_pair( stripNumber, pChannelSCurves->getStripSCurve(stripNumber).estimateParameters() ) );
+		}
+	}
+
+	std::stringstream outputStream;
+	outputStream << "{\"fed\":" << fedNumber << ",\"channel\":" << fedChannel << ",\"numberOfBins\":" << numberOfBins << ",\"strips\":[";
+	for( size_t index=0; index<estimates.size(); ++index )
 	{
-		reply.status=httpserver::HttpServer::Reply::StatusType::bad_request;
-		reply.content=std::string("Exception encountered: ")+error.what();
-		reply.headers.resize( 2 );
-		reply.headers[0].name="Content-Length";
-		reply.headers[0].value=std::to_string( reply.content.size() );
-		reply.headers[1].name="Content-Type";
-		reply.headers[1].value="text/plain";
+		const cbcanalyser::SCurve::Estimate& estimate=estimates[index].second;
+		if( index!=0 ) outputStream << ",";
+		outputStream << "{\"strip\":" << estimates[index].first << ",\"valid\":" << ( estimate.isValid ? "true" : "false" );
+		if( estimate.isValid )
+		{
+			outputStream << ",\"direction\":" << estimate.direction << ",\"plateau\":" << estimate.plateau
+					<< ",\"mean\":" << estimate.mean << ",\"width\":" << estimate.width;
+		}
+		outputStream << "}";
 	}
+	outputStream << "]}";
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str(), "application/json" );
+}
+
+void cbcanalyser::AnalyseCBCOutput::handleDebugEcho( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply )
+{
+	std::stringstream outputStream;
+
+	outputStream << "Request was:" << "\n"
+			<< 	"method=" << request.method << "\n"
+			<< 	"uri=" << request.uri << "\n"
+			<< 	"http_version_major=" << request.http_version_major << "\n"
+			<< 	"http_version_minor=" << request.http_version_minor << "\n"
+			<< 	"headers.size()=" << request.headers.size() << "\n";
+	for( const auto& header : request.headers ) outputStream << "\t" << header.name << "=" << header.value << "\n";
+
+	outputStream << "\n" << "globalComparatorThreshold_=" << globalComparatorThreshold_ << "\n"
+			<< "\n" << "Other resources available are /changeVar, /status and /scurves/<fed>/<channel>" << "\n";
+
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str() );
 }
 
 void cbcanalyser::AnalyseCBCOutput::readI2CValues()
@@ -387,24 +483,34 @@ void cbcanalyser::AnalyseCBCOutput::readI2CValues()
 
 void cbcanalyser::AnalyseCBCOutput::saveState( const std::string& filename )
 {
-	std::fstream outputFile( filename, std::ios_base::out | std::ios_base::trunc );
-	if( !outputFile.is_open() ) throw std::runtime_error( "Unable to open the output file \""+filename+"\" to save the analyser state.");
-	FileStreamSentry closeFileSentry(outputFile);
-
-	detectorSCurves_.dumpToStream( outputFile );
-
-	outputFile << "stripThresholdOffsets_ " << stripThresholdOffsets_.size() << " ";
-	for( const auto& offset : stripThresholdOffsets_ ) outputFile << offset << " ";
-
-	outputFile << eventsProcessed_ << " " << runsProcessed_ << " ";
+	// The snapshot is written to a temporary file and renamed, so anything reading the state
+	// (e.g. the run control scripts) never sees a half written file.
+	cbcanalyser::SCurveSnapshot snapshot;
+	snapshot.stripThresholdOffsets=stripThresholdOffsets_;
+	snapshot.eventsProcessed=eventsProcessed_;
+	snapshot.runsProcessed=runsProcessed_;
+	snapshot.write( filename, detectorSCurves_ );
 }
 
 void cbcanalyser::AnalyseCBCOutput::restoreState( const std::string& filename )
 {
+	if( cbcanalyser::SCurveSnapshot::isSnapshotFile( filename ) )
+	{
+		cbcanalyser::SCurveSnapshot snapshot;
+		std::lock_guard<std::mutex> sCurveLock( sCurveMutex_ );
+		snapshot.read( filename, detectorSCurves_ );
+		stripThresholdOffsets_.swap( snapshot.stripThresholdOffsets );
+		eventsProcessed_=snapshot.eventsProcessed;
+		runsProcessed_=snapshot.runsProcessed;
+		return;
+	}
+
+	// Otherwise it's a state saved in the old text format
 	std::fstream inputFile( filename, std::ios_base::in );
 	if( !inputFile.is_open() ) throw std::runtime_error( "Unable to open the input file \""+filename+"\" to restore the analyser state.");
 	FileStreamSentry closeFileSentry(inputFile);
 
+	std::lock_guard<std::mutex> sCurveLock( sCurveMutex_ );
 	detectorSCurves_.restoreFromStream( inputFile );
 
 	std::string identifier;
@@ -416,5 +522,8 @@ void cbcanalyser::AnalyseCBCOutput::restoreState( const std::string& filename )
 	stripThresholdOffsets_.resize(entries);
 	for( size_t index=0; index<entries; ++index ) inputFile >> stripThresholdOffsets_[index];
 
-	inputFile >> eventsProcessed_ >> runsProcessed_;
+	size_t eventsProcessed, runsProcessed;
+	inputFile >> eventsProcessed >> runsProcessed;
+	eventsProcessed_=eventsProcessed;
+	runsProcessed_=runsProcessed;
 }
@@ -3,10 +3,15 @@
 
 #include <fstream>
 #include <atomic>
+#include <mutex>
+#include <chrono>
 #include <FWCore/Framework/interface/Frameworkfwd.h>
 #include <FWCore/Framework/interface/EDAnalyzer.h>
+#include <FWCore/Utilities/interface/InputTag.h>
 #include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
 #include "XtalDAQ/OnlineCBCAnalyser/interface/HttpServer.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/HttpRouteTable.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SteadyClock.h"
 
 //
 // Forward declarations
@@ -16,6 +21,27 @@ class TH1;
 namespace cbcanalyser
 {
 	/** @brief Analyser to look over the CBC output written by the GlibStreamer XDAQ plugin.
+	 *
+	 * Reads the hits from the CBCHitCollection made by CBCHitProducer, with the module label given
+	 * by the "hitCollectionLabel" untracked parameter (default "cbcHits").
+	 *
+	 * At the end of the job every strip's s-curve is fitted and written to the TFileService file.
+	 * By default the fits are done with ROOT in a single thread. Setting "numberOfFitThreads"
+	 * (untracked, default 0) spreads them over that many threads instead, one FED channel at a
+	 * time, with SCurve::fit. How long it took is printed either way.
+	 *
+	 * The embedded HTTP server answers these requests:
+	 *   /changeVar?name=value&...  sets one or more variables. Either all are set or, if any name or
+	 *                              value is invalid, none are. Variables are "globalComparatorThreshold_"
+	 *                              (between 0 and 1) and "debug_" (0 or 1).
+	 *   /status                    JSON with the event and run counts, the event rate and the threshold.
+	 *   /scurves/<fed>/<channel>   the raw s-curve counts for every strip on a FED channel as JSON, or
+	 *                              with "?format=binary" as packed little endian uint32_t: numberOfStrips,
+	 *                              numberOfBins, stripNumbers[numberOfStrips], then
+	 *                              counts[numberOfStrips][numberOfBins][2] with events on then events off.
+	 *   /estimates/<fed>/<channel> JSON with SCurve::estimateParameters for every strip on a FED channel,
+	 *                              i.e. the plateau, mean and width (in bins) without fitting.
+	 *   /                          the details of the request, for debugging.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 08/May2013
@@ -42,25 +68,38 @@ namespace cbcanalyser
 		virtual void beginLuminosityBlock( const edm::LuminosityBlock& lumiBlock, const edm::EventSetup& setup );
 		virtual void endLuminosityBlock( const edm::LuminosityBlock& lumiBlock, const edm::EventSetup& setup );
 
-		/** @brief The handler that server_ will call when a HTTP request comes in. */
+		/** @brief The handler that server_ will call when a HTTP request comes in. Passes it on to routeTable_. */
 		virtual void handleRequest( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply );
+
+		/// @brief Handlers for the different resources in routeTable_. See the class description for what they do.
+		void handleChangeVar( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleStatus( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleSCurves( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleEstimates( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleDebugEcho( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply );
 	protected:
 		/** @brief Save the current state to disk so that another AnalyseCBCOutput can be restored to the same state.
 		 *
 		 * I've been having a lot of problems with the DAQ runcontrol. The only way I can take multiple runs (as of
 		 * 04/Sep/2013) is to kill all the processes and start again, so I need a way of restoring the analyser's
 		 * state after a run.
+		 *
+		 * The state is saved as a binary SCurveSnapshot, which is written atomically.
 		 */
 		void saveState( const std::string& filename );
 		/** @brief Restore to the state that was saved to a call to saveState.
 		 *
-		 * See the note on saveState for an explanation of why this is necassary.
+		 * See the note on saveState for an explanation of why this is necassary. Files saved in the old
+		 * text format can still be restored.
 		 */
 		void restoreState( const std::string& filename );
 		/** @brief Filename to save the state to. Optional - if empty the state is not restored or saved to disk. */
 		std::string savedStateFilename_;
 
 		DetectorSCurves detectorSCurves_;
+		/** @brief Held while detectorSCurves_ is modified, or read from the server thread. Adding a strip can
+		 * move the counts for a whole channel, so the server can't read while analyze() is writing. */
+		std::mutex sCurveMutex_;
 
 		/** @brief Dumps the s-curves to the output stream for debugging */
 		void dumpSCurveToStream( std::ostream& output );
@@ -72,16 +111,19 @@ namespace cbcanalyser
 		 */
 		void readI2CValues();
 		std::string I2CValuesFilename_;
+		unsigned int numberOfFitThreads_; ///< @brief Zero to fit with ROOT in this thread
+		edm::InputTag hitCollectionLabel_;
 		std::vector<unsigned int> stripThresholdOffsets_;
 		//std::atomic<float> globalComparatorThreshold_; /// @brief Atomic because the handleRequest method can change it from a different thread.
 		float globalComparatorThreshold_; /// @brief Should be std::atomic but it won't link (compiles though). I think the compiler is too old.
 
-		size_t eventsProcessed_;
-		size_t runsProcessed_;
+		std::atomic<size_t> eventsProcessed_;
+		std::atomic<size_t> runsProcessed_;
+		std::atomic<cbcanalyser::SteadyClock::rep> runStartTime_; ///< Time since the SteadyClock epoch that the current run started
 
-		class cbcanalyser::SCurveEntry* pSCurveEntryToMonitorForDQM_;
+		httpserver::RouteTable routeTable_;
 		httpserver::HttpServer server_;
-		bool debug_; ///< @brief Whether or not to print lots of debug messages.
+		std::atomic<bool> debug_; ///< @brief Whether or not to print lots of debug messages.
 	};
 
 } // end of namespace cbcanalyser
@@ -0,0 +1,73 @@
+#include "XtalDAQ/OnlineCBCAnalyser/plugins/CBCHitProducer.h"
+
+#include <iostream>
+#include <memory>
+#include <FWCore/Framework/interface/MakerMacros.h>
+#include <FWCore/Framework/interface/Event.h>
+#include <FWCore/ParameterSet/interface/ParameterSet.h>
+#include <DataFormats/FEDRawData/interface/FEDRawDataCollection.h>
+#include <EventFilter/SiStripRawToDigi/interface/SiStripFEDBuffer.h>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCHitCollection.h"
+
+namespace cbcanalyser
+{
+	DEFINE_FWK_MODULE(CBCHitProducer);
+}
+
+cbcanalyser::CBCHitProducer::CBCHitProducer( const edm::ParameterSet& config )
+	: rawDataLabel_( config.getUntrackedParameter<edm::InputTag>("rawDataLabel",edm::InputTag("rawDataCollector")) ),
+	  eventsProcessed_(0), malformedBuffers_(0)
+{
+	produces<cbcanalyser::CBCHitCollection>();
+}
+
+void cbcanalyser::CBCHitProducer::produce( edm::Event& event, const edm::EventSetup& setup )
+{
+	++eventsProcessed_;
+
+	edm::Handle<FEDRawDataCollection> hRawData;
+	event.getByLabel( rawDataLabel_, hRawData );
+
+	std::auto_ptr<cbcanalyser::CBCHitCollection> pHits( new cbcanalyser::CBCHitCollection );
+
+	for( size_t fedIndex=sistrip::FED_ID_MIN; fedIndex<=sistrip::FED_ID_MAX && fedIndex<sistrip::CMS_FED_ID_MAX; ++fedIndex )
+	{
+		const FEDRawData& fedData=hRawData->FEDData(fedIndex);
+		if( fedData.size()==0 ) continue;
+
+		try
+		{
+			sistrip::FEDBuffer myBuffer(fedData.data(),fedData.size());
+
+			for ( uint16_t feIndex = 0; feIndex<sistrip::FEUNITS_PER_FED; ++feIndex )
+			{
+				if( !myBuffer.fePresent(feIndex) ) continue;
+
+				for ( uint16_t channelInFe = 0; channelInFe < sistrip::FEDCH_PER_FEUNIT; ++channelInFe )
+				{
+					const uint16_t channelIndex=feIndex*sistrip::FEDCH_PER_FEUNIT+channelInFe;
+					const sistrip::FEDChannel& channel=myBuffer.channel(channelIndex);
+
+					cbcanalyser::CBCChannelUnpacker unpacker(channel);
+					if( !unpacker.hasData() ) continue;
+
+					pHits->add( cbcanalyser::CBCChannelHits( fedIndex, channelIndex, unpacker.hitMask() ) );
+				} // end of loop over FED channels
+			}
+		}
+		catch( std::exception& error )
+		{
+			pHits->addMalformedBuffer();
+			++malformedBuffers_;
+			std::cerr << "CBCHitProducer - couldn't unpack FED " << fedIndex << ": " << error.what() << std::endl;
+		}
+	} // end of loop over FEDs
+
+	event.put( pHits );
+}
+
+void cbcanalyser::CBCHitProducer::endJob()
+{
+	if( malformedBuffers_!=0 ) std::cout << "CBCHitProducer - " << malformedBuffers_ << " FED buffers couldn't be unpacked in " << eventsProcessed_ << " events." << std::endl;
+}
@@ -0,0 +1,36 @@
+#ifndef XtalDAQ_OnlineCBCAnalyser_plugins_CBCHitProducer_h
+#define XtalDAQ_OnlineCBCAnalyser_plugins_CBCHitProducer_h
+
+#include <FWCore/Framework/interface/Frameworkfwd.h>
+#include <FWCore/Framework/interface/EDProducer.h>
+#include <FWCore/Utilities/interface/InputTag.h>
+
+namespace cbcanalyser
+{
+	/** @brief Producer that unpacks the CBC hits from the raw FED data once per event and puts them in the
+	 * event as a CBCHitCollection.
+	 *
+	 * AnalyseCBCOutput and OccupancyDQM used to both unpack every FED buffer themselves. They now read
+	 * the collection this makes instead. FED buffers that can't be unpacked are counted in the collection,
+	 * and the total is printed at the end of the job.
+	 *
+	 * The raw data is taken from the "rawDataLabel" untracked parameter, which defaults to "rawDataCollector".
+	 */
+	class CBCHitProducer : public edm::EDProducer
+	{
+	public:
+		explicit CBCHitProducer( const edm::ParameterSet& config );
+		CBCHitProducer( const cbcanalyser::CBCHitProducer& otherProducer ) = delete;
+		CBCHitProducer& operator=( const cbcanalyser::CBCHitProducer& otherProducer ) = delete;
+	private:
+		virtual void produce( edm::Event& event, const edm::EventSetup& setup );
+		virtual void endJob();
+
+		edm::InputTag rawDataLabel_;
+		size_t eventsProcessed_;
+		size_t malformedBuffers_;
+	};
+
+} // end of namespace cbcanalyser
+
+#endif
@@ -1,11 +1,20 @@
 #include "XtalDAQ/OnlineCBCAnalyser/plugins/OccupancyDQM.h"
 
+#include <map>
+#include <array>
+#include <algorithm>
+#include <mutex>
+#include <cmath>
+#include <chrono>
+#include <memory>
+#include <deque>
 #include <FWCore/Framework/interface/MakerMacros.h>
 #include <FWCore/Framework/interface/Event.h>
-#include <DataFormats/FEDRawData/interface/FEDRawDataCollection.h>
-#include <EventFilter/SiStripRawToDigi/interface/SiStripFEDBuffer.h>
+#include <FWCore/ParameterSet/interface/ParameterSet.h>
 #include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCHitCollection.h"
 #include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SteadyClock.h"
 
 namespace cbcanalyser
 {
@@ -33,9 +42,7 @@ namespace // Use the unnamed namespace for things only used in this file. Defini
 		bool isLocked_;
 	};
 
-	/** @brief Class to calculate the occupancy for the last rolling <n> events.
-	 *
-	 * <n> is set in the constructor.
+	/** @brief The occupancy of a strip over one of the windows of a CBCChipRollingOccupancy.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 09/Oct/2013
@@ -43,36 +50,114 @@ namespace // Use the unnamed namespace for things only used in this file. Defini
 	class RollingOccupancy
 	{
 	public:
-		RollingOccupancy( size_t eventsToRecord );
-		void addEvent( bool isOn ); ///< Adds a new event and forgets the event furthest in the past
-		float occupancy() const; ///< The occupancy for the last <n> events.
+		RollingOccupancy( size_t eventsOn, size_t numberOfEvents );
+		float occupancy() const; ///< The occupancy over the window, or zero if there haven't been any events yet.
 		float occupancyError() const; ///< Simple poisson error.
 		size_t eventsOn() const; ///< The number of recent events that the channel was on
 		size_t eventsOff() const; ///< The number of recent events that the channel was off
 	protected:
-		std::deque<bool> mostRecentEvents_; ///< Keeps track of the state for individual events. Events furthest in the past are at the front.
-		size_t eventsOn_; ///< Keeps track of the number of entries in mostRecentEvents_ that are true
+		size_t eventsOn_;
+		size_t numberOfEvents_;
 	};
 
+	/** @brief Calculates the occupancy of every strip on a chip for several rolling windows, e.g. the
+	 * last 100, 1000 and 10000 events.
+	 *
+	 * The hit masks for the most recent events are kept in a ring as long as the longest window, so
+	 * each event is only stored once however many windows there are. When an event is added the
+	 * per strip counts of each window only change for the strips that differ between the new event
+	 * and the one leaving that window, which are found with a few word operations. The total number
+	 * of hits in each window is kept with popcount.
+	 *
+	 * Until a window has filled up the occupancy is over the events recorded so far.
+	 */
 	class CBCChipRollingOccupancy
 	{
 	public:
-		static void setDefaultEventsToRecord( size_t defaultEventsToRecord );
+		typedef std::array<uint32_t,cbcanalyser::CBCChannelUnpacker::numberOfStrips> StripCounts;
+		static void setDefaultWindowLengths( const std::vector<size_t>& defaultWindowLengths );
+		static const std::vector<size_t>& defaultWindowLengths();
 	public:
-		/** @brief Constructor that creates RollingOccupancy instances to track the most recent <n> events,
-		 * where <n> is whatever the last call to the static setDefaultEventsToRecord was.
-		 */
+		/** @brief Constructor that tracks whatever windows the last call to the static setDefaultWindowLengths was. */
 		CBCChipRollingOccupancy();
-		/** @brief Constructor that creates RollingOccupancy instances to track the most recent <eventsToRecord> events. */
-		CBCChipRollingOccupancy( size_t eventsToRecord );
-		void addEvent( const cbcanalyser::CBCChannelUnpacker& unpacker );
-		const RollingOccupancy& stripOccupancy( size_t stripNumber ) const;
+		/** @brief Constructor that tracks the given window lengths. There must be at least one, and none can be zero. */
+		CBCChipRollingOccupancy( const std::vector<size_t>& windowLengths );
+		/** @brief Adds an event from a hit mask in the format of CBCChannelUnpacker::hitMask(). */
+		void addEvent( const uint64_t* pHitWords );
+		RollingOccupancy stripOccupancy( size_t stripNumber, size_t windowIndex=0 ) const;
 		size_t numberOfStrips() const;
+		size_t numberOfWindows() const;
+		size_t windowLength( size_t windowIndex ) const;
+		/** @brief The number of events currently in the window, i.e. the length unless it hasn't filled up yet. */
+		size_t eventsInWindow( size_t windowIndex ) const;
+		/** @brief The number of hits summed over all strips and all the events in the window. */
+		size_t hitsInWindow( size_t windowIndex ) const;
+		/** @brief The number of events in the window that each strip was on. */
+		const StripCounts& stripCounts( size_t windowIndex ) const;
 	protected:
-		std::vector<RollingOccupancy> stripOccupancies_;
-		static size_t defaultEventsToRecord_;
+		static const size_t numberOfStrips_=cbcanalyser::CBCChannelUnpacker::numberOfStrips;
+		static const size_t numberOfWords_=cbcanalyser::CBCChannelUnpacker::numberOfWords;
+		typedef cbcanalyser::CBCChannelUnpacker::HitMask HitMask;
+
+		std::vector<size_t> windowLengths_;
+		std::vector<HitMask> history_; ///< Ring of the most recent events, as long as the longest window
+		size_t nextEvent_; ///< The position in history_ the next event will be written to
+		size_t eventsRecorded_;
+		std::vector<StripCounts> eventsOn_; ///< The number of events each strip was on, for each window
+		std::vector<size_t> hitsInWindow_;
+		static std::vector<size_t> defaultWindowLengths_;
+	};
+
+	/** @brief An immutable copy of all the occupancies, published by analyze() for the HTTP server to render.
+	 *
+	 * Only the per strip counts are copied and not the event history, so it's cheap to make one. Once
+	 * published a snapshot is never modified, so the server can read it for as long as it likes
+	 * without holding up the event loop.
+	 */
+	struct OccupancySnapshot
+	{
+		struct ChipOccupancy
+		{
+			size_t fedNumber;
+			size_t fedChannel;
+			std::vector<CBCChipRollingOccupancy::StripCounts> eventsOn; ///< Indexed by window then strip
+			std::vector<size_t> eventsInWindow;
+			std::vector<size_t> hitsInWindow;
+			RollingOccupancy stripOccupancy( size_t stripNumber, size_t windowIndex ) const;
+		};
+		std::vector<size_t> windowLengths;
+		std::vector<ChipOccupancy> chips; ///< Ordered by FED number then FED channel
+		size_t numberOfEvents;
+		size_t malformedBuffers;
+		size_t sequenceNumber; ///< Goes up by one for each snapshot, starting at 1
+		double eventRate; ///< Events per second since the previous snapshot, or zero for the first
+		cbcanalyser::SteadyClock::time_point timeTaken;
 	};
 
+	/** @brief Copies the counts out of the nested maps of chip occupancies held by OccupancyDQMPrivateMembers.
+	 *
+	 * The event rate and sequence number are calculated from the previous snapshot, if there is one. */
+	std::shared_ptr<const OccupancySnapshot> takeSnapshot( const std::map<size_t,std::map<size_t,CBCChipRollingOccupancy> >& allRollingOccupancies,
+			size_t numberOfEvents, size_t malformedBuffers, const OccupancySnapshot* pPreviousSnapshot );
+
+	/** @brief Encodes the strip counts in "snapshot" that are different to those in "pBaseSnapshot", for one window.
+	 *
+	 * This is what's sent to clients of the occupancy stream. If pBaseSnapshot is null every chip is sent, as if
+	 * the base had every count at zero. Everything is an unsigned LEB128 varint (seven bits per byte, least
+	 * significant first, top bit set on all but the last byte):
+	 *
+	 *   header     sequenceNumber, baseSequenceNumber (zero if everything is sent), numberOfEvents,
+	 *              windowLength, numberOfChips
+	 *   each chip  fedNumber, fedChannel, eventsInWindow, numberOfChangedStrips, then numberOfChangedStrips
+	 *              times: stripGap, eventsOn
+	 *
+	 * The strip number is the previous changed strip in the chip plus stripGap plus one, so the first
+	 * strip number is just stripGap. A chip is sent if any of its counts or eventsInWindow has changed.
+	 * Since the counts are sent rather than the occupancy, the client can work out the occupancy of
+	 * every strip exactly.
+	 */
+	std::string encodeOccupancyDelta( const OccupancySnapshot* pBaseSnapshot, const OccupancySnapshot& snapshot, size_t windowIndex );
+
 } // end of the unnamed namespace
 
 
@@ -93,11 +178,61 @@ namespace cbcanalyser
 		 * "allRollingOccupancies_[2][4]".
 		 */
 		std::map<size_t,std::map<size_t,::CBCChipRollingOccupancy> > allRollingOccupancies_;
+
+		/** @brief Makes the snapshot the one the server renders from. Only holds snapshotMutex_ to add the pointer. */
+		void publishSnapshot( std::shared_ptr<const ::OccupancySnapshot> pNewSnapshot );
+		/** @brief Returns the most recently published snapshot, or null if there hasn't been one yet. */
+		std::shared_ptr<const ::OccupancySnapshot> latestSnapshot();
+		/** @brief Returns the snapshot with the given sequence number, or null if it's not in recentSnapshots_ any more. */
+		std::shared_ptr<const ::OccupancySnapshot> findSnapshot( size_t sequenceNumber );
+
+		/** @brief The most recent copies of allRollingOccupancies_ for the server, newest at the back. The old
+		 * ones are kept so that the stream can send clients what's changed since the one they last saw. Only
+		 * modify or copy from this while holding snapshotMutex_, i.e. use the methods above. */
+		std::deque< std::shared_ptr<const ::OccupancySnapshot> > recentSnapshots_;
+		static const size_t maximumRecentSnapshots_=32;
+		std::mutex snapshotMutex_;
+		size_t snapshotEventInterval_; ///< Publish a new snapshot after this many events...
+		std::chrono::milliseconds snapshotTimeInterval_; ///< ...or after this much time, whichever comes first.
+		size_t eventsSinceSnapshot_;
+		cbcanalyser::SteadyClock::time_point lastSnapshotTime_;
 	};
 
 } // end of namespace cbcanalyser
 
 
+const size_t cbcanalyser::OccupancyDQMPrivateMembers::maximumRecentSnapshots_;
+
+void cbcanalyser::OccupancyDQMPrivateMembers::publishSnapshot( std::shared_ptr<const ::OccupancySnapshot> pNewSnapshot )
+{
+	// The oldest snapshot is deleted when the last shared_ptr to it goes, which could be in the
+	// server thread if it's still rendering it. Either way, it's after the lock has been released.
+	::MutexLockSentry mutexLock( snapshotMutex_ );
+	recentSnapshots_.push_back( pNewSnapshot );
+	if( recentSnapshots_.size()>maximumRecentSnapshots_ )
+	{
+		pNewSnapshot.swap( recentSnapshots_.front() );
+		recentSnapshots_.pop_front();
+	}
+}
+
+std::shared_ptr<const ::OccupancySnapshot> cbcanalyser::OccupancyDQMPrivateMembers::latestSnapshot()
+{
+	::MutexLockSentry mutexLock( snapshotMutex_ );
+	if( recentSnapshots_.empty() ) return nullptr;
+	return recentSnapshots_.back();
+}
+
+std::shared_ptr<const ::OccupancySnapshot> cbcanalyser::OccupancyDQMPrivateMembers::findSnapshot( size_t sequenceNumber )
+{
+	::MutexLockSentry mutexLock( snapshotMutex_ );
+	for( const auto& pSnapshot : recentSnapshots_ )
+	{
+		if( pSnapshot->sequenceNumber==sequenceNumber ) return pSnapshot;
+	}
+	return nullptr;
+}
+
 cbcanalyser::OccupancyDQM::OccupancyDQM( const edm::ParameterSet& config )
 	: server_(*this), pImple( new OccupancyDQMPrivateMembers )
 {
@@ -113,10 +248,29 @@ cbcanalyser::OccupancyDQM::OccupancyDQM( const edm::ParameterSet& config )
 	hostname_=config.getUntrackedParameter<std::string>("commsServerHostname");
 	port_=config.getUntrackedParameter<std::string>("commsServerPort");
 
-	size_t eventsToRecord=config.getParameter<unsigned int>("eventsToRecord");
-	CBCChipRollingOccupancy::setDefaultEventsToRecord( eventsToRecord );
+	hitCollectionLabel_=config.getUntrackedParameter<edm::InputTag>("hitCollectionLabel",edm::InputTag("cbcHits"));
+
+	// The window in "eventsToRecord" is the one shown by default, and any others are optional
+	std::vector<size_t> windowLengths( 1, config.getParameter<unsigned int>("eventsToRecord") );
+	for( const auto windowLength : config.getUntrackedParameter< std::vector<unsigned int> >("additionalWindows",std::vector<unsigned int>()) )
+	{
+		if( std::find( windowLengths.begin(), windowLengths.end(), windowLength )==windowLengths.end() ) windowLengths.push_back( windowLength );
+	}
+	CBCChipRollingOccupancy::setDefaultWindowLengths( windowLengths );
+
+	pImple->snapshotEventInterval_=config.getUntrackedParameter<unsigned int>("snapshotEventInterval",100);
+	pImple->snapshotTimeInterval_=std::chrono::milliseconds( config.getUntrackedParameter<unsigned int>("snapshotTimeInterval",1000) );
+	pImple->eventsSinceSnapshot_=0;
+	// lastSnapshotTime_ is default constructed to the clock's epoch, so the first event always publishes a snapshot
+
+	using namespace std::placeholders; // For _1, _2 and _3 in the std::binds below
+	routeTable_.addRoute( "/", std::bind( &OccupancyDQM::handleOccupancyPage, this, _1, _2, _3 ), "Webpage of the occupancies, optionally with ?window=<index>" );
+	routeTable_.addRoute( "/occupancy.json", std::bind( &OccupancyDQM::handleOccupancyJson, this, _1, _2, _3 ), "Occupancies as JSON, optionally with ?window=<index>&fed=<number>&channel=<number>" );
+	routeTable_.addRoute( "/occupancy/stream", std::bind( &OccupancyDQM::handleOccupancyStream, this, _1, _2, _3 ), "Long poll for the counts changed since a snapshot, with ?since=<sequence number>&window=<index>&interval=<ms>&timeout=<ms>" );
+	routeTable_.addRoute( "/status", std::bind( &OccupancyDQM::handleStatus, this, _1, _2, _3 ), "Event counts and rates as JSON" );
 
 	numberOfEvents_=0;
+	malformedBuffers_=0;
 }
 
 cbcanalyser::OccupancyDQM::~OccupancyDQM()
@@ -133,125 +287,314 @@ void cbcanalyser::OccupancyDQM::analyze( const edm::Event& event, const edm::Eve
 
 	++numberOfEvents_;
 
-	edm::Handle<FEDRawDataCollection> hRawData;
-	event.getByLabel( "rawDataCollector", hRawData );
+	// The hits are unpacked once per event by CBCHitProducer
+	edm::Handle<cbcanalyser::CBCHitCollection> hHits;
+	event.getByLabel( hitCollectionLabel_, hHits );
+	malformedBuffers_+=hHits->malformedBuffers();
 
-	// I need to lock the mutex because the HTTP server thread could try and read while I'm
-	// in the middle of modifying. I'm not worried about the server getting incorrect information
-	// (since it's not mission critical) but the iterators it's looping on could change and cause
-	// invalid memory access.
-	// Use a sentry class to lock it in an exception safe way.
-	MutexLockSentry mutexLock( serverMutex_ );
-
-
-	for( size_t fedIndex=0; fedIndex<sistrip::CMS_FED_ID_MAX; ++fedIndex )
+	// The server never looks at allRollingOccupancies_, only at the snapshots published below,
+	// so there's no need to lock anything while modifying it.
+	for( const auto& channelHits : *hHits )
 	{
-		const FEDRawData& fedData=hRawData->FEDData(fedIndex);
-
-		if( fedData.size()!=0 )
-		{
-			// Check to see if this FED is one of the ones allocated to the strip tracker
-			if( fedIndex < sistrip::FED_ID_MIN || fedIndex > sistrip::FED_ID_MAX ) continue;
-
-			try
-			{
-				sistrip::FEDBuffer myBuffer(fedData.data(),fedData.size());
-
-				for ( uint16_t feIndex = 0; feIndex<sistrip::FEUNITS_PER_FED; ++feIndex )
-				{
-					if( !myBuffer.fePresent(feIndex) ) continue;
-
-					for ( uint16_t channelInFe = 0; channelInFe < sistrip::FEDCH_PER_FEUNIT; ++channelInFe )
-					{
-						const uint16_t channelIndex=feIndex*sistrip::FEDCH_PER_FEUNIT+channelInFe;
-						const sistrip::FEDChannel& channel=myBuffer.channel(channelIndex);
-
-						cbcanalyser::CBCChannelUnpacker unpacker(channel);
-						if( !unpacker.hasData() ) continue;
-
-						pImple->allRollingOccupancies_[fedIndex][channelIndex].addEvent( unpacker );
-
-					} // end of loop over FED channels
-				}
-			}
-			catch( std::exception& error )
-			{
-				std::cerr << "Exception: "<< error.what() << std::endl;
-			}
+		pImple->allRollingOccupancies_[channelHits.fedNumber][channelHits.fedChannel].addEvent( channelHits.hitWords );
+	}
 
-		} // end of "if FED has data"
-	} // end of loop over FEDs
+	++pImple->eventsSinceSnapshot_;
+	const auto now=cbcanalyser::SteadyClock::now();
+	if( pImple->eventsSinceSnapshot_>=pImple->snapshotEventInterval_ || now-pImple->lastSnapshotTime_>=pImple->snapshotTimeInterval_ )
+	{
+		// The copy is made before taking the lock, so that the lock is only held for the pointer swap.
+		// This is the only thread that changes recentSnapshots_, so it's safe to read it here without the lock.
+		const ::OccupancySnapshot* pPreviousSnapshot=( pImple->recentSnapshots_.empty() ? nullptr : pImple->recentSnapshots_.back().get() );
+		pImple->publishSnapshot( ::takeSnapshot( pImple->allRollingOccupancies_, numberOfEvents_, malformedBuffers_, pPreviousSnapshot ) );
 
+		pImple->eventsSinceSnapshot_=0;
+		pImple->lastSnapshotTime_=now;
+	}
 }
 
 void cbcanalyser::OccupancyDQM::handleRequest( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply )
 {
-	// I don't really care what the request is (what URI or whatever), I'll just return the
-	// same thing for every request. I should probably change this in the future but it's
-	// okay to have something rough-n-ready for now.
+	routeTable_.handleRequest( request, reply );
+}
+
+void cbcanalyser::OccupancyDQM::handleOccupancyPage( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	// The "window" parameter says which of the rolling windows to show, e.g. "/?window=1". Anything
+	// out of range shows the default window. The page keeps itself up to date with the occupancy
+	// stream, asking for changes at most every "refresh" milliseconds.
+	size_t windowIndex=uri.unsignedParameter( "window", 0 );
+	size_t refreshInterval=uri.unsignedParameter( "refresh", 1000 );
 
+	// Once this has the pointer the snapshot can't change, and analyze() is free to publish another.
+	std::shared_ptr<const ::OccupancySnapshot> pSnapshot=pImple->latestSnapshot();
 
 	std::stringstream responseStream; // This will contain the data to send back in the reply
 	responseStream << "<html>"
 			<< "<body>"
 			<< "<h1>CBC occupancies</h1><br>"
 			<< "Strips run left to right, top to bottom. So strip 0 is top left; strip 15 top right; 16 second row far left etcetera."
-			<< "<p>Total number of events=" << numberOfEvents_ << "</p>";
-	// numberOfEvents_ is atomic so the above line should be fine without a mutex.
+			<< "<p>Total number of events=" << numberOfEvents_ << "</p>"
+			<< "<p>FED buffers that couldn't be unpacked=" << malformedBuffers_ << "</p>";
+	// numberOfEvents_ and malformedBuffers_ are atomic so the above lines should be fine without a mutex.
 
-	// Use a sentry class to lock the thread in an exception safe way, in case something
-	// changes while I'm traversing the map.
-	::MutexLockSentry mutexLock( serverMutex_ );
+	if( pSnapshot==nullptr ) responseStream << "<p>No events have been processed yet.</p>";
+	else
+	{
+		const auto snapshotAge=std::chrono::duration_cast<std::chrono::milliseconds>( cbcanalyser::SteadyClock::now()-pSnapshot->timeTaken );
+		responseStream << "<p>Occupancies below are from a snapshot taken " << snapshotAge.count() << " ms before the page loaded, after event <span id=\"snapshotEvent\">"
+				<< pSnapshot->numberOfEvents << "</span>. Snapshots are taken every " << pImple->snapshotEventInterval_
+				<< " events or " << pImple->snapshotTimeInterval_.count() << " ms, whichever is first, and the page is updated with"
+				<< " the changes at most every " << refreshInterval << " ms.</p>";
+
+		if( windowIndex>=pSnapshot->windowLengths.size() ) windowIndex=0;
+		responseStream << "<p>Occupancy over the last " << pSnapshot->windowLengths[windowIndex] << " events.";
+		for( size_t index=0; index<pSnapshot->windowLengths.size(); ++index )
+		{
+			if( index!=windowIndex ) responseStream << " <a href=\"/?window=" << index << "\">Last " << pSnapshot->windowLengths[index] << "</a>";
+		}
+		responseStream << "</p>";
+	}
 
-	// Loop over the information for the FEDs
-	for( const auto& fedNumberMapPair : pImple->allRollingOccupancies_ )
+	// Loop over the information for the chips, which is ordered by FED then FED channel
+	static const std::vector< ::OccupancySnapshot::ChipOccupancy > noChips;
+	const std::vector< ::OccupancySnapshot::ChipOccupancy >& chips=( pSnapshot ? pSnapshot->chips : noChips );
+	for( const auto& chipOccupancy : chips )
 	{
-		size_t fedNumber=fedNumberMapPair.first;
-		// Loop over the information for the FED channels
-		for( const auto& fedChannelNumberChipOccupancyPair : fedNumberMapPair.second )
+		const std::string chipKey=std::to_string(chipOccupancy.fedNumber)+"_"+std::to_string(chipOccupancy.fedChannel); // For the script to find the elements
+		responseStream << "<p>FED " << chipOccupancy.fedNumber << ", FED channel " << chipOccupancy.fedChannel
+				<< " (<span id=\"summary_" << chipKey << "\">" << chipOccupancy.hitsInWindow[windowIndex] << " hits in " << chipOccupancy.eventsInWindow[windowIndex] << " events</span>)</p>"
+				<< "<table border=\"1\" id=\"chip_" << chipKey << "\">";
+		for( size_t stripIndex=0; stripIndex<cbcanalyser::CBCChannelUnpacker::numberOfStrips; ++stripIndex )
 		{
-			size_t channelNumber=fedChannelNumberChipOccupancyPair.first;
-			const ::CBCChipRollingOccupancy& chipOccupancy=fedChannelNumberChipOccupancyPair.second;
-			responseStream << "<p>FED " << fedNumber << ", FED channel " << channelNumber << "</p>"
-					<< "<table border=\"1\">";
-			for( size_t stripIndex=0; stripIndex<chipOccupancy.numberOfStrips(); ++stripIndex )
-			{
-				const RollingOccupancy& stripOccupancy=chipOccupancy.stripOccupancy(stripIndex);
-				float occupancy=stripOccupancy.occupancy();
+			const RollingOccupancy stripOccupancy=chipOccupancy.stripOccupancy( stripIndex, windowIndex );
+			float occupancy=stripOccupancy.occupancy();
+
+			if( stripIndex%16 == 0 ) responseStream << "<tr>";
+			// Make the cell colour a shade of green according to the occupancy, and put the contents as
+			// the number of events on, events off, and percentage of events on.
+			// To make the cell a shade of green, set the green RGB value to always max, and the other two
+			// to max when occupancy is zero (=white) or zero when the occupancy is full (=green).
+			responseStream << "<td align=\"center\" bgcolor=\"#"
+					<< std::hex << static_cast<int>((1-occupancy)*255)  // The red RGB component of the cell background
+					<< "ff"  // The green RGB component of the cell background. Always fully green.
+					<< static_cast<int>((1-occupancy)*255)  // The blue RGB component of the cell background
+					<< std::dec << "\">"
+					<< stripOccupancy.eventsOn() << ":" << stripOccupancy.eventsOff() << "<br>"
+					<< static_cast<int>(occupancy*100+0.5) << "&#37</td>"; // Multiply the occupancy by 100 to get a percentage. The +0.5 makes it round correctly.
+			if( stripIndex%16 == 15 ) responseStream << "</tr>";
+
+		} // end of loop over CBC strips
+
+		responseStream << "</table>";
+
+	} // end of loop over chips
+
+	// Script to keep the tables up to date by long polling the occupancy stream, which only sends the counts that
+	// have changed. See encodeOccupancyDelta for the format.
+	if( pSnapshot!=nullptr )
+	{
+		responseStream << "<script type=\"text/javascript\">\n"
+				<< "var windowIndex=" << windowIndex << ";\n"
+				<< "var refreshInterval=" << refreshInterval << ";\n"
+				<< R"javascript(var sequenceNumber=0;
+var chips={}; // The counts for each chip, keyed by "<fed>_<channel>"
+function readVarint( bytes, position ) {
+	var value=0, multiplier=1, byte;
+	do {
+		byte=bytes[position.index++];
+		value+=(byte & 0x7f)*multiplier;
+		multiplier*=128;
+	} while( byte & 0x80 );
+	return value;
+}
+function cellColour( occupancy ) {
+	var other=Math.floor((1-occupancy)*255).toString(16);
+	if( other.length<2 ) other="0"+other;
+	return "#"+other+"ff"+other;
+}
+function drawChip( key ) {
+	var chip=chips[key];
+	var table=document.getElementById("chip_"+key);
+	var summary=document.getElementById("summary_"+key);
+	if( table==null || summary==null ) return false;
+	var hits=0;
+	for( var strip=0; strip<128; ++strip ) {
+		var eventsOn=chip.eventsOn[strip];
+		var occupancy=( chip.eventsInWindow>0 ? eventsOn/chip.eventsInWindow : 0 );
+		var cell=table.rows[Math.floor(strip/16)].cells[strip%16];
+		cell.innerHTML=eventsOn+":"+(chip.eventsInWindow-eventsOn)+"<br>"+Math.floor(occupancy*100+0.5)+"&#37";
+		cell.bgColor=cellColour( occupancy );
+		hits+=eventsOn;
+	}
+	summary.innerHTML=hits+" hits in "+chip.eventsInWindow+" events";
+	return true;
+}
+function applyDelta( bytes ) {
+	var position={ index: 0 };
+	var newSequenceNumber=readVarint( bytes, position );
+	var baseSequenceNumber=readVarint( bytes, position );
+	var numberOfEvents=readVarint( bytes, position );
+	readVarint( bytes, position ); // The window length, which is already on the page
+	var numberOfChips=readVarint( bytes, position );
+	if( baseSequenceNumber==0 ) chips={};
+	for( var chipIndex=0; chipIndex<numberOfChips; ++chipIndex ) {
+		var key=readVarint( bytes, position )+"_"+readVarint( bytes, position );
+		if( !(key in chips) ) {
+			chips[key]={ eventsInWindow: 0, eventsOn: [] };
+			for( var strip=0; strip<128; ++strip ) chips[key].eventsOn.push( 0 );
+		}
+		var chip=chips[key];
+		chip.eventsInWindow=readVarint( bytes, position );
+		var numberOfChangedStrips=readVarint( bytes, position );
+		var strip=0;
+		for( var changeIndex=0; changeIndex<numberOfChangedStrips; ++changeIndex ) {
+			strip+=readVarint( bytes, position );
+			chip.eventsOn[strip]=readVarint( bytes, position );
+			++strip;
+		}
+		// A chip that wasn't there when the page was made doesn't have a table yet
+		if( !drawChip( key ) ) { window.location.reload(); return; }
+	}
+	sequenceNumber=newSequenceNumber;
+	document.getElementById("snapshotEvent").innerHTML=numberOfEvents;
+}
+function poll() {
+	var request=new XMLHttpRequest();
+	request.open( "GET", "/occupancy/stream?since="+sequenceNumber+"&window="+windowIndex+"&interval="+refreshInterval, true );
+	request.responseType="arraybuffer";
+	request.onload=function() {
+		if( request.status==200 ) {
+			applyDelta( new Uint8Array( request.response ) );
+			poll();
+		}
+		else setTimeout( poll, 5000 );
+	};
+	request.onerror=function() { setTimeout( poll, 5000 ); };
+	request.send();
+}
+poll();
+)javascript" << "</script>";
+	}
 
-				if( stripIndex%16 == 0 ) responseStream << "<tr>";
-				// Make the cell colour a shade of green according to the occupancy, and put the contents as
-				// the number of events on, events off, and percentage of events on.
-				// To make the cell a shade of green, set the green RGB value to always max, and the other two
-				// to max when occupancy is zero (=white) or zero when the occupancy is full (=green).
-				responseStream << "<td align=\"center\" bgcolor=\"#"
-						<< std::hex << static_cast<int>((1-occupancy)*255)  // The red RGB component of the cell background
-						<< "ff"  // The green RGB component of the cell background. Always fully green.
-						<< static_cast<int>((1-occupancy)*255)  // The blue RGB component of the cell background
-						<< std::dec << "\">"
-						<< stripOccupancy.eventsOn() << ":" << stripOccupancy.eventsOff() << "<br>"
-						<< static_cast<int>(occupancy*100+0.5) << "&#37</td>"; // Multiply the occupancy by 100 to get a percentage. The +0.5 makes it round correctly.
-				if( stripIndex%16 == 15 ) responseStream << "</tr>";
+	responseStream << "</body>"
+			<< "</html>";
 
-			} // end of loop over CBC strips
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, responseStream.str(), "text/html" );
+}
 
-			responseStream << "</table>";
+void cbcanalyser::OccupancyDQM::handleOccupancyJson( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	std::shared_ptr<const ::OccupancySnapshot> pSnapshot=pImple->latestSnapshot();
+	if( pSnapshot==nullptr )
+	{
+		httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::service_unavailable, "No events have been processed yet" );
+		return;
+	}
 
-		} // end of loop over FED channels
-	} // end of loop over FEDs
+	size_t windowIndex=uri.unsignedParameter( "window", 0 );
+	if( windowIndex>=pSnapshot->windowLengths.size() ) throw std::runtime_error( "There is no window with that index" );
+	// Optionally only send the chips for one FED, or one FED channel
+	const size_t all=static_cast<size_t>(-1);
+	size_t fedNumber=uri.unsignedParameter( "fed", all );
+	size_t fedChannel=uri.unsignedParameter( "channel", all );
+
+	std::stringstream outputStream;
+	outputStream << "{\"numberOfEvents\":" << pSnapshot->numberOfEvents
+			<< ",\"snapshotAge\":" << std::chrono::duration_cast<std::chrono::milliseconds>( cbcanalyser::SteadyClock::now()-pSnapshot->timeTaken ).count()
+			<< ",\"window\":" << windowIndex
+			<< ",\"windowLength\":" << pSnapshot->windowLengths[windowIndex]
+			<< ",\"chips\":[";
+	bool firstChip=true;
+	for( const auto& chipOccupancy : pSnapshot->chips )
+	{
+		if( fedNumber!=all && chipOccupancy.fedNumber!=fedNumber ) continue;
+		if( fedChannel!=all && chipOccupancy.fedChannel!=fedChannel ) continue;
+
+		if( !firstChip ) outputStream << ",";
+		firstChip=false;
+		outputStream << "{\"fed\":" << chipOccupancy.fedNumber
+				<< ",\"channel\":" << chipOccupancy.fedChannel
+				<< ",\"eventsInWindow\":" << chipOccupancy.eventsInWindow[windowIndex]
+				<< ",\"hitsInWindow\":" << chipOccupancy.hitsInWindow[windowIndex]
+				<< ",\"eventsOn\":[";
+		const ::CBCChipRollingOccupancy::StripCounts& eventsOn=chipOccupancy.eventsOn[windowIndex];
+		for( size_t stripIndex=0; stripIndex<eventsOn.size(); ++stripIndex )
+		{
+			if( stripIndex!=0 ) outputStream << ",";
+			outputStream << eventsOn[stripIndex];
+		}
+		outputStream << "]}";
+	}
+	outputStream << "]}";
 
-	mutexLock.unlock(); // Finished with the map so I can release the lock
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str(), "application/json" );
+}
 
-	responseStream << "</body>"
-			<< "</html>";
+void cbcanalyser::OccupancyDQM::handleOccupancyStream( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	const size_t since=uri.unsignedParameter( "since", 0 );
+	const size_t windowIndex=uri.unsignedParameter( "window", 0 );
+	if( windowIndex>=::CBCChipRollingOccupancy::defaultWindowLengths().size() ) throw std::runtime_error( "There is no window with that index" );
+	const std::chrono::milliseconds interval( uri.unsignedParameter( "interval", 0 ) );
+	const std::chrono::milliseconds timeout( std::min<size_t>( uri.unsignedParameter( "timeout", 20000 ), 60000 ) );
+	const cbcanalyser::SteadyClock::time_point deadline=cbcanalyser::SteadyClock::now()+timeout;
+
+	// Checks whether there's anything to send and fills the reply if there is. It's called straight
+	// away, and if there's nothing to send the server keeps calling it until there is or the timeout
+	// is reached.
+	std::function<bool( httpserver::HttpServer::Reply& )> sendIfReady=[this,since,windowIndex,interval,deadline]( httpserver::HttpServer::Reply& reply )
+	{
+		const bool timedOut=( cbcanalyser::SteadyClock::now()>=deadline );
+		std::shared_ptr<const ::OccupancySnapshot> pLatestSnapshot=pImple->latestSnapshot();
+		if( pLatestSnapshot==nullptr )
+		{
+			if( !timedOut ) return false;
+			httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::service_unavailable, "No events have been processed yet" );
+			return true;
+		}
+
+		// If the client already has the latest snapshot there's nothing new, but on the timeout an empty
+		// update is sent anyway so that the client knows the server is still there. A sequence number
+		// that's too old (or from before a restart) gets everything straight away.
+		std::shared_ptr<const ::OccupancySnapshot> pBaseSnapshot=pImple->findSnapshot( since );
+		if( !timedOut )
+		{
+			if( pLatestSnapshot->sequenceNumber==since ) return false;
+			if( pBaseSnapshot!=nullptr && pLatestSnapshot->timeTaken-pBaseSnapshot->timeTaken<interval ) return false; // Throttle to the client's rate
+		}
+
+		httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, ::encodeOccupancyDelta( pBaseSnapshot.get(), *pLatestSnapshot, windowIndex ), "application/octet-stream" );
+		return true;
+	};
+
+	if( !sendIfReady( reply ) )
+	{
+		reply.poll=sendIfReady;
+		reply.pollInterval=std::chrono::milliseconds(50);
+	}
+}
+
+void cbcanalyser::OccupancyDQM::handleStatus( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply )
+{
+	std::shared_ptr<const ::OccupancySnapshot> pSnapshot=pImple->latestSnapshot();
+
+	std::stringstream outputStream;
+	outputStream << "{\"numberOfEvents\":" << numberOfEvents_
+			<< ",\"malformedBuffers\":" << malformedBuffers_
+			<< ",\"windowLengths\":[";
+	const std::vector<size_t>& windowLengths=::CBCChipRollingOccupancy::defaultWindowLengths();
+	for( size_t index=0; index<windowLengths.size(); ++index ) outputStream << ( index==0 ? "" : "," ) << windowLengths[index];
+	outputStream << "]";
+	if( pSnapshot!=nullptr )
+	{
+		outputStream << ",\"eventRate\":" << pSnapshot->eventRate
+				<< ",\"numberOfChips\":" << pSnapshot->chips.size()
+				<< ",\"snapshotAge\":" << std::chrono::duration_cast<std::chrono::milliseconds>( cbcanalyser::SteadyClock::now()-pSnapshot->timeTaken ).count();
+	}
+	outputStream << "}";
 
-	reply.status=httpserver::HttpServer::Reply::StatusType::ok;
-	reply.content=responseStream.str();
-	reply.headers.resize( 2 );
-	reply.headers[0].name="Content-Length";
-	reply.headers[0].value=std::to_string( reply.content.size() );
-	reply.headers[1].name="Content-Type";
-	reply.headers[1].value="text/html";
+	httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, outputStream.str(), "application/json" );
 }
 
 //---------------------------------------------------------------------
@@ -259,35 +602,22 @@ void cbcanalyser::OccupancyDQM::handleRequest( const httpserver::HttpServer::Req
 //---------------------------------------------------------------------
 namespace
 {
-	RollingOccupancy::RollingOccupancy( size_t eventsToRecord )
-		: mostRecentEvents_(eventsToRecord,false), eventsOn_(0)
+	RollingOccupancy::RollingOccupancy( size_t eventsOn, size_t numberOfEvents )
+		: eventsOn_(eventsOn), numberOfEvents_(numberOfEvents)
 	{
-		// No operation besides the initialiser list. Sets everything up
-		// as though the last eventsToRecord number of events had the
-		// channel off.
-	}
-
-	void RollingOccupancy::addEvent( bool isOn )
-	{
-		// First see if the number of eventsOn_ needs to change, i.e. whether
-		// the event furthest in the past that I'm about to forget is different.
-		if( mostRecentEvents_.front()!=isOn )
-		{
-			if( isOn ) ++eventsOn_;
-			else --eventsOn_;
-		}
-		mostRecentEvents_.pop_front();
-		mostRecentEvents_.push_back(isOn);
+		// No operation besides the initialiser list.
 	}
 
 	float RollingOccupancy::occupancy() const
 	{
-		return static_cast<float>(eventsOn_)/static_cast<float>(mostRecentEvents_.size());
+		if( numberOfEvents_==0 ) return 0;
+		return static_cast<float>(eventsOn_)/static_cast<float>(numberOfEvents_);
 	}
 
 	float RollingOccupancy::occupancyError() const
 	{
-		return std::sqrt(eventsOn_)/static_cast<float>(mostRecentEvents_.size());
+		if( numberOfEvents_==0 ) return 0;
+		return std::sqrt(eventsOn_)/static_cast<float>(numberOfEvents_);
 	}
 
 	size_t RollingOccupancy::eventsOn() const
@@ -297,48 +627,216 @@ namespace
 
 	size_t RollingOccupancy::eventsOff() const
 	{
-		return mostRecentEvents_.size()-eventsOn_;
+		return numberOfEvents_-eventsOn_;
 	}
 
 
 
-	size_t CBCChipRollingOccupancy::defaultEventsToRecord_=100;
+	const size_t CBCChipRollingOccupancy::numberOfStrips_;
+	const size_t CBCChipRollingOccupancy::numberOfWords_;
+	std::vector<size_t> CBCChipRollingOccupancy::defaultWindowLengths_( 1, 100 );
 
-	void CBCChipRollingOccupancy::setDefaultEventsToRecord( size_t defaultEventsToRecord )
+	void CBCChipRollingOccupancy::setDefaultWindowLengths( const std::vector<size_t>& defaultWindowLengths )
 	{
-		defaultEventsToRecord_=defaultEventsToRecord;
+		defaultWindowLengths_=defaultWindowLengths;
 	}
 
-	CBCChipRollingOccupancy::CBCChipRollingOccupancy() : stripOccupancies_(128,defaultEventsToRecord_)
+	const std::vector<size_t>& CBCChipRollingOccupancy::defaultWindowLengths()
 	{
-		// No operation besides the initialiser list
+		return defaultWindowLengths_;
 	}
 
-	CBCChipRollingOccupancy::CBCChipRollingOccupancy( size_t eventsToRecord ) : stripOccupancies_(128,eventsToRecord)
+	CBCChipRollingOccupancy::CBCChipRollingOccupancy()
 	{
-		// No operation besides the initialiser list
+		// Delegating constructors aren't supported by the compiler, so do the same as the other constructor
+		*this=CBCChipRollingOccupancy( defaultWindowLengths_ );
 	}
 
-	void CBCChipRollingOccupancy::addEvent( const cbcanalyser::CBCChannelUnpacker& unpacker )
+	CBCChipRollingOccupancy::CBCChipRollingOccupancy( const std::vector<size_t>& windowLengths )
+		: windowLengths_(windowLengths), nextEvent_(0), eventsRecorded_(0), eventsOn_(windowLengths.size()), hitsInWindow_(windowLengths.size(),0)
 	{
-		const std::vector<bool>& hits=unpacker.hits();
+		if( windowLengths_.empty() ) throw std::logic_error( "CBCChipRollingOccupancy - there must be at least one window" );
+		if( std::find( windowLengths_.begin(), windowLengths_.end(), 0 )!=windowLengths_.end() ) throw std::logic_error( "CBCChipRollingOccupancy - windows can't have zero length" );
 
-		if( stripOccupancies_.size()!=hits.size() ) throw std::logic_error( "CBCChipRollingOccupancy::addEvent was provided an unpacker with an unexpected number of strips" );
+		HitMask emptyMask;
+		emptyMask.fill(0);
+		history_.resize( *std::max_element( windowLengths_.begin(), windowLengths_.end() ), emptyMask );
+		for( auto& stripCounts : eventsOn_ ) stripCounts.fill(0);
+	}
 
-		for( size_t stripNumber=0; stripNumber<hits.size(); ++stripNumber )
+	void CBCChipRollingOccupancy::addEvent( const uint64_t* pHitWords )
+	{
+		for( size_t windowIndex=0; windowIndex<windowLengths_.size(); ++windowIndex )
 		{
-			stripOccupancies_[stripNumber].addEvent( hits[stripNumber] );
+			// The event that drops out of this window is the one windowLength events ago. That's still
+			// in the ring for every window because the ring is as long as the longest one. Before
+			// the window has filled up nothing drops out.
+			const size_t windowLength=windowLengths_[windowIndex];
+			const HitMask* pLeavingEvent=nullptr;
+			if( eventsRecorded_>=windowLength ) pLeavingEvent=&history_[(nextEvent_+history_.size()-windowLength)%history_.size()];
+
+			StripCounts& stripCounts=eventsOn_[windowIndex];
+			for( size_t wordIndex=0; wordIndex<numberOfWords_; ++wordIndex )
+			{
+				const uint64_t arriving=pHitWords[wordIndex];
+				const uint64_t leaving=( pLeavingEvent ? (*pLeavingEvent)[wordIndex] : 0 );
+				hitsInWindow_[windowIndex]+=__builtin_popcountll(arriving);
+				hitsInWindow_[windowIndex]-=__builtin_popcountll(leaving);
+
+				// Only the strips that are different between the two events need their counts changing
+				uint32_t* pWordCounts=&stripCounts[wordIndex*64];
+				for( uint64_t turnedOn=arriving & ~leaving; turnedOn!=0; turnedOn&=turnedOn-1 ) ++pWordCounts[__builtin_ctzll(turnedOn)];
+				for( uint64_t turnedOff=leaving & ~arriving; turnedOff!=0; turnedOff&=turnedOff-1 ) --pWordCounts[__builtin_ctzll(turnedOff)];
+			}
 		}
+
+		// Now the counts are updated I can overwrite the oldest event
+		std::copy( pHitWords, pHitWords+numberOfWords_, history_[nextEvent_].begin() );
+		nextEvent_=(nextEvent_+1)%history_.size();
+		++eventsRecorded_;
 	}
 
-	const RollingOccupancy& CBCChipRollingOccupancy::stripOccupancy( size_t stripNumber ) const
+	RollingOccupancy CBCChipRollingOccupancy::stripOccupancy( size_t stripNumber, size_t windowIndex ) const
 	{
-		return stripOccupancies_.at(stripNumber);
+		return RollingOccupancy( eventsOn_.at(windowIndex).at(stripNumber), eventsInWindow(windowIndex) );
 	}
 
 	size_t CBCChipRollingOccupancy::numberOfStrips() const
 	{
-		return stripOccupancies_.size();
+		return numberOfStrips_;
+	}
+
+	size_t CBCChipRollingOccupancy::numberOfWindows() const
+	{
+		return windowLengths_.size();
+	}
+
+	size_t CBCChipRollingOccupancy::windowLength( size_t windowIndex ) const
+	{
+		return windowLengths_.at(windowIndex);
+	}
+
+	size_t CBCChipRollingOccupancy::eventsInWindow( size_t windowIndex ) const
+	{
+		return std::min( eventsRecorded_, windowLengths_.at(windowIndex) );
+	}
+
+	size_t CBCChipRollingOccupancy::hitsInWindow( size_t windowIndex ) const
+	{
+		return hitsInWindow_.at(windowIndex);
+	}
+
+	const CBCChipRollingOccupancy::StripCounts& CBCChipRollingOccupancy::stripCounts( size_t windowIndex ) const
+	{
+		return eventsOn_.at(windowIndex);
+	}
+
+
+
+	RollingOccupancy OccupancySnapshot::ChipOccupancy::stripOccupancy( size_t stripNumber, size_t windowIndex ) const
+	{
+		return RollingOccupancy( eventsOn.at(windowIndex).at(stripNumber), eventsInWindow.at(windowIndex) );
+	}
+
+	std::shared_ptr<const OccupancySnapshot> takeSnapshot( const std::map<size_t,std::map<size_t,CBCChipRollingOccupancy> >& allRollingOccupancies,
+			size_t numberOfEvents, size_t malformedBuffers, const OccupancySnapshot* pPreviousSnapshot )
+	{
+		std::shared_ptr<OccupancySnapshot> pSnapshot( new OccupancySnapshot );
+		pSnapshot->windowLengths=CBCChipRollingOccupancy::defaultWindowLengths();
+		pSnapshot->numberOfEvents=numberOfEvents;
+		pSnapshot->malformedBuffers=malformedBuffers;
+		pSnapshot->timeTaken=cbcanalyser::SteadyClock::now();
+		pSnapshot->sequenceNumber=1;
+		pSnapshot->eventRate=0;
+		if( pPreviousSnapshot!=nullptr )
+		{
+			pSnapshot->sequenceNumber=pPreviousSnapshot->sequenceNumber+1;
+			double secondsSincePrevious=std::chrono::duration_cast< std::chrono::duration<double> >( pSnapshot->timeTaken-pPreviousSnapshot->timeTaken ).count();
+			if( secondsSincePrevious>0 ) pSnapshot->eventRate=(numberOfEvents-pPreviousSnapshot->numberOfEvents)/secondsSincePrevious;
+		}
+
+		for( const auto& fedNumberMapPair : allRollingOccupancies )
+		{
+			for( const auto& fedChannelNumberChipOccupancyPair : fedNumberMapPair.second )
+			{
+				const CBCChipRollingOccupancy& chipOccupancy=fedChannelNumberChipOccupancyPair.second;
+				pSnapshot->chips.push_back( OccupancySnapshot::ChipOccupancy() );
+				OccupancySnapshot::ChipOccupancy& chipSnapshot=pSnapshot->chips.back();
+				chipSnapshot.fedNumber=fedNumberMapPair.first;
+				chipSnapshot.fedChannel=fedChannelNumberChipOccupancyPair.first;
+				for( size_t windowIndex=0; windowIndex<chipOccupancy.numberOfWindows(); ++windowIndex )
+				{
+					chipSnapshot.eventsOn.push_back( chipOccupancy.stripCounts(windowIndex) );
+					chipSnapshot.eventsInWindow.push_back( chipOccupancy.eventsInWindow(windowIndex) );
+					chipSnapshot.hitsInWindow.push_back( chipOccupancy.hitsInWindow(windowIndex) );
+				}
+			}
+		}
+
+		return pSnapshot;
+	}
+
+	/** @brief Appends the value to the output as an unsigned LEB128 varint. */
+	void appendVarint( std::string& output, uint64_t value )
+	{
+		while( value>=0x80 )
+		{
+			output.push_back( static_cast<char>( (value & 0x7f) | 0x80 ) );
+			value>>=7;
+		}
+		output.push_back( static_cast<char>(value) );
+	}
+
+	std::string encodeOccupancyDelta( const OccupancySnapshot* pBaseSnapshot, const OccupancySnapshot& snapshot, size_t windowIndex )
+	{
+		std::string chipsOutput;
+		size_t numberOfChips=0;
+
+		// Both lists of chips are ordered by FED then FED channel, and chips are never removed, so
+		// the base chips can be found by stepping through alongside.
+		std::vector<OccupancySnapshot::ChipOccupancy>::const_iterator iBaseChip;
+		if( pBaseSnapshot!=nullptr ) iBaseChip=pBaseSnapshot->chips.begin();
+		std::vector< std::pair<size_t,uint32_t> > changedStrips;
+		for( const auto& chip : snapshot.chips )
+		{
+			const OccupancySnapshot::ChipOccupancy* pBaseChip=nullptr;
+			if( pBaseSnapshot!=nullptr )
+			{
+				while( iBaseChip!=pBaseSnapshot->chips.end() && std::make_pair(iBaseChip->fedNumber,iBaseChip->fedChannel)<std::make_pair(chip.fedNumber,chip.fedChannel) ) ++iBaseChip;
+				if( iBaseChip!=pBaseSnapshot->chips.end() && iBaseChip->fedNumber==chip.fedNumber && iBaseChip->fedChannel==chip.fedChannel ) pBaseChip=&*iBaseChip;
+			}
+
+			changedStrips.clear();
+			const CBCChipRollingOccupancy::StripCounts& eventsOn=chip.eventsOn[windowIndex];
+			for( size_t stripIndex=0; stripIndex<eventsOn.size(); ++stripIndex )
+			{
+				const uint32_t baseEventsOn=( pBaseChip ? pBaseChip->eventsOn[windowIndex][stripIndex] : 0 );
+				if( eventsOn[stripIndex]!=baseEventsOn ) changedStrips.push_back( std::make_pair( stripIndex, eventsOn[stripIndex] ) );
+			}
+			// Unseen chips are always sent so that the client knows they exist
+			if( changedStrips.empty() && pBaseChip!=nullptr && pBaseChip->eventsInWindow[windowIndex]==chip.eventsInWindow[windowIndex] ) continue;
+
+			++numberOfChips;
+			appendVarint( chipsOutput, chip.fedNumber );
+			appendVarint( chipsOutput, chip.fedChannel );
+			appendVarint( chipsOutput, chip.eventsInWindow[windowIndex] );
+			appendVarint( chipsOutput, changedStrips.size() );
+			size_t nextStrip=0;
+			for( const auto& stripNumberEventsOnPair : changedStrips )
+			{
+				appendVarint( chipsOutput, stripNumberEventsOnPair.first-nextStrip );
+				appendVarint( chipsOutput, stripNumberEventsOnPair.second );
+				nextStrip=stripNumberEventsOnPair.first+1;
+			}
+		}
+
+		std::string output;
+		appendVarint( output, snapshot.sequenceNumber );
+		appendVarint( output, pBaseSnapshot ? pBaseSnapshot->sequenceNumber : 0 );
+		appendVarint( output, snapshot.numberOfEvents );
+		appendVarint( output, snapshot.windowLengths.at(windowIndex) );
+		appendVarint( output, numberOfChips );
+		return output+chipsOutput;
 	}
 
 } // end of the unnamed namespace
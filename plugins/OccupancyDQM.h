@@ -1,11 +1,12 @@
 #ifndef XtalDAQ_OnlineCBCAnalyser_plugins_OccupancyDQM_h
 #define XtalDAQ_OnlineCBCAnalyser_plugins_OccupancyDQM_h
 
-#include <mutex>
 #include <atomic>
 #include <FWCore/Framework/interface/Frameworkfwd.h>
 #include <FWCore/Framework/interface/EDAnalyzer.h>
+#include <FWCore/Utilities/interface/InputTag.h>
 #include "XtalDAQ/OnlineCBCAnalyser/interface/HttpServer.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/HttpRouteTable.h"
 
 
 namespace cbcanalyser
@@ -14,7 +15,27 @@ namespace cbcanalyser
 	 * on a webpage.
 	 *
 	 * The hostname and port to try and run the server on is given in the config ParameterSet, as well
-	 * as the number of events to calculate the occupancy for.
+	 * as the number of events to calculate the occupancy for. Longer windows can be added with the
+	 * "additionalWindows" untracked parameter, and chosen on the webpage with e.g. "/?window=1". The
+	 * hits are read from the CBCHitCollection made by CBCHitProducer, with the label given by the
+	 * "hitCollectionLabel" untracked parameter (default "cbcHits").
+	 *
+	 * The webpage is rendered from an immutable snapshot of the occupancies, which analyze() publishes
+	 * every "snapshotEventInterval" events (default 100) or "snapshotTimeInterval" milliseconds (default
+	 * 1000), whichever comes first. Both are untracked. That way a slow page render never holds up the
+	 * event loop, and a busy event loop never holds up the page.
+	 *
+	 * The embedded HTTP server answers these requests:
+	 *   /                  the webpage. Add e.g. "?window=1" for a window other than the first. The page keeps
+	 *                      itself up to date from /occupancy/stream, at most every "refresh" ms (default 1000).
+	 *   /occupancy.json    the number of events each strip was on as JSON. Takes the optional parameters
+	 *                      "window" (the index, default 0), "fed" and "channel" to only send some chips.
+	 *   /occupancy/stream  long poll for the counts that have changed since the snapshot with sequence number
+	 *                      "since" (default 0, i.e. everything), in a compact binary format described at
+	 *                      encodeOccupancyDelta in the .cc file. Replies when there's a newer snapshot at least
+	 *                      "interval" ms (default 0) newer than "since", or after "timeout" ms (default 20000)
+	 *                      with no changes. Also takes "window".
+	 *   /status            JSON with the event counts, the event rate and the snapshot age.
 	 *
 	 * @author Mark Grimes (mark.grimes@bristol.ac.uk)
 	 * @date 09/Oct/2013
@@ -34,14 +55,22 @@ namespace cbcanalyser
 
 		/// @brief The handler that server_ will call when a HTTP request comes in. Required by the IRequestHandler interface.
 		virtual void handleRequest( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply );
+
+		/// @brief Handlers for the different resources in routeTable_. See the class description for what they do.
+		void handleOccupancyPage( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleOccupancyJson( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleOccupancyStream( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
+		void handleStatus( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply );
 	protected:
+		httpserver::RouteTable routeTable_;
 		httpserver::HttpServer server_;
-		std::mutex serverMutex_; ///< Mutex to stop the server reading while the analyze method is writing.
 	private:
 		// I've got a few utility classes that are only visible in the .cc file, so
 		// I need to use a pImple.
 		std::unique_ptr<class OccupancyDQMPrivateMembers> pImple;
 		std::atomic<size_t> numberOfEvents_;
+		std::atomic<size_t> malformedBuffers_; ///< Total number of FED buffers CBCHitProducer couldn't unpack
+		edm::InputTag hitCollectionLabel_;
 		std::string hostname_;
 		std::string port_;
 	};
@@ -24,6 +24,11 @@ process.source = cms.Source("DaqSource",
 	evtsPerLS = cms.untracked.uint32(1000000)
 )
 
+# Unpacks the hits from the raw data once, for both of the analysers below
+process.cbcHits = cms.EDProducer("CBCHitProducer",
+	rawDataLabel = cms.untracked.InputTag("rawDataCollector")
+)
+
 #process.load("MarksAnalysers.CBCAnalyser.AnalyseCBCOutput_cfi")
 process.AnalyseCBCOutput = cms.EDAnalyzer("AnalyseCBCOutput",
 	trimFilename = cms.string("/tmp/i2CFileToSendToBoard.txt"),
@@ -35,11 +40,13 @@ process.AnalyseCBCOutput = cms.EDAnalyzer("AnalyseCBCOutput",
 
 process.DQM = cms.EDAnalyzer("OccupancyDQM",
 	eventsToRecord = cms.uint32(100),
+	additionalWindows = cms.untracked.vuint32(1000,10000),
 	commsServerHostname = cms.untracked.string("127.0.0.1"),
 	commsServerPort = cms.untracked.string("4001")
 )
 
 process.analysisPath = cms.Path(
+		process.cbcHits+
 		process.DQM+
 		process.AnalyseCBCOutput
 	)
@@ -47,7 +54,9 @@ process.analysisPath = cms.Path(
 
 process.consumer = cms.OutputModule("ShmStreamConsumer",
 	compression_level = cms.untracked.int32(1),
-	use_compression = cms.untracked.bool(True)
+	use_compression = cms.untracked.bool(True),
+	# The hits can be remade from the raw data, so don't send them to the storage manager
+	outputCommands = cms.untracked.vstring( "keep *", "drop *_cbcHits_*_*" )
 	)
 
 process.outpath = cms.EndPath( process.consumer )
@@ -9,6 +9,7 @@ import XDAQTools
 import time
 import math
 import os
+import re
 
 class I2cRegister :
 	"""
@@ -28,11 +29,17 @@ class I2cRegister :
 class I2cChip :
 	"""
 	Class to hold several instances of an I2cRegister.
+
+	Keeps track of which registers have changed since they were last sent to the board
+	(the "dirty" registers) so that only those need to be sent. Since nothing is known
+	about what's on the board to begin with, all of the channel trims start off dirty.
 	@author Mark Grimes (mark.grimes@bristol.ac.uk)
 	@date 08/Aug/2013
 	"""
 	def __init__( self, filename=None ) :
 		self.registers=[]
+		self.registersByName={}
+		self.dirtyRegisterNames=set()
 		
 		if filename!=None :
 			inputFile = open(filename,'r')
@@ -41,39 +48,75 @@ class I2cChip :
 					splitLine = line.split()
 					newRegister = I2cRegister( splitLine[0], splitLine[1], splitLine[2], splitLine[3] )
 					self.addRegister( newRegister )
+			self.markBoardReset()
 
 
 	def addRegister(self,register) :
 		self.registers.append(register)
+		self.registersByName[register.name]=register
 
 	def getRegister(self,registerName) :
 		"""
-		Returns the Register instance with the given name
+		Returns the Register instance with the given name, or None if there isn't one
+		"""
+		return self.registersByName.get(registerName)
+
+	def setRegisterValue( self, registerName, value ) :
+		"""
+		Set the register with the given name to the supplied value, and mark it as dirty if that
+		is a change.
 		"""
-		for register in self.registers :
-			if register.name==registerName : return register
-		# If control got this far then no register was found
-		return None
+		register = self.getRegister(registerName)
+		if register==None : raise Exception( "Nothing known about register "+registerName )
+		if register.value!=value :
+			register.value=value
+			self.dirtyRegisterNames.add( registerName )
 	
 	def setChannelTrim( self, channelNumber, value ) :
 		"""
 		Set the register with the name "Channel<channelNumber>" to the supplied value
 		"""
 		name = "Channel"+str(channelNumber)
-		register = self.getRegister(name)
-		if register==None : raise Exception( "Nothing known about channel "+str(channelNumber) )
-		register.value=value
+		if self.getRegister(name)==None : raise Exception( "Nothing known about channel "+str(channelNumber) )
+		self.setRegisterValue( name, value )
+
+	def dirtyRegisters( self ) :
+		"""
+		Returns the registers that have changed since the last call to markClean, in file order
+		"""
+		return [ register for register in self.registers if register.name in self.dirtyRegisterNames ]
+
+	def markClean( self, registerNames=None ) :
+		"""
+		Record that the given registers (or all of them if registerNames is None) are now on the board
+		"""
+		if registerNames==None : self.dirtyRegisterNames.clear()
+		else : self.dirtyRegisterNames.difference_update( registerNames )
+
+	def markDirty( self, registerNames=None ) :
+		"""
+		Force the given registers (or all of them if registerNames is None) to be sent next time
+		"""
+		if registerNames==None : registerNames=self.registersByName.keys()
+		self.dirtyRegisterNames.update( registerNames )
+
+	def markBoardReset( self ) :
+		"""
+		Record that the board has lost its settings (e.g. the XDAQ processes were restarted), so the
+		channel trims have to be sent again. That's the same as when nothing was known about the board.
+		"""
+		self.markDirty( [ register.name for register in self.registers if register.name[0:7]=='Channel' ] )
 
 	def writeToFilename( self, filename ) :
-		file = open( filename, 'w' )
-		for register in self.registers :
-			register.writeToFile(file)
-		file.close()
+		self.writeRegistersToFilename( filename, self.registers )
 
 	def writeTrimsToFilename( self, filename ) :
+		self.writeRegistersToFilename( filename, [ register for register in self.registers if register.name[0:7]=='Channel' ] )
+
+	def writeRegistersToFilename( self, filename, registers ) :
 		file = open( filename, 'w' )
-		for register in self.registers :
-			if register.name[0:7]=='Channel' :register.writeToFile(file)
+		for register in registers :
+			register.writeToFile(file)
 		file.close()
 
 
@@ -141,9 +184,22 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		self.I2cChip.setChannelTrim( channel, value )
 
 	def sendI2c( self, registerNames=None ) :
-		temporaryFilename = "/tmp/i2CFileToSendToBoard.txt"
-		self.I2cChip.writeTrimsToFilename( temporaryFilename )
+		"""
+		Writes the registers that have changed since they were last sent to the board, plus any
+		named in "registerNames". If there's nothing to send, no request is made at all. Returns
+		the number of registers sent.
+		"""
+		if registerNames!=None : self.I2cChip.markDirty( registerNames )
+		registers=self.I2cChip.dirtyRegisters()
+		if len(registers)==0 : return 0
+		temporaryFilename = "/tmp/i2CChangedRegistersToSendToBoard.txt"
+		self.I2cChip.writeRegistersToFilename( temporaryFilename, registers )
 		self.sendI2cFile( temporaryFilename )
+		# The analyser reads the full set of trims from this file at the start of each run
+		self.I2cChip.writeTrimsToFilename( "/tmp/i2CFileToSendToBoard.txt" )
+		# Only forget about the changes once the supervisor has accepted them
+		self.I2cChip.markClean( [ register.name for register in registers ] )
+		return len(registers)
 
 	def sendI2cFile( self, fileName ) :
 		"""
@@ -184,6 +240,39 @@ class GlibStreamerApplication( XDAQTools.Application ) :
 		self.headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
 		self.saveParametersResource = "/urn:xdaq-application:lid="+str(self.id)+"/validParam"
 		self.forceStartResource = "/urn:xdaq-application:lid="+str(self.id)+"/forceStartXgi"
+		# How long a fetched status page is good for before it's downloaded again
+		self.statusCacheLifetime=0.5
+		self._status=None
+		# Regular expression that picks the event counter out of the status page
+		self.eventCounterPattern=r"Events acquired\D*?(\d+)"
+
+	def getStatus( self, maximumAge=None ) :
+		"""
+		Returns a GlibStreamerStatus parsed from the html status page. The page is only fetched
+		if the last status is older than "maximumAge" seconds (self.statusCacheLifetime if
+		None), so that getState, acquisitionState and eventsAcquired can all be called in the
+		same poll without each one downloading the page. A failed fetch is never cached.
+		"""
+		if maximumAge==None : maximumAge=self.statusCacheLifetime
+		if self._status!=None and time.time()-self._status.time<=maximumAge : return self._status
+		# The streamer doesn't have any soap commands to query to the state of the acquisition. The
+		# only external way I can find to see if data is being recorded is to check the html status
+		# page. There's not a specific status display, but depending on the information shown the
+		# status can be inferred.
+		try:
+			response=self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) )
+		except :
+			self.connectionPool.discard( self.host, self.port ) # Don't reuse anything to a peer that isn't responding
+			self._status=None
+			return GlibStreamerStatus( "<uncontactable>", "<uncontactable>", None )
+		self._status=GlibStreamerStatus.fromStatusPage( response.fullMessage, self.eventCounterPattern )
+		return self._status
+
+	def invalidateStatus( self ) :
+		"""
+		Forgets the cached status so that the next query fetches the page again.
+		"""
+		self._status=None
 
 	def getState(self) :
 		"""
@@ -191,28 +280,28 @@ class GlibStreamerApplication( XDAQTools.Application ) :
 		in the answer to a "ParameterQuery". This is a massive hack because it's the only way
 		I know to get the state.
 		"""
-		try:
-			# The streamer doesn't have any soap commands to query to the state of the acquisition. The
-			# only external way I can find to see if data is being recorded is to check the html status
-			# page. There's not a specific status display, but depending on the information shown the
-			# status can be inferred.
-			response=self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) )
-		except :
-			self.connection.close() # Just in case something left it open and this method is being polled
-			return "<uncontactable>"		
-		try:
-			# The only way I've figured out how to get this information is by using some
-			# hard coded knowledge about where it's stored
-			streamerState=response.fullMessage.splitlines()[19].split('>')[1].split('<')[0]
-			return streamerState
-		except: return "<unknown>"
+		return self.getStatus().state
+
+	def isResponsive(self) :
+		"""
+		Override of base XDAQTools.Application because the state for the streamer is scraped from
+		the status page, which doesn't always give something sensible. If the page can be fetched
+		then the streamer is responding.
+		"""
+		return self.getState()!="<uncontactable>"
+
+	def sendCommand( self, command ) :
+		self.invalidateStatus()
+		return super(GlibStreamerApplication,self).sendCommand( command )
 
 	def configure( self, numberOfEvents=None ) :
 		if numberOfEvents!=None : self.parameters['nbAcq']=numberOfEvents
+		self.invalidateStatus()
 		response=self.httpRequest( "POST", self.saveParametersResource, self.parameters, False )
 		if response.status!= 200 : raise Exception( "GlibStreamer.configure got the response "+str(response.status)+" - "+response.reason )
 	
 	def startRecording( self ) :
+		self.invalidateStatus()
 		response=self.httpRequest( "GET", self.forceStartResource, {}, False )
 		if response.status!= 200 : raise Exception( "GlibStreamer.startRecording got the response "+str(response.status)+" - "+response.reason )
 
@@ -220,33 +309,94 @@ class GlibStreamerApplication( XDAQTools.Application ) :
 		"""
 		Reports whether data is being taken or not.
 		"""
-		# The streamer doesn't have any soap commands to query to the state of the acquisition. The
-		# only external way I can find to see if data is being recorded is to check the html status
-		# page. There's not a specific status display, but depending on the information shown the
-		# status can be inferred.
-		try:
-			response=self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) )
-		except:
-			self.connection.close() # Just in case something left it open and this method is being polled
-			return "<uncontactable>"		
-		try:			
-			# The only way I've figured out how to get this information is by using some
-			# hard coded knowledge what the webpage shows in different states.
-			streamerStateLine=response.fullMessage.splitlines()[34]
+		return self.getStatus().acquisitionState
+
+	def eventsAcquired( self ) :
+		"""
+		The number of events acquired so far, or None if the status page doesn't show it.
+		"""
+		return self.getStatus().eventsAcquired
+
+	def waitForEvents( self, numberOfEvents=None, timeout=None, pollInterval=2.0, minimumInterval=0.05 ) :
+		"""
+		Blocks until the streamer has acquired "numberOfEvents" (by default the number it was
+		configured with), or has stopped taking data. Rather than polling at a fixed interval,
+		the wait before each poll is the time the remaining events should take at the rate seen
+		so far, between "minimumInterval" and "pollInterval" seconds. So the end of the run is
+		noticed soon after it happens without polling the whole way through.
+
+		Returns the last GlibStreamerStatus. Raises an XDAQTools.TimeoutError if "timeout" is
+		not None and that many seconds pass first.
+		"""
+		if numberOfEvents==None : numberOfEvents=int(self.parameters['nbAcq'])
+		startTime=time.time()
+		firstCount=None # (time,events) for the first poll that showed the counter
+		while True :
+			status=self.getStatus( maximumAge=0 )
+			now=time.time()
+			if status.acquisitionState=="Stopped" : return status
+			if status.eventsAcquired!=None and status.eventsAcquired>=numberOfEvents : return status
+			if timeout!=None and now-startTime>timeout :
+				raise XDAQTools.TimeoutError( "GlibStreamer did not acquire "+str(numberOfEvents)+" events within "+str(timeout)+" seconds. Last status was "+repr(status) )
+
+			interval=pollInterval
+			if status.eventsAcquired!=None :
+				if firstCount==None : firstCount=(now,status.eventsAcquired)
+				elif status.eventsAcquired>firstCount[1] :
+					rate=(status.eventsAcquired-firstCount[1])/(now-firstCount[0])
+					interval=(numberOfEvents-status.eventsAcquired)/rate
+				else : interval=minimumInterval # Not seen the rate yet, so check again soon
+			time.sleep( max( minimumInterval, min( pollInterval, interval ) ) )
+
+class GlibStreamerStatus(object) :
+	"""
+	What the GlibStreamer status page says at one point in time. "state" is the streamer state,
+	"acquisitionState" is "Running" or "Stopped" (or "<unknown>"/"<uncontactable>"), and
+	"eventsAcquired" is the event counter, or None if it couldn't be found.
+	"""
+	def __init__( self, state, acquisitionState, eventsAcquired ) :
+		self.state=state
+		self.acquisitionState=acquisitionState
+		self.eventsAcquired=eventsAcquired
+		self.time=time.time()
+
+	def __repr__(self) :
+		return "<GlibStreamerStatus "+self.state+", "+self.acquisitionState+", "+str(self.eventsAcquired)+" events>"
+
+	@staticmethod
+	def fromStatusPage( page, eventCounterPattern ) :
+		lines=page.splitlines()
+		# The only way I've figured out how to get this information is by using some
+		# hard coded knowledge about where it's stored
+		try : state=lines[19].split('>')[1].split('<')[0]
+		except : state="<unknown>"
+		# Whether data is being taken is inferred from what the webpage shows in different states
+		try :
+			streamerStateLine=lines[34]
 			if streamerStateLine[8:28]=="Short pause duration":
 				# The table to modify parameters is showing which means data is not being taken
-				return "Stopped"
+				acquisitionState="Stopped"
 			elif streamerStateLine[8:49]=='<input type="submit" value="Start saving"':
-				return "Running"
-			else: return "<unknown>"
-		except: return "<unknown>"
-		
-		
+				acquisitionState="Running"
+			else: acquisitionState="<unknown>"
+		except : acquisitionState="<unknown>"
+		match=re.search( eventCounterPattern, page )
+		if match==None : eventsAcquired=None
+		else : eventsAcquired=int(match.group(1))
+		return GlibStreamerStatus( state, acquisitionState, eventsAcquired )
 
 class GlibProgram( XDAQTools.Program ) :
-	def __init__( self, xdaqConfigFilename ) :
-		super(GlibProgram,self).__init__( xdaqConfigFilename )
+	def __init__( self, xdaqConfigFilename, concurrent=True, I2cRegisterFilename=None ) :
+		super(GlibProgram,self).__init__( xdaqConfigFilename, concurrent )
+		# The list of I2C registers for the GlibSupervisor, or None to use its default file
+		self.I2cRegisterFilename=I2cRegisterFilename
 		self._extendStreamerAndSupervisor()
+		# Callables that takeRun calls with the run number before enabling and after
+		# stopping each run, e.g. to tell the analyser what the threshold is.
+		self.beginRunHooks=[]
+		self.endRunHooks=[]
+		self.runNumber=0
+		self._lastRunConfiguration=None
 		
 	def _extendStreamerAndSupervisor( self ) :
 		# The super class constructor will create all of the Context and Application instances.
@@ -261,7 +411,9 @@ class GlibProgram( XDAQTools.Program ) :
 					self.streamer=application # Make a note so I can access it easily later
 				elif application.className=="GlibSupervisor" :
 					application.__class__=GlibSupervisorApplication # Change the class type to my extension
-					application.__init__() # Call the constructor. A check is made to not reinitialise the base.
+					# Call the constructor. A check is made to not reinitialise the base.
+					if self.I2cRegisterFilename==None : application.__init__()
+					else : application.__init__( I2cRegisterFilename=self.I2cRegisterFilename )
 					self.supervisor=application # Make a note so I can access it easily later
 
 	def reloadXDAQConfig( self ) :
@@ -270,131 +422,172 @@ class GlibProgram( XDAQTools.Program ) :
 		super(GlibProgram,self).reloadXDAQConfig()
 		self._extendStreamerAndSupervisor()
 		
+	def restartAllProcesses( self, triggerRate=16, numberOfEvents=100, timeout=60.0 ) :
+		"""
+		Kills any running processes, then starts, initialises and configures everything from
+		scratch, and sends the I2C registers that the reset lost. "timeout" is how long to wait
+		for the processes to start.
+		"""
+		if [ context for context in self.contexts if context.jobid!=-1 ] :
+			self.killAllProcesses()
+			self.waitUntilAllProcessesKilled(30)
+		self.startAllProcesses()
+		self.waitUntilAllProcessesStarted( timeout )
+		# The new processes start with the CBC registers reset, so whatever was sent before is gone
+		self.supervisor.I2cChip.markBoardReset()
+		self.initialise()
+		self.configure( triggerRate=triggerRate, numberOfEvents=numberOfEvents )
+		# Anything set before the restart, e.g. trims from a TrimTuner, has to go to the new board
+		self.supervisor.sendI2c()
+		self._lastRunConfiguration=(triggerRate,numberOfEvents)
+
+	def isHealthyForRun( self ) :
+		"""
+		Returns True if the processes have been started, every application can be contacted, and
+		the GlibSupervisor and TrackerManager are "Configured", i.e. a new run can be enabled
+		without restarting anything.
+		"""
+		if [ context for context in self.contexts if context.jobid==-1 ] : return False
+		results=XDAQTools.runConcurrently( lambda application : application.getState(), self.allApplications(), self.concurrent )
+		for result in results :
+			if result.status!=XDAQTools.Result.succeeded or result.value=="<uncontactable>" : return False
+			if result.target.className in ("GlibSupervisor","TrackerManager") and result.value!="Configured" : return False
+		return True
+
+	def prepareRun( self, triggerRate=16, numberOfEvents=100, restartProcesses=False, timeout=60.0 ) :
+		"""
+		Gets everything ready for takeRun. The processes are kept running between runs, so
+		normally this only resends the Glib parameters (and only if they've changed). If
+		"restartProcesses" is True, or isHealthyForRun fails, then the processes are killed
+		and started again with restartAllProcesses. In that case the analyser has to carry its
+		histograms over through its saved state file.
+		"""
+		if restartProcesses or not self.isHealthyForRun() :
+			self.restartAllProcesses( triggerRate, numberOfEvents, timeout )
+		elif self._lastRunConfiguration!=(triggerRate,numberOfEvents) :
+			self.supervisor.configure( triggerRate )
+			self.streamer.configure( numberOfEvents )
+			self._lastRunConfiguration=(triggerRate,numberOfEvents)
+
+	def takeRun( self, pollInterval=2.0 ) :
+		"""
+		Takes one run with whatever configuration prepareRun set up: calls the beginRunHooks,
+		enables, records until the streamer has taken all of the events, stops, and then calls
+		the endRunHooks. Everything is left in the "Configured" state ready for the next
+		prepareRun.
+		"""
+		self.startRun( pollInterval )
+		self.endRun()
+
+	def startRun( self, pollInterval=2.0 ) :
+		"""
+		The first half of takeRun: calls the beginRunHooks, enables, and records until the
+		streamer has taken all of the events. The run is left enabled until endRun is called,
+		so that something else (e.g. changing the supply for the next point) can be done at
+		the same time as stopping.
+		"""
+		self.runNumber+=1
+		for hook in self.beginRunHooks : hook( self.runNumber )
+		self.enable()
+		self.streamer.startRecording()
+		self.streamer.waitForEvents( pollInterval=pollInterval )
+
+	def endRun( self ) :
+		"""
+		The second half of takeRun: stops, and then calls the endRunHooks.
+		"""
+		self.stop()
+		for hook in self.endRunHooks : hook( self.runNumber )
+
+	def _runTransition( self, transition, timeout ) :
+		"""
+		Runs the transition, waiting for the final states only if "timeout" is positive, and
+		keeps the records so that e.g. the critical path can be looked at afterwards with
+		"self.lastTransition.criticalPath( self.lastTransitionRecords )".
+		"""
+		self.lastTransition=transition
+		self.lastTransitionRecords=transition.run( self, timeout, waitForFinalStates=(timeout>0) )
+		return self.lastTransitionRecords
+
 	def initialise( self, timeout=5.0 ) :
 		"""
 		Starts the initialise process. If "timeout" is positive then control will block
 		until all the applications have reached the required state, or until "timeout"
 		seconds have passed.
 		"""
-		self.sendAllMatchingApplicationsCommand( "Initialise", "TrackerManager" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "pt::atcp::PeerTransportATCP" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "pt::atcp::PeerTransportATCP" )
-						
-		self.sendAllMatchingApplicationsCommand( "Configure", "rubuilder::evm::Application" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "rubuilder::ru::Application" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "rubuilder::bu::Application" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "evf::FUEventProcessor" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "evf::FUResourceBroker" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "StorageManager" )
-
-		self.sendAllMatchingApplicationsCommand( "Initialise", "GlibSupervisor" )
-
-
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		self.waitAllMatchingApplicationsForState( "Ready", timeout, "rubuilder::evm::Application" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "rubuilder::evm::Application" )
-		
-		self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::ru::Application" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "rubuilder::ru::Application" )
-
-		self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::bu::Application" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "rubuilder::bu::Application" )
-
-		if timeout>0:
-			self.waitAllMatchingApplicationsForState( "Halted", timeout, "TrackerManager" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "GlibSupervisor" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "rubuilder::evm::Application" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "rubuilder::ru::Application" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "rubuilder::bu::Application" )
-#			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::evm::Application" )
-#			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::ru::Application" )
-#			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::bu::Application" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "evf::FUEventProcessor" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "evf::FUResourceBroker" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "StorageManager" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "pt::atcp::PeerTransportATCP" )
+		Step=XDAQTools.TransitionStep
+		transition=XDAQTools.Transition( "initialise", [
+			Step( "trackerManager", "TrackerManager", "Initialise", "Halted" ),
+			Step( "supervisor", "GlibSupervisor", "Initialise", "Halted" ),
+			Step( "ptConfigure", "pt::atcp::PeerTransportATCP", "Configure" ),
+			Step( "ptEnable", "pt::atcp::PeerTransportATCP", "Enable", dependencies=["ptConfigure"] ),
+			Step( "ptEnabled", "pt::atcp::PeerTransportATCP", state="Enabled", dependencies=["ptEnable"] ),
+			# Everything else needs the peer transport enabled before it's configured
+			Step( "evmConfigure", "rubuilder::evm::Application", "Configure", "Ready", dependencies=["ptEnable"] ),
+			Step( "ruConfigure", "rubuilder::ru::Application", "Configure", "Ready", dependencies=["ptEnable"] ),
+			Step( "buConfigure", "rubuilder::bu::Application", "Configure", "Ready", dependencies=["ptEnable"] ),
+			Step( "fuConfigure", "evf::FUEventProcessor", "Configure", "Ready", dependencies=["ptEnable"] ),
+			Step( "rbConfigure", "evf::FUResourceBroker", "Configure", "Ready", dependencies=["ptEnable"] ),
+			Step( "smConfigure", "StorageManager", "Configure", "Ready", dependencies=["ptEnable"] ),
+			# The RU builder has to be enabled in the order EVM, RU, BU; each once it's Ready
+			Step( "evmEnable", "rubuilder::evm::Application", "Enable", dependencies=["evmConfigure"] ),
+			Step( "ruEnable", "rubuilder::ru::Application", "Enable", dependencies=["ruConfigure","evmEnable"] ),
+			Step( "buEnable", "rubuilder::bu::Application", "Enable", dependencies=["buConfigure","ruEnable"] ),
+			Step( "evmEnabled", "rubuilder::evm::Application", state="Enabled", dependencies=["evmEnable"] ),
+			Step( "ruEnabled", "rubuilder::ru::Application", state="Enabled", dependencies=["ruEnable"] ),
+			Step( "buEnabled", "rubuilder::bu::Application", state="Enabled", dependencies=["buEnable"] )
+			] )
+		return self._runTransition( transition, timeout )
 		
 	def configure( self, triggerRate=16, numberOfEvents=100, timeout=5.0 ) :
-		self.supervisor.configure(triggerRate)
-		self.streamer.configure(numberOfEvents)
-		self.sendAllMatchingApplicationsCommand( "Configure", "GlibSupervisor" )
-		self.sendAllMatchingApplicationsCommand( "Configure", "TrackerManager" )
-		
-		if timeout>0:
-			startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-			self.waitAllMatchingApplicationsForState( "Configured", timeout, "TrackerManager" )
-			self.waitAllMatchingApplicationsForState( "Configured", timeout-(time.time()-startTime), "GlibSupervisor" )
-		
-		
+		Step=XDAQTools.TransitionStep
+		transition=XDAQTools.Transition( "configure", [
+			Step( "supervisorParameters", action=lambda : self.supervisor.configure(triggerRate) ),
+			Step( "streamerParameters", action=lambda : self.streamer.configure(numberOfEvents) ),
+			Step( "supervisor", "GlibSupervisor", "Configure", "Configured", dependencies=["supervisorParameters","streamerParameters"] ),
+			Step( "trackerManager", "TrackerManager", "Configure", "Configured", dependencies=["supervisorParameters","streamerParameters"] )
+			] )
+		return self._runTransition( transition, timeout )
 
 	def enable( self, timeout=5.0 ) :
-		self.sendAllMatchingApplicationsCommand( "Enable", "GlibSupervisor" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "TrackerManager" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "evf::FUEventProcessor" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "evf::FUResourceBroker" )
-		self.sendAllMatchingApplicationsCommand( "start", "GlibStreamer" )
-#		self.sendAllMatchingApplicationsCommand( "Enable", "rubuilder::ru::Application" )
-#		self.sendAllMatchingApplicationsCommand( "Enable", "rubuilder::evm::Application" )
-#		self.sendAllMatchingApplicationsCommand( "Enable", "rubuilder::bu::Application" )
-		self.sendAllMatchingApplicationsCommand( "Enable", "StorageManager" )
-
-		if timeout>0:
-			startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout, "TrackerManager" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "GlibSupervisor" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "evf::FUEventProcessor" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "evf::FUResourceBroker" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "rubuilder::ru::Application" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "rubuilder::evm::Application" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "rubuilder::bu::Application" )
-			self.waitAllMatchingApplicationsForState( "Enabled", timeout-(time.time()-startTime), "StorageManager" )
+		Step=XDAQTools.TransitionStep
+		transition=XDAQTools.Transition( "enable", [
+			Step( "supervisor", "GlibSupervisor", "Enable" ),
+			Step( "trackerManager", "TrackerManager", "Enable" ),
+			Step( "fu", "evf::FUEventProcessor", "Enable" ),
+			Step( "rb", "evf::FUResourceBroker", "Enable" ),
+			Step( "sm", "StorageManager", "Enable" ),
+			# Only start the streamer once everything downstream has been told to enable
+			Step( "streamer", "GlibStreamer", "start", dependencies=["supervisor","trackerManager","fu","rb","sm"] ),
+			Step( "supervisorEnabled", "GlibSupervisor", state="Enabled", dependencies=["supervisor"] ),
+			Step( "trackerManagerEnabled", "TrackerManager", state="Enabled", dependencies=["trackerManager"] ),
+			Step( "fuEnabled", "evf::FUEventProcessor", state="Enabled", dependencies=["fu"] ),
+			Step( "rbEnabled", "evf::FUResourceBroker", state="Enabled", dependencies=["rb"] ),
+			Step( "smEnabled", "StorageManager", state="Enabled", dependencies=["sm"] ),
+			Step( "ruEnabled", "rubuilder::ru::Application", state="Enabled" ),
+			Step( "evmEnabled", "rubuilder::evm::Application", state="Enabled" ),
+			Step( "buEnabled", "rubuilder::bu::Application", state="Enabled" )
+			] )
+		return self._runTransition( transition, timeout )
 		
 	def stop( self, timeout=5.0 ) :
-		self.sendAllMatchingApplicationsCommand( "stop", "GlibStreamer" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "GlibSupervisor" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "TrackerManager" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "rubuilder::ru::Application" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "rubuilder::evm::Application" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "rubuilder::bu::Application" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "evf::FUEventProcessor" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "evf::FUResourceBroker" )
-		self.sendAllMatchingApplicationsCommand( "Stop", "StorageManager" )
-
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		self.waitAllMatchingApplicationsForState( "PrePaused", timeout, "TrackerManager" )
-		self.sendAllMatchingApplicationsCommand( "PostStop", "TrackerManager" )
-
-		if timeout>0:
-			self.waitAllMatchingApplicationsForState( "Configured", timeout, "TrackerManager" )
-			self.waitAllMatchingApplicationsForState( "Configured", timeout-(time.time()-startTime), "GlibSupervisor" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::ru::Application" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::evm::Application" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "rubuilder::bu::Application" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "evf::FUEventProcessor" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "evf::FUResourceBroker" )
-			self.waitAllMatchingApplicationsForState( "Ready", timeout-(time.time()-startTime), "StorageManager" )
+		return self._runTransition( self._stopOrHaltTransition( "Stop", "PostStop", "Configured", "Ready" ), timeout )
 
 	def halt( self, timeout=5.0 ) :
-		self.sendAllMatchingApplicationsCommand( "stop", "GlibStreamer" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "GlibSupervisor" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "TrackerManager" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "rubuilder::ru::Application" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "rubuilder::evm::Application" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "rubuilder::bu::Application" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "evf::FUEventProcessor" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "evf::FUResourceBroker" )
-		self.sendAllMatchingApplicationsCommand( "Halt", "StorageManager" )
-
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		self.waitAllMatchingApplicationsForState( "PrePaused", timeout, "TrackerManager" )
-		self.sendAllMatchingApplicationsCommand( "PostHalt", "TrackerManager" )
-
-		if timeout>0:
-			self.waitAllMatchingApplicationsForState( "Halted", timeout, "TrackerManager" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "GlibSupervisor" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "evf::FUEventProcessor" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "evf::FUResourceBroker" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "rubuilder::evm::Application" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "rubuilder::ru::Application" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "rubuilder::bu::Application" )
-			self.waitAllMatchingApplicationsForState( "Halted", timeout-(time.time()-startTime), "StorageManager" )
+		return self._runTransition( self._stopOrHaltTransition( "Halt", "PostHalt", "Halted", "Halted" ), timeout )
+
+	def _stopOrHaltTransition( self, command, trackerManagerPostCommand, glibState, daqState ) :
+		"""
+		Stop and halt have the same structure: stop the streamer taking data, then send the command
+		to everything else. The TrackerManager also needs a second command once it's "PrePaused".
+		"""
+		Step=XDAQTools.TransitionStep
+		steps=[
+			Step( "streamer", "GlibStreamer", "stop" ),
+			Step( "supervisor", "GlibSupervisor", command, glibState, dependencies=["streamer"] ),
+			Step( "trackerManager", "TrackerManager", command, "PrePaused", dependencies=["streamer"] ),
+			Step( "trackerManagerPost", "TrackerManager", trackerManagerPostCommand, glibState, dependencies=["trackerManager"] )
+			]
+		for className in [ "rubuilder::ru::Application", "rubuilder::evm::Application", "rubuilder::bu::Application", "evf::FUEventProcessor", "evf::FUResourceBroker", "StorageManager" ] :
+			steps.append( Step( className, className, command, daqState, dependencies=["streamer"] ) )
+		return XDAQTools.Transition( command.lower(), steps )
@@ -0,0 +1,32 @@
+"""
+Sums the s-curve counts in several analyser state files, e.g. from analysers that ran on different
+boards or on parts of a scan split into voltage ranges, and writes the result in the text format
+that AnalyseCBCOutput can restore from. The inputs can be either format and are read one channel
+at a time, so memory stays at about the size of one state however many files are merged. E.g.
+
+	python MergeStates.py -o /tmp/savedState.log /tmp/part1.log /tmp/part2.log
+
+The C++ equivalent is DetectorSCurves::merge.
+"""
+
+import pythonlib.SavedState as SavedState
+
+if __name__ == '__main__':
+	from optparse import OptionParser
+	parser=OptionParser( usage="%prog [options] inputFile [inputFile ...]", description="Sums the s-curve counts in several analyser state files" )
+	parser.add_option( "-o", "--output", help="File to write the merged state to" )
+	parser.add_option( "--channel", action="append", default=[], metavar="FED,CHANNEL", help="Only merge this FED channel. Can be given more than once [default: all channels]" )
+	parser.add_option( "--allowDifferentOffsets", action="store_true", default=False, help="Keep the strip threshold offsets of the first file if they're different in the others" )
+	(options,args)=parser.parse_args()
+	if options.output==None : parser.error( "an output file has to be given with --output" )
+	if len(args)==0 : parser.error( "no input files were given" )
+
+	channels=None
+	if len(options.channel)!=0 :
+		try : channels=set( [ tuple( [ int(number) for number in channel.split(",") ] ) for channel in options.channel ] )
+		except ValueError : parser.error( "channels should be given as FED,CHANNEL" )
+		if [ channel for channel in channels if len(channel)!=2 ] : parser.error( "channels should be given as FED,CHANNEL" )
+
+	merged=SavedState.mergeStates( args, channels, options.allowDifferentOffsets )
+	SavedState.writeTextState( options.output, merged )
+	print "Merged "+str(len(args))+" files into "+options.output+": "+str(len(merged.channels))+" FED channels, "+str(sum([ len(channel.stripNumbers) for channel in merged.channels ]))+" strips, "+str(merged.eventsProcessed)+" events in "+str(merged.runsProcessed)+" runs"
@@ -0,0 +1,157 @@
+"""
+Takes the runs for a comparator threshold scan, overlapping the stages of consecutive points
+where they don't depend on each other.
+"""
+
+import XDAQTools
+import httplib
+import socket
+
+class ScanRunner(object) :
+	"""
+	Callable taking (threshold,numberOfEvents) that takes one run at that threshold, so it can
+	be used as the "takePoint" of a ThresholdScan.AdaptiveThresholdScan. Each point is run as
+	an XDAQTools.Transition with these steps:
+
+		stopPrevious - stops the run from the previous point (GlibProgram.endRun)
+		supply       - sets the external supply and waits for it to settle
+		prepare      - GlibProgram.prepareRun, after stopPrevious
+		analyser     - tells the analyser the new threshold, after supply (and stopPrevious)
+		run          - GlibProgram.startRun, after everything else
+
+	So the supply changes while the previous run is being stopped, and the analyser is told
+	the threshold while the DAQ is being configured. The run is left enabled at the end of each
+	point and only stopped at the start of the next one, so call "finish()" after the last one
+	(or wrap anything that reads the analyser's saved state with "afterFinishing").
+
+	The analyser applies the threshold to every event it processes from then on, so by default
+	it isn't told until the previous run has stopped. If "analyserUpdateWaitsForStop" is False
+	the update overlaps the stop as well, at the risk of the tail of the previous run being
+	recorded with the new threshold. If the analyser can't be contacted (e.g. the processes are
+	being started by "prepare") the threshold is sent again just before the run instead, as it
+	is if "prepare" restarts the processes.
+
+	The StepRecords for every point are kept in "records" for timingReport.
+	"""
+	def __init__( self, program, supply, triggerRate=32, voltageRange=5.0, analyserHost="127.0.0.1", analyserPort=4000,
+			restartProcessesEveryRun=False, analyserUpdateWaitsForStop=True, pollInterval=2.0, verbose=True ) :
+		self.program=program
+		self.supply=supply
+		self.triggerRate=triggerRate
+		self.voltageRange=voltageRange # The supply voltage that corresponds to a threshold of 1
+		self.analyserHost=analyserHost
+		self.analyserPort=analyserPort
+		self.restartProcessesEveryRun=restartProcessesEveryRun
+		self.analyserUpdateWaitsForStop=analyserUpdateWaitsForStop
+		self.pollInterval=pollInterval
+		self.verbose=verbose
+		self.currentVoltage=None
+		self._thresholdSent=False
+		self.records=[] # List of (transition,records) for every point, and for finish
+		self._runInProgress=False
+
+	def __call__( self, threshold, numberOfEvents ) :
+		return self.takePoint( threshold, numberOfEvents )
+
+	def takePoint( self, threshold, numberOfEvents ) :
+		if self.verbose : print "Taking point at threshold "+str(threshold)+" with "+str(numberOfEvents)+" events"
+		Step=XDAQTools.TransitionStep
+		analyserDependencies=["supply"]
+		if self.analyserUpdateWaitsForStop : analyserDependencies.append( "stopPrevious" )
+		# Once the processes are running they're only restarted if they fail a health check
+		restartProcesses=( self.restartProcessesEveryRun and self.program.runNumber!=0 )
+		transition=XDAQTools.Transition( "point"+str(len(self.records)), [
+			Step( "stopPrevious", action=self._endPreviousRun ),
+			Step( "supply", action=lambda : self._setSupply( threshold*self.voltageRange ) ),
+			Step( "prepare", action=lambda : self._prepareRun( numberOfEvents, restartProcesses ), dependencies=["stopPrevious"] ),
+			Step( "analyser", action=self._sendThresholdToAnalyser, dependencies=analyserDependencies ),
+			Step( "run", action=self._startRun, dependencies=["prepare","analyser","supply"] )
+			] )
+		self._runTransition( transition )
+
+	def finish( self ) :
+		"""
+		Stops the run from the last point, if there is one.
+		"""
+		if not self._runInProgress : return
+		self._runTransition( XDAQTools.Transition( "finish", [ XDAQTools.TransitionStep( "stopPrevious", action=self._endPreviousRun ) ] ) )
+
+	def afterFinishing( self, function ) :
+		"""
+		Returns a callable that calls finish() before calling "function", e.g. so that the
+		readSCurves of an AdaptiveThresholdScan sees the state saved at the end of the last run.
+		"""
+		def wrapper( *args, **kwargs ) :
+			self.finish()
+			return function( *args, **kwargs )
+		return wrapper
+
+	def timingReport( self ) :
+		"""
+		Returns a string with the total and mean time spent in each step over all the points,
+		and how many times the step was on the critical path (i.e. how often it was the thing
+		holding up the point).
+		"""
+		totals={}
+		counts={}
+		criticalCounts={}
+		wallTime=0.0
+		for transition,records in self.records :
+			for name,record in records.iteritems() :
+				totals[name]=totals.get(name,0.0)+record.duration()
+				counts[name]=counts.get(name,0)+1
+			for record in transition.criticalPath( records ) :
+				criticalCounts[record.step.name]=criticalCounts.get(record.step.name,0)+1
+			if records :
+				wallTime+=max( [ record.endTime for record in records.values() ] )-min( [ record.startTime for record in records.values() ] )
+		lines=[ "Step".ljust(16)+"total/s".rjust(10)+"mean/s".rjust(10)+"critical".rjust(10) ]
+		for name in sorted( totals.keys(), key=lambda name : -totals[name] ) :
+			lines.append( name.ljust(16)+("%.3f" % totals[name]).rjust(10)+("%.3f" % (totals[name]/counts[name])).rjust(10)+str(criticalCounts.get(name,0)).rjust(10) )
+		lines.append( "Wall time for "+str(len(self.records))+" transitions: "+("%.3f" % wallTime)+"s" )
+		return "\n".join(lines)
+
+	def _runTransition( self, transition ) :
+		self.records.append( (transition,transition.run( self.program, 0 )) )
+
+	def _endPreviousRun( self ) :
+		if not self._runInProgress : return
+		self._runInProgress=False
+		self.program.endRun()
+
+	def _prepareRun( self, numberOfEvents, restartProcesses ) :
+		jobIDs=[ context.jobid for context in self.program.contexts ]
+		self.program.prepareRun( self.triggerRate, numberOfEvents, restartProcesses )
+		# A new analyser won't know the threshold, even if it was sent to the old one
+		if jobIDs!=[ context.jobid for context in self.program.contexts ] : self._thresholdSent=False
+
+	def _startRun( self ) :
+		if not self._thresholdSent : self._sendThresholdToAnalyser( required=True )
+		self._runInProgress=True
+		self.program.startRun( self.pollInterval )
+
+	def _setSupply( self, voltage ) :
+		# Asking for the output blocks until the supply has settled (if it's in cacheState mode)
+		self.supply.setOutput( voltage=voltage, wait=False )
+		self.currentVoltage=self.supply.getOutput()['voltage']
+		if self.verbose : print "External voltage for comparator has been set to "+str(self.currentVoltage)
+
+	def _sendThresholdToAnalyser( self, required=False ) :
+		"""
+		Tells the analyser the threshold. If "required" is False and the analyser isn't listening,
+		it's left for _startRun to try again.
+		"""
+		self._thresholdSent=False
+		# The analyser expects this in the range 0 (for lowest possible) to 1 (highest possible)
+		# inclusive. See AnalyseCBCOutput::handleChangeVar().
+		connection=httplib.HTTPConnection( self.analyserHost, self.analyserPort )
+		try :
+			connection.request( "GET", "/changeVar?globalComparatorThreshold_="+str( self.currentVoltage/self.voltageRange ) )
+			response=connection.getresponse()
+			response.read()
+		except ( socket.error, httplib.HTTPException ) :
+			# Either nothing was listening or the connection was closed without a proper reply
+			if required : raise
+			return
+		finally : connection.close()
+		if response.status!=200 : raise Exception( "Analyser didn't accept the threshold. Response was "+str(response.status)+" - "+response.reason )
+		self._thresholdSent=True
@@ -0,0 +1,569 @@
+"""
+A stand-in for the XDAQ daemon (xdaq.exe launcher on port 9999) and the contexts it starts,
+including the GlibSupervisor and GlibStreamer, so that XDAQTools and GlibProgram can be run
+without any hardware or XDAQ installation. Useful for load testing and benchmarking changes
+to the run control, e.g.
+
+	python SimulatedXDAQ.py --transitionLatency 0.2 --failureProbability 0.01 &
+
+and then point GlibProgram at a config file where all the contexts are on localhost. Only
+enough is implemented for the run control to work: the "startXdaqExe" and "killExec" daemon
+commands, "ParameterQuery" and the FSM commands for each application class, and the
+GlibSupervisor and GlibStreamer web resources that GlibProgram uses. The GlibStreamer status
+page keeps the same layout as the real one since GlibStreamerApplication reads fixed lines.
+
+Latencies can be set for every response, for every state transition to complete, and for
+a context to start listening after it's been launched. Failures can be injected either as
+an HTTP 500 response or by closing the connection without replying.
+"""
+
+import xml.etree.ElementTree as ElementTree
+import BaseHTTPServer, SocketServer
+import urllib, urlparse
+import threading
+import socket
+import random
+import time
+import re
+
+def _localName( tag ) :
+	"""
+	Strips the xml namespace (which ElementTree puts in curly braces) from a tag name
+	"""
+	return tag.split("}")[-1]
+
+def _soapEnvelope( body ) :
+	return """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xdaq="urn:xdaq-soap:3.0">
+<SOAP-ENV:Header/>
+<SOAP-ENV:Body>"""+body+"""</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>"""
+
+def _soapFault( message ) :
+	return _soapEnvelope( "<SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode><faultstring>"+message+"</faultstring></SOAP-ENV:Fault>" )
+
+def _soapCommand( body ) :
+	"""
+	Returns the first element inside the Body of the soap message
+	"""
+	envelope=ElementTree.fromstring( body )
+	for child in envelope.getchildren() :
+		if _localName(child.tag)=="Body" :
+			commands=child.getchildren()
+			if len(commands)==0 : raise Exception( "Soap message has an empty body" )
+			return commands[0]
+	raise Exception( "Soap message has no body" )
+
+class SimulationSettings(object) :
+	"""
+	Latencies (in seconds) and failure probabilities shared by the daemon and every context it
+	starts. They can be changed while the simulation is running.
+	"""
+	def __init__( self, responseLatency=0.0, transitionLatency=0.0, startupLatency=0.0, failureProbability=0.0, dropProbability=0.0, verbose=False ) :
+		self.responseLatency=responseLatency # Added to every HTTP and SOAP response
+		self.transitionLatency=transitionLatency # How long after an FSM command the new state is reported
+		self.startupLatency=startupLatency # How long after "startXdaqExe" the context starts listening
+		self.failureProbability=failureProbability # Chance of replying to any request with HTTP 500
+		self.dropProbability=dropProbability # Chance of closing the connection without replying
+		self.verbose=verbose
+
+class SimulatedGlib(object) :
+	"""
+	The state of the hardware that the GlibSupervisor and GlibStreamer share, even though
+	they're in different contexts. Events are "acquired" at the trigger rate once the streamer
+	is told to start, until the requested number of events has been reached. Also keeps a note
+	of every application running, for the ones that control applications in other contexts.
+	"""
+	def __init__( self ) :
+		self.triggerRate=16
+		self.registerValues={} # The I2C register values written to the board, keyed by name
+		self.i2cWrites=0
+		self.numberOfEventsRequested=0
+		self._acquisitionStartTime=None
+		self._eventsAtStop=0
+		self._applications=[]
+		self._lock=threading.Lock()
+
+	def addApplications( self, applications ) :
+		self._lock.acquire()
+		try : self._applications.extend( applications )
+		finally : self._lock.release()
+
+	def removeApplications( self, applications ) :
+		self._lock.acquire()
+		try : self._applications=[ application for application in self._applications if not application in applications ]
+		finally : self._lock.release()
+
+	def applications( self ) :
+		self._lock.acquire()
+		try : return list(self._applications)
+		finally : self._lock.release()
+
+	def resetRegisters( self ) :
+		"""
+		Forgets every I2C register value, like the CBC does when the supervisor process starts.
+		"""
+		self._lock.acquire()
+		try : self.registerValues={}
+		finally : self._lock.release()
+
+	def writeI2cFile( self, filename ) :
+		"""
+		Sets the registers listed in an I2C file (in the I2cChip format). Returns the number of
+		registers written. A file that doesn't exist writes nothing.
+		"""
+		self._lock.acquire()
+		try :
+			self.i2cWrites+=1
+			try : lines=open(filename,'r').readlines()
+			except IOError : return 0
+			numberOfRegisters=0
+			for line in lines :
+				splitLine=line.split()
+				if len(splitLine)<4 or line[0]=='#' or line[0]=='*' : continue
+				self.registerValues[splitLine[0]]=int(splitLine[3],0)
+				numberOfRegisters+=1
+			return numberOfRegisters
+		finally : self._lock.release()
+
+	def startAcquisition( self, numberOfEvents ) :
+		self._lock.acquire()
+		try :
+			self.numberOfEventsRequested=numberOfEvents
+			self._acquisitionStartTime=time.time()
+			self._eventsAtStop=0
+		finally : self._lock.release()
+
+	def stopAcquisition( self ) :
+		self._lock.acquire()
+		try :
+			if self._acquisitionStartTime!=None :
+				self._eventsAtStop=self._eventsSinceStart()
+				self._acquisitionStartTime=None
+		finally : self._lock.release()
+
+	def eventsAcquired( self ) :
+		self._lock.acquire()
+		try :
+			if self._acquisitionStartTime==None : return self._eventsAtStop
+			return self._eventsSinceStart()
+		finally : self._lock.release()
+
+	def isAcquiring( self ) :
+		return self._acquisitionStartTime!=None and self.eventsAcquired()<self.numberOfEventsRequested
+
+	def _eventsSinceStart( self ) :
+		return min( self.numberOfEventsRequested, int( (time.time()-self._acquisitionStartTime)*self.triggerRate ) )
+
+class SimulatedApplication(object) :
+	"""
+	An XDAQ application with a finite state machine. "transitions" is a dictionary of the state
+	each soap command moves to; the new state is only reported "latency" seconds after the
+	command was received.
+	"""
+	def __init__( self, className, id, instance, transitions, initialState, hardware ) :
+		self.className=className
+		self.id=id
+		self.instance=instance
+		self.transitions=transitions
+		self.hardware=hardware
+		self._state=initialState
+		self._pendingState=None
+		self._pendingTime=None
+		self._lock=threading.Lock()
+
+	def __repr__(self) :
+		return "<SimulatedApplication "+self.className+" "+str(self.instance)+" "+self.state()+">"
+
+	def state( self ) :
+		self._lock.acquire()
+		try :
+			if self._pendingState!=None and time.time()>=self._pendingTime :
+				self._state=self._pendingState
+				self._pendingState=None
+			return self._state
+		finally : self._lock.release()
+
+	def command( self, command, latency ) :
+		"""
+		Starts the transition for the command and returns the state it will end up in
+		"""
+		if not command in self.transitions : raise Exception( self.className+" doesn't understand the command '"+command+"'" )
+		newState=self.transitions[command]
+		self._lock.acquire()
+		try :
+			if latency>0 :
+				self._pendingState=newState
+				self._pendingTime=time.time()+latency
+			else :
+				self._state=newState
+				self._pendingState=None
+		finally : self._lock.release()
+		return newState
+
+	def resource( self, method, name, parameters ) :
+		"""
+		Handles an HTTP request to "/urn:xdaq-application:lid=<id>/<name>". Returns a tuple
+		of (status,contentType,content).
+		"""
+		if name=="" : return ( 200, "text/html", "<html><body>"+self.className+" is "+self.state()+"</body></html>" )
+		return ( 404, "text/plain", "No resource '"+name+"' for "+self.className )
+
+class SimulatedTrackerManager(SimulatedApplication) :
+	"""
+	The TrackerManager drives the RU builder, so enabling it also enables any RU builder
+	applications that are "Ready". GlibProgram relies on this after a stop, since it never
+	sends "Enable" to the RU builder itself.
+	"""
+	def command( self, command, latency ) :
+		newState=super(SimulatedTrackerManager,self).command( command, latency )
+		if command=="Enable" :
+			for application in self.hardware.applications() :
+				if application.className.startswith("rubuilder::") and application.state()=="Ready" : application.command( "Enable", latency )
+		return newState
+
+class SimulatedGlibSupervisor(SimulatedApplication) :
+	"""
+	The GlibSupervisor, which takes the Glib parameters and writes I2C files to the simulated board.
+	"""
+	def __init__( self, className, id, instance, transitions, initialState, hardware ) :
+		super(SimulatedGlibSupervisor,self).__init__( className, id, instance, transitions, initialState, hardware )
+		self.parameters={}
+		self.i2cFilename=None
+		# A new supervisor process resets the board, so nothing written earlier survives
+		self.hardware.resetRegisters()
+
+	def resource( self, method, name, parameters ) :
+		if name=="saveParameters" :
+			self.parameters.update( parameters )
+			if "triggerFreq" in parameters : self.hardware.triggerRate=2**int(parameters["triggerFreq"])
+			return ( 200, "text/html", "<html><body>Parameters saved</body></html>" )
+		elif name=="i2cRead" :
+			if not "i2CFile" in parameters : return ( 500, "text/plain", "No i2CFile parameter" )
+			self.i2cFilename=parameters["i2CFile"]
+			return ( 200, "text/html", "<html><body>Read "+self.i2cFilename+"</body></html>" )
+		elif name=="i2cWriteFileValues" :
+			# Like the real supervisor, the filename has to have been set by an earlier read
+			if self.i2cFilename==None : return ( 500, "text/plain", "No I2C file has been read" )
+			numberOfRegisters=self.hardware.writeI2cFile( self.i2cFilename )
+			return ( 200, "text/html", "<html><body>Wrote "+str(numberOfRegisters)+" registers</body></html>" )
+		return super(SimulatedGlibSupervisor,self).resource( method, name, parameters )
+
+class SimulatedGlibStreamer(SimulatedApplication) :
+	"""
+	The GlibStreamer, which starts and stops the acquisition and serves the status page.
+	"""
+	def __init__( self, className, id, instance, transitions, initialState, hardware ) :
+		super(SimulatedGlibStreamer,self).__init__( className, id, instance, transitions, initialState, hardware )
+		self.numberOfEvents=100
+
+	def command( self, command, latency ) :
+		if command=="stop" : self.hardware.stopAcquisition()
+		return super(SimulatedGlibStreamer,self).command( command, latency )
+
+	def resource( self, method, name, parameters ) :
+		if name=="validParam" :
+			if "nbAcq" in parameters : self.numberOfEvents=int(parameters["nbAcq"])
+			return ( 200, "text/html", "<html><body>Parameters saved</body></html>" )
+		elif name=="forceStartXgi" :
+			self.hardware.startAcquisition( self.numberOfEvents )
+			return ( 200, "text/html", "<html><body>Acquisition started</body></html>" )
+		elif name=="" : return ( 200, "text/html", self.statusPage() )
+		return super(SimulatedGlibStreamer,self).resource( method, name, parameters )
+
+	def statusPage( self ) :
+		"""
+		The html status page. GlibStreamerApplication reads the state from line 19, and whether
+		data is being taken from the first characters of line 34, so those have to stay put.
+		"""
+		lines=[ "" ]*40
+		lines[0]="<html>"
+		lines[1]="<head><title>GlibStreamer</title></head>"
+		lines[2]="<body>"
+		lines[18]="<table>"
+		lines[19]="<b>"+self.state()+"</b>"
+		lines[20]="<tr><td>Events acquired</td><td>"+str(self.hardware.eventsAcquired())+"</td></tr>"
+		lines[21]="<tr><td>Events requested</td><td>"+str(self.hardware.numberOfEventsRequested)+"</td></tr>"
+		lines[22]="</table>"
+		lines[33]="<form>"
+		if self.hardware.isAcquiring() : lines[34]="        "+'<input type="submit" value="Start saving" name="save"/>'
+		else : lines[34]="        "+"Short pause duration <input type=\"text\" name=\"shortPause\"/>"
+		lines[35]="</form>"
+		lines[38]="</body>"
+		lines[39]="</html>"
+		return "\n".join(lines)
+
+# The state each command moves to for each class of application. Anything not listed here
+# behaves like the RU builder applications.
+_defaultTransitions={ "Configure":"Ready", "Enable":"Enabled", "Stop":"Ready", "Halt":"Halted" }
+_transitions={
+	"TrackerManager":{ "Initialise":"Halted", "Configure":"Configured", "Enable":"Enabled", "Stop":"PrePaused", "PostStop":"Configured", "Halt":"PrePaused", "PostHalt":"Halted" },
+	"GlibSupervisor":{ "Initialise":"Halted", "Configure":"Configured", "Enable":"Enabled", "Stop":"Configured", "Halt":"Halted" },
+	"GlibStreamer":{ "start":"Enabled", "stop":"Halted" },
+	"pt::atcp::PeerTransportATCP":{ "Configure":"Configured", "Enable":"Enabled" }
+}
+_initialStates={ "TrackerManager":"Initial", "GlibSupervisor":"Initial", "pt::atcp::PeerTransportATCP":"Halted" }
+_applicationClasses={ "TrackerManager":SimulatedTrackerManager, "GlibSupervisor":SimulatedGlibSupervisor, "GlibStreamer":SimulatedGlibStreamer }
+
+def createApplication( className, id, instance, hardware ) :
+	transitions=_transitions.get( className, _defaultTransitions )
+	initialState=_initialStates.get( className, "Halted" )
+	return _applicationClasses.get( className, SimulatedApplication )( className, id, instance, transitions, initialState, hardware )
+
+class _RequestHandler( BaseHTTPServer.BaseHTTPRequestHandler ) :
+	protocol_version="HTTP/1.1" # So that XDAQTools.ConnectionPool can keep connections open
+
+	def setup( self ) :
+		BaseHTTPServer.BaseHTTPRequestHandler.setup( self )
+		self.server.addConnection( self.connection )
+
+	def finish( self ) :
+		self.server.removeConnection( self.connection )
+		BaseHTTPServer.BaseHTTPRequestHandler.finish( self )
+
+	def do_GET( self ) : self._handle( "GET" )
+	def do_POST( self ) : self._handle( "POST" )
+
+	def _handle( self, method ) :
+		contentLength=int( self.headers.getheader( "content-length", 0 ) )
+		if contentLength>0 : body=self.rfile.read( contentLength )
+		else : body=""
+		settings=self.server.settings
+		if settings.responseLatency>0 : time.sleep( settings.responseLatency )
+		if random.random()<settings.dropProbability :
+			self.close_connection=1
+			return
+		if random.random()<settings.failureProbability :
+			self._reply( 500, "text/plain", "Simulated failure" )
+			return
+		try : status,contentType,content=self.server.handleRequest( method, urllib.unquote(self.path), self.headers, body )
+		except Exception as error : status,contentType,content=( 500, "text/plain", str(error) )
+		self._reply( status, contentType, content )
+
+	def _reply( self, status, contentType, content ) :
+		self.send_response( status )
+		self.send_header( "Content-Type", contentType )
+		self.send_header( "Content-Length", str(len(content)) )
+		self.end_headers()
+		self.wfile.write( content )
+
+	def log_message( self, format, *args ) :
+		if self.server.settings.verbose : BaseHTTPServer.BaseHTTPRequestHandler.log_message( self, format, *args )
+
+class _SimulatedServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ) :
+	"""
+	Threaded HTTP server that can be killed like a process, i.e. it also drops all of the
+	keep-alive connections that are open to it.
+	"""
+	daemon_threads=True
+	allow_reuse_address=True
+
+	def __init__( self, address, settings ) :
+		BaseHTTPServer.HTTPServer.__init__( self, address, _RequestHandler )
+		self.settings=settings
+		self._openConnections=set()
+		self._connectionsLock=threading.Lock()
+
+	def addConnection( self, connection ) :
+		self._connectionsLock.acquire()
+		try : self._openConnections.add( connection )
+		finally : self._connectionsLock.release()
+
+	def removeConnection( self, connection ) :
+		self._connectionsLock.acquire()
+		try : self._openConnections.discard( connection )
+		finally : self._connectionsLock.release()
+
+	def start( self ) :
+		thread=threading.Thread( target=self.serve_forever )
+		thread.daemon=True
+		thread.start()
+
+	def kill( self ) :
+		self.shutdown()
+		self.server_close()
+		self._connectionsLock.acquire()
+		try : connections=list(self._openConnections)
+		finally : self._connectionsLock.release()
+		for connection in connections :
+			try : connection.shutdown( socket.SHUT_RDWR )
+			except socket.error : pass
+
+	def handle_error( self, request, clientAddress ) :
+		# Connections are dropped deliberately when killed or injecting failures, so keep quiet
+		if self.settings.verbose : BaseHTTPServer.HTTPServer.handle_error( self, request, clientAddress )
+
+	def handleRequest( self, method, path, headers, body ) :
+		"""
+		Returns the (status, contentType, content) of the reply to the request. Subclasses override
+		this to serve their resources; a server that doesn't answers everything with a 501.
+		"""
+		return ( 501, "text/plain", "Nothing is served at "+path )
+
+class SimulatedContext( _SimulatedServer ) :
+	"""
+	Stand-in for an xdaq.exe process running one of the contexts in a config file.
+	"""
+	def __init__( self, address, settings, applications ) :
+		_SimulatedServer.__init__( self, address, settings )
+		self.applications=applications
+
+	def handleRequest( self, method, path, headers, body ) :
+		if path=="/cgi-bin/query" : return self._handleSoap( headers, body )
+		match=re.match( r"/urn:xdaq-application:lid=(\d+)/?(.*)", path )
+		if match==None : return ( 404, "text/plain", "Unknown resource "+path )
+		matchingApplications=[ application for application in self.applications if application.id==int(match.group(1)) ]
+		if len(matchingApplications)==0 : return ( 404, "text/plain", "No application with lid "+match.group(1) )
+		parameters=dict( [ (key,values[-1]) for key,values in urlparse.parse_qs( body ).iteritems() ] )
+		return matchingApplications[0].resource( method, match.group(2), parameters )
+
+	def _handleSoap( self, headers, body ) :
+		match=re.match( r"urn:xdaq-application:class=(.*),instance=(\d+)", headers.getheader( "SOAPAction", "" ) )
+		if match==None : return ( 500, "text/xml", _soapFault( "No application in the SOAPAction header" ) )
+		matchingApplications=[ application for application in self.applications if application.className==match.group(1) and application.instance==int(match.group(2)) ]
+		if len(matchingApplications)==0 : return ( 500, "text/xml", _soapFault( "No application "+match.group(1)+" instance "+match.group(2) ) )
+		application=matchingApplications[0]
+		command=_localName( _soapCommand(body).tag )
+		if command=="ParameterQuery" :
+			return ( 200, "text/xml", _soapEnvelope( "<xdaq:ParameterQueryResponse><properties><stateName>"+application.state()+"</stateName></properties></xdaq:ParameterQueryResponse>" ) )
+		try : newState=application.command( command, self.settings.transitionLatency )
+		except Exception as error : return ( 500, "text/xml", _soapFault( str(error) ) )
+		return ( 200, "text/xml", _soapEnvelope( "<xdaq:"+command+"Response><xdaq:state xdaq:stateName=\""+newState+"\"/></xdaq:"+command+"Response>" ) )
+
+class SimulatedExecutive( _SimulatedServer ) :
+	"""
+	Stand-in for the daemon that launches xdaq.exe processes when it gets a "startXdaqExe" soap
+	command, and kills them on "killExec". Each launched context only has the applications in
+	the context of the config file with the port given in the "-p" argument.
+
+	Call "start()" to serve requests from a background thread, or "serve_forever()".
+	"""
+	def __init__( self, host="localhost", port=9999, settings=None ) :
+		if settings==None : settings=SimulationSettings()
+		_SimulatedServer.__init__( self, (host,port), settings )
+		self.host=host
+		self.hardware=SimulatedGlib()
+		self.jobs={} # Job ID to [port,timer,context] of each context started
+		self._nextJobID=1
+		self._jobsLock=threading.Lock()
+
+	def kill( self ) :
+		"""
+		Kills every context that's been started as well as the executive itself
+		"""
+		for jobID in self.jobs.keys() : self.killJob( jobID )
+		_SimulatedServer.kill( self )
+
+	def handleRequest( self, method, path, headers, body ) :
+		if path!="/cgi-bin/query" : return ( 404, "text/plain", "Unknown resource "+path )
+		command=_soapCommand( body )
+		commandName=_localName( command.tag )
+		try :
+			if commandName=="startXdaqExe" :
+				jobID=self.startJob( command )
+				return ( 200, "text/xml", _soapEnvelope( "<xdaq:jidResponse><xdaq:jid>"+str(jobID)+"</xdaq:jid></xdaq:jidResponse>" ) )
+			elif commandName=="killExec" :
+				if self.killJob( int(command.get("jid")) ) : reply="killed by JID"
+				else : reply="no job killed."
+				return ( 200, "text/xml", _soapEnvelope( "<xdaq:getStateResponse><xdaq:reply>"+reply+"</xdaq:reply></xdaq:getStateResponse>" ) )
+		except Exception as error : return ( 500, "text/xml", _soapFault( str(error) ) )
+		return ( 500, "text/xml", _soapFault( "Unknown command "+commandName ) )
+
+	def startJob( self, command ) :
+		"""
+		Starts listening on the port in the command's argv, after the startup latency, with the
+		applications from the matching context in the config file. Returns the job ID.
+		"""
+		match=re.search( r"-p\s+(\d+)", command.get("argv","") )
+		if match==None : raise Exception( "No port in the argv '"+command.get("argv","")+"'" )
+		port=int(match.group(1))
+		configFiles=[ child for child in command.getchildren() if _localName(child.tag)=="ConfigFile" ]
+		if len(configFiles)==0 : raise Exception( "No ConfigFile in startXdaqExe" )
+		applications=[]
+		for context in ElementTree.fromstring( configFiles[0].text.strip() ).getiterator() :
+			if _localName(context.tag)!="Context" or not context.get("url","").endswith( ":"+str(port) ) : continue
+			for child in context.getchildren() :
+				if _localName(child.tag)=="Application" :
+					applications.append( createApplication( child.get("class"), int(child.get("id")), int(child.get("instance")), self.hardware ) )
+		if len(applications)==0 : raise Exception( "No context in the config file for port "+str(port) )
+
+		self._jobsLock.acquire()
+		try :
+			for job in self.jobs.values() :
+				if job[0]==port : raise Exception( "A process is already running on port "+str(port) )
+			jobID=self._nextJobID
+			self._nextJobID+=1
+			job=[ port, None, None ]
+			def startContext() :
+				context=SimulatedContext( (self.host,port), self.settings, applications )
+				self._jobsLock.acquire()
+				try :
+					if job[1]==None : # Killed before it had started
+						context.server_close()
+						return
+					job[2]=context
+					self.hardware.addApplications( applications )
+					context.start()
+				finally : self._jobsLock.release()
+			job[1]=threading.Timer( self.settings.startupLatency, startContext )
+			job[1].daemon=True
+			self.jobs[jobID]=job
+			job[1].start()
+		finally : self._jobsLock.release()
+		return jobID
+
+	def killJob( self, jobID ) :
+		"""
+		Stops the context with the given job ID. Returns False if there's no such job.
+		"""
+		self._jobsLock.acquire()
+		try :
+			job=self.jobs.pop( jobID, None )
+			if job==None : return False
+			job[1].cancel()
+			job[1]=None
+			context=job[2]
+		finally : self._jobsLock.release()
+		if context!=None :
+			self.hardware.removeApplications( context.applications )
+			context.kill()
+		return True
+
+def benchmark( program, numberOfRuns=3, triggerRate=1024, numberOfEvents=100, pollInterval=0.05 ) :
+	"""
+	Times a full cycle of a GlibProgram: starting the processes, initialise, configure, a
+	number of runs, halt and kill. Returns a list of (stepName,seconds) tuples.
+	"""
+	timings=[]
+	def timeStep( name, function ) :
+		startTime=time.time()
+		function()
+		timings.append( (name,time.time()-startTime) )
+
+	timeStep( "start", lambda : (program.startAllProcesses(), program.waitUntilAllProcessesStarted()) )
+	timeStep( "initialise", program.initialise )
+	timeStep( "configure", lambda : program.configure( triggerRate, numberOfEvents ) )
+	for runNumber in range(numberOfRuns) :
+		timeStep( "run"+str(runNumber), lambda : program.takeRun( pollInterval ) )
+	timeStep( "halt", program.halt )
+	timeStep( "kill", lambda : (program.killAllProcesses(), program.waitUntilAllProcessesKilled()) )
+	return timings
+
+if __name__ == '__main__':
+	from optparse import OptionParser
+	parser=OptionParser( usage="%prog [options]", description="Simulates the XDAQ daemon and the GlibSupervisor/GlibStreamer contexts it starts" )
+	parser.add_option( "--host", default="localhost", help="Host to listen on [default: %default]" )
+	parser.add_option( "--port", type="int", default=9999, help="Port for the daemon to listen on [default: %default]" )
+	parser.add_option( "--responseLatency", type="float", default=0.0, help="Seconds added to every response [default: %default]" )
+	parser.add_option( "--transitionLatency", type="float", default=0.0, help="Seconds for a state transition to complete [default: %default]" )
+	parser.add_option( "--startupLatency", type="float", default=0.0, help="Seconds for a context to start listening [default: %default]" )
+	parser.add_option( "--failureProbability", type="float", default=0.0, help="Chance of replying with HTTP 500 [default: %default]" )
+	parser.add_option( "--dropProbability", type="float", default=0.0, help="Chance of closing the connection without replying [default: %default]" )
+	parser.add_option( "-v", "--verbose", action="store_true", default=False, help="Log every request" )
+	(options,args)=parser.parse_args()
+
+	settings=SimulationSettings( options.responseLatency, options.transitionLatency, options.startupLatency, options.failureProbability, options.dropProbability, options.verbose )
+	executive=SimulatedExecutive( options.host, options.port, settings )
+	print "Simulated XDAQ daemon listening on "+options.host+":"+str(options.port)
+	try : executive.serve_forever()
+	except KeyboardInterrupt : executive.kill()
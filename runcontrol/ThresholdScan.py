@@ -0,0 +1,126 @@
+"""
+Scheduling of the comparator threshold points to take runs at when measuring s-curves.
+"""
+
+import math
+
+def estimateSCurve( entries, minimumEvents=1 ) :
+	"""
+	Quick estimate of the s-curve parameters from a list of [eventsOn,eventsOff] pairs, one per
+	bin, without doing a fit. Works on whichever bins have data, so can be used on a partially
+	complete scan. The curve can be rising or falling.
+
+	Returns a dictionary with "plateau", "mean" and "width" (in bins, matching parameters 0, 2
+	and 1/[1] of the function in FitSCurve) and "meanError" and "widthError", or None if the
+	turn on hasn't been seen yet. The errors include the binomial error on the points either side
+	of each crossing and the resolution from how far apart those points are.
+
+	pythonlib.SCurveFitter.estimateSCurves is a separate estimator, matching the C++ one used to
+	start the fits. It doesn't give errors, so AdaptiveThresholdScan can't use it to know when to
+	stop.
+	"""
+	points=[ (bin,float(entry[0])/(entry[0]+entry[1]),entry[0]+entry[1]) for bin,entry in enumerate(entries) if entry[0]+entry[1]>=minimumEvents ]
+	if len(points)<2 : return None
+	plateau=max( [ fraction for bin,fraction,events in points ] )
+	if plateau==0 : return None
+
+	def crossing( level ) :
+		"""Returns (position,error) where the fraction first crosses level, or None"""
+		for index in range(len(points)-1) :
+			(bin1,fraction1,events1)=points[index]
+			(bin2,fraction2,events2)=points[index+1]
+			if (fraction1-level)*(fraction2-level)>0 or fraction1==fraction2 : continue
+			slope=(fraction2-fraction1)/(bin2-bin1)
+			position=bin1+(level-fraction1)/slope
+			# Binomial errors on the two points, using the level if a point has no spread
+			statisticalError=math.sqrt( max(fraction1*(1-fraction1),level*(1-level))/events1 + max(fraction2*(1-fraction2),level*(1-level))/events2 )/2/abs(slope)
+			resolutionError=(bin2-bin1)/math.sqrt(12)
+			return ( position, math.sqrt(statisticalError**2+resolutionError**2) )
+		return None
+
+	# For the error function the points at plus and minus one sigma are at these fractions of the plateau
+	middle=crossing( plateau*0.5 )
+	lower=crossing( plateau*0.1587 )
+	upper=crossing( plateau*0.8413 )
+	if middle==None or lower==None or upper==None : return None
+	return { "plateau":plateau,
+		"mean":middle[0], "meanError":middle[1],
+		"width":abs(upper[0]-lower[0])/2, "widthError":math.sqrt(upper[1]**2+lower[1]**2)/2 }
+
+class AdaptiveThresholdScan(object) :
+	"""
+	Decides which threshold points to take runs at, rather than stepping evenly through every bin.
+	A coarse pass over the whole range finds where the strips turn on, then each subsequent pass
+	halves the spacing between points but only inside the region where strips are actually turning
+	on, and with more events per point. This stops as soon as the mean and width of every strip
+	(that has turned on) are known to the target precision.
+
+	"takePoint" is a callable taking (threshold,numberOfEvents) that takes a run at that threshold,
+	where threshold is in the range [0,1] like AnalyseCBCOutput's globalComparatorThreshold_.
+	"readSCurves" is a callable that returns the accumulated s-curves as a dictionary of lists of
+	[eventsOn,eventsOff] per bin, e.g. a wrapper around SavedState.readSCurves.
+
+	Precisions are in units of bins.
+	"""
+	def __init__( self, takePoint, readSCurves, numberOfBins=256, coarsePoints=16, coarseEvents=200, fineEvents=1000,
+			targetMeanPrecision=1.0, targetWidthPrecision=1.0, regionWidths=3.0, maximumPasses=10, verbose=True ) :
+		self.takePoint=takePoint
+		self.readSCurves=readSCurves
+		self.numberOfBins=numberOfBins
+		self.coarsePoints=coarsePoints
+		self.coarseEvents=coarseEvents
+		self.fineEvents=fineEvents
+		self.targetMeanPrecision=targetMeanPrecision
+		self.targetWidthPrecision=targetWidthPrecision
+		self.regionWidths=regionWidths # How many widths either side of the mean count as the turn on region
+		self.maximumPasses=maximumPasses
+		self.verbose=verbose
+		self.pointsTaken=[] # List of (bin,numberOfEvents) for every run taken
+		self.estimates={}
+
+	def thresholdForBin( self, bin ) :
+		"""
+		The threshold at the middle of the bin, which maps back to exactly that bin in the analyser
+		"""
+		return (bin+0.5)/self.numberOfBins
+
+	def run( self ) :
+		"""
+		Takes all the runs and returns the final dictionary of estimates from estimateSCurve for each
+		strip (None for strips that never turned on).
+		"""
+		spacing=max( 1, self.numberOfBins/self.coarsePoints )
+		bins=range( 0, self.numberOfBins, spacing )
+		events=self.coarseEvents
+
+		for scanPass in range(self.maximumPasses) :
+			if self.verbose : print "Threshold scan pass "+str(scanPass)+": "+str(len(bins))+" points with "+str(events)+" events each"
+			for bin in bins :
+				self.takePoint( self.thresholdForBin(bin), events )
+				self.pointsTaken.append( (bin,events) )
+
+			sCurves=self.readSCurves()
+			self.estimates=dict( [ (key,estimateSCurve(entries)) for key,entries in sCurves.iteritems() ] )
+			turnedOn=[ estimate for estimate in self.estimates.values() if estimate!=None ]
+			if len(turnedOn)==0 :
+				# Haven't found the turn on of anything, so go over the whole range more finely
+				lowBin,highBin=0,self.numberOfBins-1
+			else :
+				if [ estimate for estimate in turnedOn if estimate["meanError"]>self.targetMeanPrecision or estimate["widthError"]>self.targetWidthPrecision ]==[] :
+					if self.verbose : print "Threshold scan reached target precision after "+str(len(self.pointsTaken))+" points"
+					break
+				lowBin=max( 0, int( min([ estimate["mean"]-self.regionWidths*estimate["width"] for estimate in turnedOn ]) )-1 )
+				highBin=min( self.numberOfBins-1, int( max([ estimate["mean"]+self.regionWidths*estimate["width"] for estimate in turnedOn ]) )+1 )
+
+			if spacing>1 :
+				# Fill in the points in between the ones already taken in the turn on region
+				spacing=max( 1, spacing/2 )
+				measuredBins=set( [ bin for bin,events in self.pointsTaken ] )
+				bins=[ bin for bin in range( lowBin-lowBin%spacing, highBin+1, spacing ) if bin not in measuredBins ]
+				events=self.fineEvents
+			else :
+				# Already at full resolution, so add more statistics to the turn on region
+				bins=range( lowBin, highBin+1 )
+				events=self.fineEvents
+
+		return self.estimates
@@ -0,0 +1,120 @@
+"""
+Tools to equalise the thresholds of all the strips on a CBC by tuning the per channel
+trims in the I2C registers.
+"""
+
+import math
+import pythonlib.SavedState as SavedState
+
+class SavedStateOccupancyMeasurement(object) :
+	"""
+	Callable that takes a run with whatever the current settings are and returns a list of the
+	occupancy for each strip of one CBC during that run. The occupancies come from the difference
+	in the AnalyseCBCOutput saved state file before and after the run, so the analyser has to be
+	configured with "savedStateFilename".
+
+	If fedNumber and fedChannel are None then the first CBC found in the saved state is used.
+	"""
+	def __init__( self, program, savedStateFilename="/tmp/savedState.log", fedNumber=None, fedChannel=None, triggerRate=32, numberOfEvents=1000, numberOfStrips=128 ) :
+		self.program=program
+		self.savedStateFilename=savedStateFilename
+		self.fedNumber=fedNumber
+		self.fedChannel=fedChannel
+		self.triggerRate=triggerRate
+		self.numberOfEvents=numberOfEvents
+		self.numberOfStrips=numberOfStrips
+
+	def _readTotals( self ) :
+		try : return SavedState.readStripTotals( self.savedStateFilename )
+		except IOError : return {} # No state saved yet
+
+	def __call__( self ) :
+		totalsBefore=self._readTotals()
+		self.program.prepareRun( triggerRate=self.triggerRate, numberOfEvents=self.numberOfEvents )
+		self.program.takeRun()
+		totalsAfter=self._readTotals()
+
+		if self.fedNumber==None or self.fedChannel==None :
+			if len(totalsAfter)==0 : raise Exception( "The analyser didn't save any data to "+self.savedStateFilename )
+			(self.fedNumber,self.fedChannel,stripNumber)=min( totalsAfter.keys() )
+
+		occupancies=[]
+		for stripNumber in range(self.numberOfStrips) :
+			key=(self.fedNumber,self.fedChannel,stripNumber)
+			before=totalsBefore.get( key, [0,0] )
+			after=totalsAfter.get( key, [0,0] )
+			eventsOn=after[0]-before[0]
+			eventsOff=after[1]-before[1]
+			if eventsOn+eventsOff==0 : raise Exception( "No events recorded for strip "+str(key) )
+			occupancies.append( float(eventsOn)/float(eventsOn+eventsOff) )
+		return occupancies
+
+class TrimTuner(object) :
+	"""
+	Equalises the thresholds of all the strips on the chip by finding, for every channel, the
+	trim where the strip's s-curve midpoint sits at the current global threshold, i.e. where the
+	occupancy is "targetOccupancy". A binary search is done on every channel at the same time:
+	each iteration sets all the trims, takes one run with "measureOccupancies", and halves the
+	trim range for every channel. So an 8 bit trim takes at most 8 runs, not 256.
+
+	"measureOccupancies" is a callable that returns the list of occupancies for the strips with
+	the trims as they are, e.g. a SavedStateOccupancyMeasurement. "higherTrimMeansHigherOccupancy"
+	says which way the trim moves the strip threshold.
+	"""
+	def __init__( self, supervisor, measureOccupancies, numberOfChannels=128, trimBits=8, targetOccupancy=0.5, higherTrimMeansHigherOccupancy=True, verbose=True ) :
+		self.supervisor=supervisor
+		self.measureOccupancies=measureOccupancies
+		self.numberOfChannels=numberOfChannels
+		self.maximumTrim=2**trimBits-1
+		self.targetOccupancy=targetOccupancy
+		self.higherTrimMeansHigherOccupancy=higherTrimMeansHigherOccupancy
+		self.verbose=verbose
+		# The spread of occupancies (RMS about the target) after each iteration
+		self.spreadHistory=[]
+
+	def spread( self, occupancies ) :
+		"""
+		Returns the RMS of the occupancies about the target occupancy
+		"""
+		return math.sqrt( sum( [ (occupancy-self.targetOccupancy)**2 for occupancy in occupancies ] )/len(occupancies) )
+
+	def tune( self, tolerance=0.05 ) :
+		"""
+		Runs the bisection until every channel's range has shrunk to a single trim value, or until
+		every occupancy is within "tolerance" of the target. The best trim found for each channel
+		is left set on the supervisor (and sent to the board), and returned as a list.
+		"""
+		lowTrims=[0]*self.numberOfChannels # Inclusive bounds of the search range for each channel
+		highTrims=[self.maximumTrim]*self.numberOfChannels
+		bestTrims=[None]*self.numberOfChannels
+		bestDistances=[None]*self.numberOfChannels
+		self.spreadHistory=[]
+
+		while True :
+			trims=[ (lowTrims[channel]+highTrims[channel]+1)/2 for channel in range(self.numberOfChannels) ]
+			self._applyTrims( trims )
+			occupancies=self.measureOccupancies()
+			self.spreadHistory.append( self.spread(occupancies) )
+			if self.verbose : print "Trim tuning iteration "+str(len(self.spreadHistory))+": occupancy spread about target is "+str(self.spreadHistory[-1])
+
+			for channel in range(self.numberOfChannels) :
+				distance=abs( occupancies[channel]-self.targetOccupancy )
+				if bestDistances[channel]==None or distance<bestDistances[channel] :
+					bestDistances[channel]=distance
+					bestTrims[channel]=trims[channel]
+				# If the strip is on too often its threshold is too low, so move the trim in the
+				# direction that lowers the occupancy.
+				if (occupancies[channel]>self.targetOccupancy)==self.higherTrimMeansHigherOccupancy : highTrims[channel]=trims[channel]-1
+				else : lowTrims[channel]=trims[channel]
+
+			if max(bestDistances)<=tolerance : break
+			if [ channel for channel in range(self.numberOfChannels) if highTrims[channel]>lowTrims[channel] ]==[] : break
+
+		self._applyTrims( bestTrims )
+		return bestTrims
+
+	def _applyTrims( self, trims ) :
+		for channel in range(self.numberOfChannels) :
+			self.supervisor.setChannelTrim( channel, trims[channel] )
+		# Only the trims that changed get sent
+		self.supervisor.sendI2c()
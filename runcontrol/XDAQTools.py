@@ -3,6 +3,10 @@ import httplib, urllib
 #import xdglib
 import time
 import os
+import socket
+import errno
+import threading
+import Queue
 
 class ETElementExtension( ElementTree._ElementInterface ) :
 	"""
@@ -30,7 +34,205 @@ class ETElementExtension( ElementTree._ElementInterface ) :
 		if len(result)==0 : return None
 		else : return result[0]
 
-def sendSoapMessage( host, port, soapBody, className=None, instance=None ):
+class ConnectionPool(object) :
+	"""
+	Keeps persistent HTTP/1.1 connections open to each (host, port) so that repeated
+	requests (e.g. polling the state of an application) don't open and tear down a new
+	TCP connection every time. Connections are checked out for the duration of a single
+	request/response so the pool can be shared between threads.
+
+	If the peer has dropped a connection that was sitting idle in the pool (e.g. the
+	XDAQ process was killed and restarted) the request is retried on a fresh
+	connection, so this is transparent to the caller. That's only done if sending the
+	request failed, or the peer closed the connection before any of the response
+	arrived. Once a request could have been acted on it's never sent again, since it
+	might be a state transition.
+
+	The counters "connectionsOpened" and "connectionsReused" record how many requests
+	needed a new TCP connection and how many were sent over an existing one.
+	"""
+	def __init__( self, timeout=None ) :
+		self.timeout=timeout
+		self.connectionsOpened=0
+		self.connectionsReused=0
+		self._idleConnections={} # Lists of idle connections, keyed by (host,port)
+		self._lock=threading.Lock()
+
+	def __repr__(self) :
+		return "<XDAQ ConnectionPool opened="+str(self.connectionsOpened)+", reused="+str(self.connectionsReused)+">"
+
+	def request( self, host, port, method, url, body=None, headers={} ) :
+		"""
+		Sends the request and returns the httplib response. The body of the response has
+		already been read (so that the connection can go back in the pool) and is stored
+		in a custom member "fullMessage" of the response.
+		"""
+		key=(host,int(port))
+		while True :
+			connection,isReused=self._checkOut( key )
+			try :
+				connection.request( method, url, body, headers )
+			except (httplib.HTTPException, socket.error) :
+				connection.close()
+				# A connection that has been sitting in the pool could have been dropped by
+				# the other end, in which case try again with a new one. If it was a new
+				# connection then the peer is genuinely not contactable.
+				if isReused : continue
+				raise
+			try :
+				response=connection.getresponse()
+			except (httplib.HTTPException, socket.error) as error :
+				connection.close()
+				# The request has gone, so it could have been acted on. Only resend it (it could be
+				# a state transition) if the peer closed a pooled connection before replying at all.
+				if isReused and self._isDroppedConnection( error ) : continue
+				raise
+			try : response.fullMessage=response.read()
+			except :
+				connection.close()
+				raise
+			if response.will_close : connection.close()
+			else : self._checkIn( key, connection )
+			return response
+
+	def discard( self, host, port ) :
+		"""
+		Closes all idle connections to the given host and port, e.g. when the process
+		listening there has been killed.
+		"""
+		self._lock.acquire()
+		try : connections=self._idleConnections.pop( (host,int(port)), [] )
+		finally : self._lock.release()
+		for connection in connections : connection.close()
+
+	def closeAll( self ) :
+		"""
+		Closes every idle connection in the pool.
+		"""
+		self._lock.acquire()
+		try :
+			allConnections=self._idleConnections.values()
+			self._idleConnections={}
+		finally : self._lock.release()
+		for connections in allConnections :
+			for connection in connections : connection.close()
+
+	@staticmethod
+	def _isDroppedConnection( error ) :
+		"""
+		Whether the error from reading the status line means the peer had closed the connection,
+		rather than e.g. timing out while it handled the request.
+		"""
+		if isinstance( error, httplib.BadStatusLine ) : return True
+		return isinstance( error, socket.error ) and error.errno==errno.ECONNRESET
+
+	def _checkOut( self, key ) :
+		self._lock.acquire()
+		try :
+			connections=self._idleConnections.get( key )
+			if connections :
+				self.connectionsReused+=1
+				return connections.pop(), True
+			self.connectionsOpened+=1
+		finally : self._lock.release()
+		return httplib.HTTPConnection( key[0], key[1], timeout=self.timeout ), False
+
+	def _checkIn( self, key, connection ) :
+		self._lock.acquire()
+		try : self._idleConnections.setdefault( key, [] ).append( connection )
+		finally : self._lock.release()
+
+# The pool used by default for all SOAP and HTTP requests made by this module
+connectionPool=ConnectionPool()
+
+class TimeoutError(Exception) :
+	"""
+	Raised when an Application or Context doesn't reach the requested state in time.
+	It's a subclass of Exception so anything already catching Exception will still work.
+	"""
+	pass
+
+class Result(object) :
+	"""
+	Record of what happened when an operation was run on one target (usually an Application
+	or Context) as part of a fan-out with runConcurrently. "status" is one of "succeeded",
+	"failed" or "timedOut"; "value" is whatever the operation returned and "error" is the
+	exception raised, if any.
+	"""
+	succeeded="succeeded"
+	failed="failed"
+	timedOut="timedOut"
+
+	def __init__( self, target, status, value=None, error=None ) :
+		self.target=target
+		self.status=status
+		self.value=value
+		self.error=error
+
+	def __repr__(self) :
+		returnValue="<Result "+repr(self.target)+" "+self.status
+		if self.error!=None : returnValue+=" ("+str(self.error)+")"
+		return returnValue+">"
+
+def runConcurrently( function, targets, concurrent=True ) :
+	"""
+	Calls function(target) for every entry in targets and returns a list of Result instances
+	in the same order. If "concurrent" is True every call is made in its own thread, so the
+	whole thing takes about as long as the slowest call rather than the sum of all of them.
+	Exceptions are never propagated, they're recorded in the Result instead.
+	"""
+	results=[None]*len(targets)
+	def runOne( index ) :
+		target=targets[index]
+		try : results[index]=Result( target, Result.succeeded, function(target) )
+		except TimeoutError as error : results[index]=Result( target, Result.timedOut, error=error )
+		except Exception as error : results[index]=Result( target, Result.failed, error=error )
+
+	if concurrent and len(targets)>1 :
+		threads=[ threading.Thread( target=runOne, args=(index,) ) for index in range(len(targets)) ]
+		for thread in threads :
+			thread.daemon=True # Don't stop the interpreter exiting if something hangs
+			thread.start()
+		for thread in threads : thread.join()
+	else :
+		for index in range(len(targets)) : runOne( index )
+	return results
+
+def raiseFirstError( results ) :
+	"""
+	Re-raises the exception from the first Result that didn't succeed, if there is one.
+	"""
+	for result in results :
+		if result.status!=Result.succeeded : raise result.error
+
+def waitUntilAll( targets, isReady, timeout, description, concurrent=True, initialInterval=0.02, maximumInterval=0.5 ) :
+	"""
+	Probes every target with isReady(target) until it returns True. All targets are probed at
+	the same time, starting "initialInterval" seconds apart and backing off exponentially up to
+	"maximumInterval", so something that's ready straight away is noticed almost immediately
+	without hammering something that takes a while.
+
+	Returns a dictionary of how many seconds each target took to become ready. If any aren't
+	ready after "timeout" seconds a TimeoutError is raised with "description" and the targets
+	that weren't ready.
+	"""
+	startTime=time.time()
+	timeoutEndTime=startTime+timeout
+	def probe( target ) :
+		interval=initialInterval
+		while True :
+			if isReady( target ) : return time.time()-startTime
+			remainingTime=timeoutEndTime-time.time()
+			if remainingTime<=0 : raise TimeoutError( repr(target)+" not ready" )
+			time.sleep( min( interval, remainingTime ) )
+			interval=min( interval*2, maximumInterval )
+
+	results=runConcurrently( probe, targets, concurrent )
+	notReady=[ repr(result.target) for result in results if result.status!=Result.succeeded ]
+	if notReady : raise TimeoutError( description+" within "+str(timeout)+" seconds. Not ready: "+", ".join(notReady) )
+	return dict( [ (result.target,result.value) for result in results ] )
+
+def sendSoapMessage( host, port, soapBody, className=None, instance=None, pool=None ):
 	"""
 	Sends a soap message with the body provided to the host and port provided.
 	No checking is provided that the soapBody provided is valid.
@@ -38,6 +240,9 @@ def sendSoapMessage( host, port, soapBody, className=None, instance=None ):
 	If a className and instance are provided they are sent in the SOAPAction header. If either one is "None"
 	then the SOAPAction header is "urn:xdaq-application:lid=10". No idea why, but that's what it was in xdglib
 
+	The message is sent over a persistent connection from "pool", or from the module
+	level connectionPool if that is None.
+
 	Author Mark Grimes (mark.grimes@bristol.ac.uk) but heavily copied from a file called xdglib.py
 	Date 16/Sep/2013
 	"""
@@ -57,20 +262,16 @@ def sendSoapMessage( host, port, soapBody, className=None, instance=None ):
 	
 	if className==None or instance==None:	
 		headers = {"Content-Type":"text/xml", "charset":"utf-8","Content-Description":"SOAP Message", "SOAPAction":"urn:xdaq-application:lid=10"}
-		listeningUrl=host+":9999" # The port that the xdaq daemon listens on
+		listeningPort=9999 # The port that the xdaq daemon listens on
 	else:
 		headers = {"Content-Type":"text/xml", "charset":"utf-8","Content-Description":"SOAP Message", "SOAPAction":"urn:xdaq-application:class="+className+",instance="+str(instance)}
-		listeningUrl=host+":"+str(port)
+		listeningPort=port
 
-	connection = httplib.HTTPConnection( listeningUrl )
-	connection.request("POST", urllib.quote("/cgi-bin/query"), ElementTree.tostring( ElementTree.XML(message) ), headers )
-	response = connection.getresponse()
+	if pool==None : pool=connectionPool
+	response = pool.request( host, listeningPort, "POST", urllib.quote("/cgi-bin/query"), ElementTree.tostring( ElementTree.XML(message) ), headers )
 	if (response.status != 200):
-		connection.close()
 		raise Exception( "Unable to send soap message because: "+str(response.status)+" - "+response.reason )
-	data = response.read()
-	connection.close()
-	return data
+	return response.fullMessage
 
 def sendSoapStartCommand( host, port, configFilename ):
 	xdglibEnvironmentVariables={
@@ -257,37 +458,29 @@ class Context(object) :
 			if reply=='no job killed.' : return False
 			elif reply=='killed by JID' :
 				self.jobid=-1
+				# Any pooled connections to the applications in this context are now dead
+				connectionPool.discard( self.host, self.port )
 				return True
 		except:
 			raise Exception( "Couldn't kill process. Response was: "+ElementTree.tostring(response) )
 
-	def waitUntilProcessStarted( self, timeout=30.0 ) :
+	def waitUntilProcessStarted( self, timeout=30.0, concurrent=True ) :
 		"""
-		Blocks until the process has started and all applications are contactable, or throws an exception if
-		"timeout" seconds have passed.
+		Blocks until the process has started and all applications are responsive, or throws a TimeoutError
+		if "timeout" seconds have passed. All applications are probed at the same time. Returns (and keeps
+		in self.startupTimes) a dictionary of how many seconds each application took to respond.
 		"""
-		timeoutEndTime=time.time()+timeout;
-		while True :
-			allAplicationsStarted=True
-			for application in self.applications:
-				if application.getState()=="<uncontactable>": allAplicationsStarted=False
-				if allAplicationsStarted: return
-				if timeoutEndTime<time.time() : raise Exception("Context "+repr(self)+" did not start all applications within "+str(timeout)+" seconds.")
-				time.sleep(0.5)
-
-	def waitUntilProcessKilled( self, timeout=10.0 ) :
+		self.startupTimes=waitUntilAll( self.applications, lambda application : application.isResponsive(), timeout,
+			"Context "+repr(self)+" did not start all applications", concurrent )
+		return self.startupTimes
+
+	def waitUntilProcessKilled( self, timeout=10.0, concurrent=True ) :
 		"""
-		Blocks until the process has stopped and all applications are uncontactable, or throws an exception if
-		"timeout" seconds have passed.
+		Blocks until the process has stopped and all applications are uncontactable, or throws a TimeoutError
+		if "timeout" seconds have passed. All applications are probed at the same time.
 		"""
-		timeoutEndTime=time.time()+timeout;
-		while True :
-			allAplicationsStopped=True
-			for application in self.applications:
-				if application.getState()!="<uncontactable>": allAplicationsStopped=False
-				if allAplicationsStopped: return
-				if timeoutEndTime<time.time() : raise Exception("Context "+repr(self)+" did not kill all applications within "+str(timeout)+" seconds.")
-				time.sleep(0.5)
+		return waitUntilAll( self.applications, lambda application : application.getState()=="<uncontactable>", timeout,
+			"Context "+repr(self)+" did not kill all applications", concurrent )
 
 class Application(object) :
 	"""
@@ -302,17 +495,14 @@ class Application(object) :
 		self.className=className
 		self.instance=instance
 		self.id=id
-		self.connection=httplib.HTTPConnection( self.host+":"+str(self.port) )
-		# Make sure the connection is closed, because all the other methods assume
-		# it's in that state. Presumably the connection will have failed at that
-		# stage anyway.
-		self.connection.close()
+		# Connections are shared with every other Application on the same host and port
+		self.connectionPool=connectionPool
 
 	def __repr__(self) :
 		return "<XDAQ Application "+self.host+", "+str(self.port)+", "+self.className+", "+str(self.instance)+">"
 
 	def sendCommand( self, command ) :
-		return sendSoapMessage( self.host, self.port, '<xdaq:'+command+' xmlns:xdaq="urn:xdaq-soap:3.0"/>', self.className, self.instance )
+		return sendSoapMessage( self.host, self.port, '<xdaq:'+command+' xmlns:xdaq="urn:xdaq-soap:3.0"/>', self.className, self.instance, self.connectionPool )
 		#return xdglib.sendSOAPCommand( self.host, self.port, self.className, self.instance, command )
 
 	def getState(self) :
@@ -325,6 +515,14 @@ class Application(object) :
 				return "<unknown>"
 		except : return "<uncontactable>"
 
+	def isResponsive(self) :
+		"""
+		Returns True if the application can be contacted and gives a sensible answer when asked
+		for its state. Just after a process starts it can accept connections before the
+		applications are able to reply properly.
+		"""
+		return self.getState() not in ("<uncontactable>","<unknown>")
+
 	def waitForState(self,state,timeout=5.0):
 		"""
 		Blocks until the state of the application has reached the one specified, or if "timeout" seconds
@@ -334,7 +532,7 @@ class Application(object) :
 		timeoutEndTime=time.time()+timeout;
 		while True :
 			if self.getState()==state : return
-			if timeoutEndTime<time.time() : raise Exception("Application "+repr(self)+" did not reach state "+state+" within "+str(timeout)+" seconds.")
+			if timeoutEndTime<time.time() : raise TimeoutError("Application "+repr(self)+" did not reach state "+state+" within "+str(timeout)+" seconds.")
 			time.sleep(0.2)
 			
 	def httpRequest( self, requestType, resource, parameters={}, storeMessage=True ) :
@@ -342,30 +540,34 @@ class Application(object) :
 		Send an http request to the application to the resource specified, with
 		optional parameters specified as a dictionary. "requestType" is the http
 		type, e.g. "GET" or "POST".
+
+		The request goes over a persistent connection from the pool, so the response
+		message always has to be read before the connection can be reused. If
+		"storeMessage" is True it is kept in a custom member "fullMessage" of the
+		response that gets returned to the user.
 		"""
-		self.connection.connect()
 		# I copied this from an example on stack overflow
 		headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
-		self.connection.request( requestType, urllib.quote(resource), urllib.urlencode(parameters), headers )
-		response = self.connection.getresponse()
-		if storeMessage:
-			# I need to "read" the response message before the connection gets closed.
-			# I'll store the message in a custom member of the response class that gets
-			# returned to the user.
-			response.fullMessage=response.read()
-		self.connection.close()
+		response = self.connectionPool.request( self.host, self.port, requestType, urllib.quote(resource), urllib.urlencode(parameters), headers )
+		if not storeMessage: del response.fullMessage
 		return response
 
 
 class Program(object) :
 	"""
 	Class to control all XDAQ Contexts and Applications.
+
+	If "concurrent" is True (the default) commands and state waits are sent to all the
+	relevant Applications or Contexts at once rather than one after the other. Methods
+	that act on several Applications return a list of Result instances saying which ones
+	succeeded, failed or timed out.
 	
 	Author Mark Grimes (mark.grimes@bristol.ac.uk)
 	Date 29/Aug/2013
 	"""
-	def __init__( self, xdaqConfigFilename ) :
+	def __init__( self, xdaqConfigFilename, concurrent=True ) :
 		self.xdaqConfigFilename = xdaqConfigFilename
+		self.concurrent = concurrent
 		self._loadXDAQConfig()
 
 	def _loadXDAQConfig( self ) :
@@ -385,30 +587,42 @@ class Program(object) :
 		self._loadXDAQConfig()
 
 	def startAllProcesses( self ) :
-		for context in self.contexts:
-			context.startProcess()
+		results=runConcurrently( lambda context : context.startProcess(), self.contexts, self.concurrent )
+		raiseFirstError( results )
+		return results
 
 	def killAllProcesses( self ) :
-		for context in self.contexts:
-			context.killProcess()
+		results=runConcurrently( lambda context : context.killProcess(), self.contexts, self.concurrent )
+		raiseFirstError( results )
+		return results
 			
 	def waitUntilAllProcessesStarted( self, timeout=30.0 ) :
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		for context in self.contexts:
-			context.waitUntilProcessStarted( timeout-(time.time()-startTime) )
-		# Add an arbitrary wait time because I've had cases where the process appears to be
-		# running but the applications don't respond quite yet.
-		time.sleep(2)
+		# All contexts are waited on against the same deadline. If they don't run concurrently
+		# I need to subtract previous waits.
+		timeoutEndTime=time.time()+timeout
+		results=runConcurrently( lambda context : context.waitUntilProcessStarted( timeoutEndTime-time.time(), self.concurrent ), self.contexts, self.concurrent )
+		raiseFirstError( results )
+		return results
 
 	def waitUntilAllProcessesKilled( self, timeout=10.0 ) :
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		for context in self.contexts:
-			context.waitUntilProcessKilled( timeout-(time.time()-startTime) )
+		timeoutEndTime=time.time()+timeout
+		results=runConcurrently( lambda context : context.waitUntilProcessKilled( timeoutEndTime-time.time(), self.concurrent ), self.contexts, self.concurrent )
+		raiseFirstError( results )
+		return results
 
-	def sendAllCommand( self, command ) :
+	def allApplications( self ) :
+		"""
+		Returns an array of all the Applications in all of the Contexts
+		"""
+		returnValue=[]
 		for context in self.contexts :
-			for application in context.applications :
-				application.sendCommand( command )
+			returnValue.extend( context.applications )
+		return returnValue
+
+	def sendAllCommand( self, command ) :
+		results=runConcurrently( lambda application : application.sendCommand( command ), self.allApplications(), self.concurrent )
+		raiseFirstError( results )
+		return results
 
 	def printAllStates( self, hideComms=False ) :
 		for context in self.contexts :
@@ -436,21 +650,173 @@ class Program(object) :
 		return returnValue
 
 	def sendAllMatchingApplicationsCommand( self, command, className, instance=None ) :
+		"""
+		Sends the command to all applications that match the specifics given. Failures are
+		printed rather than raised, check the returned list of Result instances if you need
+		to know which ones didn't work.
+		"""
 		matchingApps=self.findAllMatchingApplications( className, instance )
-		for application in matchingApps :
-			try:
-				application.sendCommand( command )
-			except:
-				print "Unable to contact "+str(application)
+		results=runConcurrently( lambda application : application.sendCommand( command ), matchingApps, self.concurrent )
+		for result in results :
+			if result.status!=Result.succeeded : print "Unable to contact "+str(result.target)
+		return results
 
 	def waitAllMatchingApplicationsForState( self, state, timeout, className, instance=None ) :
 		"""
 		Blocks until all applications that match the specifics given reach the state given, or
-		throws an exception if "timeout" seconds have elapsed.
+		until "timeout" seconds have elapsed. All the applications share the same deadline.
+		Applications that don't make it are printed, and are marked as timed out in the returned
+		list of Result instances.
 		"""
 		matchingApps=self.findAllMatchingApplications( className, instance )
-		for application in matchingApps :
-			try:
-				application.waitForState( state, timeout )
-			except Exception as error:
-				print str(error)
+		timeoutEndTime=time.time()+timeout
+		results=runConcurrently( lambda application : application.waitForState( state, timeoutEndTime-time.time() ), matchingApps, self.concurrent )
+		for result in results :
+			if result.status!=Result.succeeded : print str(result.error)
+		return results
+
+
+class TransitionStep(object) :
+	"""
+	One node in a Transition. When it runs it will (in this order and if they're set):
+	call "action" with no arguments; send "command" to all Applications of class
+	"className"; wait for all of those Applications to reach "state". "dependencies"
+	is a list of the names of other steps in the same Transition that have to finish
+	before this one can start.
+	"""
+	def __init__( self, name, className=None, command=None, state=None, dependencies=[], action=None ) :
+		self.name=name
+		self.className=className
+		self.command=command
+		self.state=state
+		self.dependencies=list(dependencies)
+		self.action=action
+
+	def __repr__(self) :
+		return "<TransitionStep "+self.name+">"
+
+class StepRecord(object) :
+	"""
+	Record of what happened when a TransitionStep was run. "results" is the list of Result
+	instances from sending the command and waiting for the state, "error" is set if the
+	action raised (or the step wasn't run because a dependency's action raised).
+	"""
+	def __init__( self, step, startTime, endTime, results=[], error=None, skipped=False ) :
+		self.step=step
+		self.startTime=startTime
+		self.endTime=endTime
+		self.results=results
+		self.error=error
+		self.skipped=skipped
+
+	def duration(self) :
+		return self.endTime-self.startTime
+
+	def status(self) :
+		if self.error!=None : return Result.failed
+		for result in self.results :
+			if result.status!=Result.succeeded : return result.status
+		return Result.succeeded
+
+	def __repr__(self) :
+		return "<StepRecord "+self.step.name+" "+self.status()+" "+("%.3f" % self.duration())+"s>"
+
+class Transition(object) :
+	"""
+	Describes a state transition of a Program as a directed acyclic graph of TransitionSteps.
+	When run, every step starts as soon as all of its dependencies have finished, so steps
+	that don't depend on each other happen concurrently and the transition only blocks on
+	the real ordering constraints.
+	"""
+	def __init__( self, name, steps ) :
+		self.name=name
+		self.steps=list(steps)
+		self._checkGraph()
+
+	def __repr__(self) :
+		return "<Transition "+self.name+">"
+
+	def _checkGraph( self ) :
+		names=[ step.name for step in self.steps ]
+		for step in self.steps :
+			if names.count(step.name)!=1 : raise Exception( "Transition "+self.name+" has more than one step called "+step.name )
+			for dependency in step.dependencies :
+				if dependency not in names : raise Exception( "Step "+step.name+" in transition "+self.name+" depends on unknown step "+dependency )
+		# Make sure there are no cycles by repeatedly removing steps that have all their dependencies removed
+		remaining=list(self.steps)
+		removed=set()
+		while remaining :
+			ready=[ step for step in remaining if set(step.dependencies)<=removed ]
+			if not ready : raise Exception( "Transition "+self.name+" has a dependency cycle between "+str(remaining) )
+			for step in ready :
+				remaining.remove(step)
+				removed.add(step.name)
+
+	def run( self, program, timeout, waitForFinalStates=True ) :
+		"""
+		Runs all of the steps on the Program supplied, with "timeout" seconds for the whole
+		transition, and returns a dictionary of StepRecords keyed by step name.
+
+		If "waitForFinalStates" is False then steps that nothing else depends on only send
+		their command and don't wait for the state. If any step's action raises, steps that
+		depend on it are skipped and the exception is re-raised once everything has finished.
+		"""
+		timeoutEndTime=time.time()+timeout
+		dependedOn=set()
+		for step in self.steps : dependedOn.update( step.dependencies )
+
+		records={}
+		pending=list(self.steps)
+		finished=Queue.Queue()
+		numberRunning=0
+		while len(records)<len(self.steps) :
+			for step in list(pending) :
+				if not set(step.dependencies)<=set(records.keys()) : continue
+				pending.remove(step)
+				failedDependencies=[ name for name in step.dependencies if records[name].error!=None ]
+				if failedDependencies :
+					now=time.time()
+					records[step.name]=StepRecord( step, now, now, error=Exception("Step "+step.name+" not run because "+", ".join(failedDependencies)+" failed"), skipped=True )
+					continue
+				arguments=( step, program, timeoutEndTime, waitForFinalStates or step.name in dependedOn, finished )
+				if program.concurrent :
+					thread=threading.Thread( target=self._runStep, args=arguments )
+					thread.daemon=True
+					thread.start()
+				else : self._runStep( *arguments )
+				numberRunning+=1
+			if numberRunning>0 :
+				record=finished.get()
+				records[record.step.name]=record
+				numberRunning-=1
+
+		for step in self.steps :
+			record=records[step.name]
+			if record.error!=None and not record.skipped : raise record.error
+		return records
+
+	def _runStep( self, step, program, timeoutEndTime, waitForState, finished ) :
+		startTime=time.time()
+		results=[]
+		error=None
+		try :
+			if step.action!=None : step.action()
+			if step.command!=None : results+=program.sendAllMatchingApplicationsCommand( step.command, step.className )
+			if step.state!=None and waitForState : results+=program.waitAllMatchingApplicationsForState( step.state, timeoutEndTime-time.time(), step.className )
+		except Exception as exception :
+			error=exception
+		finished.put( StepRecord( step, startTime, time.time(), results, error ) )
+
+	def criticalPath( self, records ) :
+		"""
+		Returns the list of StepRecords, earliest first, along the chain of dependencies that
+		determined when the transition finished, i.e. the steps that would have to be sped
+		up to make the whole transition quicker.
+		"""
+		if not records : return []
+		record=max( records.values(), key=lambda record : record.endTime )
+		path=[record]
+		while record.step.dependencies :
+			record=max( [ records[name] for name in record.step.dependencies ], key=lambda record : record.endTime )
+			path.insert( 0, record )
+		return path
@@ -29,10 +29,24 @@ except:
         print "Can't find VISA or MyGpib (linux-gpib wrapper: Power supply control won't work)"
     
 class PowerSupply(object):
-    def __init__(self, gpibAddress = "GPIB0::13" , psuPresent=1, verbose=True ):
-        self.powerSupply = instrument(gpibAddress)
+    def __init__(self, gpibAddress = "GPIB0::13" , psuPresent=1, verbose=True, cacheState=False, simulated=False ):
+        """
+        If "cacheState" is True the channel selection and output settings are remembered so
+        that they don't have to be sent or queried again, which assumes nothing else is talking
+        to the supply. If "simulated" is True a SimulatedInstrument is used instead of hardware.
+        """
+        if simulated:
+            import SimulatedInstrument
+            self.powerSupply = SimulatedInstrument.instrument(gpibAddress)
+        else:
+            self.powerSupply = instrument(gpibAddress)
         self.verbose=verbose
         self.psuPresent = psuPresent
+        self.cacheState = cacheState
+        self._selectedChannel = None # Cached channel selection, None if not known
+        self._outputs = {}           # Cached {"voltage":...,"current":...} keyed by channel
+        self._isOn = None            # Cached output state, None if not known
+        self._completionPending = False # True if an "*OPC?" reply is still waiting to be read
 
         # Get the pulse-generator's ID
         if psuPresent == 1:
@@ -46,7 +60,7 @@ class PowerSupply(object):
     
     def selftest(self):
         # Perform a self-test - should be 0 if all ok
-        selfTestResult = self.powerSupply.ask("*TST?")
+        selfTestResult = self._ask("*TST?")
         if selfTestResult == "+0" or selfTestResult == "+0\n":
             print "Power supply's self-test passed ok"
         else:
@@ -56,69 +70,130 @@ class PowerSupply(object):
     
     def reset(self):
           print "Resetting the power supply..."
-          self.powerSupply.write("*RST")
+          self._write("*RST")
+          self._selectedChannel = None
+          self._outputs = {}
+          self._isOn = None
           print "...Done!"
 
 
     def setChannel(self,  output = "OUTP1"):
          """selects which output to read/write"""
 
-         self.powerSupply.write("INST " + output)
+         if self.cacheState and output == self._selectedChannel: return
+         self._write("INST " + output)
+         self._selectedChannel = output
          if self.verbose:
-         	outp = self.powerSupply.ask("INST?")
+         	outp = self._ask("INST?")
          	print "Controlling output " + outp
 
     def getChannel(self):
-    	return self.powerSupply.ask("INST?")
+    	if self.cacheState and self._selectedChannel != None: return self._selectedChannel
+    	return self._ask("INST?")
          
-    def setOutput(self, voltage = 0 , current = 0.005 , output = "OUTP1"):
+    def setOutput(self, voltage = 0 , current = 0.005 , output = "OUTP1", wait = True):
          """
          Set the output voltage and current.
          output selects which output to vary
+
+         In "cacheState" mode the channel selection, setting and read back are sent as one
+         command string. If "wait" is False the read back is replaced by "*OPC?" and this
+         returns straight away, so the supply can settle while something else is done. The
+         next command to the supply (or waitForCompletion) blocks until it has finished.
          """
          if self.psuPresent == 1:
              if (voltage<=self.voltageLimit):
-                 self.setChannel( output = output )
-                 self.powerSupply.write("APPLY " + str(voltage) + " , " + str(current) )
-                 state = self.powerSupply.ask("APPLY?" )
-                 if self.verbose: print "Power supply reports Output Voltage, Current = " + state
+                 if not self.cacheState:
+                     self.setChannel( output = output )
+                     self._write("APPLY " + str(voltage) + " , " + str(current) )
+                     state = self._ask("APPLY?" )
+                     if self.verbose: print "Power supply reports Output Voltage, Current = " + state
+                     return
+                 commands = []
+                 if output != self._selectedChannel: commands.append( "INST " + output )
+                 commands.append( "APPLY " + str(voltage) + " , " + str(current) )
+                 if wait:
+                     commands.append( "APPLY?" )
+                     state = self._ask( ";:".join(commands) )
+                     self._selectedChannel = output
+                     self._outputs[output] = self._parseState( state )
+                     if self.verbose: print "Power supply reports Output Voltage, Current = " + state
+                 else:
+                     commands.append( "*OPC?" )
+                     self._write( ";:".join(commands) )
+                     self._completionPending = True
+                     self._selectedChannel = output
+                     # Not read back, so assume the supply does what it's told
+                     self._outputs[output] = {"voltage":float(voltage),"current":float(current)}
              else:
                  raise Exception("Soft-limit set to %s . Refusing to set output voltage to %s" % ( self.voltageLimit , voltage))
+
+    def waitForCompletion(self):
+         """
+         Blocks until the supply has finished the last setOutput that was called with wait=False.
+         Does nothing if there isn't one.
+         """
+         if not self._completionPending: return
+         self._completionPending = False
+         reply = self.powerSupply.read()
+         if reply.strip() != "1": raise Exception('The command "*OPC?" returned "'+reply+'"')
          
     def getOutput(self,  output = "OUTP1"):
          """
          Reads the output voltage and current.
          output selects which output to read
          """
+         if self.cacheState and output in self._outputs:
+             self.waitForCompletion()
+             return dict( self._outputs[output] )
+
          self.setChannel( output = output )
 
-         state = self.powerSupply.ask("APPLY?" )
+         state = self._ask("APPLY?" )
          if self.verbose: print "Power supply reports Voltage, current = " + state
          # Get the state in number format
+         result = self._parseState( state )
+         if self.cacheState: self._outputs[output] = result
+         return dict( result )
+
+    def _parseState(self, state):
          splitState=state.split('"')[1].split(',')
          return {"voltage":float(splitState[0]),"current":float(splitState[1])}
 
+    def _write(self, command):
+         """ Writes to the supply, first reading any outstanding "*OPC?" reply """
+         self.waitForCompletion()
+         return self.powerSupply.write(command)
+
+    def _ask(self, command):
+         self.waitForCompletion()
+         return self.powerSupply.ask(command)
+
     
          
     def getOnOff(self , output = "OUT1" ):
          """ Reads the on/off status of an output"""
-         outp = self.powerSupply.ask("OUTP?")
+         outp = self._ask("OUTP?")
          print "Output State (0/1 = off/on) =  " + outp
 
     def isOn(self):
     	""" Returns whether the output is on or off as a boolean """
-    	outp = self.powerSupply.ask("OUTP?")
-    	if outp=="1" or outp=="1\n": return True
-    	elif outp=="0" or outp=="0\n": return False
+    	if self.cacheState and self._isOn != None: return self._isOn
+    	outp = self._ask("OUTP?")
+    	if outp=="1" or outp=="1\n": self._isOn = True
+    	elif outp=="0" or outp=="0\n": self._isOn = False
     	else: raise Exception('The command "OUTP?" returned "'+outp+'"')
+    	return self._isOn
 
     def setOn(self , output = "OUT1" ):
-         outp = self.powerSupply.write("OUTP 1")
+         outp = self._write("OUTP 1")
+         self._isOn = True
          if self.verbose: self.getOnOff()
 
 
     def setOff(self, output = "OUT1" ):
-         outp = self.powerSupply.write("OUTP 0")
+         outp = self._write("OUTP 0")
+         self._isOn = False
          if self.verbose: self.getOnOff()
 
     def setVoltageLimit(self, voltageLimit = 1.25 ):
@@ -0,0 +1,254 @@
+"""
+Fits the s-curves of many strips at once with numpy, for reanalysing saved scans without
+ROOT. The model is the same one FitSCurve in src/SCurve.cc gives to ROOT, i.e.
+
+	[0]*0.5*( 1 + Erf( [1]*(x-[2])/sqrt(2) ) )
+
+but instead of one Minuit fit per strip every strip is fitted together, with a damped
+Gauss-Newton (Levenberg-Marquardt) iteration where each step is a handful of array operations
+over the whole [strip][bin] block.
+
+Each fit starts from estimateSCurves, a one pass estimate from the moments of the differences
+between neighbouring bins, which can also be used on its own for a quick look. The on/off counts
+can be taken straight from a SavedState.SnapshotChannel with fitSnapshotChannel, or given as two
+arrays with fitSCurves. Needs numpy.
+"""
+
+import math
+
+try :
+	import numpy
+except ImportError :
+	numpy=None
+
+def _requireNumpy() :
+	if numpy==None : raise Exception( "The s-curve fitter needs numpy, which couldn't be imported" )
+
+def histogramBinCentres( numberOfBins ) :
+	"""
+	Returns the x value of the centre of each bin in the histograms from SCurve::createHistogram,
+	which are what the ROOT fit sees. Fitting against these gives parameters that can be compared
+	directly with the ones FitSCurve produces.
+	"""
+	_requireNumpy()
+	binWidth=1.0/numberOfBins
+	# The histograms run from -binWidth to 1+binWidth, so the real spacing is slightly wider
+	spacing=(1.0+2*binWidth)/numberOfBins
+	return -binWidth+spacing*(numpy.arange(numberOfBins)+0.5)
+
+def erf( x ) :
+	"""
+	Vectorised error function, from Abramowitz and Stegun 7.1.26 which is accurate to 1.5e-7.
+	Only used so that scipy isn't needed as well.
+	"""
+	sign=numpy.sign(x)
+	x=numpy.abs(x)
+	t=1.0/(1.0+0.3275911*x)
+	polynomial=t*(0.254829592+t*(-0.284496736+t*(1.421413741+t*(-1.453152027+t*1.061405429))))
+	return sign*(1.0-polynomial*numpy.exp(-x*x))
+
+class SCurveFitResults(object) :
+	"""
+	The result of fitting a block of s-curves. Each attribute is an array with one value per strip,
+	in the same order as the counts that were fitted:
+		plateau   - parameter [0], limited to between 0 and 1 like the ROOT fit
+		slope     - parameter [1], negative for falling curves
+		mean      - parameter [2], the 50% point
+		width     - 1/abs(slope), the sigma of the turn on
+		chi2      - the weighted sum of squared residuals
+		ndf       - the number of bins with events minus the three parameters
+		converged - boolean, False if the iteration limit was hit or the strip has too few bins
+	Strips that couldn't be fitted have NaN for the parameters.
+	"""
+	def __init__( self, plateau, slope, mean, chi2, ndf, converged ) :
+		self.plateau=plateau
+		self.slope=slope
+		self.mean=mean
+		with numpy.errstate( divide='ignore' ) : self.width=1.0/numpy.abs(slope)
+		self.chi2=chi2
+		self.ndf=ndf
+		self.converged=converged
+
+def _model( parameters, x ) :
+	"""
+	Returns the model and its derivatives with respect to the three parameters, each as a
+	[strip][bin] array. "parameters" is a [strip][3] array and x is a [bin] array.
+	"""
+	plateau=parameters[:,0:1]
+	slope=parameters[:,1:2]
+	mean=parameters[:,2:3]
+	distance=x[numpy.newaxis,:]-mean
+	z=slope*distance/math.sqrt(2)
+	turnOn=0.5*(1+erf(z))
+	gaussian=numpy.exp(-z*z)/math.sqrt(2*math.pi)
+	return ( plateau*turnOn, turnOn, plateau*gaussian*distance, -plateau*gaussian*slope )
+
+def _solve3x3( matrix, vector ) :
+	"""
+	Solves a [strip][3][3] by [strip][3] set of linear equations with Cramer's rule, so that each
+	strip is done in the same array operation. Singular strips give a zero step.
+	"""
+	def determinant( m ) :
+		return ( m[:,0,0]*(m[:,1,1]*m[:,2,2]-m[:,1,2]*m[:,2,1])
+			- m[:,0,1]*(m[:,1,0]*m[:,2,2]-m[:,1,2]*m[:,2,0])
+			+ m[:,0,2]*(m[:,1,0]*m[:,2,1]-m[:,1,1]*m[:,2,0]) )
+	denominator=determinant(matrix)
+	singular=(denominator==0) | ~numpy.isfinite(denominator)
+	denominator=numpy.where( singular, 1.0, denominator )
+	solution=numpy.empty_like(vector)
+	for column in range(3) :
+		replaced=matrix.copy()
+		replaced[:,:,column]=vector
+		solution[:,column]=numpy.where( singular, 0.0, determinant(replaced)/denominator )
+	return solution
+
+def _estimate( fraction, hasData, x ) :
+	"""
+	The calculation for estimateSCurves, on [strip][bin] arrays of the fraction and whether each
+	bin has any events.
+	"""
+	numberOfStrips, numberOfBins=fraction.shape
+	# For each bin find the closest bin before it that has data, or -1 if there isn't one
+	indices=numpy.where( hasData, numpy.arange(numberOfBins)[numpy.newaxis,:], -1 )
+	previous=numpy.maximum.accumulate( indices, axis=1 )
+	previous=numpy.concatenate( ( numpy.full( (numberOfStrips,1), -1, dtype=previous.dtype ), previous[:,:-1] ), axis=1 )
+	usable=hasData & (previous>=0)
+	previous=numpy.maximum( previous, 0 )
+
+	difference=numpy.where( usable, fraction-fraction[numpy.arange(numberOfStrips)[:,numpy.newaxis],previous], 0.0 )
+	position=0.5*( x[numpy.newaxis,:]+x[previous] )
+
+	sumOfDifferences=difference.sum(axis=1)
+	valid=( usable.sum(axis=1)>0 ) & ( sumOfDifferences!=0 )
+	sumOfDifferences=numpy.where( valid, sumOfDifferences, 1.0 )
+	mean=(difference*position).sum(axis=1)/sumOfDifferences
+	# The mean absolute deviation is sigma*sqrt(2/pi) for a Gaussian. Noise far from the turn on
+	# would be weighted by the distance squared in the variance, so this is much more robust.
+	width=math.sqrt(math.pi/2)*(difference*numpy.abs(position-mean[:,numpy.newaxis])).sum(axis=1)/sumOfDifferences
+
+	return { "valid":valid,
+		"direction":numpy.where( sumOfDifferences<0, -1, 1 ),
+		"plateau":numpy.where( valid, numpy.abs(sumOfDifferences), numpy.nan ),
+		"mean":numpy.where( valid, mean, numpy.nan ),
+		"width":numpy.where( valid, numpy.maximum( width, 0.0 ), numpy.nan ) }
+
+def estimateSCurves( eventsOn, eventsOff, x=None ) :
+	"""
+	Quick estimate of the s-curve parameters of every strip in the [strip][bin] arrays of eventsOn
+	and eventsOff counts, without fitting. The same calculation as SCurve::estimateParameters in
+	C++: the differences between the fractions of neighbouring bins are treated as a Gaussian, and
+	its sum, mean and mean absolute deviation give the plateau, mean and width. Bins without events
+	are skipped.
+
+	Returns a dictionary of arrays with one value per strip: "plateau", "mean", "width", "direction"
+	(+1 for rising curves and -1 for falling) and "valid", which is False if there weren't two bins
+	with events or the fraction didn't change. The parameters of invalid strips are NaN. "x" is the
+	same as for fitSCurves, so by default the positions are on the histogram scale.
+
+	ThresholdScan.estimateSCurve is deliberately a different estimator. It finds where the fraction
+	crosses fixed levels and gives errors on them, which the adaptive scan needs to decide when to
+	stop, and it runs without numpy. This one has no errors, but it works on every strip at once
+	and gives the same starting point as the C++ fit, so the fits here match AnalyseCBCOutput's.
+	"""
+	_requireNumpy()
+	eventsOn, eventsOff, x=_checkedInput( eventsOn, eventsOff, x )
+	events=eventsOn+eventsOff
+	with numpy.errstate( invalid='ignore', divide='ignore' ) :
+		fraction=numpy.where( events>0, eventsOn/events, 0.0 )
+	return _estimate( fraction, events>0, x )
+
+def _initialParameters( fraction, events, x ) :
+	"""
+	Starting point for each strip, from the same estimate as estimateSCurves. Strips without a valid
+	estimate start from the middle of the range, and widths are kept to at least half a bin.
+	"""
+	estimate=_estimate( fraction, events>0, x )
+	valid=estimate["valid"]
+	# With a single bin there's no spacing, but the strip can't be fitted anyway
+	binSpacing=numpy.abs(x[-1]-x[0])/(len(x)-1) if len(x)>1 else 1.0
+
+	plateau=numpy.where( valid, numpy.clip( estimate["plateau"], 0.01, 1.0 ), 1.0 )
+	mean=numpy.where( valid, estimate["mean"], 0.5*(x[0]+x[-1]) )
+	width=numpy.where( valid, numpy.maximum( estimate["width"], binSpacing/2 ), binSpacing*len(x)/8.0 )
+	return numpy.column_stack( (plateau, estimate["direction"]/width, mean) )
+
+def _checkedInput( eventsOn, eventsOff, x ) :
+	"""
+	Converts the counts to [strip][bin] float arrays and x to a [bin] array, filling in the default
+	for x. Throws an Exception if the shapes don't agree.
+	"""
+	eventsOn=numpy.atleast_2d( numpy.asarray( eventsOn, dtype=float ) )
+	eventsOff=numpy.atleast_2d( numpy.asarray( eventsOff, dtype=float ) )
+	if eventsOn.shape!=eventsOff.shape : raise Exception( "eventsOn and eventsOff have different shapes "+str(eventsOn.shape)+" and "+str(eventsOff.shape) )
+	numberOfBins=eventsOn.shape[1]
+	if x is None : x=histogramBinCentres( numberOfBins )
+	x=numpy.asarray( x, dtype=float )
+	if x.shape!=(numberOfBins,) : raise Exception( "There are "+str(numberOfBins)+" bins but "+str(len(x))+" x values" )
+	return eventsOn, eventsOff, x
+
+def fitSCurves( eventsOn, eventsOff, x=None, maximumIterations=100, tolerance=1e-6 ) :
+	"""
+	Fits every strip in the [strip][bin] arrays of eventsOn and eventsOff counts, and returns an
+	SCurveFitResults. "x" is the position of each bin; by default it's the histogram bin centres
+	so that the parameters are on the same scale as the ROOT fit. Pass numpy.arange(numberOfBins)
+	to get them in bins instead, like ThresholdScan.estimateSCurve.
+
+	Each bin is weighted by the inverse of its binomial variance, using (on+0.5)/(on+off+1) for the
+	efficiency so that bins at 0% or 100% still carry weight. Bins without any events are ignored.
+	"""
+	_requireNumpy()
+	eventsOn, eventsOff, x=_checkedInput( eventsOn, eventsOff, x )
+	numberOfStrips=eventsOn.shape[0]
+
+	events=eventsOn+eventsOff
+	with numpy.errstate( invalid='ignore', divide='ignore' ) :
+		fraction=numpy.where( events>0, eventsOn/events, 0.0 )
+		smoothed=(eventsOn+0.5)/(events+1)
+		weight=numpy.where( events>0, events/(smoothed*(1-smoothed)), 0.0 )
+	ndf=(events>0).sum(axis=1)-3
+	fittable=ndf>0
+
+	def chi2For( modelValues ) :
+		return ( weight*(fraction-modelValues)**2 ).sum(axis=1)
+
+	parameters=_initialParameters( fraction, events, x )
+	modelValues=_model( parameters, x )[0]
+	chi2=chi2For( modelValues )
+	damping=numpy.full( numberOfStrips, 1e-3 )
+	converged=~fittable
+	identity=numpy.eye(3)[numpy.newaxis,:,:]
+
+	for iteration in range(maximumIterations) :
+		if converged.all() : break
+		modelValues, dPlateau, dSlope, dMean=_model( parameters, x )
+		jacobian=numpy.concatenate( (dPlateau[:,:,numpy.newaxis], dSlope[:,:,numpy.newaxis], dMean[:,:,numpy.newaxis]), axis=2 )
+		weightedJacobian=jacobian*weight[:,:,numpy.newaxis]
+		curvature=numpy.einsum( 'sbi,sbj->sij', weightedJacobian, jacobian )
+		gradient=numpy.einsum( 'sbi,sb->si', weightedJacobian, fraction-modelValues )
+
+		diagonal=curvature*identity
+		step=_solve3x3( curvature+damping[:,numpy.newaxis,numpy.newaxis]*diagonal, gradient )
+		trial=parameters+step
+		trial[:,0]=numpy.clip( trial[:,0], 0.0, 1.0 )
+		trialChi2=chi2For( _model( trial, x )[0] )
+
+		improved=(trialChi2<=chi2) & ~converged & numpy.isfinite(trialChi2)
+		relativeChange=numpy.abs(chi2-trialChi2)/numpy.maximum( chi2, 1e-12 )
+		parameters=numpy.where( improved[:,numpy.newaxis], trial, parameters )
+		# A step that barely changes anything, whether or not it was taken, means there's nowhere better to go
+		converged|=( relativeChange<tolerance ) & ( improved | (damping>1e6) )
+		chi2=numpy.where( improved, trialChi2, chi2 )
+		damping=numpy.where( improved, damping/10, damping*10 )
+
+	parameters[~fittable,:]=numpy.nan
+	chi2=numpy.where( fittable, chi2, numpy.nan )
+	return SCurveFitResults( parameters[:,0], parameters[:,1], parameters[:,2], chi2, numpy.maximum(ndf,0), converged & fittable )
+
+def fitSnapshotChannel( channel, x=None, maximumIterations=100 ) :
+	"""
+	Fits all the strips of a SavedState.SnapshotChannel. The results are in the same order as
+	channel.stripNumbers.
+	"""
+	_requireNumpy()
+	counts=numpy.asarray( channel.counts ).reshape( len(channel.stripNumbers), channel.numberOfBins, 2 )
+	return fitSCurves( counts[:,:,0], counts[:,:,1], x, maximumIterations )
@@ -0,0 +1,367 @@
+"""
+Reads the state files that AnalyseCBCOutput::saveState writes, so that run control scripts
+can look at the s-curves without starting CMSSW. These are either binary snapshots (see
+interface/SCurveSnapshot.h for the layout) or, for files saved by older versions, the text
+format from DetectorSCurves::dumpToStream followed by the stripThresholdOffsets_ trailer. Text
+files are parsed as a stream of tokens, so they're never loaded whole.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import array
+import itertools
+
+try :
+	import numpy
+except ImportError :
+	numpy=None
+
+snapshotMagic="CBCSNAP\0"
+_snapshotHeader=struct.Struct("<8sIIIIIIQQ")
+_snapshotChannelRecord=struct.Struct("<IIIIQ")
+
+def _padded( size ) :
+	return (size+7) & ~7
+
+class SnapshotChannel(object) :
+	"""
+	The s-curves for all the strips of one FED channel in a snapshot. "counts" is a flat array
+	of numberOfStrips*numberOfBins*2 uint32 counts, with eventsOn then eventsOff for each bin,
+	and all the bins of one strip before the next. It's a numpy array if numpy is available
+	(a view of the file, so it's only valid while the file is mapped), otherwise an array.array.
+	"""
+	def __init__( self, fedNumber, fedChannel, stripNumbers, numberOfBins, counts ) :
+		self.fedNumber=fedNumber
+		self.fedChannel=fedChannel
+		self.stripNumbers=stripNumbers
+		self.numberOfBins=numberOfBins
+		self.counts=counts
+
+	def stripSCurve( self, stripIndex ) :
+		"""
+		Returns the s-curve of the strip at "stripIndex" in stripNumbers, as a list with an
+		[eventsOn,eventsOff] pair for every bin.
+		"""
+		start=2*self.numberOfBins*stripIndex
+		return [ [ int(self.counts[start+2*bin]), int(self.counts[start+2*bin+1]) ] for bin in range(self.numberOfBins) ]
+
+class Snapshot(object) :
+	"""
+	The contents of a snapshot file, as returned by readSnapshot.
+	"""
+	def __init__( self, channels, stripThresholdOffsets, eventsProcessed, runsProcessed ) :
+		self.channels=channels
+		self.stripThresholdOffsets=stripThresholdOffsets
+		self.eventsProcessed=eventsProcessed
+		self.runsProcessed=runsProcessed
+
+def isSnapshotFile( filename ) :
+	"""
+	Returns True if the file starts with the snapshot magic number.
+	"""
+	inputFile=open(filename,'rb')
+	try : return inputFile.read(len(snapshotMagic))==snapshotMagic
+	finally : inputFile.close()
+
+def _uint32Array( buffer, offset, length ) :
+	if numpy!=None : return numpy.frombuffer( buffer, dtype="<u4", count=length, offset=offset )
+	result=array.array('I')
+	result.fromstring( buffer[offset:offset+4*length] )
+	return result
+
+def readSnapshot( filename ) :
+	"""
+	Maps a snapshot file into memory and returns a Snapshot of it. Throws an Exception if the file
+	isn't a valid snapshot.
+	"""
+	inputFile=open(filename,'rb')
+	try :
+		try : buffer=mmap.mmap( inputFile.fileno(), 0, access=mmap.ACCESS_READ )
+		except (ValueError,mmap.error) : raise Exception( "Unable to map "+filename+" into memory" )
+	finally : inputFile.close() # The mapping stays valid after the file is closed
+	def checkedSize( offset, size ) :
+		if offset+size>len(buffer) : raise Exception( filename+" is truncated" )
+
+	checkedSize( 0, _snapshotHeader.size )
+	magic, version, byteOrderMark, headerSize, numberOfChannels, numberOfOffsets, reserved, eventsProcessed, runsProcessed=_snapshotHeader.unpack_from( buffer, 0 )
+	if magic!=snapshotMagic : raise Exception( filename+" is not an s-curve snapshot" )
+	if version!=1 : raise Exception( filename+" is snapshot version "+str(version)+" which can't be read" )
+	if byteOrderMark!=0x01020304 : raise Exception( filename+" was written with a different byte order" )
+
+	offset=headerSize
+	checkedSize( offset, 4*numberOfOffsets )
+	stripThresholdOffsets=[ int(value) for value in _uint32Array( buffer, offset, numberOfOffsets ) ]
+	offset+=_padded( 4*numberOfOffsets )
+
+	checkedSize( offset, _snapshotChannelRecord.size*numberOfChannels )
+	channels=[]
+	for channelIndex in range(numberOfChannels) :
+		fedNumber, fedChannel, numberOfStrips, numberOfBins, dataOffset=_snapshotChannelRecord.unpack_from( buffer, offset+_snapshotChannelRecord.size*channelIndex )
+		checkedSize( dataOffset, 4*numberOfStrips )
+		stripNumbers=[ int(value) for value in _uint32Array( buffer, dataOffset, numberOfStrips ) ]
+		countsOffset=dataOffset+_padded( 4*numberOfStrips )
+		checkedSize( countsOffset, 4*2*numberOfStrips*numberOfBins )
+		counts=_uint32Array( buffer, countsOffset, 2*numberOfStrips*numberOfBins )
+		channels.append( SnapshotChannel( fedNumber, fedChannel, stripNumbers, numberOfBins, counts ) )
+	return Snapshot( channels, stripThresholdOffsets, eventsProcessed, runsProcessed )
+
+def readSCurves( filename ) :
+	"""
+	Returns a dictionary, keyed by (fedNumber,fedChannel,stripNumber), of the s-curve for each
+	strip as a list with an [eventsOn,eventsOff] pair for every bin. An empty file (e.g. one that
+	has been truncated at the end of a job) gives an empty dictionary.
+	"""
+	if isSnapshotFile( filename ) : channels=readSnapshot( filename ).channels
+	else : channels=iterateTextChannels( filename )
+
+	sCurves={}
+	for channel in channels :
+		for stripIndex in range(len(channel.stripNumbers)) :
+			sCurves[(channel.fedNumber,channel.fedChannel,channel.stripNumbers[stripIndex])]=channel.stripSCurve( stripIndex )
+	return sCurves
+
+def _tokens( inputFile, chunkSize=65536 ) :
+	"""
+	Generator for the whitespace separated tokens in a file, reading it a chunk at a time.
+	"""
+	remainder=""
+	while True :
+		chunk=inputFile.read( chunkSize )
+		if len(chunk)==0 : break
+		pieces=(remainder+chunk).split()
+		# Unless the chunk ends in whitespace the last piece might carry on in the next chunk
+		if chunk[-1].isspace() : remainder=""
+		else : remainder=pieces.pop()
+		for piece in pieces : yield piece
+	if len(remainder)!=0 : yield remainder
+
+class _TextParser(object) :
+	"""
+	Pulls tokens from the text format of DetectorSCurves::dumpToStream one at a time, checking the
+	class identifiers as it goes.
+	"""
+	def __init__( self, inputFile, filename ) :
+		self.tokens=_tokens( inputFile )
+		self.filename=filename
+
+	def nextToken( self, expectedIdentifier=None ) :
+		try : token=next( self.tokens )
+		except StopIteration : raise Exception( self.filename+" ended unexpectedly" )
+		if expectedIdentifier!=None and token!=expectedIdentifier : raise Exception( "Expected '"+expectedIdentifier+"' in "+self.filename+" but got '"+token+"'" )
+		return token
+
+	def nextInt( self ) :
+		token=self.nextToken()
+		try : return int(token)
+		except ValueError : raise Exception( "Expected a number in "+self.filename+" but got '"+token+"'" )
+
+	def skip( self, numberOfTokens ) :
+		"""Throws away the next numberOfTokens tokens without looking at them"""
+		for token in itertools.islice( self.tokens, numberOfTokens ) : pass
+
+	def channels( self, wantedChannels ) :
+		"""
+		Generator for a SnapshotChannel for each channel in the DetectorSCurves section that is in
+		wantedChannels, or for every channel if wantedChannels is None. Afterwards the parser is at
+		the start of the stripThresholdOffsets_ trailer.
+		"""
+		self.nextToken("DetectorSCurves")
+		for fedIndex in range( self.nextInt() ) :
+			fedNumber=self.nextInt()
+			self.nextToken("FedSCurves")
+			for channelIndex in range( self.nextInt() ) :
+				fedChannel=self.nextInt()
+				self.nextToken("FedChannelSCurves")
+				numberOfStrips=self.nextInt()
+				if wantedChannels!=None and (fedNumber,fedChannel) not in wantedChannels :
+					for stripIndex in range( numberOfStrips ) :
+						self.nextInt() # The strip number
+						self.nextToken("SCurve")
+						self.skip( 3*self.nextInt() ) # Each bin is "SCE", eventsOn, eventsOff
+					continue
+
+				stripNumbers=[]
+				numberOfBins=None
+				counts=array.array('I')
+				for stripIndex in range( numberOfStrips ) :
+					stripNumbers.append( self.nextInt() )
+					self.nextToken("SCurve")
+					stripBins=self.nextInt()
+					if numberOfBins==None : numberOfBins=stripBins
+					elif stripBins!=numberOfBins : raise Exception( "Strips in FED "+str(fedNumber)+" channel "+str(fedChannel)+" of "+self.filename+" have different numbers of bins" )
+					for bin in range( stripBins ) :
+						self.nextToken("SCE")
+						counts.append( self.nextInt() )
+						counts.append( self.nextInt() )
+				if numpy!=None : counts=numpy.frombuffer( counts, dtype=numpy.uint32 ).copy()
+				yield SnapshotChannel( fedNumber, fedChannel, stripNumbers, numberOfBins if numberOfBins!=None else 0, counts )
+
+def iterateTextChannels( filename, channels=None ) :
+	"""
+	Generator that reads a state file in the text format of DetectorSCurves::dumpToStream one FED
+	channel at a time, without loading the whole file. Each channel is returned as a SnapshotChannel,
+	so "counts" is a numpy array (or an array.array if numpy isn't available) of the same layout as a
+	snapshot's. The array is a copy, so it can be kept after the generator moves on.
+
+	"channels" is an optional collection of (fedNumber,fedChannel) pairs to return. Other channels
+	are skipped over without being converted. An empty file gives nothing.
+	"""
+	inputFile=open(filename,'r')
+	try :
+		parser=_TextParser( inputFile, filename )
+		# An empty file (e.g. one that has been truncated at the end of a job) has no channels
+		try : firstToken=next( parser.tokens )
+		except StopIteration : return
+		parser.tokens=itertools.chain( [firstToken], parser.tokens )
+		for channel in parser.channels( None if channels==None else set(channels) ) : yield channel
+	finally : inputFile.close()
+
+def _readTextState( filename, channels, useChannel ) :
+	"""
+	Reads a text state file, calling useChannel with each SnapshotChannel as soon as it has been
+	read, and returns (stripThresholdOffsets,eventsProcessed,runsProcessed) from the trailer.
+	"""
+	inputFile=open(filename,'r')
+	try :
+		parser=_TextParser( inputFile, filename )
+		for channel in parser.channels( None if channels==None else set(channels) ) : useChannel( channel )
+		parser.nextToken("stripThresholdOffsets_")
+		stripThresholdOffsets=[ parser.nextInt() for index in range( parser.nextInt() ) ]
+		eventsProcessed=parser.nextInt()
+		runsProcessed=parser.nextInt()
+	finally : inputFile.close()
+	return ( stripThresholdOffsets, eventsProcessed, runsProcessed )
+
+def readTextState( filename, channels=None ) :
+	"""
+	Reads a state file in the text format into a Snapshot, the same as readSnapshot returns for the
+	binary format, including the stripThresholdOffsets_ trailer and the event and run counts.
+	"channels" selects a subset of channels like in iterateTextChannels.
+	"""
+	channelList=[]
+	stripThresholdOffsets, eventsProcessed, runsProcessed=_readTextState( filename, channels, channelList.append )
+	return Snapshot( channelList, stripThresholdOffsets, eventsProcessed, runsProcessed )
+
+def streamState( filename, useChannel, channels=None ) :
+	"""
+	Calls useChannel with a SnapshotChannel for each FED channel in a state file of either format,
+	one at a time, so that only one channel of a text file is in memory at once. A snapshot's counts
+	are views of the mapped file, so copy them if they're needed after useChannel returns. Returns
+	(stripThresholdOffsets,eventsProcessed,runsProcessed). "channels" selects a subset of channels
+	like in iterateTextChannels. An empty file has no channels and zero events.
+	"""
+	if isSnapshotFile( filename ) :
+		snapshot=readSnapshot( filename )
+		for channel in snapshot.channels :
+			if channels==None or (channel.fedNumber,channel.fedChannel) in channels : useChannel( channel )
+		return ( snapshot.stripThresholdOffsets, snapshot.eventsProcessed, snapshot.runsProcessed )
+
+	emptyFile=open(filename,'r')
+	try :
+		if len( emptyFile.read(4096).split() )==0 : return ( [], 0, 0 )
+	finally : emptyFile.close()
+	return _readTextState( filename, channels, useChannel )
+
+def mergeStates( filenames, channels=None, allowDifferentOffsets=False ) :
+	"""
+	Sums the s-curve counts in several state files, of either format, e.g. ones saved by analysers
+	running in parallel on parts of a scan, and returns the result as a Snapshot. Strips that are only
+	in some of the files are included. The event and run counts are summed as well.
+
+	The inputs are read one channel at a time, so memory use is about the size of the merged state
+	however many files there are. Throws an Exception if the same channel has a different number of
+	bins in different files, or if a count gets too large for the analyser's uint32_t counters. The
+	stripThresholdOffsets_ of each file have to be the same unless "allowDifferentOffsets" is True,
+	in which case the first file's are kept.
+	"""
+	merged={} # Keyed by (fedNumber,fedChannel), with [numberOfBins,{stripNumber:counts}]
+	stripThresholdOffsets=None
+	eventsProcessed=0
+	runsProcessed=0
+	for filename in filenames :
+		def addChannel( channel ) :
+			key=(channel.fedNumber,channel.fedChannel)
+			if key not in merged : merged[key]=[ channel.numberOfBins, {} ]
+			numberOfBins, strips=merged[key]
+			if channel.numberOfBins!=numberOfBins :
+				raise Exception( "FED "+str(key[0])+" channel "+str(key[1])+" has "+str(channel.numberOfBins)+" bins in "+filename+" but "+str(numberOfBins)+" in earlier files" )
+			for stripIndex in range(len(channel.stripNumbers)) :
+				start=2*numberOfBins*stripIndex
+				counts=channel.counts[start:start+2*numberOfBins]
+				stripNumber=channel.stripNumbers[stripIndex]
+				if numpy!=None :
+					if stripNumber in strips : strips[stripNumber]+=counts
+					else : strips[stripNumber]=numpy.array( counts, dtype=numpy.uint64 )
+				else :
+					if stripNumber in strips : strips[stripNumber]=[ total+int(count) for total,count in zip(strips[stripNumber],counts) ]
+					else : strips[stripNumber]=[ int(count) for count in counts ]
+
+		offsets, events, runs=streamState( filename, addChannel, channels )
+		eventsProcessed+=events
+		runsProcessed+=runs
+		if len(offsets)==0 : continue # An empty file
+		if stripThresholdOffsets==None : stripThresholdOffsets=offsets
+		elif offsets!=stripThresholdOffsets and not allowDifferentOffsets : raise Exception( "The strip threshold offsets in "+filename+" are different to the earlier files" )
+
+	channelList=[]
+	for key in sorted(merged.keys()) :
+		numberOfBins, strips=merged[key]
+		stripNumbers=sorted(strips.keys())
+		if numpy!=None :
+			counts=numpy.concatenate( [ strips[stripNumber] for stripNumber in stripNumbers ] ) if len(stripNumbers)!=0 else numpy.zeros( 0, dtype=numpy.uint64 )
+			if len(counts)!=0 and counts.max()>0xffffffff : raise Exception( "FED "+str(key[0])+" channel "+str(key[1])+" has counts too large for the analyser" )
+			counts=counts.astype( numpy.uint32 )
+		else :
+			counts=[ count for stripNumber in stripNumbers for count in strips[stripNumber] ]
+			if len(counts)!=0 and max(counts)>0xffffffff : raise Exception( "FED "+str(key[0])+" channel "+str(key[1])+" has counts too large for the analyser" )
+			counts=array.array( 'I', counts )
+		channelList.append( SnapshotChannel( key[0], key[1], stripNumbers, numberOfBins, counts ) )
+	return Snapshot( channelList, stripThresholdOffsets if stripThresholdOffsets!=None else [], eventsProcessed, runsProcessed )
+
+def writeTextState( filename, snapshot ) :
+	"""
+	Writes a Snapshot in the text format that AnalyseCBCOutput::restoreState reads, i.e. the output of
+	DetectorSCurves::dumpToStream followed by the stripThresholdOffsets_ trailer. It's written to a
+	temporary file that is then renamed, so nothing ever sees a half written file. If writing fails
+	the temporary file is removed.
+	"""
+	feds={}
+	for channel in snapshot.channels : feds.setdefault( channel.fedNumber, [] ).append( channel )
+
+	temporaryFilename=filename+".tmp"
+	outputFile=open(temporaryFilename,'w')
+	try :
+		try :
+			outputFile.write( "DetectorSCurves "+str(len(feds))+" " )
+			for fedNumber in sorted(feds.keys()) :
+				channels=sorted( feds[fedNumber], key=lambda channel : channel.fedChannel )
+				outputFile.write( str(fedNumber)+" FedSCurves "+str(len(channels))+" " )
+				for channel in channels :
+					outputFile.write( str(channel.fedChannel)+" FedChannelSCurves "+str(len(channel.stripNumbers))+" " )
+					for stripIndex in range(len(channel.stripNumbers)) :
+						outputFile.write( str(channel.stripNumbers[stripIndex])+" SCurve "+str(channel.numberOfBins)+" " )
+						outputFile.write( "".join( [ "SCE "+str(eventsOn)+" "+str(eventsOff)+" " for eventsOn, eventsOff in channel.stripSCurve( stripIndex ) ] ) )
+			outputFile.write( "stripThresholdOffsets_ "+str(len(snapshot.stripThresholdOffsets))+" " )
+			outputFile.write( "".join( [ str(offset)+" " for offset in snapshot.stripThresholdOffsets ] ) )
+			outputFile.write( str(snapshot.eventsProcessed)+" "+str(snapshot.runsProcessed)+"\n" )
+		finally : outputFile.close()
+		os.rename( temporaryFilename, filename )
+	except :
+		# Don't leave the half written file behind. Keep hold of the original error, since a failure
+		# to remove the file would replace it.
+		errorType, error, traceback=sys.exc_info()
+		try : os.remove( temporaryFilename )
+		except OSError : pass
+		raise errorType, error, traceback
+
+def readStripTotals( filename ) :
+	"""
+	Returns a dictionary, keyed by (fedNumber,fedChannel,stripNumber), of the total
+	[eventsOn,eventsOff] summed over all the bins of each strip's s-curve.
+	"""
+	totals={}
+	for key, entries in readSCurves( filename ).iteritems() :
+		totals[key]=[ sum([ entry[0] for entry in entries ]), sum([ entry[1] for entry in entries ]) ]
+	return totals
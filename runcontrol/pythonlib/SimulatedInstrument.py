@@ -0,0 +1,86 @@
+"""
+Stand-in for a GPIB instrument with the same interface as MyGpib (and pyvisa), simulating
+enough of an Agilent E3646 power supply for PowerSupply to work without any hardware.
+Every write and read costs "roundTripTime" seconds like a real GPIB transaction, and a new
+output setting takes "settleTime" seconds before "*OPC?" reports that it's complete. The
+number of transactions is counted so that different ways of driving the supply can be
+compared.
+
+Several commands can be sent in one string separated by ";" as with real SCPI.
+"""
+
+import time
+
+def instrument(resource_name, **keyw):
+    """
+    Instantiates a SimulatedPowerSupply, in the same way as MyGpib.instrument
+    """
+    return SimulatedPowerSupply(resource_name=resource_name, **keyw)
+
+class SimulatedPowerSupply(object):
+    def __init__( self, resource_name="", roundTripTime=0.01, settleTime=0.05, outputs=("OUTP1","OUTP2") ) :
+        self.resource_name=resource_name
+        self.roundTripTime=roundTripTime
+        self.settleTime=settleTime
+        self.writes=0
+        self.reads=0
+        self.reset()
+        self._outputNames=outputs
+        self._responses=[]
+
+    def reset( self ) :
+        self.selectedOutput="OUTP1"
+        self.outputs={} # (voltage,current) keyed by output name
+        self.isOn=False
+        self.settledTime=time.time() # When the last change to the outputs will have settled
+
+    def write( self, command ) :
+        self.writes+=1
+        time.sleep( self.roundTripTime )
+        for singleCommand in command.split(";") :
+            self._execute( singleCommand.strip().lstrip(":") )
+
+    def read( self, maxSize=1024 ) :
+        self.reads+=1
+        time.sleep( self.roundTripTime )
+        if len(self._responses)==0 : raise Exception( "SimulatedPowerSupply: read with nothing to read (query timeout)" )
+        response=self._responses.pop(0)
+        if callable(response) : response=response()
+        return response
+
+    def ask( self, command, maxSize=1024 ) :
+        self.write( command )
+        return self.read( maxSize )
+
+    def _execute( self, command ) :
+        if command=="" : return
+        splitCommand=command.split(None,1)
+        header=splitCommand[0].upper()
+        if len(splitCommand)>1 : arguments=[ argument.strip() for argument in splitCommand[1].split(",") ]
+        else : arguments=[]
+
+        if header=="*IDN?" : self._responses.append( "Simulated,E3646A,0,0\n" )
+        elif header=="*TST?" : self._responses.append( "+0\n" )
+        elif header=="*RST" : self.reset()
+        elif header=="*OPC?" :
+            # Only answers once everything has settled, which is when a read would return
+            def waitUntilSettled() :
+                remaining=self.settledTime-time.time()
+                if remaining>0 : time.sleep( remaining )
+                return "1\n"
+            self._responses.append( waitUntilSettled )
+        elif header=="INST" :
+            if not arguments[0] in self._outputNames : raise Exception( "SimulatedPowerSupply: unknown output "+arguments[0] )
+            self.selectedOutput=arguments[0]
+        elif header=="INST?" : self._responses.append( self.selectedOutput+"\n" )
+        elif header=="APPLY" :
+            self.outputs[self.selectedOutput]=( float(arguments[0]), float(arguments[1]) )
+            self.settledTime=time.time()+self.settleTime
+        elif header=="APPLY?" :
+            voltage,current=self.outputs.get( self.selectedOutput, (0.0,0.0) )
+            self._responses.append( '"%f,%f"\n' % (voltage,current) )
+        elif header=="OUTP" :
+            self.isOn=( arguments[0] in ("1","ON") )
+            self.settledTime=time.time()+self.settleTime
+        elif header=="OUTP?" : self._responses.append( ("1" if self.isOn else "0")+"\n" )
+        else : raise Exception( "SimulatedPowerSupply: unknown command "+command )
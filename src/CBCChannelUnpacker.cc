@@ -1,9 +1,14 @@
 #include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
+#include <stdexcept>
 #include <EventFilter/SiStripRawToDigi/interface/SiStripFEDBuffer.h>
 
+const size_t cbcanalyser::CBCChannelUnpacker::numberOfStrips;
+const size_t cbcanalyser::CBCChannelUnpacker::numberOfWords;
+
 cbcanalyser::CBCChannelUnpacker::CBCChannelUnpacker( const sistrip::FEDChannel& fedChannel )
-	: hits_(128,false)
 {
+	hitMask_.fill(0);
+
 	sistrip::FEDZSChannelUnpacker unpacker=sistrip::FEDZSChannelUnpacker::zeroSuppressedModeUnpacker(fedChannel);
 
 	hasData_=unpacker.hasData();
@@ -12,15 +17,29 @@ cbcanalyser::CBCChannelUnpacker::CBCChannelUnpacker( const sistrip::FEDChannel&
 	{
 		if( unpacker.adc()>0 ) // A "1" seems to be encoded with "243", and "0" either absent or with "0"
 		{
-			hits_[unpacker.sampleNumber()]=true;
+			const size_t stripNumber=unpacker.sampleNumber();
+			if( stripNumber>=numberOfStrips ) throw std::runtime_error( "CBCChannelUnpacker - the FED channel has a hit on a strip past the end of the CBC" );
+			hitMask_[stripNumber/64]|=static_cast<uint64_t>(1)<<(stripNumber%64);
 		}
 		unpacker++;
 	}
 }
 
-const std::vector<bool>& cbcanalyser::CBCChannelUnpacker::hits() const
+const cbcanalyser::CBCChannelUnpacker::HitMask& cbcanalyser::CBCChannelUnpacker::hitMask() const
+{
+	return hitMask_;
+}
+
+bool cbcanalyser::CBCChannelUnpacker::hit( size_t stripNumber ) const
+{
+	return ( hitMask_[stripNumber/64]>>(stripNumber%64) ) & 1;
+}
+
+std::vector<bool> cbcanalyser::CBCChannelUnpacker::hits() const
 {
-	return hits_;
+	std::vector<bool> returnValue( numberOfStrips );
+	for( size_t stripNumber=0; stripNumber<numberOfStrips; ++stripNumber ) returnValue[stripNumber]=hit(stripNumber);
+	return returnValue;
 }
 
 bool cbcanalyser::CBCChannelUnpacker::hasData() const
@@ -0,0 +1,100 @@
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCHitCollection.h"
+
+#include <algorithm>
+#include <stdexcept>
+
+namespace // Use the unnamed namespace for tools only used in this file
+{
+	/** @brief Sort order for the channels in the collection, i.e. by FED number then FED channel. */
+	bool isBefore( const cbcanalyser::CBCChannelHits& channelHits, const std::pair<uint16_t,uint16_t>& fedNumberChannelPair )
+	{
+		if( channelHits.fedNumber!=fedNumberChannelPair.first ) return channelHits.fedNumber<fedNumberChannelPair.first;
+		return channelHits.fedChannel<fedNumberChannelPair.second;
+	}
+
+} // end of the unnamed namespace
+
+//----------------------------------------------------------------------------------------------
+//------------------------ cbcanalyser::CBCChannelHits definitions -----------------------------
+//----------------------------------------------------------------------------------------------
+
+cbcanalyser::CBCChannelHits::CBCChannelHits()
+	: fedNumber(0), fedChannel(0)
+{
+	std::fill( hitWords, hitWords+cbcanalyser::CBCChannelUnpacker::numberOfWords, 0 );
+}
+
+cbcanalyser::CBCChannelHits::CBCChannelHits( uint16_t newFedNumber, uint16_t newFedChannel, const cbcanalyser::CBCChannelUnpacker::HitMask& hitMask )
+	: fedNumber(newFedNumber), fedChannel(newFedChannel)
+{
+	std::copy( hitMask.begin(), hitMask.end(), hitWords );
+}
+
+bool cbcanalyser::CBCChannelHits::hit( size_t stripNumber ) const
+{
+	return ( hitWords[stripNumber/64]>>(stripNumber%64) ) & 1;
+}
+
+//----------------------------------------------------------------------------------------------
+//----------------------- cbcanalyser::CBCHitCollection definitions ----------------------------
+//----------------------------------------------------------------------------------------------
+
+cbcanalyser::CBCHitCollection::CBCHitCollection()
+	: malformedBuffers_(0)
+{
+	// No operation besides the initialiser list.
+}
+
+void cbcanalyser::CBCHitCollection::add( const cbcanalyser::CBCChannelHits& channelHits )
+{
+	const std::pair<uint16_t,uint16_t> key( channelHits.fedNumber, channelHits.fedChannel );
+
+	// Normally channels come in order, so check the end first
+	if( channels_.empty() || isBefore( channels_.back(), key ) )
+	{
+		channels_.push_back( channelHits );
+		return;
+	}
+
+	auto iPosition=std::lower_bound( channels_.begin(), channels_.end(), key, isBefore );
+	if( iPosition->fedNumber==channelHits.fedNumber && iPosition->fedChannel==channelHits.fedChannel ) throw std::runtime_error( "CBCHitCollection::add - the channel is already in the collection" );
+	channels_.insert( iPosition, channelHits );
+}
+
+const cbcanalyser::CBCChannelHits* cbcanalyser::CBCHitCollection::find( uint16_t fedNumber, uint16_t fedChannel ) const
+{
+	const std::pair<uint16_t,uint16_t> key( fedNumber, fedChannel );
+	auto iPosition=std::lower_bound( channels_.begin(), channels_.end(), key, isBefore );
+	if( iPosition==channels_.end() || iPosition->fedNumber!=fedNumber || iPosition->fedChannel!=fedChannel ) return nullptr;
+	return &(*iPosition);
+}
+
+cbcanalyser::CBCHitCollection::const_iterator cbcanalyser::CBCHitCollection::begin() const
+{
+	return channels_.begin();
+}
+
+cbcanalyser::CBCHitCollection::const_iterator cbcanalyser::CBCHitCollection::end() const
+{
+	return channels_.end();
+}
+
+size_t cbcanalyser::CBCHitCollection::size() const
+{
+	return channels_.size();
+}
+
+bool cbcanalyser::CBCHitCollection::empty() const
+{
+	return channels_.empty();
+}
+
+void cbcanalyser::CBCHitCollection::addMalformedBuffer()
+{
+	++malformedBuffers_;
+}
+
+size_t cbcanalyser::CBCHitCollection::malformedBuffers() const
+{
+	return malformedBuffers_;
+}
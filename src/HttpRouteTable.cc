@@ -0,0 +1,173 @@
+#include "XtalDAQ/OnlineCBCAnalyser/interface/HttpRouteTable.h"
+
+#include <sstream>
+#include <stdexcept>
+#include <cstdlib>
+#include <cctype>
+#include <cerrno>
+#include <limits>
+
+namespace // Use the unnamed namespace for things only used in this file
+{
+	/** @brief Undoes the percent encoding in a URI, and converts "+" to a space.
+	 *
+	 * Throws a std::runtime_error if a "%" isn't followed by two hex digits.
+	 */
+	std::string percentDecode( const std::string& encoded )
+	{
+		std::string decoded;
+		decoded.reserve( encoded.size() );
+		for( size_t index=0; index<encoded.size(); ++index )
+		{
+			if( encoded[index]=='%' )
+			{
+				if( index+2>=encoded.size() || !std::isxdigit(static_cast<unsigned char>(encoded[index+1])) || !std::isxdigit(static_cast<unsigned char>(encoded[index+2])) )
+				{
+					throw std::runtime_error( "Badly formed percent encoding in \""+encoded+"\"" );
+				}
+				decoded.push_back( static_cast<char>( std::strtol( encoded.substr(index+1,2).c_str(), nullptr, 16 ) ) );
+				index+=2;
+			}
+			else if( encoded[index]=='+' ) decoded.push_back( ' ' );
+			else decoded.push_back( encoded[index] );
+		}
+		return decoded;
+	}
+
+	/** @brief Splits the string at each delimiter, ignoring empty pieces. */
+	std::vector<std::string> splitIgnoringEmpty( const std::string& input, char delimiter )
+	{
+		std::vector<std::string> pieces;
+		size_t start=0;
+		while( start<=input.size() )
+		{
+			size_t end=input.find( delimiter, start );
+			if( end==std::string::npos ) end=input.size();
+			if( end>start ) pieces.push_back( input.substr( start, end-start ) );
+			start=end+1;
+		}
+		return pieces;
+	}
+
+	bool isWildcard( const std::string& patternComponent )
+	{
+		return patternComponent.size()>=2 && patternComponent.front()=='<' && patternComponent.back()=='>';
+	}
+
+} // end of the unnamed namespace
+
+httpserver::DecodedUri::DecodedUri( const std::string& uri )
+{
+	size_t characterPosition=uri.find_first_of("?");
+	path=uri.substr(0,characterPosition);
+	for( const auto& component : ::splitIgnoringEmpty( path, '/' ) ) pathComponents.push_back( ::percentDecode(component) );
+
+	if( characterPosition!=std::string::npos )
+	{
+		for( const auto& parameterString : ::splitIgnoringEmpty( uri.substr(characterPosition+1), '&' ) )
+		{
+			characterPosition=parameterString.find_first_of("=");
+			if( characterPosition==std::string::npos ) parameters.push_back( std::make_pair( ::percentDecode(parameterString), std::string() ) );
+			else parameters.push_back( std::make_pair( ::percentDecode(parameterString.substr(0,characterPosition)), ::percentDecode(parameterString.substr(characterPosition+1)) ) );
+		}
+	}
+}
+
+bool httpserver::DecodedUri::hasParameter( const std::string& name ) const
+{
+	for( const auto& parameter : parameters )
+	{
+		if( parameter.first==name ) return true;
+	}
+	return false;
+}
+
+std::string httpserver::DecodedUri::parameter( const std::string& name, const std::string& defaultValue ) const
+{
+	for( const auto& parameter : parameters )
+	{
+		if( parameter.first==name ) return parameter.second;
+	}
+	return defaultValue;
+}
+
+size_t httpserver::DecodedUri::unsignedParameter( const std::string& name, size_t defaultValue ) const
+{
+	if( !hasParameter(name) ) return defaultValue;
+	return httpserver::convertToUnsigned( parameter(name), "The parameter \""+name+"\"" );
+}
+
+size_t httpserver::convertToUnsigned( const std::string& value, const std::string& description )
+{
+	char* pEnd;
+	errno=0;
+	unsigned long convertedValue=std::strtoul( value.c_str(), &pEnd, 10 );
+	if( value.empty() || *pEnd!='\0' || !std::isdigit(static_cast<unsigned char>(value[0])) ) throw std::runtime_error( description+" should be an unsigned integer, not \""+value+"\"" );
+	// strtoul saturates rather than failing, so out of range values have to be checked separately
+	if( errno==ERANGE || convertedValue>std::numeric_limits<unsigned int>::max() ) throw std::runtime_error( description+" is too large, \""+value+"\"" );
+	return convertedValue;
+}
+
+void httpserver::RouteTable::addRoute( const std::string& pattern, Handler handler, const std::string& description )
+{
+	Route route;
+	route.pattern=pattern;
+	route.patternComponents=::splitIgnoringEmpty( pattern, '/' );
+	route.handler=handler;
+	route.description=description;
+	routes_.push_back( route );
+}
+
+void httpserver::RouteTable::handleRequest( const httpserver::HttpServer::Request& request, httpserver::HttpServer::Reply& reply )
+{
+	try
+	{
+		DecodedUri uri( request.uri );
+
+		for( const auto& route : routes_ )
+		{
+			if( route.patternComponents.size()!=uri.pathComponents.size() ) continue;
+
+			std::vector<std::string> arguments;
+			bool matches=true;
+			for( size_t index=0; index<route.patternComponents.size() && matches; ++index )
+			{
+				if( ::isWildcard(route.patternComponents[index]) ) arguments.push_back( uri.pathComponents[index] );
+				else matches=( route.patternComponents[index]==uri.pathComponents[index] );
+			}
+			if( !matches ) continue;
+
+			// Default to an empty ok reply in case the handler doesn't set anything
+			setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, "" );
+			route.handler( uri, arguments, reply );
+			// Make sure the length is right in case the handler changed the content directly
+			for( auto& header : reply.headers )
+			{
+				if( header.name=="Content-Length" ) header.value=std::to_string( reply.content.size() );
+			}
+			return;
+		}
+
+		// If control gets this far nothing matched, so tell the client what is available
+		std::stringstream outputStream;
+		outputStream << "Nothing is available at \"" << uri.path << "\". The resources available are:" << "\n";
+		for( const auto& route : routes_ ) outputStream << "\t" << route.pattern << "\t" << route.description << "\n";
+		setReply( reply, httpserver::HttpServer::Reply::StatusType::not_found, outputStream.str() );
+	} // end of try block
+	catch( std::exception& error )
+	{
+		setReply( reply, httpserver::HttpServer::Reply::StatusType::bad_request, std::string("Exception encountered: ")+error.what() );
+	}
+}
+
+void httpserver::RouteTable::setReply( httpserver::HttpServer::Reply& reply, httpserver::HttpServer::Reply::StatusType status,
+		const std::string& content, const std::string& contentType )
+{
+	reply.status=status;
+	reply.content=content;
+	reply.headers.resize( 2 );
+	reply.headers[0].name="Content-Length";
+	reply.headers[0].value=std::to_string( reply.content.size() );
+	reply.headers[1].name="Content-Type";
+	reply.headers[1].value=contentType;
+}
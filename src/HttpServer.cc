@@ -15,6 +15,7 @@
 #include <thread>
 #include <set>
 #include <boost/asio.hpp>
+#include <boost/date_time/posix_time/posix_time_types.hpp>
 
 namespace // Use the unnamed namespace for things only used in this file
 {
@@ -228,7 +229,7 @@ namespace // Use the unnamed namespace for things only used in this file
 		Connection& operator=( Connection&& )=delete;
 
 		/// Construct a connection with the given socket.
-		explicit Connection( boost::asio::ip::tcp::socket socket, ::ConnectionManager& manager, httpserver::HttpServer::IRequestHandler& handler );
+		explicit Connection( boost::asio::ip::tcp::socket socket, boost::asio::io_service& io_service, ::ConnectionManager& manager, httpserver::HttpServer::IRequestHandler& handler );
 
 		/// Start the first asynchronous operation for the connection.
 		void start();
@@ -243,6 +244,9 @@ namespace // Use the unnamed namespace for things only used in this file
 		/// Perform an asynchronous write operation.
 		void do_write();
 
+		/// Wait for reply_.pollInterval then call reply_.poll, until it says the reply is ready to write.
+		void do_poll();
+
 		/// Socket for the connection.
 		boost::asio::ip::tcp::socket socket_;
 
@@ -263,6 +267,9 @@ namespace // Use the unnamed namespace for things only used in this file
 
 		/// The reply to be sent back to the client.
 		httpserver::HttpServer::Reply reply_;
+
+		/// Timer for polling replies that aren't ready yet, see httpserver::HttpServer::Reply::poll.
+		boost::asio::deadline_timer pollTimer_;
 	};
 
 
@@ -395,7 +402,7 @@ void httpserver::HttpServerPrivateMembers::do_accept()
 
 			if (!ec)
 			{
-				connectionManager_.start(std::make_shared< ::Connection>(std::move(socket_), connectionManager_, requestHandler_));
+				connectionManager_.start(std::make_shared< ::Connection>(std::move(socket_), io_service_, connectionManager_, requestHandler_));
 			}
 
 			do_accept();
@@ -553,8 +560,8 @@ namespace // unnamed namespace
 	//-------          Definitions for the Connection class          ---------
 	//------------------------------------------------------------------------
 	//------------------------------------------------------------------------
-	Connection::Connection( boost::asio::ip::tcp::socket socket, ::ConnectionManager& manager, httpserver::HttpServer::IRequestHandler& handler ) :
-			socket_( std::move( socket ) ), connectionManager_( manager ), requestHandler_( handler )
+	Connection::Connection( boost::asio::ip::tcp::socket socket, boost::asio::io_service& io_service, ::ConnectionManager& manager, httpserver::HttpServer::IRequestHandler& handler ) :
+			socket_( std::move( socket ) ), connectionManager_( manager ), requestHandler_( handler ), pollTimer_( io_service )
 	{
 	}
 
@@ -565,6 +572,7 @@ namespace // unnamed namespace
 
 	void Connection::stop()
 	{
+		pollTimer_.cancel();
 		socket_.close();
 	}
 
@@ -582,7 +590,9 @@ namespace // unnamed namespace
 				if (result == ::RequestParser::good)
 				{
 					requestHandler_.handleRequest(request_, reply_);
-					do_write();
+					// Long polling replies have to wait until they're ready
+					if( reply_.poll ) do_poll();
+					else do_write();
 				}
 				else if (result == ::RequestParser::bad)
 				{
@@ -622,6 +632,33 @@ namespace // unnamed namespace
 	}
 
 
+	void Connection::do_poll()
+	{
+		auto self( shared_from_this() );
+		pollTimer_.expires_from_now( boost::posix_time::milliseconds( reply_.pollInterval.count() ) );
+		pollTimer_.async_wait( [this, self](boost::system::error_code ec)
+		{
+			// If the timer was cancelled the connection has been stopped, so there's nothing to do
+			if( ec ) return;
+
+			bool ready;
+			try{ ready=reply_.poll( reply_ ); }
+			catch( std::exception& error )
+			{
+				reply_=httpserver::HttpServer::Reply::stockReply( httpserver::HttpServer::Reply::internal_server_error );
+				ready=true;
+			}
+
+			if( ready )
+			{
+				reply_.poll=nullptr;
+				do_write();
+			}
+			else do_poll();
+		} );
+	}
+
+
 	//------------------------------------------------------------------------
 	//------------------------------------------------------------------------
 	//-------         Definitions for the RequestParser class        ---------
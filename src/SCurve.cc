@@ -1,15 +1,173 @@
 #include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SteadyClock.h"
 
 #include <cmath>
+#include <algorithm>
 #include <stdexcept>
 #include <sstream>
 #include <iostream>
 #include <iomanip>
+#include <limits>
+#include <numeric>
+#include <chrono>
+#include <atomic>
+#include <mutex>
+#include <thread>
+#include <exception>
 #include <TH1F.h>
 #include <TF1.h>
 #include <TMath.h>
 #include <TEfficiency.h>
 #include <TDirectory.h>
+#include <DataFormats/SiStripCommon/interface/ConstantsForHardwareSystems.h>
+
+namespace // Use the unnamed namespace for tools only used in this file
+{
+	/** @brief Returns the pointer at "index", growing the vector if necessary.
+	 *
+	 * Throws std::out_of_range with "errorMessage" if "index" is above "maximumIndex", so that a
+	 * bad number in a saved state can't make the vector enormous.
+	 */
+	template<class T>
+	std::unique_ptr<T>& getSlot( std::vector< std::unique_ptr<T> >& objects, size_t index, size_t maximumIndex, const char* errorMessage )
+	{
+		if( index>maximumIndex ) throw std::out_of_range( errorMessage );
+		if( index>=objects.size() ) objects.resize( index+1 );
+		return objects[index];
+	}
+
+	/** @brief Returns the object at "index", creating it if it doesn't exist. The limit is as for getSlot. */
+	template<class T>
+	T& getOrCreate( std::vector< std::unique_ptr<T> >& objects, size_t index, size_t maximumIndex, const char* errorMessage )
+	{
+		std::unique_ptr<T>& pObject=getSlot( objects, index, maximumIndex, errorMessage );
+		if( !pObject ) pObject.reset( new T );
+		return *pObject;
+	}
+
+	/** @brief Returns "value" as a uint32_t, or throws if it won't fit. */
+	uint32_t checkedUint32( size_t value, const char* errorMessage )
+	{
+		if( value>std::numeric_limits<uint32_t>::max() ) throw std::runtime_error( errorMessage );
+		return static_cast<uint32_t>(value);
+	}
+
+	/** @brief Returns the indices of all the non null entries. */
+	template<class T>
+	std::vector<size_t> validIndices( const std::vector< std::unique_ptr<T> >& objects )
+	{
+		std::vector<size_t> returnValue;
+		for( size_t index=0; index<objects.size(); ++index )
+		{
+			if( objects[index] ) returnValue.push_back( index );
+		}
+		return returnValue;
+	}
+
+	/** @brief Makes "destination" a deep copy of "source". */
+	template<class T>
+	void copyPointedTo( const std::vector< std::unique_ptr<T> >& source, std::vector< std::unique_ptr<T> >& destination )
+	{
+		destination.clear();
+		destination.resize( source.size() );
+		for( size_t index=0; index<source.size(); ++index )
+		{
+			if( source[index] ) destination[index].reset( new T( *source[index] ) );
+		}
+	}
+
+	/** @brief Calls "function" with the difference in fraction between each bin with events and the
+	 * previous bin with events, and the position midway between them in bins. */
+	template<class T>
+	void forEachDifference( const cbcanalyser::SCurveEntry* pEntries, size_t numberOfEntries, T function )
+	{
+		bool havePrevious=false;
+		size_t previousIndex=0;
+		double previousFraction=0;
+		for( size_t index=0; index<numberOfEntries; ++index )
+		{
+			if( pEntries[index].eventsOn()+pEntries[index].eventsOff()==0 ) continue;
+
+			double fraction=pEntries[index].fraction();
+			if( havePrevious ) function( fraction-previousFraction, 0.5*static_cast<double>(index+previousIndex) );
+			havePrevious=true;
+			previousIndex=index;
+			previousFraction=fraction;
+		}
+	}
+
+	/** @brief The function that FitSCurve fits, also used when the fit was done by SCurve::fit. */
+	const char* fitFunctionFormula="([0]*0.5)*( 1 + TMath::Erf( [1]*(x-[2])/TMath::Sqrt2() ) )";
+
+	/** @brief Converts an SCurve::Estimate, which is in bins, to parameters of the FitSCurve function on the
+	 * x axis of SCurve::createHistogram. */
+	void initialFitParameters( const cbcanalyser::SCurve::Estimate& estimate, size_t numberOfBins, double parameters[3] )
+	{
+		// The histograms run from -binWidth to 1+binWidth (see SCurve::createHistogram), so convert from bins to that axis
+		double binWidth=1.0/static_cast<double>(numberOfBins);
+		double spacing=(1.0+2*binWidth)/static_cast<double>(numberOfBins);
+		// A perfect step has no width, so don't go narrower than half a bin or the slope is infinite
+		double width=std::max( static_cast<double>(estimate.width), 0.5 )*spacing;
+
+		parameters[0]=std::min( static_cast<double>(estimate.plateau), 1.0 );
+		parameters[1]=estimate.direction/width;
+		parameters[2]=-binWidth+spacing*(estimate.mean+0.5);
+	}
+
+	/** @brief A bin used in SCurve::fit. */
+	struct FitPoint
+	{
+		double x;
+		double fraction;
+		double weight;
+	};
+
+	/** @brief The FitSCurve function at "x", with the derivatives with respect to each parameter put in "derivatives". */
+	double fitFunction( double x, const double parameters[3], double derivatives[3] )
+	{
+		const double distance=x-parameters[2];
+		const double z=parameters[1]*distance/std::sqrt(2.0);
+		const double turnOn=0.5*( 1+std::erf(z) );
+		const double gaussian=std::exp(-z*z)/std::sqrt(2*M_PI);
+		derivatives[0]=turnOn;
+		derivatives[1]=parameters[0]*gaussian*distance;
+		derivatives[2]=-parameters[0]*gaussian*parameters[1];
+		return parameters[0]*turnOn;
+	}
+
+	double chi2( const std::vector<FitPoint>& points, const double parameters[3] )
+	{
+		double derivatives[3];
+		double sum=0;
+		for( const auto& point : points )
+		{
+			double residual=point.fraction-fitFunction( point.x, parameters, derivatives );
+			sum+=point.weight*residual*residual;
+		}
+		return sum;
+	}
+
+	/** @brief Solves a 3x3 set of linear equations with Cramer's rule. Returns false if the matrix is singular. */
+	bool solve3x3( const double matrix[3][3], const double vector[3], double solution[3] )
+	{
+		auto determinant=[]( const double m[3][3] ){
+			return m[0][0]*(m[1][1]*m[2][2]-m[1][2]*m[2][1]) - m[0][1]*(m[1][0]*m[2][2]-m[1][2]*m[2][0]) + m[0][2]*(m[1][0]*m[2][1]-m[1][1]*m[2][0]);
+		};
+		const double denominator=determinant(matrix);
+		if( denominator==0 || !std::isfinite(denominator) ) return false;
+		for( size_t column=0; column<3; ++column )
+		{
+			double replaced[3][3];
+			for( size_t row=0; row<3; ++row )
+			{
+				for( size_t index=0; index<3; ++index ) replaced[row][index]=( index==column ? vector[row] : matrix[row][index] );
+			}
+			solution[column]=determinant(replaced)/denominator;
+		}
+		return true;
+	}
+
+} // end of the unnamed namespace
 
 //----------------------------------------------------------------------------------------------
 //------------------------- cbcanalyser::SCurveEntry definitions -------------------------------
@@ -21,22 +179,22 @@ cbcanalyser::SCurveEntry::SCurveEntry()
 	// No operation besides the initialiser list.
 }
 
-size_t& cbcanalyser::SCurveEntry::eventsOn()
+uint32_t& cbcanalyser::SCurveEntry::eventsOn()
 {
 	return eventsOn_;
 }
 
-const size_t& cbcanalyser::SCurveEntry::eventsOn() const
+const uint32_t& cbcanalyser::SCurveEntry::eventsOn() const
 {
 	return eventsOn_;
 }
 
-size_t& cbcanalyser::SCurveEntry::eventsOff()
+uint32_t& cbcanalyser::SCurveEntry::eventsOff()
 {
 	return eventsOff_;
 }
 
-const size_t& cbcanalyser::SCurveEntry::eventsOff() const
+const uint32_t& cbcanalyser::SCurveEntry::eventsOff() const
 {
 	return eventsOff_;
 }
@@ -44,13 +202,13 @@ const size_t& cbcanalyser::SCurveEntry::eventsOff() const
 float cbcanalyser::SCurveEntry::fraction() const
 {
 	if( (eventsOn_+eventsOff_)==0 ) return 0;
-	return static_cast<float>(eventsOn_)/static_cast<float>(eventsOn_+eventsOff_);
+	return static_cast<float>(eventsOn_)/( static_cast<float>(eventsOn_)+static_cast<float>(eventsOff_) );
 }
 
 float cbcanalyser::SCurveEntry::fractionError() const
 {
 	if( (eventsOn_+eventsOff_)==0 ) return 0;
-	return std::sqrt(eventsOn_)/static_cast<float>(eventsOn_+eventsOff_);
+	return std::sqrt(eventsOn_)/( static_cast<float>(eventsOn_)+static_cast<float>(eventsOff_) );
 }
 
 bool cbcanalyser::SCurveEntry::operator==( const SCurveEntry& otherSCurveEntry ) const
@@ -80,8 +238,11 @@ void cbcanalyser::SCurveEntry::restoreFromStream( std::istream& inputStream )
 
 	if( identifier!="SCE" ) throw std::runtime_error( "SCurveEntry::restoreFromStream - stream does not describe a SCurveEntry object" );
 
-	eventsOn_=eventsOn;
-	eventsOff_=eventsOff;
+	// Check both before changing either, so that a failure leaves this entry as it was
+	const uint32_t checkedEventsOn=checkedUint32( eventsOn, "SCurveEntry::restoreFromStream - the number of events on is too large for a uint32_t" );
+	const uint32_t checkedEventsOff=checkedUint32( eventsOff, "SCurveEntry::restoreFromStream - the number of events off is too large for a uint32_t" );
+	eventsOn_=checkedEventsOn;
+	eventsOff_=checkedEventsOff;
 }
 
 //----------------------------------------------------------------------------------------------
@@ -89,20 +250,78 @@ void cbcanalyser::SCurveEntry::restoreFromStream( std::istream& inputStream )
 //----------------------------------------------------------------------------------------------
 
 cbcanalyser::SCurve::SCurve( size_t numberOfEntries )
-	: entries_( numberOfEntries ), fit_maxEfficiency_(-1.), fit_standardDeviation_(-1), fit_mean_(-1)
+	: ownedEntries_( numberOfEntries ), pEntries_( ownedEntries_.data() ), numberOfEntries_( numberOfEntries ),
+	  fit_maxEfficiency_(-1.), fit_standardDeviation_(-1), fit_mean_(-1)
 {
 }
 
-bool cbcanalyser::SCurve::operator==( const SCurve& otherSCurve ) const
+cbcanalyser::SCurve::SCurve( cbcanalyser::SCurveEntry* pEntries, size_t numberOfEntries )
+	: pEntries_( pEntries ), numberOfEntries_( numberOfEntries ),
+	  fit_maxEfficiency_(-1.), fit_standardDeviation_(-1), fit_mean_(-1)
+{
+}
+
+cbcanalyser::SCurve::SCurve( const cbcanalyser::SCurve& otherSCurve )
+	: ownedEntries_( otherSCurve.pEntries_, otherSCurve.pEntries_+otherSCurve.numberOfEntries_ ),
+	  pEntries_( ownedEntries_.data() ), numberOfEntries_( otherSCurve.numberOfEntries_ ),
+	  fit_maxEfficiency_( otherSCurve.fit_maxEfficiency_ ), fit_standardDeviation_( otherSCurve.fit_standardDeviation_ ), fit_mean_( otherSCurve.fit_mean_ )
+{
+}
+
+cbcanalyser::SCurve::SCurve( cbcanalyser::SCurve&& otherSCurve ) noexcept
+	: ownedEntries_( std::move(otherSCurve.ownedEntries_) ), pEntries_( otherSCurve.pEntries_ ), numberOfEntries_( otherSCurve.numberOfEntries_ ),
+	  fit_maxEfficiency_( otherSCurve.fit_maxEfficiency_ ), fit_standardDeviation_( otherSCurve.fit_standardDeviation_ ), fit_mean_( otherSCurve.fit_mean_ )
 {
-	if( entries_.size()!=otherSCurve.entries_.size() ) return false;
+	// Moving a std::vector keeps the same buffer, so pEntries_ is still valid if otherSCurve owned its
+	// bins. Leave otherSCurve as a valid empty instance.
+	otherSCurve.pEntries_=nullptr;
+	otherSCurve.numberOfEntries_=0;
+}
 
-	for( size_t index=0; index<entries_.size(); ++index )
+cbcanalyser::SCurve& cbcanalyser::SCurve::operator=( const cbcanalyser::SCurve& otherSCurve )
+{
+	if( this==&otherSCurve ) return *this;
+
+	if( ownedEntries_.empty() && pEntries_!=nullptr )
+	{
+		// This is a view, so the bins can only be overwritten and not resized
+		if( numberOfEntries_!=otherSCurve.numberOfEntries_ ) throw std::runtime_error( "SCurve::operator= - can't change the number of bins of an SCurve that is part of a FedChannelSCurves" );
+	}
+	else
 	{
-		if( entries_[index]!=otherSCurve.entries_[index] ) return false;
+		ownedEntries_.resize( otherSCurve.numberOfEntries_ );
+		pEntries_=ownedEntries_.data();
+		numberOfEntries_=otherSCurve.numberOfEntries_;
 	}
+	std::copy( otherSCurve.pEntries_, otherSCurve.pEntries_+otherSCurve.numberOfEntries_, pEntries_ );
+
+	fit_maxEfficiency_=otherSCurve.fit_maxEfficiency_;
+	fit_standardDeviation_=otherSCurve.fit_standardDeviation_;
+	fit_mean_=otherSCurve.fit_mean_;
+	return *this;
+}
+
+cbcanalyser::SCurve& cbcanalyser::SCurve::operator=( cbcanalyser::SCurve&& otherSCurve )
+{
+	// Only take over the other bins if neither instance is a view, otherwise it's the same as a copy
+	const bool isView=( ownedEntries_.empty() && pEntries_!=nullptr );
+	const bool otherIsView=( otherSCurve.ownedEntries_.empty() && otherSCurve.pEntries_!=nullptr );
+	if( isView || otherIsView ) return (*this)=static_cast<const cbcanalyser::SCurve&>(otherSCurve);
+
+	ownedEntries_.swap( otherSCurve.ownedEntries_ );
+	std::swap( pEntries_, otherSCurve.pEntries_ );
+	std::swap( numberOfEntries_, otherSCurve.numberOfEntries_ );
+	fit_maxEfficiency_=otherSCurve.fit_maxEfficiency_;
+	fit_standardDeviation_=otherSCurve.fit_standardDeviation_;
+	fit_mean_=otherSCurve.fit_mean_;
+	return *this;
+}
+
+bool cbcanalyser::SCurve::operator==( const SCurve& otherSCurve ) const
+{
+	if( numberOfEntries_!=otherSCurve.numberOfEntries_ ) return false;
 
-	return true;
+	return std::equal( pEntries_, pEntries_+numberOfEntries_, otherSCurve.pEntries_ );
 }
 
 bool cbcanalyser::SCurve::operator!=( const SCurve& otherSCurve ) const
@@ -112,30 +331,32 @@ bool cbcanalyser::SCurve::operator!=( const SCurve& otherSCurve ) const
 
 cbcanalyser::SCurveEntry& cbcanalyser::SCurve::getEntry( size_t index )
 {
-	return entries_.at(index);
+	if( index>=numberOfEntries_ ) throw std::out_of_range( "SCurve::getEntry - index is out of range" );
+	return pEntries_[index];
 }
 
 const cbcanalyser::SCurveEntry& cbcanalyser::SCurve::getEntry( size_t index ) const
 {
-	return entries_.at(index);
+	if( index>=numberOfEntries_ ) throw std::out_of_range( "SCurve::getEntry - index is out of range" );
+	return pEntries_[index];
 }
 
 size_t cbcanalyser::SCurve::size() const
 {
-	return entries_.size();
+	return numberOfEntries_;
 }
 
 std::unique_ptr<TEfficiency> cbcanalyser::SCurve::createHistogram( const std::string& name ) const
 {
 	// Work out what bin width I need for the given number of entries so that the range
 	// runs from 0 to 1.
-	float binWidth=1.0/static_cast<float>(entries_.size());
+	float binWidth=1.0/static_cast<float>(numberOfEntries_);
 
 	// Make two TH1F to store all events and passed (on) events
-	TH1F hAll(name.c_str(),name.c_str(), entries_.size(), -binWidth, 1+binWidth);
-        TH1F hPass("Pass","Pass", entries_.size(), -binWidth, 1+binWidth);
+	TH1F hAll(name.c_str(),name.c_str(), numberOfEntries_, -binWidth, 1+binWidth);
+        TH1F hPass("Pass","Pass", numberOfEntries_, -binWidth, 1+binWidth);
 
-	for( size_t index=0; index<entries_.size(); ++index )
+	for( size_t index=0; index<numberOfEntries_; ++index )
 	{
 		const cbcanalyser::SCurveEntry& entry=getEntry(index);
 		hAll.SetBinContent( index+1, entry.eventsOn() + entry.eventsOff() );
@@ -148,6 +369,158 @@ std::unique_ptr<TEfficiency> cbcanalyser::SCurve::createHistogram( const std::st
 	return pNewHistogram;
 }
 
+cbcanalyser::SCurve::Estimate cbcanalyser::SCurve::estimateParameters() const
+{
+	// The differences are signed, so noise in the flat parts mostly cancels and the sign of the
+	// total says which way the curve goes. The first pass gets the sum and the mean.
+	double sumOfDifferences=0;
+	double sumOfPositions=0;
+	size_t numberOfDifferences=0;
+	::forEachDifference( pEntries_, numberOfEntries_, [&]( double difference, double position ){
+		sumOfDifferences+=difference;
+		sumOfPositions+=difference*position;
+		++numberOfDifferences;
+	} );
+
+	Estimate estimate;
+	estimate.isValid=( numberOfDifferences>0 && sumOfDifferences!=0 );
+	if( !estimate.isValid )
+	{
+		estimate.direction=1;
+		estimate.plateau=0;
+		estimate.mean=0;
+		estimate.width=0;
+		return estimate;
+	}
+	estimate.direction=( sumOfDifferences>0 ? 1 : -1 );
+	estimate.plateau=std::fabs(sumOfDifferences);
+	const double mean=sumOfPositions/sumOfDifferences;
+	estimate.mean=mean;
+
+	// The second pass gets the mean absolute deviation, which is sigma*sqrt(2/pi) for a Gaussian. The
+	// variance would weight noise far from the turn on by the distance squared, but with the absolute
+	// deviation noise in a bin only adds about its size times the gap between bins.
+	double sumOfDeviations=0;
+	::forEachDifference( pEntries_, numberOfEntries_, [&]( double difference, double position ){
+		sumOfDeviations+=difference*std::fabs(position-mean);
+	} );
+	const double width=std::sqrt(M_PI/2)*sumOfDeviations/sumOfDifferences;
+	estimate.width=( width>0 ? width : 0 );
+	return estimate;
+}
+
+cbcanalyser::SCurve::FitResult cbcanalyser::SCurve::fit() const
+{
+	FitResult result;
+	result.converged=false;
+	result.chi2=0;
+	result.ndf=0;
+
+	// Use the same x values and binomial weights as the histogram. Use (on+0.5)/(total+1) for the
+	// efficiency in the weight so that bins at 0% or 100% still count.
+	const double binWidth=1.0/static_cast<double>(numberOfEntries_);
+	const double spacing=(1.0+2*binWidth)/static_cast<double>(numberOfEntries_);
+	std::vector< ::FitPoint > points;
+	for( size_t index=0; index<numberOfEntries_; ++index )
+	{
+		const double eventsOn=pEntries_[index].eventsOn();
+		const double events=eventsOn+pEntries_[index].eventsOff();
+		if( events==0 ) continue;
+		const double smoothed=(eventsOn+0.5)/(events+1);
+		::FitPoint point={ -binWidth+spacing*(static_cast<double>(index)+0.5), eventsOn/events, events/(smoothed*(1-smoothed)) };
+		points.push_back( point );
+	}
+
+	double parameters[3]={ 1., 1.1, 0.5 }; // The same defaults as FitSCurve
+	const Estimate estimate=estimateParameters();
+	if( estimate.isValid ) ::initialFitParameters( estimate, numberOfEntries_, parameters );
+	result.plateau=parameters[0];
+	result.slope=parameters[1];
+	result.mean=parameters[2];
+	if( points.size()<=3 ) return result;
+	result.ndf=points.size()-3;
+
+	double currentChi2=::chi2( points, parameters );
+	double damping=1e-3;
+	for( size_t iteration=0; iteration<100; ++iteration )
+	{
+		double curvature[3][3]={ {0,0,0}, {0,0,0}, {0,0,0} };
+		double gradient[3]={ 0, 0, 0 };
+		double derivatives[3];
+		for( const auto& point : points )
+		{
+			double residual=point.fraction-::fitFunction( point.x, parameters, derivatives );
+			for( size_t row=0; row<3; ++row )
+			{
+				gradient[row]+=point.weight*derivatives[row]*residual;
+				for( size_t column=0; column<3; ++column ) curvature[row][column]+=point.weight*derivatives[row]*derivatives[column];
+			}
+		}
+		for( size_t row=0; row<3; ++row ) curvature[row][row]*=1+damping;
+
+		double step[3];
+		double trial[3];
+		double trialChi2=std::numeric_limits<double>::infinity();
+		if( ::solve3x3( curvature, gradient, step ) )
+		{
+			for( size_t index=0; index<3; ++index ) trial[index]=parameters[index]+step[index];
+			trial[0]=std::min( std::max( trial[0], 0.0 ), 1.0 ); // Limit the plateau like FitSCurve does
+			trialChi2=::chi2( points, trial );
+		}
+
+		if( trialChi2<=currentChi2 )
+		{
+			double relativeChange=(currentChi2-trialChi2)/std::max( currentChi2, 1e-12 );
+			std::copy( trial, trial+3, parameters );
+			currentChi2=trialChi2;
+			damping/=10;
+			if( relativeChange<1e-6 )
+			{
+				result.converged=true;
+				break;
+			}
+		}
+		else
+		{
+			damping*=10;
+			// If even tiny steps don't improve anything this is the minimum
+			if( damping>1e6 )
+			{
+				result.converged=true;
+				break;
+			}
+		}
+	}
+
+	result.plateau=parameters[0];
+	result.slope=parameters[1];
+	result.mean=parameters[2];
+	result.chi2=currentChi2;
+	return result;
+}
+
+void cbcanalyser::SCurve::merge( const cbcanalyser::SCurve& otherSCurve )
+{
+	if( numberOfEntries_!=otherSCurve.numberOfEntries_ ) throw std::runtime_error( "SCurve::merge - can't merge s-curves with different numbers of bins" );
+
+	// Check everything fits before changing anything
+	const uint32_t maximumCount=std::numeric_limits<uint32_t>::max();
+	for( size_t index=0; index<numberOfEntries_; ++index )
+	{
+		const cbcanalyser::SCurveEntry& otherEntry=otherSCurve.pEntries_[index];
+		if( otherEntry.eventsOn()>maximumCount-pEntries_[index].eventsOn() || otherEntry.eventsOff()>maximumCount-pEntries_[index].eventsOff() )
+		{
+			throw std::runtime_error( "SCurve::merge - the merged counts are too large for a uint32_t" );
+		}
+	}
+
+	for( size_t index=0; index<numberOfEntries_; ++index )
+	{
+		pEntries_[index].eventsOn()+=otherSCurve.pEntries_[index].eventsOn();
+		pEntries_[index].eventsOff()+=otherSCurve.pEntries_[index].eventsOff();
+	}
+}
+
 void cbcanalyser::SCurve::storeFitParameters( const TF1& fittedFunction )
 {
   if ( fittedFunction.GetNpar() != 3 ) {
@@ -161,10 +534,10 @@ void cbcanalyser::SCurve::storeFitParameters( const TF1& fittedFunction )
 
 void cbcanalyser::SCurve::dumpToStream( std::ostream& outputStream ) const
 {
-	outputStream << "SCurve " << entries_.size() << " ";
-	for( const auto& entry : entries_ )
+	outputStream << "SCurve " << numberOfEntries_ << " ";
+	for( size_t index=0; index<numberOfEntries_; ++index )
 	{
-		entry.dumpToStream(outputStream); // Then delegate to the SCurveEntry class
+		pEntries_[index].dumpToStream(outputStream); // Then delegate to the SCurveEntry class
 	}
 }
 
@@ -172,7 +545,7 @@ void cbcanalyser::SCurve::restoreFromStream( std::istream& inputStream )
 {
 	// Use a temporary object, so that if restoring fails I'm not left with a
 	// half modified instance.
-	cbcanalyser::SCurve temporaryInstance;
+	cbcanalyser::SCurve temporaryInstance( numberOfEntries_ );
 
 	std::string identifier;
 	inputStream >> identifier;
@@ -181,53 +554,167 @@ void cbcanalyser::SCurve::restoreFromStream( std::istream& inputStream )
 
 	size_t numberOfEntries;
 	inputStream >> numberOfEntries;
+	if( numberOfEntries>numberOfEntries_ ) throw std::runtime_error( "SCurve::restoreFromStream - stream has more entries than the SCurve" );
 
 	for( size_t entry=0; entry<numberOfEntries; ++entry )
 	{
 		// Delegate to each entry to restore its state from disk
-		temporaryInstance.entries_[entry].restoreFromStream(inputStream);
+		temporaryInstance.pEntries_[entry].restoreFromStream(inputStream);
 	}
 
 	// If everything went smoothly and I get to this point, I can overwrite the contents
 	// with what was read from disk.
-	(*this)=temporaryInstance;
+	(*this)=std::move(temporaryInstance);
 }
 
 size_t cbcanalyser::SCurve::maxiumumEntries()
 {
-	return entries_.size();
+	return numberOfEntries_;
 }
 
 //----------------------------------------------------------------------------------------------
 //----------------------- cbcanalyser::FedChannelSCurves definitions ---------------------------
 //----------------------------------------------------------------------------------------------
 
+const size_t cbcanalyser::FedChannelSCurves::defaultNumberOfStrips;
+
+cbcanalyser::FedChannelSCurves::FedChannelSCurves( size_t numberOfBins )
+	: numberOfBins_( numberOfBins )
+{
+	// No operation besides the initialiser list. Nothing is allocated until a strip is used.
+}
+
+cbcanalyser::FedChannelSCurves::FedChannelSCurves( const cbcanalyser::FedChannelSCurves& otherFedChannelSCurves )
+	: numberOfBins_( otherFedChannelSCurves.numberOfBins_ ), entries_( otherFedChannelSCurves.entries_ ), validStrips_( otherFedChannelSCurves.validStrips_ )
+{
+	// The views in otherFedChannelSCurves point to its own block, so need new ones for this block
+	createViews();
+}
+
+cbcanalyser::FedChannelSCurves::FedChannelSCurves( cbcanalyser::FedChannelSCurves&& otherFedChannelSCurves ) noexcept
+	: numberOfBins_( otherFedChannelSCurves.numberOfBins_ ), entries_( std::move(otherFedChannelSCurves.entries_) ),
+	  stripSCurves_( std::move(otherFedChannelSCurves.stripSCurves_) ), validStrips_( std::move(otherFedChannelSCurves.validStrips_) )
+{
+	// Moving a std::vector keeps the same buffer, so the views are still valid
+}
+
+cbcanalyser::FedChannelSCurves& cbcanalyser::FedChannelSCurves::operator=( const cbcanalyser::FedChannelSCurves& otherFedChannelSCurves )
+{
+	if( this==&otherFedChannelSCurves ) return *this;
+	numberOfBins_=otherFedChannelSCurves.numberOfBins_;
+	entries_=otherFedChannelSCurves.entries_;
+	validStrips_=otherFedChannelSCurves.validStrips_;
+	createViews();
+	return *this;
+}
+
+cbcanalyser::FedChannelSCurves& cbcanalyser::FedChannelSCurves::operator=( cbcanalyser::FedChannelSCurves&& otherFedChannelSCurves ) noexcept
+{
+	numberOfBins_=otherFedChannelSCurves.numberOfBins_;
+	entries_.swap( otherFedChannelSCurves.entries_ );
+	stripSCurves_.swap( otherFedChannelSCurves.stripSCurves_ );
+	validStrips_.swap( otherFedChannelSCurves.validStrips_ );
+	return *this;
+}
+
 cbcanalyser::SCurve& cbcanalyser::FedChannelSCurves::getStripSCurve( size_t stripNumber )
 {
+	useStrip( stripNumber );
 	return stripSCurves_[stripNumber];
 }
 
+const cbcanalyser::SCurve& cbcanalyser::FedChannelSCurves::getStripSCurve( size_t stripNumber ) const
+{
+	if( stripNumber>=validStrips_.size() || !validStrips_[stripNumber] ) throw std::out_of_range( "FedChannelSCurves::getStripSCurve - there's no s-curve for the strip" );
+	return stripSCurves_[stripNumber];
+}
+
+cbcanalyser::SCurveEntry& cbcanalyser::FedChannelSCurves::getEntry( size_t stripNumber, size_t bin )
+{
+	if( bin>=numberOfBins_ ) throw std::out_of_range( "FedChannelSCurves::getEntry - bin is out of range" );
+	useStrip( stripNumber );
+	return entries_[stripNumber*numberOfBins_+bin];
+}
+
+void cbcanalyser::FedChannelSCurves::addEvent( size_t bin, const uint64_t* pHitWords, size_t numberOfStrips )
+{
+	if( bin>=numberOfBins_ ) throw std::out_of_range( "FedChannelSCurves::addEvent - bin is out of range" );
+	if( numberOfStrips==0 ) return;
+
+	useStrip( numberOfStrips-1 );
+	std::fill( validStrips_.begin(), validStrips_.begin()+numberOfStrips, 1 );
+
+	// Step through the block a strip at a time, staying on the same bin
+	cbcanalyser::SCurveEntry* pEntry=&entries_[bin];
+	for( size_t firstStrip=0; firstStrip<numberOfStrips; firstStrip+=64 )
+	{
+		uint64_t word=pHitWords[firstStrip/64];
+		const size_t stripsInWord=std::min<size_t>( 64, numberOfStrips-firstStrip );
+		for( size_t bit=0; bit<stripsInWord; ++bit, word>>=1, pEntry+=numberOfBins_ )
+		{
+			// Branchless so that the pattern of hits doesn't matter
+			const uint32_t isOn=static_cast<uint32_t>( word & 1 );
+			pEntry->eventsOn()+=isOn;
+			pEntry->eventsOff()+=1-isOn;
+		}
+	}
+}
+
+size_t cbcanalyser::FedChannelSCurves::numberOfBins() const
+{
+	return numberOfBins_;
+}
+
 std::vector<size_t> cbcanalyser::FedChannelSCurves::getValidStripIndices() const
 {
 	std::vector<size_t> returnValue;
-	for( const auto& stripNumberSCurvesPair : stripSCurves_ ) returnValue.push_back( stripNumberSCurvesPair.first );
+	for( size_t stripNumber=0; stripNumber<validStrips_.size(); ++stripNumber )
+	{
+		if( validStrips_[stripNumber] ) returnValue.push_back( stripNumber );
+	}
 	return returnValue;
 }
 
+void cbcanalyser::FedChannelSCurves::useStrip( size_t stripNumber )
+{
+	if( stripNumber>=validStrips_.size() )
+	{
+		// Allocate the whole block in one go the first time, and double it if it ever needs to grow
+		size_t numberOfStrips=std::max( defaultNumberOfStrips, 2*validStrips_.size() );
+		if( numberOfStrips<=stripNumber ) numberOfStrips=stripNumber+1;
+
+		entries_.resize( numberOfStrips*numberOfBins_ );
+		validStrips_.resize( numberOfStrips, false );
+		createViews();
+	}
+	validStrips_[stripNumber]=true;
+}
+
+void cbcanalyser::FedChannelSCurves::createViews()
+{
+	stripSCurves_.clear();
+	stripSCurves_.reserve( validStrips_.size() );
+	for( size_t stripNumber=0; stripNumber<validStrips_.size(); ++stripNumber )
+	{
+		stripSCurves_.push_back( cbcanalyser::SCurve( &entries_[stripNumber*numberOfBins_], numberOfBins_ ) );
+	}
+}
+
 void cbcanalyser::FedChannelSCurves::createHistograms( TDirectory* pParentDirectory ) const
 {
 	std::stringstream stringConverter;
 
-	for( const auto& stripNumberSCurvesPair : stripSCurves_ )
+	for( const auto stripNumber : getValidStripIndices() )
 	{
 		stringConverter.str("");
-		stringConverter << "Strip " << std::setfill('0') << std::setw(2) << stripNumberSCurvesPair.first;
+		stringConverter << "Strip " << std::setfill('0') << std::setw(2) << stripNumber;
 
-		std::unique_ptr<TEfficiency> pNewHistogram=stripNumberSCurvesPair.second.createHistogram( stringConverter.str() );
+		std::unique_ptr<TEfficiency> pNewHistogram=stripSCurves_[stripNumber].createHistogram( stringConverter.str() );
 		pNewHistogram->SetDirectory( pParentDirectory );
 
-		// Fit this S-Curve
+		// Fit this S-Curve, starting from the quick estimate
 		cbcanalyser::FitSCurve fit( *pNewHistogram, stringConverter.str() );
+		fit.setInitialParameters( stripSCurves_[stripNumber].estimateParameters(), numberOfBins_ );
 		std::unique_ptr<TF1> pNewFittedFunction=fit.performFit();
 
 		// Set current directory and write fitted function
@@ -240,13 +727,58 @@ void cbcanalyser::FedChannelSCurves::createHistograms( TDirectory* pParentDirect
 
 }
 
+std::vector<cbcanalyser::SCurve::FitResult> cbcanalyser::FedChannelSCurves::fitStrips() const
+{
+	std::vector<cbcanalyser::SCurve::FitResult> fitResults;
+	for( const auto stripNumber : getValidStripIndices() ) fitResults.push_back( stripSCurves_[stripNumber].fit() );
+	return fitResults;
+}
+
+void cbcanalyser::FedChannelSCurves::createHistograms( TDirectory* pParentDirectory, const std::vector<cbcanalyser::SCurve::FitResult>& fitResults ) const
+{
+	const std::vector<size_t> stripNumbers=getValidStripIndices();
+	if( fitResults.size()!=stripNumbers.size() ) throw std::runtime_error( "FedChannelSCurves::createHistograms - the number of fit results doesn't match the number of strips" );
+
+	std::stringstream stringConverter;
+	for( size_t index=0; index<stripNumbers.size(); ++index )
+	{
+		stringConverter.str("");
+		stringConverter << "Strip " << std::setfill('0') << std::setw(2) << stripNumbers[index];
+
+		std::unique_ptr<TEfficiency> pNewHistogram=stripSCurves_[stripNumbers[index]].createHistogram( stringConverter.str() );
+		pNewHistogram->SetDirectory( pParentDirectory );
+
+		// Write the function with the parameters already fitted, named the same as FitSCurve would
+		std::unique_ptr<TF1> pNewFittedFunction( new TF1( TString(stringConverter.str()+"_fittedFunction"), ::fitFunctionFormula, 0, 1 ) );
+		pNewFittedFunction->SetParameters( fitResults[index].plateau, fitResults[index].slope, fitResults[index].mean );
+		pNewFittedFunction->SetChisquare( fitResults[index].chi2 );
+		pNewFittedFunction->SetNDF( fitResults[index].ndf );
+		pParentDirectory->cd();
+		pNewFittedFunction->Write();
+
+		pNewHistogram.release(); // When the directory gets set, the directory takes ownership
+		pNewFittedFunction.release();
+	}
+}
+
+void cbcanalyser::FedChannelSCurves::merge( const cbcanalyser::FedChannelSCurves& otherFedChannelSCurves )
+{
+	if( numberOfBins_!=otherFedChannelSCurves.numberOfBins_ ) throw std::runtime_error( "FedChannelSCurves::merge - can't merge channels with different numbers of bins" );
+
+	for( const auto stripNumber : otherFedChannelSCurves.getValidStripIndices() )
+	{
+		getStripSCurve( stripNumber ).merge( otherFedChannelSCurves.stripSCurves_[stripNumber] );
+	}
+}
+
 void cbcanalyser::FedChannelSCurves::dumpToStream( std::ostream& outputStream ) const
 {
-	outputStream << "FedChannelSCurves " << stripSCurves_.size() << " ";
-	for( const auto& stripNumberSCurvesPair : stripSCurves_ )
+	const std::vector<size_t> stripNumbers=getValidStripIndices();
+	outputStream << "FedChannelSCurves " << stripNumbers.size() << " ";
+	for( const auto stripNumber : stripNumbers )
 	{
-		outputStream << stripNumberSCurvesPair.first << " "; // Dump the strip number
-		stripNumberSCurvesPair.second.dumpToStream(outputStream); // Then delegate to the SCurve class
+		outputStream << stripNumber << " "; // Dump the strip number
+		stripSCurves_[stripNumber].dumpToStream(outputStream); // Then delegate to the SCurve class
 	}
 }
 
@@ -254,7 +786,7 @@ void cbcanalyser::FedChannelSCurves::restoreFromStream( std::istream& inputStrea
 {
 	// Use a temporary object, so that if restoring fails I'm not left with a
 	// half modified instance.
-	cbcanalyser::FedChannelSCurves temporaryInstance;
+	cbcanalyser::FedChannelSCurves temporaryInstance( numberOfBins_ );
 
 	std::string identifier;
 	inputStream >> identifier;
@@ -276,7 +808,7 @@ void cbcanalyser::FedChannelSCurves::restoreFromStream( std::istream& inputStrea
 
 	// If everything went smoothly and I get to this point, I can overwrite the contents
 	// with what was read from disk.
-	(*this)=temporaryInstance;
+	(*this)=std::move(temporaryInstance);
 }
 
 //----------------------------------------------------------------------------------------------
@@ -286,14 +818,24 @@ void cbcanalyser::FedChannelSCurves::restoreFromStream( std::istream& inputStrea
 cbcanalyser::FitSCurve::FitSCurve( TEfficiency & sCurve, const std::string& name )
         : sCurveToFit_(sCurve)
 {
-  fitFunction_ = new TF1(TString(name+"_fittedFunction"), "([0]*0.5)*( 1 + TMath::Erf( [1]*(x-[2])/TMath::Sqrt2() ) )", 0, 1 );
+  fitFunction_ = new TF1(TString(name+"_fittedFunction"), ::fitFunctionFormula, 0, 1 );
+  // Default initial parameters, in case setInitialParameters isn't called
+  initialParameters_[0]=1.;
+  initialParameters_[1]=1.1;
+  initialParameters_[2]=0.5;
+}
+
+void cbcanalyser::FitSCurve::setInitialParameters( const SCurve::Estimate& estimate, size_t numberOfBins )
+{
+  if( !estimate.isValid || numberOfBins==0 ) return;
+  ::initialFitParameters( estimate, numberOfBins, initialParameters_ );
 }
 
 std::unique_ptr<TF1> cbcanalyser::FitSCurve::performFit() const
 {
 //   Define fit function and set initial parameters
   std::unique_ptr<TF1> pFitFunction(fitFunction_);
-  pFitFunction->SetParameters(1., 1.1, 0.5); // Set initial parameters
+  pFitFunction->SetParameters( initialParameters_[0], initialParameters_[1], initialParameters_[2] );
   pFitFunction->SetParLimits(0,0,1); // Limit range of p0 to be between 0 and 1
   // Do the fit
   sCurveToFit_.Fit(pFitFunction.get());
@@ -304,45 +846,84 @@ std::unique_ptr<TF1> cbcanalyser::FitSCurve::performFit() const
 //-------------------------- cbcanalyser::FedSCurves definitions -------------------------------
 //----------------------------------------------------------------------------------------------
 
+cbcanalyser::FedSCurves::FedSCurves()
+{
+	// No operation
+}
+
+cbcanalyser::FedSCurves::FedSCurves( const cbcanalyser::FedSCurves& otherFedSCurves )
+{
+	copyPointedTo( otherFedSCurves.fedChannelSCurves_, fedChannelSCurves_ );
+}
+
+cbcanalyser::FedSCurves::FedSCurves( cbcanalyser::FedSCurves&& otherFedSCurves ) noexcept
+	: fedChannelSCurves_( std::move(otherFedSCurves.fedChannelSCurves_) )
+{
+	// No operation besides the initialiser list.
+}
+
+cbcanalyser::FedSCurves& cbcanalyser::FedSCurves::operator=( cbcanalyser::FedSCurves otherFedSCurves )
+{
+	fedChannelSCurves_.swap( otherFedSCurves.fedChannelSCurves_ );
+	return *this;
+}
+
 cbcanalyser::FedChannelSCurves& cbcanalyser::FedSCurves::getFedChannelSCurves( size_t fedChannelNumber )
 {
-	return fedChannelSCurves_[fedChannelNumber];
+	return getOrCreate( fedChannelSCurves_, fedChannelNumber, sistrip::FEDCH_PER_FED-1, "FedSCurves::getFedChannelSCurves - the FED channel number is too large" );
+}
+
+const cbcanalyser::FedChannelSCurves& cbcanalyser::FedSCurves::getFedChannelSCurves( size_t fedChannelNumber ) const
+{
+	if( fedChannelNumber>=fedChannelSCurves_.size() || !fedChannelSCurves_[fedChannelNumber] ) throw std::out_of_range( "FedSCurves::getFedChannelSCurves - there's no data for the channel" );
+	return *fedChannelSCurves_[fedChannelNumber];
 }
 
 cbcanalyser::SCurve& cbcanalyser::FedSCurves::getStripSCurve( size_t fedChannelNumber, size_t stripNumber )
 {
-	return fedChannelSCurves_[fedChannelNumber].getStripSCurve(stripNumber);
+	return getFedChannelSCurves(fedChannelNumber).getStripSCurve(stripNumber);
 }
 
 std::vector<size_t> cbcanalyser::FedSCurves::getValidChannelIndices() const
 {
-	std::vector<size_t> returnValue;
-	for( const auto& fedChannelNumberSCurvesPair : fedChannelSCurves_ ) returnValue.push_back( fedChannelNumberSCurvesPair.first );
-	return returnValue;
+	return validIndices( fedChannelSCurves_ );
 }
 
 void cbcanalyser::FedSCurves::createHistograms( TDirectory* pParentDirectory ) const
 {
 	std::stringstream stringConverter;
 
-	for( const auto& fedChannelNumberSCurvesPair : fedChannelSCurves_ )
+	for( const auto fedChannelNumber : getValidChannelIndices() )
 	{
 		stringConverter.str("");
-		stringConverter << "Channel " << std::setfill('0') << std::setw(2) << fedChannelNumberSCurvesPair.first;
+		stringConverter << "Channel " << std::setfill('0') << std::setw(2) << fedChannelNumber;
 
 		TDirectory* pSubDirectory=pParentDirectory->mkdir( stringConverter.str().c_str() );
-		fedChannelNumberSCurvesPair.second.createHistograms( pSubDirectory );
+		fedChannelSCurves_[fedChannelNumber]->createHistograms( pSubDirectory );
 	}
 
 }
 
+void cbcanalyser::FedSCurves::merge( const cbcanalyser::FedSCurves& otherFedSCurves )
+{
+	for( const auto fedChannelNumber : otherFedSCurves.getValidChannelIndices() )
+	{
+		const cbcanalyser::FedChannelSCurves& otherFedChannelSCurves=*otherFedSCurves.fedChannelSCurves_[fedChannelNumber];
+		std::unique_ptr<cbcanalyser::FedChannelSCurves>& pFedChannelSCurves=getSlot( fedChannelSCurves_, fedChannelNumber, sistrip::FEDCH_PER_FED-1, "FedSCurves::merge - the FED channel number is too large" );
+		// Copy channels this doesn't have, so that they keep their number of bins
+		if( !pFedChannelSCurves ) pFedChannelSCurves.reset( new cbcanalyser::FedChannelSCurves( otherFedChannelSCurves ) );
+		else pFedChannelSCurves->merge( otherFedChannelSCurves );
+	}
+}
+
 void cbcanalyser::FedSCurves::dumpToStream( std::ostream& outputStream ) const
 {
-	outputStream << "FedSCurves " << fedChannelSCurves_.size() << " ";
-	for( const auto& fedChannelNumberSCurvesPair : fedChannelSCurves_ )
+	const std::vector<size_t> fedChannelNumbers=getValidChannelIndices();
+	outputStream << "FedSCurves " << fedChannelNumbers.size() << " ";
+	for( const auto fedChannelNumber : fedChannelNumbers )
 	{
-		outputStream << fedChannelNumberSCurvesPair.first << " "; // Dump the FED channel number
-		fedChannelNumberSCurvesPair.second.dumpToStream(outputStream); // Then delegate to the FedSCurves class
+		outputStream << fedChannelNumber << " "; // Dump the FED channel number
+		fedChannelSCurves_[fedChannelNumber]->dumpToStream(outputStream); // Then delegate to the FedChannelSCurves class
 	}
 }
 
@@ -372,57 +953,173 @@ void cbcanalyser::FedSCurves::restoreFromStream( std::istream& inputStream )
 
 	// If everything went smoothly and I get to this point, I can overwrite the contents
 	// with what was read from disk.
-	(*this)=temporaryInstance;
+	(*this)=std::move(temporaryInstance);
 }
 
 //----------------------------------------------------------------------------------------------
 //------------------------ cbcanalyser::DetectorSCurves definitions ----------------------------
 //----------------------------------------------------------------------------------------------
 
+cbcanalyser::DetectorSCurves::DetectorSCurves()
+{
+	// No operation
+}
+
+cbcanalyser::DetectorSCurves::DetectorSCurves( const cbcanalyser::DetectorSCurves& otherDetectorSCurves )
+{
+	copyPointedTo( otherDetectorSCurves.fedSCurves_, fedSCurves_ );
+}
+
+cbcanalyser::DetectorSCurves::DetectorSCurves( cbcanalyser::DetectorSCurves&& otherDetectorSCurves ) noexcept
+	: fedSCurves_( std::move(otherDetectorSCurves.fedSCurves_) )
+{
+	// No operation besides the initialiser list.
+}
+
+cbcanalyser::DetectorSCurves& cbcanalyser::DetectorSCurves::operator=( cbcanalyser::DetectorSCurves otherDetectorSCurves )
+{
+	fedSCurves_.swap( otherDetectorSCurves.fedSCurves_ );
+	return *this;
+}
+
 cbcanalyser::FedSCurves& cbcanalyser::DetectorSCurves::getFedSCurves( size_t fedNumber )
 {
-	return fedSCurves_[fedNumber];
+	return getOrCreate( fedSCurves_, fedNumber, sistrip::FED_ID_MAX, "DetectorSCurves::getFedSCurves - the FED number is too large" );
+}
+
+const cbcanalyser::FedSCurves& cbcanalyser::DetectorSCurves::getFedSCurves( size_t fedNumber ) const
+{
+	if( fedNumber>=fedSCurves_.size() || !fedSCurves_[fedNumber] ) throw std::out_of_range( "DetectorSCurves::getFedSCurves - there's no data for the FED" );
+	return *fedSCurves_[fedNumber];
 }
 
 cbcanalyser::FedChannelSCurves& cbcanalyser::DetectorSCurves::getFedChannelSCurves( size_t fedNumber, size_t fedChannelNumber )
 {
-	return fedSCurves_[fedNumber].getFedChannelSCurves(fedChannelNumber);
+	return getFedSCurves(fedNumber).getFedChannelSCurves(fedChannelNumber);
 }
 
 cbcanalyser::SCurve& cbcanalyser::DetectorSCurves::getStripSCurve( size_t fedNumber, size_t fedChannelNumber, size_t stripNumber )
 {
-	return fedSCurves_[fedNumber].getStripSCurve(fedChannelNumber,stripNumber);
+	return getFedSCurves(fedNumber).getStripSCurve(fedChannelNumber,stripNumber);
 }
 
 std::vector<size_t> cbcanalyser::DetectorSCurves::getValidFedIndices() const
 {
-	std::vector<size_t> returnValue;
-	for( const auto& fedNumberSCurvesPair : fedSCurves_ ) returnValue.push_back( fedNumberSCurvesPair.first );
-	return returnValue;
+	return validIndices( fedSCurves_ );
 }
 
 void cbcanalyser::DetectorSCurves::createHistograms( TDirectory* pParentDirectory ) const
 {
 	std::stringstream stringConverter;
 
-	for( const auto& fedNumberSCurvesPair : fedSCurves_ )
+	for( const auto fedNumber : getValidFedIndices() )
 	{
 		stringConverter.str("");
-		stringConverter << "FED " << std::setfill('0') << std::setw(2) << fedNumberSCurvesPair.first;
+		stringConverter << "FED " << std::setfill('0') << std::setw(2) << fedNumber;
 
 		TDirectory* pSubDirectory=pParentDirectory->mkdir( stringConverter.str().c_str() );
-		fedNumberSCurvesPair.second.createHistograms( pSubDirectory );
+		fedSCurves_[fedNumber]->createHistograms( pSubDirectory );
+	}
+
+}
+
+cbcanalyser::DetectorSCurves::HistogramTiming cbcanalyser::DetectorSCurves::createHistograms( TDirectory* pParentDirectory, size_t numberOfThreads ) const
+{
+	typedef cbcanalyser::SteadyClock Clock;
+	auto secondsSince=[]( Clock::time_point startTime ){ return std::chrono::duration_cast< std::chrono::duration<double> >( Clock::now()-startTime ).count(); };
+
+	// Make a list of every channel in the order the single threaded version would write them
+	std::vector< std::pair<size_t,size_t> > channels;
+	for( const auto fedNumber : getValidFedIndices() )
+	{
+		for( const auto fedChannelNumber : fedSCurves_[fedNumber]->getValidChannelIndices() ) channels.push_back( std::make_pair( fedNumber, fedChannelNumber ) );
+	}
+
+	HistogramTiming timing;
+	timing.numberOfChannels=channels.size();
+	timing.numberOfThreads=std::max<size_t>( 1, std::min( numberOfThreads, channels.size() ) );
+
+	//
+	// Fit every channel, with each thread taking the next task from the list until there are none left
+	//
+	Clock::time_point startTime=Clock::now();
+	std::vector< std::vector<cbcanalyser::SCurve::FitResult> > fitResults( channels.size() );
+	std::vector<double> taskSeconds( channels.size() );
+	std::atomic<size_t> nextTask( 0 );
+	std::exception_ptr pFirstError;
+	std::mutex errorMutex;
+	auto worker=[&](){
+		for( size_t task=nextTask++; task<channels.size(); task=nextTask++ )
+		{
+			try
+			{
+				Clock::time_point taskStartTime=Clock::now();
+				fitResults[task]=fedSCurves_[channels[task].first]->getFedChannelSCurves( channels[task].second ).fitStrips();
+				taskSeconds[task]=secondsSince( taskStartTime );
+			}
+			catch( ... )
+			{
+				std::lock_guard<std::mutex> lock( errorMutex );
+				if( !pFirstError ) pFirstError=std::current_exception();
+			}
+		}
+	};
+	std::vector<std::thread> threads;
+	for( size_t index=1; index<timing.numberOfThreads; ++index ) threads.push_back( std::thread( worker ) );
+	worker(); // This thread helps out too
+	for( auto& thread : threads ) thread.join();
+	if( pFirstError ) std::rethrow_exception( pFirstError );
+	timing.fittingSeconds=secondsSince( startTime );
+	timing.summedFittingSeconds=std::accumulate( taskSeconds.begin(), taskSeconds.end(), 0.0 );
+
+	//
+	// Then create all the ROOT objects in this thread, in order
+	//
+	startTime=Clock::now();
+	std::stringstream stringConverter;
+	TDirectory* pFedDirectory=nullptr;
+	for( size_t task=0; task<channels.size(); ++task )
+	{
+		if( task==0 || channels[task].first!=channels[task-1].first )
+		{
+			stringConverter.str("");
+			stringConverter << "FED " << std::setfill('0') << std::setw(2) << channels[task].first;
+			pFedDirectory=pParentDirectory->mkdir( stringConverter.str().c_str() );
+		}
+		stringConverter.str("");
+		stringConverter << "Channel " << std::setfill('0') << std::setw(2) << channels[task].second;
+		TDirectory* pChannelDirectory=pFedDirectory->mkdir( stringConverter.str().c_str() );
+		fedSCurves_[channels[task].first]->getFedChannelSCurves( channels[task].second ).createHistograms( pChannelDirectory, fitResults[task] );
+	}
+	timing.writingSeconds=secondsSince( startTime );
+
+	return timing;
+}
+
+void cbcanalyser::DetectorSCurves::merge( const cbcanalyser::DetectorSCurves& otherDetectorSCurves )
+{
+	// Merge into a copy, so that if anything doesn't match I'm not left with a half merged instance
+	cbcanalyser::DetectorSCurves temporaryInstance( *this );
+
+	for( const auto fedNumber : otherDetectorSCurves.getValidFedIndices() )
+	{
+		const cbcanalyser::FedSCurves& otherFedSCurves=*otherDetectorSCurves.fedSCurves_[fedNumber];
+		std::unique_ptr<cbcanalyser::FedSCurves>& pFedSCurves=getSlot( temporaryInstance.fedSCurves_, fedNumber, sistrip::FED_ID_MAX, "DetectorSCurves::merge - the FED number is too large" );
+		if( !pFedSCurves ) pFedSCurves.reset( new cbcanalyser::FedSCurves( otherFedSCurves ) );
+		else pFedSCurves->merge( otherFedSCurves );
 	}
 
+	(*this)=std::move(temporaryInstance);
 }
 
 void cbcanalyser::DetectorSCurves::dumpToStream( std::ostream& outputStream ) const
 {
-	outputStream << "DetectorSCurves " << fedSCurves_.size() << " ";
-	for( const auto& fedNumberSCurvesPair : fedSCurves_ )
+	const std::vector<size_t> fedNumbers=getValidFedIndices();
+	outputStream << "DetectorSCurves " << fedNumbers.size() << " ";
+	for( const auto fedNumber : fedNumbers )
 	{
-		outputStream << fedNumberSCurvesPair.first << " "; // Dump the FED number
-		fedNumberSCurvesPair.second.dumpToStream(outputStream); // Then delegate to the FedSCurves class
+		outputStream << fedNumber << " "; // Dump the FED number
+		fedSCurves_[fedNumber]->dumpToStream(outputStream); // Then delegate to the FedSCurves class
 	}
 }
 
@@ -452,5 +1149,5 @@ void cbcanalyser::DetectorSCurves::restoreFromStream( std::istream& inputStream
 
 	// If everything went smoothly and I get to this point, I can overwrite the contents
 	// with what was read from disk.
-	(*this)=temporaryInstance;
+	(*this)=std::move(temporaryInstance);
 }
@@ -0,0 +1,278 @@
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SCurveSnapshot.h"
+
+#include <cstdio>
+#include <cstring>
+#include <limits>
+#include <stdexcept>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
+
+namespace // Use the unnamed namespace for tools only used in this file
+{
+	const char snapshotMagic[8]={ 'C', 'B', 'C', 'S', 'N', 'A', 'P', '\0' };
+	const uint32_t byteOrderMark=0x01020304;
+
+	struct SnapshotHeader
+	{
+		char magic[8];
+		uint32_t version;
+		uint32_t byteOrderMark;
+		uint32_t headerSize;
+		uint32_t numberOfChannels;
+		uint32_t numberOfStripThresholdOffsets;
+		uint32_t reserved;
+		uint64_t eventsProcessed;
+		uint64_t runsProcessed;
+	};
+
+	struct SnapshotChannelRecord
+	{
+		uint32_t fedNumber;
+		uint32_t fedChannel;
+		uint32_t numberOfStrips;
+		uint32_t numberOfBins;
+		uint64_t dataOffset;
+	};
+
+	static_assert( sizeof(SnapshotHeader)==48, "SnapshotHeader isn't packed the way the file format expects" );
+	static_assert( sizeof(SnapshotChannelRecord)==24, "SnapshotChannelRecord isn't packed the way the file format expects" );
+
+	/** @brief Rounds up to the next multiple of 8, since every block in the file is 8 byte aligned. */
+	uint64_t padded( uint64_t size ) { return (size+7) & ~static_cast<uint64_t>(7); }
+
+	uint32_t checkedUint32( size_t value, const char* description )
+	{
+		if( value>std::numeric_limits<uint32_t>::max() ) throw std::runtime_error( std::string("SCurveSnapshot - ")+description+" is too large to store" );
+		return static_cast<uint32_t>(value);
+	}
+
+	/** @brief Closes the FILE as soon as it goes out of scope, and deletes the file if it wasn't finished.
+	 *
+	 * Used as an exception safe way to write the temporary file.
+	 */
+	class TemporaryFileSentry
+	{
+	public:
+		TemporaryFileSentry( const std::string& filename ) : filename_(filename), pFile_( std::fopen( filename.c_str(), "wb" ) ), finished_(false) {}
+		~TemporaryFileSentry()
+		{
+			if( pFile_ ) std::fclose( pFile_ );
+			if( !finished_ ) std::remove( filename_.c_str() );
+		}
+		std::FILE* file() { return pFile_; }
+		void write( const void* pData, size_t size )
+		{
+			if( size>0 && std::fwrite( pData, size, 1, pFile_ )!=1 ) throw std::runtime_error( "SCurveSnapshot - unable to write to \""+filename_+"\"" );
+		}
+		void pad( uint64_t size )
+		{
+			static const char zeros[8]={0};
+			write( zeros, padded(size)-size );
+		}
+		/** @brief Flushes everything to disk and closes the file. */
+		void close()
+		{
+			if( std::fflush( pFile_ )!=0 || ::fsync( fileno(pFile_) )!=0 ) throw std::runtime_error( "SCurveSnapshot - unable to flush \""+filename_+"\"" );
+			int result=std::fclose( pFile_ );
+			pFile_=nullptr;
+			if( result!=0 ) throw std::runtime_error( "SCurveSnapshot - unable to close \""+filename_+"\"" );
+		}
+		void setFinished() { finished_=true; }
+	private:
+		std::string filename_;
+		std::FILE* pFile_;
+		bool finished_;
+	};
+
+	/** @brief Maps a file read only into memory for as long as it's in scope.
+	 */
+	class MappedFile
+	{
+	public:
+		MappedFile( const std::string& filename ) : pData_(nullptr), size_(0)
+		{
+			int fileDescriptor=::open( filename.c_str(), O_RDONLY );
+			if( fileDescriptor<0 ) throw std::runtime_error( "SCurveSnapshot - unable to open \""+filename+"\"" );
+			struct stat fileStatus;
+			if( ::fstat( fileDescriptor, &fileStatus )!=0 )
+			{
+				::close( fileDescriptor );
+				throw std::runtime_error( "SCurveSnapshot - unable to get the size of \""+filename+"\"" );
+			}
+			size_=fileStatus.st_size;
+			if( size_>0 ) pData_=::mmap( nullptr, size_, PROT_READ, MAP_PRIVATE, fileDescriptor, 0 );
+			::close( fileDescriptor ); // The mapping stays valid after the file is closed
+			if( pData_==MAP_FAILED )
+			{
+				pData_=nullptr;
+				throw std::runtime_error( "SCurveSnapshot - unable to map \""+filename+"\" into memory" );
+			}
+		}
+		~MappedFile() { if( pData_ ) ::munmap( pData_, size_ ); }
+		/** @brief Returns a pointer "offset" bytes into the file, checking that "size" bytes from there are inside the file. */
+		const char* at( uint64_t offset, uint64_t size ) const
+		{
+			if( offset>size_ || size>size_-offset ) throw std::runtime_error( "SCurveSnapshot - file is truncated" );
+			return static_cast<const char*>(pData_)+offset;
+		}
+	private:
+		void* pData_;
+		uint64_t size_;
+	};
+
+} // end of the unnamed namespace
+
+cbcanalyser::SCurveSnapshot::SCurveSnapshot()
+	: eventsProcessed(0), runsProcessed(0)
+{
+	// No operation besides the initialiser list.
+}
+
+bool cbcanalyser::SCurveSnapshot::isSnapshotFile( const std::string& filename )
+{
+	char magic[sizeof(snapshotMagic)];
+	std::FILE* pFile=std::fopen( filename.c_str(), "rb" );
+	if( !pFile ) return false;
+	bool isSnapshot=( std::fread( magic, sizeof(magic), 1, pFile )==1 && std::memcmp( magic, snapshotMagic, sizeof(magic) )==0 );
+	std::fclose( pFile );
+	return isSnapshot;
+}
+
+void cbcanalyser::SCurveSnapshot::write( const std::string& filename, const cbcanalyser::DetectorSCurves& detectorSCurves ) const
+{
+	//
+	// First work out the layout, so that the channel table can be written before the data
+	//
+	struct ChannelToWrite
+	{
+		SnapshotChannelRecord record;
+		const cbcanalyser::FedChannelSCurves* pSCurves;
+		std::vector<size_t> stripNumbers;
+	};
+	std::vector<ChannelToWrite> channels;
+	for( const auto fedNumber : detectorSCurves.getValidFedIndices() )
+	{
+		const cbcanalyser::FedSCurves& fedSCurves=detectorSCurves.getFedSCurves(fedNumber);
+		for( const auto fedChannel : fedSCurves.getValidChannelIndices() )
+		{
+			ChannelToWrite channel;
+			channel.pSCurves=&fedSCurves.getFedChannelSCurves(fedChannel);
+			channel.stripNumbers=channel.pSCurves->getValidStripIndices();
+			channel.record.fedNumber=checkedUint32( fedNumber, "FED number" );
+			channel.record.fedChannel=checkedUint32( fedChannel, "FED channel" );
+			channel.record.numberOfStrips=checkedUint32( channel.stripNumbers.size(), "number of strips" );
+			channel.record.numberOfBins=0;
+			if( !channel.stripNumbers.empty() ) channel.record.numberOfBins=checkedUint32( channel.pSCurves->getStripSCurve(channel.stripNumbers.front()).size(), "number of bins" );
+			channels.push_back( channel );
+		}
+	}
+
+	SnapshotHeader header;
+	std::memcpy( header.magic, snapshotMagic, sizeof(snapshotMagic) );
+	header.version=version;
+	header.byteOrderMark=byteOrderMark;
+	header.headerSize=sizeof(SnapshotHeader);
+	header.numberOfChannels=checkedUint32( channels.size(), "number of channels" );
+	header.numberOfStripThresholdOffsets=checkedUint32( stripThresholdOffsets.size(), "number of strip threshold offsets" );
+	header.reserved=0;
+	header.eventsProcessed=eventsProcessed;
+	header.runsProcessed=runsProcessed;
+
+	uint64_t offsetsSize=sizeof(uint32_t)*stripThresholdOffsets.size();
+	uint64_t dataOffset=sizeof(SnapshotHeader)+padded(offsetsSize)+sizeof(SnapshotChannelRecord)*channels.size();
+	for( auto& channel : channels )
+	{
+		channel.record.dataOffset=dataOffset;
+		dataOffset+=padded( sizeof(uint32_t)*channel.record.numberOfStrips )+sizeof(uint32_t)*2*channel.record.numberOfStrips*channel.record.numberOfBins;
+	}
+
+	//
+	// Then write everything to a temporary file in the same directory, so that the rename is atomic
+	//
+	const std::string temporaryFilename=filename+".tmp";
+	TemporaryFileSentry outputFile( temporaryFilename );
+	if( !outputFile.file() ) throw std::runtime_error( "SCurveSnapshot - unable to open \""+temporaryFilename+"\" to write the snapshot" );
+
+	outputFile.write( &header, sizeof(header) );
+	std::vector<uint32_t> buffer( stripThresholdOffsets.begin(), stripThresholdOffsets.end() );
+	outputFile.write( buffer.data(), offsetsSize );
+	outputFile.pad( offsetsSize );
+	for( const auto& channel : channels ) outputFile.write( &channel.record, sizeof(SnapshotChannelRecord) );
+
+	for( const auto& channel : channels )
+	{
+		buffer.assign( channel.stripNumbers.begin(), channel.stripNumbers.end() );
+		outputFile.write( buffer.data(), sizeof(uint32_t)*buffer.size() );
+		outputFile.pad( sizeof(uint32_t)*buffer.size() );
+
+		buffer.resize( 2*channel.record.numberOfBins );
+		for( const auto stripNumber : channel.stripNumbers )
+		{
+			const cbcanalyser::SCurve& sCurve=channel.pSCurves->getStripSCurve(stripNumber);
+			if( sCurve.size()!=channel.record.numberOfBins ) throw std::runtime_error( "SCurveSnapshot - the strips in a FED channel have s-curves with different numbers of bins" );
+			for( size_t bin=0; bin<sCurve.size(); ++bin )
+			{
+				buffer[2*bin]=checkedUint32( sCurve.getEntry(bin).eventsOn(), "number of events on" );
+				buffer[2*bin+1]=checkedUint32( sCurve.getEntry(bin).eventsOff(), "number of events off" );
+			}
+			outputFile.write( buffer.data(), sizeof(uint32_t)*buffer.size() );
+		}
+	}
+
+	outputFile.close();
+	if( std::rename( temporaryFilename.c_str(), filename.c_str() )!=0 ) throw std::runtime_error( "SCurveSnapshot - unable to rename \""+temporaryFilename+"\" to \""+filename+"\"" );
+	outputFile.setFinished();
+}
+
+void cbcanalyser::SCurveSnapshot::read( const std::string& filename, cbcanalyser::DetectorSCurves& detectorSCurves )
+{
+	MappedFile inputFile( filename );
+
+	SnapshotHeader header;
+	std::memcpy( &header, inputFile.at( 0, sizeof(SnapshotHeader) ), sizeof(SnapshotHeader) );
+	if( std::memcmp( header.magic, snapshotMagic, sizeof(snapshotMagic) )!=0 ) throw std::runtime_error( "SCurveSnapshot - \""+filename+"\" is not a snapshot file" );
+	if( header.byteOrderMark!=byteOrderMark ) throw std::runtime_error( "SCurveSnapshot - \""+filename+"\" was written with a different byte order" );
+	if( header.version!=version ) throw std::runtime_error( "SCurveSnapshot - \""+filename+"\" is a version this code doesn't understand" );
+
+	// Use temporary objects, so that if restoring fails I'm not left with a
+	// half modified instance.
+	cbcanalyser::DetectorSCurves temporarySCurves;
+	std::vector<unsigned int> temporaryOffsets( header.numberOfStripThresholdOffsets );
+
+	uint64_t offset=header.headerSize;
+	const uint32_t* pOffsets=reinterpret_cast<const uint32_t*>( inputFile.at( offset, sizeof(uint32_t)*header.numberOfStripThresholdOffsets ) );
+	for( size_t index=0; index<temporaryOffsets.size(); ++index ) temporaryOffsets[index]=pOffsets[index];
+	offset+=padded( sizeof(uint32_t)*header.numberOfStripThresholdOffsets );
+
+	const SnapshotChannelRecord* pRecords=reinterpret_cast<const SnapshotChannelRecord*>( inputFile.at( offset, sizeof(SnapshotChannelRecord)*header.numberOfChannels ) );
+	for( uint32_t channelIndex=0; channelIndex<header.numberOfChannels; ++channelIndex )
+	{
+		const SnapshotChannelRecord& record=pRecords[channelIndex];
+		uint64_t stripNumbersSize=sizeof(uint32_t)*record.numberOfStrips;
+		const uint32_t* pStripNumbers=reinterpret_cast<const uint32_t*>( inputFile.at( record.dataOffset, stripNumbersSize ) );
+		const uint32_t* pCounts=reinterpret_cast<const uint32_t*>( inputFile.at( record.dataOffset+padded(stripNumbersSize), sizeof(uint32_t)*2*record.numberOfStrips*record.numberOfBins ) );
+
+		cbcanalyser::FedChannelSCurves& channelSCurves=temporarySCurves.getFedChannelSCurves( record.fedNumber, record.fedChannel );
+		if( channelSCurves.numberOfBins()!=record.numberOfBins ) channelSCurves=cbcanalyser::FedChannelSCurves( record.numberOfBins );
+		for( uint32_t stripIndex=0; stripIndex<record.numberOfStrips; ++stripIndex )
+		{
+			cbcanalyser::SCurve& sCurve=channelSCurves.getStripSCurve( pStripNumbers[stripIndex] );
+			const uint32_t* pStripCounts=pCounts+2*static_cast<size_t>(record.numberOfBins)*stripIndex;
+			for( uint32_t bin=0; bin<record.numberOfBins; ++bin )
+			{
+				sCurve.getEntry(bin).eventsOn()=pStripCounts[2*bin];
+				sCurve.getEntry(bin).eventsOff()=pStripCounts[2*bin+1];
+			}
+		}
+	}
+
+	// If everything went smoothly and I get to this point, I can overwrite the contents
+	// with what was read from disk.
+	detectorSCurves=std::move(temporarySCurves);
+	stripThresholdOffsets.swap( temporaryOffsets );
+	eventsProcessed=header.eventsProcessed;
+	runsProcessed=header.runsProcessed;
+}
@@ -0,0 +1,13 @@
+#include <vector>
+#include <DataFormats/Common/interface/Wrapper.h>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCHitCollection.h"
+
+namespace
+{
+	struct dictionary
+	{
+		cbcanalyser::CBCHitCollection hitCollection;
+		std::vector<cbcanalyser::CBCChannelHits> channelHitsVector;
+		edm::Wrapper<cbcanalyser::CBCHitCollection> hitCollectionWrapper;
+	};
+}
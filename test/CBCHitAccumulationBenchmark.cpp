@@ -0,0 +1,145 @@
+/** @file
+ *
+ * @brief Micro-benchmark comparing the old std::vector<bool> way of unpacking and accumulating
+ * CBC hits with the bit mask and FedChannelSCurves::addEvent.
+ *
+ * Making genuine FED buffers needs the full sistrip::FEDBuffer format, so instead this makes
+ * synthetic events as the list of hit strips the zero suppressed unpacker would produce for
+ * each channel. Both paths start from that list and do the rest of the work that
+ * AnalyseCBCOutput::analyze does, so the difference is the unpacking and accumulation only.
+ *
+ * Usage: XtalDAQ_OnlineCBCAnalyser_hitAccumulationBenchmark [numberOfEvents] [occupancy]
+ */
+
+#include <iostream>
+#include <cstdlib>
+#include <chrono>
+#include <random>
+#include <vector>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCChannelUnpacker.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SteadyClock.h"
+
+namespace // Use the unnamed namespace for things only used in this file
+{
+	const size_t numberOfFeds=2;
+	const size_t numberOfChannels=96;
+	const size_t strips=cbcanalyser::CBCChannelUnpacker::numberOfStrips;
+
+	/** @brief The strips that were hit, for every channel of every event. */
+	typedef std::vector< std::vector< std::vector<uint8_t> > > SyntheticEvents;
+
+	SyntheticEvents makeEvents( size_t numberOfEvents, double occupancy )
+	{
+		std::mt19937 generator( 12345 );
+		std::bernoulli_distribution isHit( occupancy );
+
+		SyntheticEvents events( numberOfEvents, std::vector< std::vector<uint8_t> >( numberOfFeds*numberOfChannels ) );
+		for( auto& event : events )
+		{
+			for( auto& channel : event )
+			{
+				for( size_t stripNumber=0; stripNumber<strips; ++stripNumber )
+				{
+					if( isHit(generator) ) channel.push_back( stripNumber );
+				}
+			}
+		}
+		return events;
+	}
+
+	/** @brief What analyze did before, with a std::vector<bool> per channel and a loop over strips. */
+	void oldPath( const SyntheticEvents& events, cbcanalyser::DetectorSCurves& detectorSCurves )
+	{
+		for( size_t eventNumber=0; eventNumber<events.size(); ++eventNumber )
+		{
+			const size_t thresholdBin=128; // Every event in a run is at the same threshold
+			for( size_t channelIndex=0; channelIndex<events[eventNumber].size(); ++channelIndex )
+			{
+				std::vector<bool> hits( strips, false );
+				for( const auto stripNumber : events[eventNumber][channelIndex] ) hits[stripNumber]=true;
+
+				cbcanalyser::FedChannelSCurves& fedChannelSCurves=detectorSCurves.getFedChannelSCurves( 50+channelIndex/numberOfChannels, channelIndex%numberOfChannels );
+				for( size_t stripNumber=0; stripNumber<hits.size(); ++stripNumber )
+				{
+					cbcanalyser::SCurveEntry& sCurveEntry=fedChannelSCurves.getStripSCurve(stripNumber).getEntry( thresholdBin );
+					if( hits[stripNumber]==true ) ++sCurveEntry.eventsOn();
+					else ++sCurveEntry.eventsOff();
+				}
+			}
+		}
+	}
+
+	/** @brief What analyze does now, with a bit mask and FedChannelSCurves::addEvent. */
+	void newPath( const SyntheticEvents& events, cbcanalyser::DetectorSCurves& detectorSCurves )
+	{
+		for( size_t eventNumber=0; eventNumber<events.size(); ++eventNumber )
+		{
+			const size_t thresholdBin=128; // Every event in a run is at the same threshold
+			for( size_t channelIndex=0; channelIndex<events[eventNumber].size(); ++channelIndex )
+			{
+				cbcanalyser::CBCChannelUnpacker::HitMask hitMask;
+				hitMask.fill(0);
+				for( const auto stripNumber : events[eventNumber][channelIndex] ) hitMask[stripNumber/64]|=static_cast<uint64_t>(1)<<(stripNumber%64);
+
+				cbcanalyser::FedChannelSCurves& fedChannelSCurves=detectorSCurves.getFedChannelSCurves( 50+channelIndex/numberOfChannels, channelIndex%numberOfChannels );
+				fedChannelSCurves.addEvent( thresholdBin, hitMask.data(), strips );
+			}
+		}
+	}
+
+	template<class T>
+	double timePath( T path, const SyntheticEvents& events, cbcanalyser::DetectorSCurves& detectorSCurves )
+	{
+		auto startTime=cbcanalyser::SteadyClock::now();
+		path( events, detectorSCurves );
+		auto endTime=cbcanalyser::SteadyClock::now();
+		return std::chrono::duration<double>( endTime-startTime ).count();
+	}
+
+} // end of the unnamed namespace
+
+int main( int argc, char* argv[] )
+{
+	size_t numberOfEvents=2000;
+	double occupancy=0.5;
+	if( argc>1 ) numberOfEvents=std::atoi( argv[1] );
+	if( argc>2 ) occupancy=std::atof( argv[2] );
+
+	std::cout << "Making " << numberOfEvents << " synthetic events with " << numberOfFeds*numberOfChannels << " channels and occupancy " << occupancy << std::endl;
+	SyntheticEvents events=makeEvents( numberOfEvents, occupancy );
+
+	cbcanalyser::DetectorSCurves oldSCurves;
+	cbcanalyser::DetectorSCurves newSCurves;
+	// Run both once first so that allocating the blocks isn't included in the timing
+	oldPath( SyntheticEvents( 1, events.front() ), oldSCurves );
+	newPath( SyntheticEvents( 1, events.front() ), newSCurves );
+
+	const double oldTime=timePath( oldPath, events, oldSCurves );
+	const double newTime=timePath( newPath, events, newSCurves );
+
+	const double channelEvents=static_cast<double>( numberOfEvents*numberOfFeds*numberOfChannels );
+	std::cout << "std::vector<bool> and per strip lookup: " << oldTime << "s (" << oldTime/channelEvents*1e9 << "ns per channel per event)" << std::endl;
+	std::cout << "Bit mask and FedChannelSCurves::addEvent: " << newTime << "s (" << newTime/channelEvents*1e9 << "ns per channel per event)" << std::endl;
+	if( newTime>0 ) std::cout << "Speed up: " << oldTime/newTime << std::endl;
+
+	// Make sure both paths actually came up with the same answer
+	for( const auto fedNumber : oldSCurves.getValidFedIndices() )
+	{
+		for( const auto channelNumber : oldSCurves.getFedSCurves(fedNumber).getValidChannelIndices() )
+		{
+			const cbcanalyser::FedChannelSCurves& oldChannel=oldSCurves.getFedSCurves(fedNumber).getFedChannelSCurves(channelNumber);
+			const cbcanalyser::FedChannelSCurves& newChannel=newSCurves.getFedSCurves(fedNumber).getFedChannelSCurves(channelNumber);
+			for( const auto stripNumber : oldChannel.getValidStripIndices() )
+			{
+				if( oldChannel.getStripSCurve(stripNumber)!=newChannel.getStripSCurve(stripNumber) )
+				{
+					std::cerr << "The two paths give different s-curves for FED " << fedNumber << " channel " << channelNumber << " strip " << stripNumber << std::endl;
+					return 1;
+				}
+			}
+		}
+	}
+
+	return 0;
+}
@@ -0,0 +1,93 @@
+#include <cppunit/extensions/HelperMacros.h>
+
+
+/** @brief A cppunit TestFixture to test the classes in CBCHitCollection.h
+ */
+class CBCHitCollectionUnitTestSuite : public CPPUNIT_NS::TestFixture
+{
+	CPPUNIT_TEST_SUITE(CBCHitCollectionUnitTestSuite);
+	CPPUNIT_TEST(testChannelHits);
+	CPPUNIT_TEST(testOrdering);
+	CPPUNIT_TEST_SUITE_END();
+
+protected:
+
+public:
+	void setUp();
+
+protected:
+	void testChannelHits();
+	void testOrdering();
+};
+
+
+
+
+
+#include <cppunit/config/SourcePrefix.h>
+#include <stdexcept>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/CBCHitCollection.h"
+
+CPPUNIT_TEST_SUITE_REGISTRATION(CBCHitCollectionUnitTestSuite);
+
+void CBCHitCollectionUnitTestSuite::setUp()
+{
+
+}
+
+void CBCHitCollectionUnitTestSuite::testChannelHits()
+{
+	cbcanalyser::CBCChannelUnpacker::HitMask hitMask;
+	hitMask[0]=(static_cast<uint64_t>(1)<<63) | 1;
+	hitMask[1]=static_cast<uint64_t>(1)<<5;
+
+	cbcanalyser::CBCChannelHits channelHits( 50, 7, hitMask );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint16_t>(50), channelHits.fedNumber );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint16_t>(7), channelHits.fedChannel );
+	for( size_t stripNumber=0; stripNumber<cbcanalyser::CBCChannelUnpacker::numberOfStrips; ++stripNumber )
+	{
+		const bool shouldBeHit=( stripNumber==0 || stripNumber==63 || stripNumber==69 );
+		CPPUNIT_ASSERT_EQUAL( shouldBeHit, channelHits.hit(stripNumber) );
+	}
+}
+
+void CBCHitCollectionUnitTestSuite::testOrdering()
+{
+	cbcanalyser::CBCChannelUnpacker::HitMask hitMask;
+	hitMask.fill(0);
+
+	cbcanalyser::CBCHitCollection hits;
+	CPPUNIT_ASSERT( hits.empty() );
+	CPPUNIT_ASSERT( hits.find( 50, 0 )==nullptr );
+
+	// Add out of order to make sure they get sorted
+	hitMask[0]=1;
+	hits.add( cbcanalyser::CBCChannelHits( 51, 3, hitMask ) );
+	hitMask[0]=2;
+	hits.add( cbcanalyser::CBCChannelHits( 50, 10, hitMask ) );
+	hitMask[0]=3;
+	hits.add( cbcanalyser::CBCChannelHits( 50, 2, hitMask ) );
+	hitMask[0]=4;
+	hits.add( cbcanalyser::CBCChannelHits( 51, 4, hitMask ) );
+	CPPUNIT_ASSERT_THROW( hits.add( cbcanalyser::CBCChannelHits( 50, 10, hitMask ) ), std::runtime_error );
+
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(4), hits.size() );
+	const uint16_t expectedOrder[4][2]={ {50,2}, {50,10}, {51,3}, {51,4} };
+	size_t index=0;
+	for( const auto& channelHits : hits )
+	{
+		CPPUNIT_ASSERT_EQUAL( expectedOrder[index][0], channelHits.fedNumber );
+		CPPUNIT_ASSERT_EQUAL( expectedOrder[index][1], channelHits.fedChannel );
+		++index;
+	}
+
+	const cbcanalyser::CBCChannelHits* pChannelHits=hits.find( 50, 10 );
+	CPPUNIT_ASSERT( pChannelHits!=nullptr );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint64_t>(2), pChannelHits->hitWords[0] );
+	CPPUNIT_ASSERT( hits.find( 50, 3 )==nullptr );
+	CPPUNIT_ASSERT( hits.find( 52, 0 )==nullptr );
+
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(0), hits.malformedBuffers() );
+	hits.addMalformedBuffer();
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(1), hits.malformedBuffers() );
+}
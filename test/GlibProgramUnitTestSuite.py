@@ -0,0 +1,163 @@
+"""
+Unit tests for runcontrol/GlibProgram.py, using SimulatedXDAQ instead of the XDAQ processes.
+Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import GlibProgram
+import SimulatedSetup
+
+class I2cChipUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.directory=tempfile.mkdtemp()
+		self.filename=os.path.join( self.directory, "i2cRegisters.txt" )
+		SimulatedSetup.writeI2cFile( self.filename, 4 )
+		self.chip=GlibProgram.I2cChip( self.filename )
+
+	def tearDown( self ) :
+		shutil.rmtree( self.directory )
+
+	def dirtyNames( self ) :
+		return [ register.name for register in self.chip.dirtyRegisters() ]
+
+	def testRead( self ) :
+		self.assertEqual( ["FrontEndControl","TriggerLatency","VCth","Channel0","Channel1","Channel2","Channel3"], [ register.name for register in self.chip.registers ] )
+		register=self.chip.getRegister( "Channel2" )
+		self.assertEqual( ( 0x22, 0x50, 0x50 ), ( register.address, register.defaultValue, register.value ) )
+		self.assertEqual( None, self.chip.getRegister( "Channel4" ) )
+
+	def testDirtyTracking( self ) :
+		# Nothing is known about the trims on the board to start with
+		self.assertEqual( ["Channel0","Channel1","Channel2","Channel3"], self.dirtyNames() )
+		self.chip.markClean()
+		self.assertEqual( [], self.dirtyNames() )
+
+		# Setting the value a register already has isn't a change
+		self.chip.setChannelTrim( 1, 0x50 )
+		self.chip.setRegisterValue( "VCth", 0x78 )
+		self.assertEqual( [], self.dirtyNames() )
+		# Changes are returned in file order, not the order they were made
+		self.chip.setChannelTrim( 3, 0x10 )
+		self.chip.setRegisterValue( "VCth", 0x60 )
+		self.chip.setChannelTrim( 0, 0x11 )
+		self.assertEqual( ["VCth","Channel0","Channel3"], self.dirtyNames() )
+		self.chip.markClean( ["Channel0","Channel3"] )
+		self.assertEqual( ["VCth"], self.dirtyNames() )
+		self.chip.markDirty( ["TriggerLatency"] )
+		self.assertEqual( ["TriggerLatency","VCth"], self.dirtyNames() )
+		self.chip.markClean()
+		self.chip.markDirty()
+		self.assertEqual( len(self.chip.registers), len(self.dirtyNames()) )
+
+		self.chip.markClean()
+		self.chip.markBoardReset()
+		self.assertEqual( ["Channel0","Channel1","Channel2","Channel3"], self.dirtyNames() )
+
+		self.assertRaises( Exception, self.chip.setChannelTrim, 4, 0x10 )
+		self.assertRaises( Exception, self.chip.setRegisterValue, "NotARegister", 0x10 )
+
+	def testWrite( self ) :
+		self.chip.setChannelTrim( 2, 0x7f )
+		outputFilename=os.path.join( self.directory, "output.txt" )
+		self.chip.writeRegistersToFilename( outputFilename, self.chip.dirtyRegisters() )
+		readBack=GlibProgram.I2cChip( outputFilename )
+		self.assertEqual( ["Channel0","Channel1","Channel2","Channel3"], [ register.name for register in readBack.registers ] )
+		self.assertEqual( 0x7f, readBack.getRegister( "Channel2" ).value )
+
+class GlibProgramUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.simulation=None
+
+	def tearDown( self ) :
+		if self.simulation!=None : self.simulation.stop()
+
+	def startSimulation( self, useExecutive=False ) :
+		self.simulation=SimulatedSetup.SimulatedSetup( useExecutive=useExecutive, numberOfChannels=8 )
+		self.program=self.simulation.program
+		self.hardware=self.simulation.hardware
+
+	def testSendI2c( self ) :
+		self.startSimulation()
+		supervisor=self.program.supervisor
+		# All the trims have to be sent the first time, and only the trims
+		self.assertEqual( 8, supervisor.sendI2c() )
+		self.assertEqual( dict( [ ("Channel"+str(channel),0x50) for channel in range(8) ] ), self.hardware.registerValues )
+		# If nothing has changed the supervisor isn't contacted at all
+		i2cWrites=self.hardware.i2cWrites
+		self.assertEqual( 0, supervisor.sendI2c() )
+		self.assertEqual( i2cWrites, self.hardware.i2cWrites )
+
+		supervisor.setChannelTrim( 5, 0x20 )
+		supervisor.setChannelTrim( 6, 0x50 )
+		self.assertEqual( 1, supervisor.sendI2c() )
+		self.assertEqual( 0x20, self.hardware.registerValues["Channel5"] )
+		self.assertEqual( 2, supervisor.sendI2c( ["FrontEndControl","Channel1"] ) )
+		self.assertEqual( 0x7f, self.hardware.registerValues["FrontEndControl"] )
+
+	def testRun( self ) :
+		self.startSimulation()
+		self.assertFalse( self.program.isHealthyForRun() )
+		self.program.initialise()
+		self.program.configure( triggerRate=1024, numberOfEvents=20 )
+		self.assertEqual( "Configured", self.simulation.simulatedApplication( "TrackerManager" ).state() )
+		self.assertEqual( 1024, self.hardware.triggerRate )
+		self.assertTrue( self.program.isHealthyForRun() )
+
+		runs=[]
+		self.program.beginRunHooks.append( lambda runNumber : runs.append( ("begin",runNumber) ) )
+		self.program.endRunHooks.append( lambda runNumber : runs.append( ("end",runNumber) ) )
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20 )
+		self.program.takeRun( pollInterval=0.05 )
+		self.assertEqual( 20, self.hardware.eventsAcquired() )
+		self.assertEqual( [("begin",1),("end",1)], runs )
+		self.assertEqual( "Configured", self.simulation.simulatedApplication( "GlibSupervisor" ).state() )
+		self.assertTrue( self.program.isHealthyForRun() )
+
+		# The Glib parameters are only sent again if they change
+		self.hardware.triggerRate=1
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20 )
+		self.assertEqual( 1, self.hardware.triggerRate )
+		self.program.prepareRun( triggerRate=512, numberOfEvents=20 )
+		self.assertEqual( 512, self.hardware.triggerRate )
+
+		self.program.halt()
+		self.assertEqual( "Halted", self.simulation.simulatedApplication( "TrackerManager" ).state() )
+		self.assertFalse( self.program.isHealthyForRun() )
+
+	def testRestart( self ) :
+		self.startSimulation( useExecutive=True )
+		# Nothing is running yet, so the processes are started and the trims sent
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20 )
+		self.assertTrue( self.program.isHealthyForRun() )
+		jobIDs=[ context.jobid for context in self.program.contexts ]
+		self.assertFalse( -1 in jobIDs )
+		self.assertEqual( 8, len(self.hardware.registerValues) )
+		self.program.supervisor.setChannelTrim( 3, 0x33 )
+		self.assertEqual( 1, self.program.supervisor.sendI2c() )
+		self.program.takeRun( pollInterval=0.05 )
+
+		# A healthy program isn't restarted
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20 )
+		self.assertEqual( jobIDs, [ context.jobid for context in self.program.contexts ] )
+		self.assertEqual( 0, self.program.supervisor.sendI2c() )
+
+		# The restart resets the board, so every trim is sent again even though none have changed
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20, restartProcesses=True )
+		self.assertNotEqual( jobIDs, [ context.jobid for context in self.program.contexts ] )
+		self.assertTrue( self.program.isHealthyForRun() )
+		self.assertEqual( 8, len(self.hardware.registerValues) )
+		self.assertEqual( 0x33, self.hardware.registerValues["Channel3"] )
+		self.assertEqual( 0, self.program.supervisor.sendI2c() )
+		self.program.takeRun( pollInterval=0.05 )
+		self.assertEqual( 2, self.program.runNumber )
+
+if __name__ == '__main__' :
+	unittest.main()
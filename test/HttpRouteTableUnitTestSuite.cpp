@@ -0,0 +1,109 @@
+#include <cppunit/extensions/HelperMacros.h>
+
+
+/** @brief A cppunit TestFixture to test the classes in HttpRouteTable.h
+ */
+class HttpRouteTableUnitTestSuite : public CPPUNIT_NS::TestFixture
+{
+	CPPUNIT_TEST_SUITE(HttpRouteTableUnitTestSuite);
+	CPPUNIT_TEST(testDecodedUri);
+	CPPUNIT_TEST(testRouting);
+	CPPUNIT_TEST_SUITE_END();
+
+protected:
+
+public:
+	void setUp();
+
+protected:
+	void testDecodedUri();
+	void testRouting();
+};
+
+
+
+
+
+#include <cppunit/config/SourcePrefix.h>
+#include <stdexcept>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/HttpRouteTable.h"
+
+CPPUNIT_TEST_SUITE_REGISTRATION(HttpRouteTableUnitTestSuite);
+
+void HttpRouteTableUnitTestSuite::setUp()
+{
+
+}
+
+void HttpRouteTableUnitTestSuite::testDecodedUri()
+{
+	httpserver::DecodedUri uri( "/scurves//50/3?format=binary&name=a%20b+c&flag&count=12" );
+	CPPUNIT_ASSERT_EQUAL( std::string("/scurves//50/3"), uri.path );
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(3), uri.pathComponents.size() );
+	CPPUNIT_ASSERT_EQUAL( std::string("scurves"), uri.pathComponents[0] );
+	CPPUNIT_ASSERT_EQUAL( std::string("50"), uri.pathComponents[1] );
+	CPPUNIT_ASSERT_EQUAL( std::string("3"), uri.pathComponents[2] );
+
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(4), uri.parameters.size() );
+	CPPUNIT_ASSERT_EQUAL( std::string("binary"), uri.parameter("format") );
+	CPPUNIT_ASSERT_EQUAL( std::string("a b c"), uri.parameter("name") );
+	CPPUNIT_ASSERT( uri.hasParameter("flag") );
+	CPPUNIT_ASSERT_EQUAL( std::string(""), uri.parameter("flag","default") );
+	CPPUNIT_ASSERT( !uri.hasParameter("missing") );
+	CPPUNIT_ASSERT_EQUAL( std::string("default"), uri.parameter("missing","default") );
+
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(12), uri.unsignedParameter("count",5) );
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(5), uri.unsignedParameter("missing",5) );
+	CPPUNIT_ASSERT_THROW( uri.unsignedParameter("format",5), std::runtime_error );
+	CPPUNIT_ASSERT_THROW( uri.unsignedParameter("flag",5), std::runtime_error );
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(4294967295u), httpserver::DecodedUri("/test?value=4294967295").unsignedParameter("value",5) );
+	CPPUNIT_ASSERT_THROW( httpserver::DecodedUri("/test?value=4294967296").unsignedParameter("value",5), std::runtime_error );
+	CPPUNIT_ASSERT_THROW( httpserver::DecodedUri("/test?value=99999999999999999999999").unsignedParameter("value",5), std::runtime_error );
+
+	CPPUNIT_ASSERT_THROW( httpserver::DecodedUri("/test?value=%4"), std::runtime_error );
+	CPPUNIT_ASSERT_THROW( httpserver::DecodedUri("/test?value=%zz"), std::runtime_error );
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(0), httpserver::DecodedUri("/").pathComponents.size() );
+}
+
+void HttpRouteTableUnitTestSuite::testRouting()
+{
+	std::vector<std::string> receivedArguments;
+	httpserver::RouteTable routeTable;
+	routeTable.addRoute( "/", [&]( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply ){
+		reply.content="index";
+	} );
+	routeTable.addRoute( "/scurves/<fed>/<channel>", [&]( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply ){
+		receivedArguments=arguments;
+		httpserver::RouteTable::setReply( reply, httpserver::HttpServer::Reply::StatusType::ok, "{}", "application/json" );
+	} );
+	routeTable.addRoute( "/fail", [&]( const httpserver::DecodedUri& uri, const std::vector<std::string>& arguments, httpserver::HttpServer::Reply& reply ){
+		throw std::runtime_error( "failed" );
+	}, "Always fails" );
+
+	httpserver::HttpServer::Request request;
+	httpserver::HttpServer::Reply reply;
+
+	request.uri="/";
+	routeTable.handleRequest( request, reply );
+	CPPUNIT_ASSERT_EQUAL( httpserver::HttpServer::Reply::StatusType::ok, reply.status );
+	CPPUNIT_ASSERT_EQUAL( std::string("index"), reply.content );
+	CPPUNIT_ASSERT_EQUAL( std::string("5"), reply.headers[0].value ); // The length should be corrected after the handler
+
+	request.uri="/scurves/50/3?format=binary";
+	routeTable.handleRequest( request, reply );
+	CPPUNIT_ASSERT_EQUAL( httpserver::HttpServer::Reply::StatusType::ok, reply.status );
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(2), receivedArguments.size() );
+	CPPUNIT_ASSERT_EQUAL( std::string("50"), receivedArguments[0] );
+	CPPUNIT_ASSERT_EQUAL( std::string("3"), receivedArguments[1] );
+	CPPUNIT_ASSERT_EQUAL( std::string("application/json"), reply.headers[1].value );
+
+	request.uri="/scurves/50";
+	routeTable.handleRequest( request, reply );
+	CPPUNIT_ASSERT_EQUAL( httpserver::HttpServer::Reply::StatusType::not_found, reply.status );
+	CPPUNIT_ASSERT( reply.content.find("Always fails")!=std::string::npos );
+
+	request.uri="/fail";
+	routeTable.handleRequest( request, reply );
+	CPPUNIT_ASSERT_EQUAL( httpserver::HttpServer::Reply::StatusType::bad_request, reply.status );
+	CPPUNIT_ASSERT( reply.content.find("failed")!=std::string::npos );
+}
@@ -0,0 +1,103 @@
+"""
+Unit tests for runcontrol/pythonlib/PowerSupply.py, using SimulatedInstrument instead of a
+real supply. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import pythonlib.PowerSupply as PowerSupply
+
+class PowerSupplyUnitTestSuite( unittest.TestCase ) :
+	def createSupply( self, cacheState ) :
+		supply=PowerSupply.PowerSupply( verbose=False, cacheState=cacheState, simulated=True )
+		supply.powerSupply.roundTripTime=0.0
+		return supply
+
+	def transactions( self, supply ) :
+		return ( supply.powerSupply.writes, supply.powerSupply.reads )
+
+	def testWithoutCache( self ) :
+		supply=self.createSupply( False )
+		supply.setOutput( voltage=1.5, current=0.01 )
+		self.assertEqual( { "voltage":1.5, "current":0.01 }, supply.getOutput() )
+		# Everything is sent and read back every time
+		transactions=self.transactions( supply )
+		supply.getOutput()
+		self.assertEqual( ( transactions[0]+2, transactions[1]+1 ), self.transactions( supply ) )
+		supply.setOn()
+		self.assertTrue( supply.isOn() )
+		self.assertEqual( ( transactions[0]+4, transactions[1]+2 ), self.transactions( supply ) )
+
+	def testCache( self ) :
+		supply=self.createSupply( True )
+		# Just the "*IDN?" so far
+		self.assertEqual( ( 1, 1 ), self.transactions( supply ) )
+		supply.setOutput( voltage=1.5, current=0.01 )
+		# Selecting the channel, the setting and the read back all go in one command
+		self.assertEqual( ( 2, 2 ), self.transactions( supply ) )
+		self.assertEqual( { "voltage":1.5, "current":0.01 }, supply.getOutput() )
+		supply.setChannel( "OUTP1" )
+		self.assertEqual( "OUTP1", supply.getChannel() )
+		self.assertEqual( ( 2, 2 ), self.transactions( supply ) )
+		supply.setOutput( voltage=2.5, current=0.01 )
+		self.assertEqual( ( 3, 3 ), self.transactions( supply ) )
+
+		# Other outputs are read from the supply the first time
+		self.assertEqual( { "voltage":0.0, "current":0.0 }, supply.getOutput( "OUTP2" ) )
+		self.assertEqual( "OUTP2", supply.powerSupply.selectedOutput )
+		self.assertEqual( { "voltage":2.5, "current":0.01 }, supply.getOutput( "OUTP1" ) )
+		supply.setOutput( voltage=1.0, output="OUTP1" )
+		self.assertEqual( "OUTP1", supply.powerSupply.selectedOutput )
+		self.assertEqual( ( 1.0, 0.005 ), supply.powerSupply.outputs["OUTP1"] )
+
+		supply.setOn()
+		transactions=self.transactions( supply )
+		self.assertTrue( supply.isOn() )
+		self.assertEqual( transactions, self.transactions( supply ) )
+
+		# A reset forgets everything
+		supply.reset()
+		transactions=self.transactions( supply )
+		self.assertEqual( { "voltage":0.0, "current":0.0 }, supply.getOutput() )
+		self.assertFalse( supply.isOn() )
+		self.assertNotEqual( transactions, self.transactions( supply ) )
+
+	def testCompletion( self ) :
+		supply=self.createSupply( True )
+		supply.powerSupply.settleTime=0.3
+		startTime=time.time()
+		supply.setOutput( voltage=2.0, wait=False )
+		self.assertTrue( time.time()-startTime<0.15 )
+		# The "*OPC?" reply has to be read before anything else is asked, or the answers get out of
+		# step. The output is off, so this would get the "1" meant for "*OPC?".
+		self.assertFalse( supply.isOn() )
+		self.assertTrue( time.time()-startTime>=0.3 )
+
+		supply.setOutput( voltage=3.0, wait=False )
+		startTime=time.time()
+		self.assertEqual( { "voltage":3.0, "current":0.005 }, supply.getOutput() )
+		self.assertTrue( time.time()-startTime>=0.25 )
+		self.assertEqual( ( 3.0, 0.005 ), supply.powerSupply.outputs["OUTP1"] )
+		# Nothing is outstanding now, so this shouldn't read anything
+		reads=supply.powerSupply.reads
+		supply.waitForCompletion()
+		self.assertEqual( reads, supply.powerSupply.reads )
+
+	def testVoltageLimit( self ) :
+		for cacheState in [ True, False ] :
+			supply=self.createSupply( cacheState )
+			transactions=self.transactions( supply )
+			self.assertRaises( Exception, supply.setOutput, voltage=5.5 )
+			self.assertEqual( transactions, self.transactions( supply ) )
+			supply.setVoltageLimit( 6.0 )
+			supply.setOutput( voltage=5.5 )
+			self.assertEqual( 5.5, supply.getOutput()["voltage"] )
+
+if __name__ == '__main__' :
+	unittest.main()
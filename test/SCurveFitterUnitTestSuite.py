@@ -0,0 +1,143 @@
+"""
+Unit tests for runcontrol/pythonlib/SCurveFitter.py. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import math
+import unittest
+import warnings
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import pythonlib.SCurveFitter as SCurveFitter
+import pythonlib.SavedState as SavedState
+numpy=SCurveFitter.numpy
+
+def turnOn( plateau, slope, mean, x ) :
+	"""The fraction of events on for the model in FitSCurve."""
+	return plateau*0.5*( 1+SCurveFitter.erf( slope*(x-mean)/math.sqrt(2) ) )
+
+@unittest.skipIf( numpy==None, "SCurveFitter needs numpy" )
+class SCurveFitterUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.x=numpy.arange( 64, dtype=float )
+		self.eventsPerBin=1000
+		# Any warnings (e.g. dividing by zero on the degenerate strips) should be dealt with, so fail on them
+		self.warningFilters=warnings.catch_warnings()
+		self.warningFilters.__enter__()
+		warnings.simplefilter( "error" )
+
+	def tearDown( self ) :
+		self.warningFilters.__exit__()
+
+	def exactCounts( self, parameters ) :
+		"""[strip][bin] eventsOn and eventsOff arrays with the expected number of events on in every bin."""
+		fraction=numpy.array( [ turnOn( plateau, slope, mean, self.x ) for plateau, slope, mean in parameters ] )
+		eventsOn=numpy.round( fraction*self.eventsPerBin )
+		return eventsOn, self.eventsPerBin-eventsOn
+
+	def testErf( self ) :
+		for value in [ -3.0, -0.5, 0.0, 0.2, 1.0, 2.5 ] :
+			self.assertAlmostEqual( math.erf(value), SCurveFitter.erf( numpy.array([value]) )[0], places=6 )
+
+	def testExactSCurves( self ) :
+		parameters=[ (1.0,0.5,20.3), (0.9,0.25,40.0), (0.75,-0.4,31.7), (1.0,2.0,10.5) ]
+		eventsOn, eventsOff=self.exactCounts( parameters )
+		results=SCurveFitter.fitSCurves( eventsOn, eventsOff, self.x )
+		self.assertTrue( results.converged.all() )
+		self.assertEqual( [61]*len(parameters), list(results.ndf) )
+		for index, (plateau, slope, mean) in enumerate(parameters) :
+			self.assertAlmostEqual( plateau, results.plateau[index], delta=0.002 )
+			self.assertAlmostEqual( slope, results.slope[index], delta=0.01*abs(slope) )
+			self.assertAlmostEqual( mean, results.mean[index], delta=0.02 )
+			self.assertAlmostEqual( 1/abs(slope), results.width[index], delta=0.01/abs(slope) )
+			self.assertTrue( results.chi2[index]<results.ndf[index] )
+
+	def testNoisySCurves( self ) :
+		random=numpy.random.RandomState( 1234 )
+		numberOfStrips=128
+		plateau=random.uniform( 0.8, 1.0, numberOfStrips )
+		width=random.uniform( 1.0, 6.0, numberOfStrips )
+		mean=random.uniform( 20.0, 44.0, numberOfStrips )
+		fraction=numpy.array( [ turnOn( plateau[index], 1/width[index], mean[index], self.x ) for index in range(numberOfStrips) ] )
+		eventsOn=random.binomial( self.eventsPerBin, fraction ).astype(float)
+		results=SCurveFitter.fitSCurves( eventsOn, self.eventsPerBin-eventsOn, self.x )
+
+		self.assertTrue( results.converged.all() )
+		# Limits are a few times the statistical error of each parameter
+		self.assertTrue( ( numpy.abs( results.mean-mean )<0.15*width ).all() )
+		self.assertTrue( ( numpy.abs( results.width-width )<0.15*width ).all() )
+		self.assertTrue( ( numpy.abs( results.plateau-plateau )<0.015 ).all() )
+		# The weights are binomial, so the chi2 per degree of freedom should be about one. It's a bit
+		# lower because the bins at 0% or 100% use a smoothed efficiency and so hardly contribute.
+		self.assertTrue( 0.4<results.chi2.sum()/results.ndf.sum()<1.2 )
+
+	def testEstimate( self ) :
+		eventsOn, eventsOff=self.exactCounts( [ (1.0,0.5,20.3), (0.8,-0.25,40.0) ] )
+		# Bins without events are skipped rather than treated as zero
+		eventsOn[:,::3]=0
+		eventsOff[:,::3]=0
+		estimate=SCurveFitter.estimateSCurves( eventsOn, eventsOff, self.x )
+		self.assertEqual( [True,True], list(estimate["valid"]) )
+		self.assertEqual( [1,-1], list(estimate["direction"]) )
+		self.assertAlmostEqual( 1.0, estimate["plateau"][0], delta=0.01 )
+		self.assertAlmostEqual( 0.8, estimate["plateau"][1], delta=0.01 )
+		self.assertAlmostEqual( 20.3, estimate["mean"][0], delta=0.5 )
+		self.assertAlmostEqual( 40.0, estimate["mean"][1], delta=0.5 )
+		self.assertAlmostEqual( 2.0, estimate["width"][0], delta=0.4 )
+		self.assertAlmostEqual( 4.0, estimate["width"][1], delta=0.4 )
+
+	def testDegenerateStrips( self ) :
+		numberOfBins=len(self.x)
+		eventsOn=numpy.array( [ numpy.zeros(numberOfBins), numpy.full(numberOfBins,100.0), numpy.zeros(numberOfBins), numpy.zeros(numberOfBins) ] )
+		eventsOff=numpy.array( [ numpy.full(numberOfBins,100.0), numpy.zeros(numberOfBins), numpy.zeros(numberOfBins), numpy.zeros(numberOfBins) ] )
+		# The last strip only has events in three bins, which is no degrees of freedom
+		eventsOn[3,10:13]=[0,5,10]
+		eventsOff[3,10:13]=[10,5,0]
+
+		estimate=SCurveFitter.estimateSCurves( eventsOn, eventsOff, self.x )
+		self.assertEqual( [False,False,False,True], list(estimate["valid"]) )
+		self.assertTrue( numpy.isnan( estimate["mean"][0:3] ).all() )
+
+		results=SCurveFitter.fitSCurves( eventsOn, eventsOff, self.x )
+		self.assertEqual( [True,True,False,False], list(results.converged) )
+		self.assertEqual( [61,61,0,0], list(results.ndf) )
+		# A strip that is never (or always) on has no turn on to find, but the curve still has to match
+		parameters=numpy.column_stack( (results.plateau, results.slope, results.mean) )
+		modelValues=SCurveFitter._model( parameters[0:2], self.x )[0]
+		self.assertTrue( ( numpy.abs( modelValues[0] )<1e-3 ).all() )
+		self.assertTrue( ( numpy.abs( modelValues[1]-1 )<1e-3 ).all() )
+		for attribute in [ "plateau", "slope", "mean", "chi2" ] :
+			self.assertTrue( numpy.isnan( getattr(results,attribute)[2:] ).all() )
+
+	def testSingleBin( self ) :
+		estimate=SCurveFitter.estimateSCurves( [[5]], [[5]] )
+		self.assertFalse( estimate["valid"][0] )
+		results=SCurveFitter.fitSCurves( [[5],[0]], [[5],[10]] )
+		self.assertEqual( [False,False], list(results.converged) )
+		self.assertEqual( [0,0], list(results.ndf) )
+		self.assertTrue( numpy.isnan( results.mean ).all() )
+
+	def testInputChecks( self ) :
+		self.assertRaises( Exception, SCurveFitter.fitSCurves, numpy.zeros((2,10)), numpy.zeros((2,11)) )
+		self.assertRaises( Exception, SCurveFitter.fitSCurves, numpy.zeros((2,10)), numpy.zeros((2,10)), numpy.arange(9) )
+
+	def testHistogramScaleAndSnapshotChannel( self ) :
+		numberOfBins=len(self.x)
+		binCentres=SCurveFitter.histogramBinCentres( numberOfBins )
+		self.assertEqual( (numberOfBins,), binCentres.shape )
+		self.assertTrue( binCentres[0]<0 and binCentres[-1]>1 )
+
+		eventsOn, eventsOff=self.exactCounts( [ (1.0,0.5,20.0), (0.9,-0.5,30.0) ] )
+		counts=numpy.dstack( (eventsOn,eventsOff) ).astype(numpy.uint32).flatten()
+		channel=SavedState.SnapshotChannel( 1, 2, [5,9], numberOfBins, counts )
+		results=SCurveFitter.fitSnapshotChannel( channel )
+		# The default x is the histogram scale, so bin 20 becomes its bin centre
+		self.assertAlmostEqual( binCentres[20], results.mean[0], delta=1e-3 )
+		self.assertAlmostEqual( binCentres[30], results.mean[1], delta=1e-3 )
+		self.assertAlmostEqual( 0.9, results.plateau[1], delta=0.002 )
+
+if __name__ == '__main__' :
+	unittest.main()
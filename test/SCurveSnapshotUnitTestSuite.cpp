@@ -0,0 +1,136 @@
+#include <cppunit/extensions/HelperMacros.h>
+
+
+/** @brief A cppunit TestFixture to test the SCurveSnapshot class
+ */
+class SCurveSnapshotUnitTestSuite : public CPPUNIT_NS::TestFixture
+{
+	CPPUNIT_TEST_SUITE(SCurveSnapshotUnitTestSuite);
+	CPPUNIT_TEST(testWriteAndRead);
+	CPPUNIT_TEST(testInvalidFile);
+	CPPUNIT_TEST_SUITE_END();
+
+protected:
+
+public:
+	void setUp();
+
+protected:
+	void testWriteAndRead();
+	void testInvalidFile();
+};
+
+
+
+
+
+#include <cppunit/config/SourcePrefix.h>
+#include <fstream>
+#include <stdexcept>
+#include <unistd.h>
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
+#include "XtalDAQ/OnlineCBCAnalyser/interface/SCurveSnapshot.h"
+
+CPPUNIT_TEST_SUITE_REGISTRATION(SCurveSnapshotUnitTestSuite);
+
+void SCurveSnapshotUnitTestSuite::setUp()
+{
+
+}
+
+void SCurveSnapshotUnitTestSuite::testWriteAndRead()
+{
+	const std::string testOutputFilename="testSnapshot.blah";
+
+	cbcanalyser::DetectorSCurves detectorSCurves;
+	cbcanalyser::DetectorSCurves restoredDetectorSCurves;
+
+	// Fill with some random data, with gaps in the FED, channel and strip numbers
+	detectorSCurves.getStripSCurve( 0, 0, 0 ).getEntry(0).eventsOn()+=30;
+	detectorSCurves.getStripSCurve( 0, 0, 0 ).getEntry(128).eventsOff()+=2342;
+	detectorSCurves.getStripSCurve( 0, 0, 5 ).getEntry(0).eventsOn()+=23;
+	detectorSCurves.getStripSCurve( 0, 0, 5 ).getEntry(255).eventsOff()+=34567;
+	detectorSCurves.getStripSCurve( 0, 3, 0 ).getEntry(0).eventsOn()+=43152;
+	detectorSCurves.getStripSCurve( 50, 0, 253 ).getEntry(64).eventsOn()+=3223;
+	detectorSCurves.getStripSCurve( 50, 0, 253 ).getEntry(192).eventsOff()+=9;
+	// Put something in the restored object to make sure it gets overwritten
+	restoredDetectorSCurves.getStripSCurve( 7, 7, 7 ).getEntry(0).eventsOn()+=1;
+
+	cbcanalyser::SCurveSnapshot snapshot;
+	snapshot.stripThresholdOffsets={ 0x50, 0x51, 0x4f };
+	snapshot.eventsProcessed=12345;
+	snapshot.runsProcessed=3;
+	CPPUNIT_ASSERT_NO_THROW( snapshot.write( testOutputFilename, detectorSCurves ) );
+	CPPUNIT_ASSERT( cbcanalyser::SCurveSnapshot::isSnapshotFile( testOutputFilename ) );
+
+	cbcanalyser::SCurveSnapshot restoredSnapshot;
+	CPPUNIT_ASSERT_NO_THROW( restoredSnapshot.read( testOutputFilename, restoredDetectorSCurves ) );
+	CPPUNIT_ASSERT( restoredSnapshot.stripThresholdOffsets==snapshot.stripThresholdOffsets );
+	CPPUNIT_ASSERT_EQUAL( snapshot.eventsProcessed, restoredSnapshot.eventsProcessed );
+	CPPUNIT_ASSERT_EQUAL( snapshot.runsProcessed, restoredSnapshot.runsProcessed );
+
+	//
+	// Compare what was restored to the original object
+	//
+	const auto fedIndices=detectorSCurves.getValidFedIndices();
+	CPPUNIT_ASSERT( fedIndices==restoredDetectorSCurves.getValidFedIndices() );
+	for( const auto fedIndex : fedIndices )
+	{
+		const auto& fedSCurves=detectorSCurves.getFedSCurves(fedIndex);
+		const auto& restoredFedSCurves=restoredDetectorSCurves.getFedSCurves(fedIndex);
+		const auto channelIndices=fedSCurves.getValidChannelIndices();
+		CPPUNIT_ASSERT( channelIndices==restoredFedSCurves.getValidChannelIndices() );
+
+		for( const auto channelIndex : channelIndices )
+		{
+			const auto& channelSCurves=fedSCurves.getFedChannelSCurves(channelIndex);
+			const auto& restoredChannelSCurves=restoredFedSCurves.getFedChannelSCurves(channelIndex);
+			const auto stripIndices=channelSCurves.getValidStripIndices();
+			CPPUNIT_ASSERT( stripIndices==restoredChannelSCurves.getValidStripIndices() );
+
+			for( const auto stripIndex : stripIndices )
+			{
+				CPPUNIT_ASSERT( channelSCurves.getStripSCurve(stripIndex)==restoredChannelSCurves.getStripSCurve(stripIndex) );
+			}
+		}
+	}
+}
+
+void SCurveSnapshotUnitTestSuite::testInvalidFile()
+{
+	const std::string testOutputFilename="testSnapshotInvalid.blah";
+
+	cbcanalyser::DetectorSCurves detectorSCurves;
+	detectorSCurves.getStripSCurve( 1, 2, 3 ).getEntry(0).eventsOn()+=4;
+
+	// A file in the old text format shouldn't be mistaken for a snapshot
+	{
+		std::ofstream outputFile( testOutputFilename, std::ios::trunc );
+		detectorSCurves.dumpToStream( outputFile );
+	}
+	CPPUNIT_ASSERT( !cbcanalyser::SCurveSnapshot::isSnapshotFile( testOutputFilename ) );
+
+	// Failing to read should leave the s-curves untouched
+	cbcanalyser::SCurveSnapshot snapshot;
+	CPPUNIT_ASSERT_THROW( snapshot.read( testOutputFilename, detectorSCurves ), std::runtime_error );
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(1), detectorSCurves.getValidFedIndices().size() );
+
+	// Neither should a truncated snapshot
+	snapshot.write( testOutputFilename, detectorSCurves );
+	::truncate( testOutputFilename.c_str(), 60 );
+	cbcanalyser::DetectorSCurves restoredDetectorSCurves;
+	CPPUNIT_ASSERT_THROW( snapshot.read( testOutputFilename, restoredDetectorSCurves ), std::runtime_error );
+	CPPUNIT_ASSERT( restoredDetectorSCurves.getValidFedIndices().empty() );
+
+	// Nor should a channel record with a FED number that's out of range. There are no strip
+	// threshold offsets, so the record starts straight after the 48 byte header.
+	snapshot.write( testOutputFilename, detectorSCurves );
+	{
+		std::fstream file( testOutputFilename, std::ios::in | std::ios::out | std::ios::binary );
+		const uint32_t badFedNumber=4000000000u;
+		file.seekp( 48 );
+		file.write( reinterpret_cast<const char*>(&badFedNumber), sizeof(badFedNumber) );
+	}
+	CPPUNIT_ASSERT_THROW( snapshot.read( testOutputFilename, restoredDetectorSCurves ), std::out_of_range );
+	CPPUNIT_ASSERT( restoredDetectorSCurves.getValidFedIndices().empty() );
+}
@@ -10,6 +10,11 @@ class SCurveUnitTestSuite : public CPPUNIT_NS::TestFixture
 {
 	CPPUNIT_TEST_SUITE(SCurveUnitTestSuite);
 	CPPUNIT_TEST(testSaveAndRestore);
+	CPPUNIT_TEST(testChannelStorage);
+	CPPUNIT_TEST(testEstimateParameters);
+	CPPUNIT_TEST(testFit);
+	CPPUNIT_TEST(testMerge);
+	CPPUNIT_TEST(testLimits);
 	CPPUNIT_TEST_SUITE_END();
 
 protected:
@@ -19,6 +24,11 @@ public:
 
 protected:
 	void testSaveAndRestore();
+	void testChannelStorage();
+	void testEstimateParameters();
+	void testFit();
+	void testMerge();
+	void testLimits();
 };
 
 
@@ -28,6 +38,10 @@ protected:
 #include <cppunit/config/SourcePrefix.h>
 #include <iostream>
 #include <stdexcept>
+#include <vector>
+#include <cmath>
+#include <sstream>
+#include <DataFormats/SiStripCommon/interface/ConstantsForHardwareSystems.h>
 #include "XtalDAQ/OnlineCBCAnalyser/interface/SCurve.h"
 
 CPPUNIT_TEST_SUITE_REGISTRATION(SCurveUnitTestSuite);
@@ -115,3 +129,183 @@ void SCurveUnitTestSuite::testSaveAndRestore()
 		}
 	}
 }
+
+void SCurveUnitTestSuite::testChannelStorage()
+{
+	cbcanalyser::DetectorSCurves detectorSCurves;
+
+	// Only the FEDs, channels and strips that have been asked for should be valid
+	cbcanalyser::FedChannelSCurves& channelSCurves=detectorSCurves.getFedChannelSCurves( 50, 3 );
+	channelSCurves.getEntry( 7, 10 ).eventsOn()+=5;
+	++channelSCurves.getStripSCurve( 2 ).getEntry(10).eventsOff();
+	CPPUNIT_ASSERT( detectorSCurves.getValidFedIndices()==std::vector<size_t>{50} );
+	CPPUNIT_ASSERT( detectorSCurves.getFedSCurves(50).getValidChannelIndices()==std::vector<size_t>{3} );
+	CPPUNIT_ASSERT( (channelSCurves.getValidStripIndices()==std::vector<size_t>{2,7}) );
+	CPPUNIT_ASSERT_THROW( static_cast<const cbcanalyser::DetectorSCurves&>(detectorSCurves).getFedSCurves(51), std::out_of_range );
+	CPPUNIT_ASSERT_THROW( static_cast<const cbcanalyser::FedChannelSCurves&>(channelSCurves).getStripSCurve(3), std::out_of_range );
+	CPPUNIT_ASSERT_THROW( channelSCurves.getEntry( 0, channelSCurves.numberOfBins() ), std::out_of_range );
+
+	// The shortcut and the SCurve view should refer to the same bin
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(5), channelSCurves.getStripSCurve(7).getEntry(10).eventsOn() );
+	CPPUNIT_ASSERT( &channelSCurves.getEntry( 2, 10 )==&detectorSCurves.getStripSCurve( 50, 3, 2 ).getEntry(10) );
+
+	// Adding more channels and FEDs shouldn't move existing channels
+	for( size_t fedChannel=0; fedChannel<96; ++fedChannel ) detectorSCurves.getFedChannelSCurves( 400, fedChannel );
+	CPPUNIT_ASSERT( &channelSCurves==&detectorSCurves.getFedChannelSCurves( 50, 3 ) );
+
+	// Strips past the initial block should still work, and keep the existing data
+	channelSCurves.getEntry( 1000, 0 ).eventsOn()+=1;
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(5), channelSCurves.getStripSCurve(7).getEntry(10).eventsOn() );
+	CPPUNIT_ASSERT( (channelSCurves.getValidStripIndices()==std::vector<size_t>{2,7,1000}) );
+
+	// Copies should be independent of the original
+	cbcanalyser::DetectorSCurves copiedSCurves( detectorSCurves );
+	++copiedSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn();
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(5), channelSCurves.getStripSCurve(7).getEntry(10).eventsOn() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(6), copiedSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn() );
+
+	// Assigning to a strip's SCurve copies into the channel, but can't change its size
+	cbcanalyser::SCurve sCurve;
+	sCurve.getEntry(0).eventsOff()=12;
+	channelSCurves.getStripSCurve(2)=sCurve;
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(12), channelSCurves.getEntry( 2, 0 ).eventsOff() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(0), channelSCurves.getEntry( 2, 10 ).eventsOff() );
+	CPPUNIT_ASSERT_THROW( channelSCurves.getStripSCurve(2)=cbcanalyser::SCurve(10), std::runtime_error );
+}
+
+void SCurveUnitTestSuite::testEstimateParameters()
+{
+	// Nothing filled can't give an estimate
+	cbcanalyser::SCurve sCurve(100);
+	CPPUNIT_ASSERT( !sCurve.estimateParameters().isValid );
+
+	// Fill with an exact error function, leaving some bins empty like an unfinished scan
+	const double mean=40.3, width=5, plateau=0.9;
+	for( size_t index=0; index<100; index+=( index<60 ? 1 : 3 ) )
+	{
+		uint32_t eventsOn=std::lround( 100000*plateau*0.5*(1+std::erf( (index-mean)/width/std::sqrt(2) )) );
+		sCurve.getEntry(index).eventsOn()=eventsOn;
+		sCurve.getEntry(index).eventsOff()=100000-eventsOn;
+	}
+	cbcanalyser::SCurve::Estimate estimate=sCurve.estimateParameters();
+	CPPUNIT_ASSERT( estimate.isValid );
+	CPPUNIT_ASSERT_EQUAL( 1, estimate.direction );
+	CPPUNIT_ASSERT_DOUBLES_EQUAL( plateau, estimate.plateau, 0.001 );
+	CPPUNIT_ASSERT_DOUBLES_EQUAL( mean, estimate.mean, 0.01 );
+	CPPUNIT_ASSERT_DOUBLES_EQUAL( width, estimate.width, 0.05 );
+
+	// Reversing the bins should give a falling curve with the mean mirrored
+	cbcanalyser::SCurve fallingSCurve(100);
+	for( size_t index=0; index<100; ++index ) fallingSCurve.getEntry(99-index)=sCurve.getEntry(index);
+	estimate=fallingSCurve.estimateParameters();
+	CPPUNIT_ASSERT( estimate.isValid );
+	CPPUNIT_ASSERT_EQUAL( -1, estimate.direction );
+	CPPUNIT_ASSERT_DOUBLES_EQUAL( plateau, estimate.plateau, 0.001 );
+	CPPUNIT_ASSERT_DOUBLES_EQUAL( 99-mean, estimate.mean, 0.01 );
+	CPPUNIT_ASSERT_DOUBLES_EQUAL( width, estimate.width, 0.05 );
+}
+
+void SCurveUnitTestSuite::testFit()
+{
+	// Not enough bins to fit three parameters
+	cbcanalyser::SCurve sCurve(100);
+	sCurve.getEntry(10).eventsOn()=5;
+	sCurve.getEntry(11).eventsOff()=5;
+	CPPUNIT_ASSERT( !sCurve.fit().converged );
+
+	// Fill with an exact error function on the x axis of the histogram, i.e. -binWidth to 1+binWidth
+	const double binWidth=0.01, spacing=1.02/100;
+	const double mean=0.43, slope=-60, plateau=0.8;
+	cbcanalyser::FedChannelSCurves channelSCurves(100);
+	for( size_t stripNumber=0; stripNumber<3; ++stripNumber )
+	{
+		for( size_t index=0; index<100; ++index )
+		{
+			double x=-binWidth+spacing*(index+0.5);
+			uint32_t eventsOn=std::lround( 10000*plateau*0.5*(1+std::erf( slope*(x-mean)/std::sqrt(2) )) );
+			channelSCurves.getEntry(stripNumber,index).eventsOn()=eventsOn;
+			channelSCurves.getEntry(stripNumber,index).eventsOff()=10000-eventsOn;
+		}
+	}
+	std::vector<cbcanalyser::SCurve::FitResult> fitResults=channelSCurves.fitStrips();
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(3), fitResults.size() );
+	for( const auto& fitResult : fitResults )
+	{
+		CPPUNIT_ASSERT( fitResult.converged );
+		CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(97), fitResult.ndf );
+		CPPUNIT_ASSERT_DOUBLES_EQUAL( plateau, fitResult.plateau, 0.001 );
+		CPPUNIT_ASSERT_DOUBLES_EQUAL( slope, fitResult.slope, 0.5 );
+		CPPUNIT_ASSERT_DOUBLES_EQUAL( mean, fitResult.mean, 0.0005 );
+	}
+}
+
+void SCurveUnitTestSuite::testMerge()
+{
+	cbcanalyser::DetectorSCurves detectorSCurves;
+	detectorSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn()=5;
+	detectorSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOff()=2;
+
+	cbcanalyser::DetectorSCurves otherSCurves;
+	otherSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn()=4;
+	otherSCurves.getStripSCurve( 50, 3, 8 ).getEntry(0).eventsOff()=3;
+	otherSCurves.getFedSCurves(51).getFedChannelSCurves(0)=cbcanalyser::FedChannelSCurves(20);
+	otherSCurves.getFedChannelSCurves( 51, 0 ).getEntry( 2, 19 ).eventsOn()=6;
+
+	detectorSCurves.merge( otherSCurves );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(9), detectorSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(2), detectorSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOff() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(3), detectorSCurves.getStripSCurve( 50, 3, 8 ).getEntry(0).eventsOff() );
+	// Channels that weren't there before keep their number of bins
+	CPPUNIT_ASSERT_EQUAL( static_cast<size_t>(20), detectorSCurves.getFedChannelSCurves( 51, 0 ).numberOfBins() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(6), detectorSCurves.getFedChannelSCurves( 51, 0 ).getEntry( 2, 19 ).eventsOn() );
+
+	// Merging twice should double the other counts
+	cbcanalyser::DetectorSCurves twiceMerged( detectorSCurves );
+	twiceMerged.merge( otherSCurves );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(13), twiceMerged.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(12), twiceMerged.getFedChannelSCurves( 51, 0 ).getEntry( 2, 19 ).eventsOn() );
+
+	// A channel with a different number of bins, or counts that overflow, shouldn't change anything
+	const cbcanalyser::DetectorSCurves before( detectorSCurves );
+	cbcanalyser::DetectorSCurves mismatchedSCurves;
+	mismatchedSCurves.getStripSCurve( 49, 0, 0 ).getEntry(0).eventsOn()=1;
+	mismatchedSCurves.getFedSCurves(50).getFedChannelSCurves(3)=cbcanalyser::FedChannelSCurves(100);
+	mismatchedSCurves.getFedChannelSCurves( 50, 3 ).getEntry( 7, 10 ).eventsOn()=1;
+	CPPUNIT_ASSERT_THROW( detectorSCurves.merge( mismatchedSCurves ), std::runtime_error );
+
+	cbcanalyser::DetectorSCurves largeSCurves;
+	largeSCurves.getStripSCurve( 50, 3, 7 ).getEntry(10).eventsOn()=4294967295u;
+	CPPUNIT_ASSERT_THROW( detectorSCurves.merge( largeSCurves ), std::runtime_error );
+
+	std::stringstream beforeStream, afterStream;
+	before.dumpToStream( beforeStream );
+	detectorSCurves.dumpToStream( afterStream );
+	CPPUNIT_ASSERT( beforeStream.str()==afterStream.str() );
+}
+
+void SCurveUnitTestSuite::testLimits()
+{
+	cbcanalyser::DetectorSCurves detectorSCurves;
+	CPPUNIT_ASSERT_NO_THROW( detectorSCurves.getFedChannelSCurves( sistrip::FED_ID_MAX, 95 ) );
+	CPPUNIT_ASSERT_THROW( detectorSCurves.getFedSCurves( sistrip::FED_ID_MAX+1 ), std::out_of_range );
+	CPPUNIT_ASSERT_THROW( detectorSCurves.getFedChannelSCurves( 50, 96 ), std::out_of_range );
+	CPPUNIT_ASSERT( detectorSCurves.getValidFedIndices()==std::vector<size_t>{sistrip::FED_ID_MAX} );
+
+	// A saved state with a bad FED or channel number shouldn't create anything
+	cbcanalyser::DetectorSCurves restoredDetectorSCurves;
+	std::stringstream badFedStream( "DetectorSCurves 1 4000000000 FedSCurves 0 " );
+	CPPUNIT_ASSERT_THROW( restoredDetectorSCurves.restoreFromStream( badFedStream ), std::out_of_range );
+	std::stringstream badChannelStream( "DetectorSCurves 1 50 FedSCurves 1 1000 " );
+	CPPUNIT_ASSERT_THROW( restoredDetectorSCurves.restoreFromStream( badChannelStream ), std::out_of_range );
+	CPPUNIT_ASSERT( restoredDetectorSCurves.getValidFedIndices().empty() );
+
+	// Nor should counts that don't fit in the uint32_t they're stored in
+	cbcanalyser::SCurveEntry entry;
+	std::stringstream largestStream( "SCE 4294967295 7" );
+	CPPUNIT_ASSERT_NO_THROW( entry.restoreFromStream( largestStream ) );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(4294967295u), entry.eventsOn() );
+	std::stringstream tooLargeStream( "SCE 1 4294967296" );
+	CPPUNIT_ASSERT_THROW( entry.restoreFromStream( tooLargeStream ), std::runtime_error );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(4294967295u), entry.eventsOn() );
+	CPPUNIT_ASSERT_EQUAL( static_cast<uint32_t>(7), entry.eventsOff() );
+}
@@ -0,0 +1,186 @@
+"""
+Unit tests for runcontrol/pythonlib/SavedState.py. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import pythonlib.SavedState as SavedState
+
+def makeChannel( fedNumber, fedChannel, sCurves ) :
+	"""
+	Makes a SnapshotChannel from a dictionary of strip number to a list of [eventsOn,eventsOff] pairs.
+	"""
+	stripNumbers=sorted( sCurves.keys() )
+	numberOfBins=len( sCurves[stripNumbers[0]] ) if len(stripNumbers)!=0 else 0
+	counts=[ count for stripNumber in stripNumbers for entry in sCurves[stripNumber] for count in entry ]
+	return SavedState.SnapshotChannel( fedNumber, fedChannel, stripNumbers, numberOfBins, counts )
+
+def writeBinarySnapshot( filename, channels, stripThresholdOffsets, eventsProcessed, runsProcessed ) :
+	"""
+	Writes the binary layout described in interface/SCurveSnapshot.h, the same as SCurveSnapshot::write.
+	"""
+	def padding( size ) : return "\0"*( SavedState._padded(size)-size )
+	headerSize=SavedState._snapshotHeader.size
+	data=""
+	dataOffset=headerSize+SavedState._padded( 4*len(stripThresholdOffsets) )+SavedState._snapshotChannelRecord.size*len(channels)
+	records=""
+	for channel in channels :
+		records+=SavedState._snapshotChannelRecord.pack( channel.fedNumber, channel.fedChannel, len(channel.stripNumbers), channel.numberOfBins, dataOffset+len(data) )
+		stripNumbers=struct.pack( "<"+str(len(channel.stripNumbers))+"I", *channel.stripNumbers )
+		data+=stripNumbers+padding( len(stripNumbers) )
+		data+=struct.pack( "<"+str(len(channel.counts))+"I", *channel.counts )
+	offsets=struct.pack( "<"+str(len(stripThresholdOffsets))+"I", *stripThresholdOffsets )
+	outputFile=open( filename, 'wb' )
+	outputFile.write( SavedState._snapshotHeader.pack( SavedState.snapshotMagic, 1, 0x01020304, headerSize, len(channels), len(stripThresholdOffsets), 0, eventsProcessed, runsProcessed ) )
+	outputFile.write( offsets+padding( len(offsets) ) )
+	outputFile.write( records )
+	outputFile.write( data )
+	outputFile.close()
+
+class SavedStateUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.directory=tempfile.mkdtemp()
+
+	def tearDown( self ) :
+		shutil.rmtree( self.directory )
+
+	def filename( self, name ) :
+		return os.path.join( self.directory, name )
+
+	def writeText( self, name, channels, stripThresholdOffsets=[1,2,3], eventsProcessed=100, runsProcessed=2 ) :
+		filename=self.filename( name )
+		SavedState.writeTextState( filename, SavedState.Snapshot( channels, stripThresholdOffsets, eventsProcessed, runsProcessed ) )
+		return filename
+
+	def testTokensAcrossChunks( self ) :
+		text="DetectorSCurves  12 \n345 SCE\t6"
+		for chunkSize in [ 1, 2, 3, 5, 100 ] :
+			tokens=list( SavedState._tokens( StringIO.StringIO(text), chunkSize ) )
+			self.assertEqual( [ "DetectorSCurves", "12", "345", "SCE", "6" ], tokens )
+
+	def testTextRoundTrip( self ) :
+		channels=[ makeChannel( 50, 3, { 0:[[1,2],[3,4]], 7:[[5,6],[7,8]] } ), makeChannel( 50, 1, { 2:[[9,10],[11,12]] } ), makeChannel( 2, 0, { 127:[[0,1],[1,0]] } ) ]
+		filename=self.writeText( "state.log", channels )
+		self.assertFalse( os.path.exists( filename+".tmp" ) )
+		self.assertFalse( SavedState.isSnapshotFile( filename ) )
+
+		snapshot=SavedState.readTextState( filename )
+		self.assertEqual( [1,2,3], snapshot.stripThresholdOffsets )
+		self.assertEqual( 100, snapshot.eventsProcessed )
+		self.assertEqual( 2, snapshot.runsProcessed )
+		# Written in order of FED number then FED channel
+		self.assertEqual( [ (2,0), (50,1), (50,3) ], [ (channel.fedNumber,channel.fedChannel) for channel in snapshot.channels ] )
+		self.assertEqual( [0,7], snapshot.channels[2].stripNumbers )
+		self.assertEqual( [[5,6],[7,8]], snapshot.channels[2].stripSCurve(1) )
+
+		sCurves=SavedState.readSCurves( filename )
+		self.assertEqual( 4, len(sCurves) )
+		self.assertEqual( [[9,10],[11,12]], sCurves[(50,1,2)] )
+		self.assertEqual( { (50,3,0):[4,6], (50,3,7):[12,14], (50,1,2):[20,22], (2,0,127):[1,1] }, SavedState.readStripTotals( filename ) )
+
+	def testIterateTextChannels( self ) :
+		channels=[ makeChannel( 1, channelNumber, { 0:[[channelNumber,1]]*3 } ) for channelNumber in range(5) ]
+		filename=self.writeText( "state.log", channels )
+
+		iterator=SavedState.iterateTextChannels( filename )
+		firstChannel=next( iterator )
+		self.assertEqual( (1,0), (firstChannel.fedNumber,firstChannel.fedChannel) )
+		self.assertEqual( 4, len(list(iterator)) )
+
+		# Only the requested channels are returned, and the counts stay valid afterwards
+		selected=list( SavedState.iterateTextChannels( filename, channels=[ (1,3), (1,1), (7,0) ] ) )
+		self.assertEqual( [1,3], [ channel.fedChannel for channel in selected ] )
+		self.assertEqual( [[3,1]]*3, selected[1].stripSCurve(0) )
+
+		visited=[]
+		offsets, events, runs=SavedState.streamState( filename, lambda channel : visited.append( channel.fedChannel ), channels=set([ (1,4) ]) )
+		self.assertEqual( [4], visited )
+		self.assertEqual( ( [1,2,3], 100, 2 ), ( offsets, events, runs ) )
+
+	def testEmptyAndTruncatedFiles( self ) :
+		emptyFilename=self.filename( "empty.log" )
+		open( emptyFilename, 'w' ).close()
+		self.assertEqual( [], list( SavedState.iterateTextChannels( emptyFilename ) ) )
+		self.assertEqual( {}, SavedState.readSCurves( emptyFilename ) )
+		self.assertEqual( ( [], 0, 0 ), SavedState.streamState( emptyFilename, lambda channel : None ) )
+
+		filename=self.writeText( "state.log", [ makeChannel( 1, 2, { 3:[[4,5]]*4 } ) ] )
+		contents=open( filename ).read()
+		truncatedFilename=self.filename( "truncated.log" )
+		open( truncatedFilename, 'w' ).write( contents[:len(contents)//2] )
+		self.assertRaises( Exception, SavedState.readTextState, truncatedFilename )
+		open( truncatedFilename, 'w' ).write( contents.replace( "SCurve", "SCurf", 1 ) )
+		self.assertRaises( Exception, SavedState.readTextState, truncatedFilename )
+
+	def testSnapshot( self ) :
+		filename=self.filename( "snapshot.dat" )
+		writeBinarySnapshot( filename, [ makeChannel( 4, 5, { 1:[[1,2],[3,4],[5,6]], 9:[[7,8],[9,10],[11,12]] } ) ], [6,7], 20, 1 )
+		self.assertTrue( SavedState.isSnapshotFile( filename ) )
+		snapshot=SavedState.readSnapshot( filename )
+		self.assertEqual( ( [6,7], 20, 1 ), ( snapshot.stripThresholdOffsets, snapshot.eventsProcessed, snapshot.runsProcessed ) )
+		self.assertEqual( [1,9], snapshot.channels[0].stripNumbers )
+		self.assertEqual( [[7,8],[9,10],[11,12]], snapshot.channels[0].stripSCurve(1) )
+
+		contents=open( filename, 'rb' ).read()
+		open( filename, 'wb' ).write( contents[:-4] )
+		self.assertRaises( Exception, SavedState.readSnapshot, filename )
+
+	def testMergeStates( self ) :
+		firstFilename=self.writeText( "first.log", [ makeChannel( 1, 0, { 0:[[1,2],[3,4]], 1:[[5,6],[7,8]] } ), makeChannel( 1, 1, { 0:[[1,1],[1,1]] } ) ], eventsProcessed=10, runsProcessed=1 )
+		secondFilename=self.filename( "second.dat" )
+		writeBinarySnapshot( secondFilename, [ makeChannel( 1, 0, { 1:[[10,20],[30,40]], 2:[[2,2],[2,2]] } ), makeChannel( 3, 7, { 5:[[0,9],[9,0]] } ) ], [1,2,3], 20, 2 )
+		emptyFilename=self.filename( "empty.log" )
+		open( emptyFilename, 'w' ).close()
+
+		merged=SavedState.mergeStates( [ firstFilename, emptyFilename, secondFilename ] )
+		self.assertEqual( [1,2,3], merged.stripThresholdOffsets )
+		self.assertEqual( 30, merged.eventsProcessed )
+		self.assertEqual( 3, merged.runsProcessed )
+		self.assertEqual( [ (1,0), (1,1), (3,7) ], [ (channel.fedNumber,channel.fedChannel) for channel in merged.channels ] )
+		self.assertEqual( [0,1,2], merged.channels[0].stripNumbers )
+		self.assertEqual( [[1,2],[3,4]], merged.channels[0].stripSCurve(0) )
+		self.assertEqual( [[15,26],[37,48]], merged.channels[0].stripSCurve(1) )
+		self.assertEqual( [[2,2],[2,2]], merged.channels[0].stripSCurve(2) )
+
+		# The merged state can be written and read back the same
+		outputFilename=self.filename( "merged.log" )
+		SavedState.writeTextState( outputFilename, merged )
+		self.assertEqual( SavedState.readSCurves( outputFilename )[(1,0,1)], [[15,26],[37,48]] )
+
+		selected=SavedState.mergeStates( [ firstFilename, secondFilename ], channels=set([ (3,7) ]) )
+		self.assertEqual( [ (3,7) ], [ (channel.fedNumber,channel.fedChannel) for channel in selected.channels ] )
+
+	def testMergeStatesMismatches( self ) :
+		firstFilename=self.writeText( "first.log", [ makeChannel( 1, 0, { 0:[[1,2],[3,4]] } ) ] )
+		differentBinsFilename=self.writeText( "bins.log", [ makeChannel( 1, 0, { 0:[[1,2],[3,4],[5,6]] } ) ] )
+		self.assertRaises( Exception, SavedState.mergeStates, [ firstFilename, differentBinsFilename ] )
+
+		differentOffsetsFilename=self.writeText( "offsets.log", [ makeChannel( 1, 0, { 0:[[1,2],[3,4]] } ) ], stripThresholdOffsets=[9,9,9] )
+		self.assertRaises( Exception, SavedState.mergeStates, [ firstFilename, differentOffsetsFilename ] )
+		merged=SavedState.mergeStates( [ firstFilename, differentOffsetsFilename ], allowDifferentOffsets=True )
+		self.assertEqual( [1,2,3], merged.stripThresholdOffsets )
+		self.assertEqual( [[2,4],[6,8]], merged.channels[0].stripSCurve(0) )
+
+		largeFilename=self.writeText( "large.log", [ makeChannel( 1, 0, { 0:[[0xffffffff,0],[0,0]] } ) ] )
+		self.assertRaises( Exception, SavedState.mergeStates, [ firstFilename, largeFilename ] )
+
+	def testFailedWriteLeavesNothingBehind( self ) :
+		filename=self.writeText( "state.log", [ makeChannel( 1, 0, { 0:[[1,2]] } ) ] )
+		originalContents=open( filename ).read()
+		# Claims more bins than there are counts, so writing fails part way through
+		brokenChannel=SavedState.SnapshotChannel( 1, 0, [0,1], 5, [1,2,3] )
+		self.assertRaises( IndexError, SavedState.writeTextState, filename, SavedState.Snapshot( [brokenChannel], [], 0, 0 ) )
+		self.assertFalse( os.path.exists( filename+".tmp" ) )
+		self.assertEqual( originalContents, open( filename ).read() )
+
+if __name__ == '__main__' :
+	unittest.main()
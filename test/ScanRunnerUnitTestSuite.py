@@ -0,0 +1,141 @@
+"""
+Unit tests for runcontrol/ScanRunner.py, running against SimulatedXDAQ and a supply from
+SimulatedInstrument. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import time
+import socket
+import urlparse
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import SimulatedXDAQ
+import ScanRunner
+import pythonlib.PowerSupply as PowerSupply
+import SimulatedSetup
+
+class SimulatedAnalyser( SimulatedXDAQ._SimulatedServer ) :
+	"""
+	Stand-in for the HTTP server of AnalyseCBCOutput that keeps a note of every threshold it's
+	told, and when.
+	"""
+	def __init__( self, settings ) :
+		SimulatedXDAQ._SimulatedServer.__init__( self, ("127.0.0.1",0), settings )
+		self.port=self.server_address[1]
+		self.thresholds=[] # List of (time,threshold)
+
+	def handleRequest( self, method, path, headers, body ) :
+		url=urlparse.urlparse( path )
+		if url.path!="/changeVar" : return SimulatedXDAQ._SimulatedServer.handleRequest( self, method, path, headers, body )
+		parameters=urlparse.parse_qs( url.query )
+		self.thresholds.append( (time.time(),float(parameters["globalComparatorThreshold_"][-1])) )
+		return ( 200, "text/plain", "OK" )
+
+class DropFirstRequestSettings( SimulatedXDAQ.SimulationSettings ) :
+	"""
+	SimulationSettings that close the connection without replying to the first request only.
+	"""
+	def __init__( self ) :
+		self.requests=0
+		super(DropFirstRequestSettings,self).__init__()
+
+	@property
+	def dropProbability( self ) :
+		# Read once for every request
+		self.requests+=1
+		return 1.0 if self.requests==1 else 0.0
+
+	@dropProbability.setter
+	def dropProbability( self, value ) : pass
+
+class ScanRunnerUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.simulation=SimulatedSetup.SimulatedSetup( numberOfChannels=8 )
+		self.program=self.simulation.program
+		self.program.initialise()
+		self.program.configure( triggerRate=1024, numberOfEvents=20 )
+		self.stopTimes=[]
+		self.program.endRunHooks.append( lambda runNumber : self.stopTimes.append( time.time() ) )
+		self.analyser=SimulatedAnalyser( self.simulation.settings )
+		self.analyser.start()
+		self.supply=PowerSupply.PowerSupply( verbose=False, cacheState=True, simulated=True )
+
+	def tearDown( self ) :
+		self.analyser.kill()
+		self.simulation.stop()
+
+	def createRunner( self, **keywords ) :
+		return ScanRunner.ScanRunner( self.program, self.supply, triggerRate=1024, analyserPort=self.analyser.port, pollInterval=0.05, verbose=False, **keywords )
+
+	def testPoints( self ) :
+		runner=self.createRunner()
+		thresholds=[ 0.1, 0.5, 0.3 ]
+		for threshold in thresholds : runner( threshold, 20 )
+		# The last run is left going until the next point, or finish
+		self.assertEqual( 2, len(self.stopTimes) )
+		self.assertEqual( "Enabled", self.simulation.simulatedApplication( "GlibSupervisor" ).state() )
+		runner.finish()
+		runner.finish()
+		self.assertEqual( 3, len(self.stopTimes) )
+		self.assertEqual( "Configured", self.simulation.simulatedApplication( "GlibSupervisor" ).state() )
+
+		self.assertEqual( 3, self.program.runNumber )
+		self.assertEqual( 20, self.simulation.hardware.eventsAcquired() )
+		self.assertEqual( 0.3*runner.voltageRange, self.supply.getOutput()["voltage"] )
+		self.assertEqual( len(thresholds), len(self.analyser.thresholds) )
+		for index,threshold in enumerate(thresholds) :
+			self.assertAlmostEqual( threshold, self.analyser.thresholds[index][1] )
+			# The analyser isn't told the new threshold until the previous run has stopped
+			if index>0 : self.assertTrue( self.analyser.thresholds[index][0]>=self.stopTimes[index-1] )
+
+		self.assertEqual( 4, len(runner.records) )
+		for transition,records in runner.records[0:3] :
+			self.assertEqual( ["analyser","prepare","run","stopPrevious","supply"], sorted(records.keys()) )
+			self.assertEqual( "run", transition.criticalPath( records )[-1].step.name )
+		report=runner.timingReport()
+		for name in [ "stopPrevious", "supply", "prepare", "analyser", "run", "Wall time for 4 transitions" ] :
+			self.assertTrue( name in report )
+
+	def testAnalyserUpdateOverlapsStop( self ) :
+		runner=self.createRunner( analyserUpdateWaitsForStop=False )
+		runner( 0.1, 20 )
+		runner( 0.2, 20 )
+		runner.finish()
+		analyserStep=[ step for step in runner.records[1][0].steps if step.name=="analyser" ][0]
+		self.assertEqual( ["supply"], analyserStep.dependencies )
+		self.assertAlmostEqual( 0.2, self.analyser.thresholds[-1][1] )
+
+	def testAnalyserUnavailable( self ) :
+		runner=self.createRunner()
+		self.analyser.kill()
+		# The threshold is tried again before the run, and the run isn't taken if that fails too
+		self.assertRaises( socket.error, runner, 0.1, 20 )
+		self.assertEqual( 0, self.program.runNumber )
+
+	def testAnalyserDropsConnection( self ) :
+		self.analyser.kill()
+		self.analyser=SimulatedAnalyser( DropFirstRequestSettings() )
+		self.analyser.start()
+		runner=self.createRunner()
+		# No reply is an httplib.BadStatusLine rather than a socket.error, and is retried the same way
+		runner( 0.1, 20 )
+		self.assertEqual( 2, self.analyser.settings.requests )
+		self.assertEqual( 1, len(self.analyser.thresholds) )
+		self.assertEqual( 1, self.program.runNumber )
+		runner.finish()
+
+	def testAfterFinishing( self ) :
+		runner=self.createRunner()
+		runner( 0.1, 20 )
+		supervisor=self.simulation.simulatedApplication( "GlibSupervisor" )
+		states=[]
+		readStates=runner.afterFinishing( lambda : states.append( supervisor.state() ) )
+		readStates()
+		self.assertEqual( ["Configured"], states )
+
+if __name__ == '__main__' :
+	unittest.main()
@@ -0,0 +1,138 @@
+"""
+Helpers for the unit tests that run GlibProgram against SimulatedXDAQ instead of real XDAQ
+processes. This isn't a test suite itself, the *UnitTestSuite.py files import it.
+"""
+
+import os
+import sys
+import errno
+import shutil
+import socket
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import SimulatedXDAQ
+import XDAQTools
+import GlibProgram
+
+# The (className,id,instance) of the applications in each context of the config file
+contextApplications=[
+	[ ("GlibSupervisor",30,0), ("pt::atcp::PeerTransportATCP",20,0) ],
+	[ ("GlibStreamer",31,0), ("TrackerManager",32,0), ("rubuilder::ru::Application",33,0), ("pt::atcp::PeerTransportATCP",21,1) ]
+	]
+
+def freePort() :
+	"""
+	Returns a port that nothing is listening on at the moment
+	"""
+	listener=socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+	listener.bind( ("127.0.0.1",0) )
+	port=listener.getsockname()[1]
+	listener.close()
+	return port
+
+def writeConfigFile( filename, ports ) :
+	"""
+	Writes an XDAQ config file with the applications in contextApplications, each context on
+	localhost at the port with the same index in "ports".
+	"""
+	outputFile=open( filename, 'w' )
+	outputFile.write( '<xc:Partition xmlns:xc="http://xdaq.web.cern.ch/xdaq/xsd/2004/XMLConfiguration-30">\n' )
+	for port,applications in zip( ports, contextApplications ) :
+		outputFile.write( '\t<xc:Context url="http://127.0.0.1:'+str(port)+'">\n' )
+		for className,id,instance in applications :
+			outputFile.write( '\t\t<xc:Application class="'+className+'" id="'+str(id)+'" instance="'+str(instance)+'" network="local"/>\n' )
+		outputFile.write( '\t</xc:Context>\n' )
+	outputFile.write( '</xc:Partition>\n' )
+	outputFile.close()
+
+def writeI2cFile( filename, numberOfChannels ) :
+	"""
+	Writes a list of I2C registers in the format I2cChip reads, with a few global registers
+	followed by the trim for each channel.
+	"""
+	outputFile=open( filename, 'w' )
+	outputFile.write( "* RegName              RegAddr  DefData  WrData\n" )
+	outputFile.write( "FrontEndControl        0x00     0x3c     0x7f\n" )
+	outputFile.write( "TriggerLatency         0x01     0xc8     0xc8\n" )
+	outputFile.write( "VCth                   0x0c     0x78     0x78\n" )
+	for channel in range(numberOfChannels) :
+		outputFile.write( ("Channel"+str(channel)).ljust(23)+hex(channel+0x20).ljust(9)+"0x50     0x50\n" )
+	outputFile.close()
+
+class SimulatedSetup(object) :
+	"""
+	A GlibProgram with everything it needs in a temporary directory. If "useExecutive" is False
+	the contexts are started straight away and marked as running, as if the processes had been
+	started earlier. Otherwise a SimulatedExecutive starts them when asked, like the real daemon.
+	That has to listen on port 9999, so unittest.SkipTest is raised if something else already is.
+
+	Call "stop()" when finished to kill everything and remove the directory.
+	"""
+	def __init__( self, settings=None, useExecutive=False, numberOfChannels=128, concurrent=True ) :
+		if settings==None : settings=SimulatedXDAQ.SimulationSettings()
+		self.settings=settings
+		self.directory=tempfile.mkdtemp()
+		self.contexts=[]
+		self.executive=None
+		self._originalEnvironment=dict( os.environ )
+		try :
+			self._setEnvironment()
+			self.ports=[ freePort() for applications in contextApplications ]
+			self.configFilename=os.path.join( self.directory, "config.xml" )
+			writeConfigFile( self.configFilename, self.ports )
+			self.i2cFilename=os.path.join( self.directory, "i2cRegisters.txt" )
+			writeI2cFile( self.i2cFilename, numberOfChannels )
+
+			if useExecutive :
+				try : self.executive=SimulatedXDAQ.SimulatedExecutive( "127.0.0.1", 9999, settings )
+				except socket.error as error :
+					if error.errno==errno.EADDRINUSE : raise unittest.SkipTest( "Something is already listening on the XDAQ daemon port" )
+					raise
+				self.executive.start()
+				self.hardware=self.executive.hardware
+			else :
+				self.hardware=SimulatedXDAQ.SimulatedGlib()
+				for port,applications in zip( self.ports, contextApplications ) :
+					simulatedApplications=[ SimulatedXDAQ.createApplication( className, id, instance, self.hardware ) for className,id,instance in applications ]
+					context=SimulatedXDAQ.SimulatedContext( ("127.0.0.1",port), settings, simulatedApplications )
+					self.hardware.addApplications( simulatedApplications )
+					context.start()
+					self.contexts.append( context )
+
+			self.program=GlibProgram.GlibProgram( self.configFilename, concurrent, self.i2cFilename )
+			if not useExecutive :
+				for context in self.program.contexts : context.jobid="0"
+		except :
+			self.stop()
+			raise
+
+	def simulatedApplication( self, className ) :
+		"""
+		Returns the SimulatedApplication with the given class name that is currently running
+		"""
+		for application in self.hardware.applications() :
+			if application.className==className : return application
+		return None
+
+	def stop( self ) :
+		if self.executive!=None : self.executive.kill()
+		for context in self.contexts : context.kill()
+		XDAQTools.connectionPool.closeAll()
+		os.environ.clear()
+		os.environ.update( self._originalEnvironment )
+		shutil.rmtree( self.directory )
+
+	def _setEnvironment( self ) :
+		"""
+		XDAQTools checks that the environment variables the XDAQ processes need are set before it
+		asks the daemon to start them, and the GlibSupervisor configuration uses CMSSW_BASE. None
+		of them matter for the simulation, so anything missing is set to the temporary directory.
+		"""
+		for name in [ "XDAQ_OS", "XDAQ_PLATFORM", "ROOTSYS", "CMSSW_SEARCH_PATH", "ENV_CMS_TK_FEC_ROOT",
+				"ENV_CMS_TK_FED9U_ROOT", "ENV_CMS_TK_TTC_ROOT", "ENV_CMS_TK_LTC_ROOT", "ENV_CMS_TK_TTCCI_ROOT",
+				"HOME", "ENV_CMS_TK_CAEN_ROOT", "ENV_CMS_TK_APVE_ROOT", "ENV_CMS_TK_SBS_ROOT", "ENV_CMS_TK_HAL_ROOT",
+				"ENV_CMS_TK_DIAG_ROOT", "HOSTNAME", "ENV_TRACKER_DAQ", "CMSSW_BASE", "CMSSW_RELEASE_BASE",
+				"CMSSW_VERSION", "USER" ] :
+			if os.getenv( name )==None : os.environ[name]=self.directory
@@ -0,0 +1,118 @@
+"""
+Unit tests for runcontrol/ThresholdScan.py. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import math
+import random
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import ThresholdScan
+
+def turnOn( plateau, mean, width, bin ) :
+	"""The fraction of events on, rising if width is positive and falling if it's negative."""
+	return plateau*0.5*( 1+math.erf( (bin-mean)/(width*math.sqrt(2)) ) )
+
+def exactEntries( plateau, mean, width, numberOfBins=64, eventsPerBin=1000 ) :
+	entries=[]
+	for bin in range(numberOfBins) :
+		eventsOn=int( round( turnOn( plateau, mean, width, bin )*eventsPerBin ) )
+		entries.append( [eventsOn,eventsPerBin-eventsOn] )
+	return entries
+
+class SimulatedStrips(object) :
+	"""
+	Stand-in for the analyser's s-curves when a run is taken at each threshold, with the given
+	(plateau,mean,width) for each strip in bins. Gives "takePoint" and "readSCurves" for an
+	AdaptiveThresholdScan.
+	"""
+	def __init__( self, parameters, numberOfBins=256, seed=1234 ) :
+		self.parameters=parameters
+		self.numberOfBins=numberOfBins
+		self.random=random.Random( seed )
+		self.sCurves=dict( [ (strip,[ [0,0] for bin in range(numberOfBins) ]) for strip in range(len(parameters)) ] )
+
+	def takePoint( self, threshold, numberOfEvents ) :
+		bin=int( threshold*self.numberOfBins )
+		for strip,(plateau,mean,width) in enumerate(self.parameters) :
+			fraction=turnOn( plateau, mean, width, bin )
+			eventsOn=len( [ event for event in range(numberOfEvents) if self.random.random()<fraction ] )
+			self.sCurves[strip][bin][0]+=eventsOn
+			self.sCurves[strip][bin][1]+=numberOfEvents-eventsOn
+
+	def readSCurves( self ) :
+		return dict( [ (strip,[ list(entry) for entry in entries ]) for strip,entries in self.sCurves.iteritems() ] )
+
+class ThresholdScanUnitTestSuite( unittest.TestCase ) :
+	def testEstimateSCurve( self ) :
+		estimate=ThresholdScan.estimateSCurve( exactEntries( 0.9, 20.3, 2.0 ) )
+		self.assertAlmostEqual( 0.9, estimate["plateau"], delta=0.005 )
+		self.assertAlmostEqual( 20.3, estimate["mean"], delta=0.1 )
+		self.assertAlmostEqual( 2.0, estimate["width"], delta=0.2 )
+		# Limited by the resolution of one bin
+		self.assertTrue( 0.25<estimate["meanError"]<0.5 )
+		self.assertTrue( 0.15<estimate["widthError"]<0.5 )
+
+		estimate=ThresholdScan.estimateSCurve( exactEntries( 1.0, 40.0, -4.0 ) )
+		self.assertAlmostEqual( 40.0, estimate["mean"], delta=0.1 )
+		self.assertAlmostEqual( 4.0, estimate["width"], delta=0.2 )
+
+	def testEstimatePartialSCurve( self ) :
+		entries=exactEntries( 1.0, 30.0, 3.0 )
+		# Bins without data are ignored, so the estimate is the same but with larger errors
+		sparseEntries=[ entry if bin%4==0 else [0,0] for bin,entry in enumerate(entries) ]
+		estimate=ThresholdScan.estimateSCurve( entries )
+		sparseEstimate=ThresholdScan.estimateSCurve( sparseEntries )
+		self.assertAlmostEqual( 30.0, sparseEstimate["mean"], delta=1.0 )
+		self.assertAlmostEqual( 3.0, sparseEstimate["width"], delta=1.0 )
+		self.assertTrue( sparseEstimate["meanError"]>estimate["meanError"] )
+		self.assertTrue( sparseEstimate["widthError"]>estimate["widthError"] )
+		self.assertEqual( None, ThresholdScan.estimateSCurve( sparseEntries, minimumEvents=1001 ) )
+
+	def testEstimateWithoutTurnOn( self ) :
+		self.assertEqual( None, ThresholdScan.estimateSCurve( [] ) )
+		self.assertEqual( None, ThresholdScan.estimateSCurve( [[5,5]] ) )
+		self.assertEqual( None, ThresholdScan.estimateSCurve( [[0,10]]*20 ) )
+		self.assertEqual( None, ThresholdScan.estimateSCurve( [[10,0]]*20 ) )
+
+	def testThresholdForBin( self ) :
+		scan=ThresholdScan.AdaptiveThresholdScan( None, None, numberOfBins=256 )
+		for bin in [ 0, 1, 127, 255 ] :
+			self.assertEqual( bin, int( scan.thresholdForBin(bin)*256 ) )
+
+	def testAdaptiveScan( self ) :
+		parameters=[ (1.0,100.3,2.0), (0.95,110.0,3.5), (0.9,95.5,1.5), (1.0,104.0,-2.5) ]
+		strips=SimulatedStrips( parameters )
+		scan=ThresholdScan.AdaptiveThresholdScan( strips.takePoint, strips.readSCurves, coarseEvents=200, fineEvents=1000, verbose=False )
+		estimates=scan.run()
+
+		for strip,(plateau,mean,width) in enumerate(parameters) :
+			estimate=estimates[strip]
+			self.assertTrue( estimate["meanError"]<=scan.targetMeanPrecision )
+			self.assertTrue( estimate["widthError"]<=scan.targetWidthPrecision )
+			self.assertAlmostEqual( mean, estimate["mean"], delta=3*estimate["meanError"] )
+			self.assertAlmostEqual( abs(width), estimate["width"], delta=3*estimate["widthError"] )
+
+		# The coarse pass covers everything, then the points get closer together in the turn on region only
+		self.assertEqual( range(0,256,16), [ bin for bin,events in scan.pointsTaken[0:16] ] )
+		fineBins=[ bin for bin,events in scan.pointsTaken if events==scan.fineEvents ]
+		# The coarse estimates of the width can be up to the coarse spacing, so allow three of those
+		self.assertTrue( min(fineBins)>=95.5-3*16 )
+		self.assertTrue( max(fineBins)<=110.0+3*16 )
+		# Far fewer events than stepping through every bin with the fine number of events
+		self.assertTrue( sum( [ events for bin,events in scan.pointsTaken ] )<0.3*256*scan.fineEvents )
+
+	def testAdaptiveScanWithoutTurnOn( self ) :
+		strips=SimulatedStrips( [ (0.0,100.0,2.0) ]*2 )
+		scan=ThresholdScan.AdaptiveThresholdScan( strips.takePoint, strips.readSCurves, maximumPasses=3, verbose=False )
+		self.assertEqual( { 0:None, 1:None }, scan.run() )
+		# The whole range is gone over more finely each pass, without repeating points
+		self.assertEqual( 16+16+32, len(scan.pointsTaken) )
+		self.assertEqual( range(0,256,4), sorted( [ bin for bin,events in scan.pointsTaken ] ) )
+
+if __name__ == '__main__' :
+	unittest.main()
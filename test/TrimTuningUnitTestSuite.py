@@ -0,0 +1,118 @@
+"""
+Unit tests for runcontrol/TrimTuning.py, with the trims sent to the GlibSupervisor of
+SimulatedXDAQ. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import math
+import random
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import TrimTuning
+import SimulatedSetup
+
+class SimulatedOccupancies(object) :
+	"""
+	Callable for the "measureOccupancies" of a TrimTuner. Each strip's occupancy is an s-curve
+	in the trim that has actually been written to the simulated board, with the midpoint at
+	"trimsNeeded[channel]" and a width of "width".
+	"""
+	def __init__( self, hardware, trimsNeeded, width, higherTrimMeansHigherOccupancy=True ) :
+		self.hardware=hardware
+		self.trimsNeeded=trimsNeeded
+		self.width=width
+		self.direction=( 1 if higherTrimMeansHigherOccupancy else -1 )
+		self.runs=0
+
+	def __call__( self ) :
+		self.runs+=1
+		occupancies=[]
+		for channel,trimNeeded in enumerate(self.trimsNeeded) :
+			trim=self.hardware.registerValues["Channel"+str(channel)]
+			occupancies.append( 0.5*( 1+math.erf( self.direction*(trim-trimNeeded)/(self.width*math.sqrt(2)) ) ) )
+		return occupancies
+
+class PreparedOccupancies(SimulatedOccupancies) :
+	"""
+	SimulatedOccupancies that calls "prepareRun" on the program first, like a
+	SavedStateOccupancyMeasurement does, so the processes can be restarted in between the
+	trims being sent and the occupancies being measured.
+	"""
+	def __init__( self, program, hardware, trimsNeeded, width ) :
+		super(PreparedOccupancies,self).__init__( hardware, trimsNeeded, width )
+		self.program=program
+
+	def __call__( self ) :
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20 )
+		return super(PreparedOccupancies,self).__call__()
+
+class TrimTuningUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.numberOfChannels=16
+		self.simulation=None
+		generator=random.Random( 1234 )
+		self.trimsNeeded=[ generator.uniform( 2.0, 253.0 ) for channel in range(self.numberOfChannels) ]
+
+	def tearDown( self ) :
+		if self.simulation!=None : self.simulation.stop()
+
+	def startSimulation( self, useExecutive=False ) :
+		self.simulation=SimulatedSetup.SimulatedSetup( useExecutive=useExecutive, numberOfChannels=self.numberOfChannels )
+		self.program=self.simulation.program
+		self.supervisor=self.program.supervisor
+		self.hardware=self.simulation.hardware
+
+	def tune( self, width, tolerance, higherTrimMeansHigherOccupancy=True, measurement=None ) :
+		if measurement==None : measurement=SimulatedOccupancies( self.hardware, self.trimsNeeded, width, higherTrimMeansHigherOccupancy )
+		self.measurement=measurement
+		self.tuner=TrimTuning.TrimTuner( self.supervisor, self.measurement, numberOfChannels=self.numberOfChannels,
+			higherTrimMeansHigherOccupancy=higherTrimMeansHigherOccupancy, verbose=False )
+		return self.tuner.tune( tolerance )
+
+	def checkTrims( self, trims, maximumDifference ) :
+		for channel in range(self.numberOfChannels) :
+			self.assertTrue( abs( trims[channel]-self.trimsNeeded[channel] )<=maximumDifference )
+			# The best trims are left on the board
+			self.assertEqual( trims[channel], self.hardware.registerValues["Channel"+str(channel)] )
+		self.assertEqual( 0, self.supervisor.sendI2c() )
+
+	def testConvergence( self ) :
+		self.startSimulation()
+		for higherTrimMeansHigherOccupancy in [ True, False ] :
+			trims=self.tune( 2.0, 0.0, higherTrimMeansHigherOccupancy )
+			# A binary search over 8 bits, one run per step
+			self.assertEqual( 8, self.measurement.runs )
+			self.assertEqual( 8, len(self.tuner.spreadHistory) )
+			self.assertTrue( self.tuner.spreadHistory[-1]<0.3*self.tuner.spreadHistory[0] )
+			# The trims left on the board are the best of those tried, so the nearest to the midpoint
+			self.assertTrue( self.tuner.spread( self.measurement() )<=min(self.tuner.spreadHistory) )
+			self.checkTrims( trims, 0.5 )
+
+	def testTolerance( self ) :
+		self.startSimulation()
+		# With wide s-curves the occupancies are all near the target well before the search ends
+		trims=self.tune( 40.0, 0.05 )
+		self.assertTrue( self.measurement.runs<8 )
+		self.assertEqual( len(self.tuner.spreadHistory), self.measurement.runs )
+		for occupancy in self.measurement() : self.assertTrue( abs(occupancy-0.5)<=0.05 )
+		self.checkTrims( trims, 40.0*0.05*math.sqrt(2*math.pi) )
+
+	def testRestartDuringTuning( self ) :
+		self.startSimulation( useExecutive=True )
+		self.program.prepareRun( triggerRate=1024, numberOfEvents=20 )
+		jobIDs=[ context.jobid for context in self.program.contexts ]
+		# Not "Configured" any more, so the first measurement restarts everything after the trims have
+		# been sent. The new processes reset the board, and the trims have to be sent to it again.
+		self.program.halt()
+		measurement=PreparedOccupancies( self.program, self.hardware, self.trimsNeeded, 2.0 )
+		trims=self.tune( 2.0, 0.0, measurement=measurement )
+		self.assertNotEqual( jobIDs, [ context.jobid for context in self.program.contexts ] )
+		self.assertEqual( 8, self.measurement.runs )
+		self.checkTrims( trims, 0.5 )
+
+if __name__ == '__main__' :
+	unittest.main()
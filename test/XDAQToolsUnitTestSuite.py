@@ -0,0 +1,216 @@
+"""
+Unit tests for runcontrol/XDAQTools.py, using SimulatedXDAQ for anything that needs an XDAQ
+process. Run from this directory with
+
+	python -m unittest discover -p "*UnitTestSuite.py"
+"""
+
+import os
+import sys
+import time
+import socket
+import unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath(__file__) ), "..", "runcontrol" ) )
+import SimulatedXDAQ
+import XDAQTools
+from SimulatedSetup import freePort
+
+class ActionOnlyProgram(object) :
+	"""
+	All a Transition needs from the Program when none of the steps send commands.
+	"""
+	def __init__( self, concurrent=True ) :
+		self.concurrent=concurrent
+
+class XDAQToolsUnitTestSuite( unittest.TestCase ) :
+	def setUp( self ) :
+		self.settings=SimulatedXDAQ.SimulationSettings()
+		self.contexts=[]
+		self.simulatedApplication=SimulatedXDAQ.createApplication( "GlibSupervisor", 30, 0, SimulatedXDAQ.SimulatedGlib() )
+		# Keep a note of every state machine command that actually reaches the application
+		self.commandsReceived=[]
+		originalCommand=self.simulatedApplication.command
+		def recordCommand( command, latency ) :
+			self.commandsReceived.append( command )
+			return originalCommand( command, latency )
+		self.simulatedApplication.command=recordCommand
+
+		self.port=freePort()
+		self.pool=XDAQTools.ConnectionPool( timeout=2.0 )
+		self.application=XDAQTools.Application( "127.0.0.1", self.port, "GlibSupervisor", 0, 30 )
+		self.application.connectionPool=self.pool
+
+	def tearDown( self ) :
+		for context in self.contexts : context.kill()
+		self.pool.closeAll()
+
+	def startContext( self ) :
+		"""
+		Starts a new process listening on self.port, with the same application as any before
+		"""
+		context=SimulatedXDAQ.SimulatedContext( ("127.0.0.1",self.port), self.settings, [self.simulatedApplication] )
+		context.start()
+		self.contexts.append( context )
+		return context
+
+	def waitForCommands( self, timeout ) :
+		"""
+		Waits until the application has received a command, or "timeout" seconds have passed.
+		"""
+		endTime=time.time()+timeout
+		while len(self.commandsReceived)==0 and time.time()<endTime : time.sleep( 0.01 )
+
+	def testConnectionReuse( self ) :
+		self.startContext()
+		for index in range(3) : self.assertEqual( "Initial", self.application.getState() )
+		response=self.application.httpRequest( "GET", "/urn:xdaq-application:lid=30" )
+		self.assertEqual( 200, response.status )
+		self.assertTrue( "GlibSupervisor is Initial" in response.fullMessage )
+		# Other applications on the same host and port share the connections
+		otherApplication=XDAQTools.Application( "127.0.0.1", self.port, "GlibSupervisor", 0, 30 )
+		otherApplication.connectionPool=self.pool
+		self.assertEqual( "Initial", otherApplication.getState() )
+		self.assertEqual( 1, self.pool.connectionsOpened )
+		self.assertEqual( 4, self.pool.connectionsReused )
+
+	def testRetryAfterRestart( self ) :
+		context=self.startContext()
+		self.assertEqual( "Initial", self.application.getState() )
+		context.kill()
+		self.startContext()
+		# The pooled connection was dropped by the old process, so the command goes on a new one
+		self.application.sendCommand( "Initialise" )
+		self.assertEqual( ["Initialise"], self.commandsReceived )
+		self.assertEqual( "Halted", self.application.getState() )
+		self.assertEqual( 2, self.pool.connectionsOpened )
+
+	def testNoResendAfterTimeout( self ) :
+		self.pool.timeout=0.2
+		self.startContext()
+		self.assertEqual( "Initial", self.application.getState() )
+		self.settings.responseLatency=0.5
+		# The command could have been acted on, so it mustn't be sent again on a new connection
+		self.assertRaises( socket.timeout, self.application.sendCommand, "Initialise" )
+		self.waitForCommands( 2.0 )
+		time.sleep( 0.5 )
+		self.assertEqual( ["Initialise"], self.commandsReceived )
+		self.assertEqual( 1, self.pool.connectionsOpened )
+
+	def testDroppedConnections( self ) :
+		self.startContext()
+		self.settings.dropProbability=1.0
+		# A new connection that gets dropped means the peer really isn't working, so no retry
+		self.assertRaises( Exception, self.application.sendCommand, "Initialise" )
+		self.assertEqual( ( 1, 0 ), ( self.pool.connectionsOpened, self.pool.connectionsReused ) )
+
+		self.settings.dropProbability=0.0
+		self.assertEqual( "Initial", self.application.getState() )
+		# A pooled connection that gets dropped is tried once more on a new connection
+		self.settings.dropProbability=1.0
+		self.assertRaises( Exception, self.application.sendCommand, "Initialise" )
+		self.assertEqual( ( 3, 1 ), ( self.pool.connectionsOpened, self.pool.connectionsReused ) )
+		self.assertEqual( [], self.commandsReceived )
+
+	def testUncontactable( self ) :
+		self.assertEqual( "<uncontactable>", self.application.getState() )
+		self.assertFalse( self.application.isResponsive() )
+		self.startContext()
+		self.assertTrue( self.application.isResponsive() )
+
+	def testRunConcurrently( self ) :
+		def function( target ) :
+			time.sleep( 0.1 )
+			if target==3 : raise ValueError( "bad target" )
+			if target==4 : raise XDAQTools.TimeoutError( "slow target" )
+			return target*2
+
+		startTime=time.time()
+		results=XDAQTools.runConcurrently( function, range(6) )
+		self.assertTrue( time.time()-startTime<0.3 )
+		self.assertEqual( range(6), [ result.target for result in results ] )
+		self.assertEqual( [ XDAQTools.Result.succeeded ]*3+[ XDAQTools.Result.failed, XDAQTools.Result.timedOut, XDAQTools.Result.succeeded ], [ result.status for result in results ] )
+		self.assertEqual( [0,2,4,None,None,10], [ result.value for result in results ] )
+		self.assertTrue( isinstance( results[3].error, ValueError ) )
+		self.assertRaises( ValueError, XDAQTools.raiseFirstError, results )
+		XDAQTools.raiseFirstError( results[0:3] )
+
+		startTime=time.time()
+		results=XDAQTools.runConcurrently( function, range(3), concurrent=False )
+		self.assertTrue( time.time()-startTime>=0.3 )
+		self.assertEqual( [0,2,4], [ result.value for result in results ] )
+
+	def testWaitUntilAll( self ) :
+		startTime=time.time()
+		readyTimes={ "quick":0.0, "slow":0.3 }
+		times=XDAQTools.waitUntilAll( readyTimes.keys(), lambda target : time.time()-startTime>=readyTimes[target], 2.0, "Not ready", maximumInterval=0.05 )
+		self.assertTrue( times["quick"]<0.1 )
+		self.assertTrue( 0.3<=times["slow"]<0.5 )
+
+		startTime=time.time()
+		readyTimes={ "quick":0.0, "never":100.0 }
+		try :
+			XDAQTools.waitUntilAll( readyTimes.keys(), lambda target : time.time()-startTime>=readyTimes[target], 0.3, "Not ready" )
+			self.fail( "waitUntilAll didn't time out" )
+		except XDAQTools.TimeoutError as error :
+			self.assertTrue( "never" in str(error) )
+			self.assertFalse( "quick" in str(error) )
+		self.assertTrue( 0.3<=time.time()-startTime<0.6 )
+
+	def testTransitionGraphChecks( self ) :
+		Step=XDAQTools.TransitionStep
+		self.assertRaisesRegexp( Exception, "more than one step", XDAQTools.Transition, "test", [ Step("a"), Step("a") ] )
+		self.assertRaisesRegexp( Exception, "unknown step", XDAQTools.Transition, "test", [ Step("a"), Step("b",dependencies=["c"]) ] )
+		self.assertRaisesRegexp( Exception, "cycle", XDAQTools.Transition, "test", [ Step("a"), Step("b",dependencies=["a","d"]), Step("c",dependencies=["b"]), Step("d",dependencies=["c"]) ] )
+
+	def testTransitionOrdering( self ) :
+		Step=XDAQTools.TransitionStep
+		durations={ "a":0.1, "b":0.1, "c":0.2, "d":0.05, "e":0.05 }
+		transition=XDAQTools.Transition( "test", [
+			Step( "e", action=lambda : time.sleep(durations["e"]), dependencies=["c","d"] ),
+			Step( "a", action=lambda : time.sleep(durations["a"]) ),
+			Step( "b", action=lambda : time.sleep(durations["b"]) ),
+			Step( "c", action=lambda : time.sleep(durations["c"]), dependencies=["a"] ),
+			Step( "d", action=lambda : time.sleep(durations["d"]), dependencies=["a","b"] )
+			] )
+
+		for concurrent in [ True, False ] :
+			startTime=time.time()
+			records=transition.run( ActionOnlyProgram(concurrent), 5.0 )
+			wallTime=time.time()-startTime
+			self.assertEqual( sorted(durations.keys()), sorted(records.keys()) )
+			for record in records.values() :
+				self.assertEqual( XDAQTools.Result.succeeded, record.status() )
+				for dependency in record.step.dependencies :
+					self.assertTrue( record.startTime>=records[dependency].endTime )
+			if concurrent :
+				# Steps without a dependency between them overlap
+				self.assertTrue( records["b"].startTime<records["a"].endTime )
+				self.assertTrue( records["d"].startTime<records["c"].endTime )
+				self.assertTrue( wallTime<0.35+0.1 )
+				self.assertEqual( ["a","c","e"], [ record.step.name for record in transition.criticalPath( records ) ] )
+			else : self.assertTrue( wallTime>=sum(durations.values()) )
+
+	def testTransitionFailure( self ) :
+		Step=XDAQTools.TransitionStep
+		stepsRun=[]
+		def action( name ) :
+			def function() :
+				stepsRun.append( name )
+				if name=="a" : raise ValueError( "step a is broken" )
+			return function
+		transition=XDAQTools.Transition( "test", [
+			Step( "a", action=action("a") ),
+			Step( "b", action=action("b") ),
+			Step( "c", action=action("c"), dependencies=["a"] ),
+			Step( "d", action=action("d"), dependencies=["c","b"] ),
+			Step( "e", action=action("e"), dependencies=["b"] )
+			] )
+		for concurrent in [ True, False ] :
+			del stepsRun[:]
+			# Everything that doesn't depend on the failure still runs before the error is raised
+			self.assertRaisesRegexp( ValueError, "step a is broken", transition.run, ActionOnlyProgram(concurrent), 5.0 )
+			self.assertEqual( ["a","b","e"], sorted(stepsRun) )
+
+if __name__ == '__main__' :
+	unittest.main()
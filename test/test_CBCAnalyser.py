@@ -61,10 +61,11 @@ process.RECOSIMoutput = cms.OutputModule("PoolOutputModule",
     )
 )
 
+process.cbcHits = cms.EDProducer("CBCHitProducer")
 process.analyse = cms.EDAnalyzer("AnalyseCBCOutput")
 
 # Path and EndPath definitions
-process.analyse_step = cms.Path(process.analyse)
+process.analyse_step = cms.Path(process.cbcHits+process.analyse)
 process.RECOSIMoutput_step = cms.EndPath(process.RECOSIMoutput)
 
 